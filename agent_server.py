@@ -22,12 +22,14 @@ from brain.analyzer import ConversationAnalyzer
 from brain.computer_use import ComputerUseAdapter
 from brain.deduper import TaskDeduper
 from brain.task_executor import DirectTaskExecutor
+from brain.result_bus import ResultBus, TaskNotifier
 
 
 app = FastAPI(title="N.E.K.O Tool Server")
 
 # Configure logging
 from utils.logger_config import setup_logging, ThrottledLogger
+from utils.llm_client import aclose_pools, get_pool_stats
 logger, log_config = setup_logging(service_name="Agent", log_level=logging.INFO)
 
 
@@ -41,6 +43,9 @@ class Modules:
     # Task tracking
     task_registry: Dict[str, Dict[str, Any]] = {}
     result_queue: Optional[mp.Queue] = None
+    # 子进程结果总线（结果或进程退出时唤醒，见 brain.result_bus）与 main_server 通知
+    result_bus: Optional[ResultBus] = None
+    notifier: Optional[TaskNotifier] = None
     poller_task: Optional[asyncio.Task] = None
     executor_reset_needed: bool = False
     analyzer_enabled: bool = False
@@ -49,6 +54,8 @@ class Modules:
     computer_use_queue: Optional[asyncio.Queue] = None
     computer_use_running: bool = False
     active_computer_use_task_id: Optional[str] = None
+    # 没有 computer-use 任务在运行时置位，调度器在此等待而不是轮询
+    computer_use_idle: Optional[asyncio.Event] = None
     # Agent feature flags (controlled by UI)
     agent_flags: Dict[str, Any] = {"mcp_enabled": False, "computer_use_enabled": False, "user_plugin_enabled": False}
     # Notification queue for frontend (one-time messages)
@@ -170,6 +177,38 @@ def _now_iso() -> str:
     return datetime.utcnow().isoformat() + "Z"
 
 
+def _get_result_queue() -> mp.Queue:
+    # Ensure result queue and its reader exist lazily
+    if Modules.result_queue is None:
+        Modules.result_queue = mp.Queue()
+    if Modules.result_bus is None:
+        Modules.result_bus = ResultBus(Modules.result_queue)
+        Modules.result_bus.start()
+    return Modules.result_queue
+
+
+def _get_computer_use_idle() -> asyncio.Event:
+    if Modules.computer_use_idle is None:
+        Modules.computer_use_idle = asyncio.Event()
+        if not Modules.computer_use_running:
+            Modules.computer_use_idle.set()
+    return Modules.computer_use_idle
+
+
+def _finish_computer_use() -> None:
+    """当前 computer-use 任务结束（或被清空），唤醒调度器运行下一个"""
+    Modules.computer_use_running = False
+    Modules.active_computer_use_task_id = None
+    _get_computer_use_idle().set()
+
+
+def _notify_main_server(text: str, lanlan_name: Optional[str]) -> None:
+    """在下一次正常回复之后插入任务完成提示（常驻连接，批量发送，失败重试）"""
+    if Modules.notifier is None:
+        Modules.notifier = TaskNotifier(f"http://localhost:{MAIN_SERVER_PORT}/api/agent/notify_task_result")
+    Modules.notifier.notify(text, lanlan_name)
+
+
 def _spawn_task(kind: str, args: Dict[str, Any]) -> Dict[str, Any]:
     """
     生成任务（仅用于 computer_use 任务）
@@ -185,10 +224,8 @@ def _spawn_task(kind: str, args: Dict[str, Any]) -> Dict[str, Any]:
         "result": None,
         "error": None,
     }
-    # Ensure result queue exists lazily
-    if Modules.result_queue is None:
-        Modules.result_queue = mp.Queue()
-    
+    _get_result_queue()
+
     if kind == "computer_use":
         # Queue the task for exclusive execution by the scheduler
         info["status"] = "queued"
@@ -219,14 +256,7 @@ def _spawn_task(kind: str, args: Dict[str, Any]) -> Dict[str, Any]:
                 # Notify main_server if executed
                 if result.get("can_execute"):
                     summary = f'你的任务\"{query[:50]}\"已完成'
-                    try:
-                        async with httpx.AsyncClient(timeout=0.5) as _client:
-                            await _client.post(
-                                f"http://localhost:{MAIN_SERVER_PORT}/api/agent/notify_task_result",
-                                json={"text": summary[:240], "lanlan_name": info.get("lanlan_name")},
-                            )
-                    except Exception:
-                        pass
+                    _notify_main_server(summary, info.get("lanlan_name"))
                 logger.info(f"[MCP] ✅ Spawned processor task {task_id} completed")
             except Exception as e:
                 info["status"] = "failed"
@@ -246,82 +276,96 @@ def _spawn_task(kind: str, args: Dict[str, Any]) -> Dict[str, Any]:
         raise ValueError(f"Unknown task kind: {kind}. Note: 'processor' tasks now use coroutines directly.")
 
 
-def _start_computer_use_process(task_info: Dict[str, Any]) -> None:
+async def _start_computer_use_process(task_info: Dict[str, Any]) -> None:
     """Spawn the actual computer-use worker process for a queued task."""
     task_id = task_info.get("task_id")
     instruction = task_info.get("instruction", "")
     screenshot = task_info.get("screenshot")
-    if Modules.result_queue is None:
-        Modules.result_queue = mp.Queue()
-    p = mp.Process(target=_worker_computer_use, args=(task_id, instruction, screenshot, Modules.result_queue))
+    p = mp.Process(target=_worker_computer_use, args=(task_id, instruction, screenshot, _get_result_queue()))
     p.daemon = True
-    p.start()
+    # 先占用执行权：结果可能在 start 返回前就已到达总线
+    Modules.computer_use_running = True
+    Modules.active_computer_use_task_id = task_id
+    _get_computer_use_idle().clear()
+    try:
+        # 进程创建（Windows 上为 spawn，需要数十毫秒）放到线程里，不阻塞事件循环
+        await asyncio.get_running_loop().run_in_executor(None, p.start)
+    except Exception as e:
+        info = Modules.task_registry.get(task_id, {})
+        info["status"] = "failed"
+        info["error"] = f"failed to start worker: {e}"
+        _finish_computer_use()
+        raise
+    Modules.result_bus.watch(task_id, p)
     # Update registry entry
     info = Modules.task_registry.get(task_id, {})
-    info["status"] = "running"
+    if info.get("status") == "queued":
+        info["status"] = "running"
     info["pid"] = p.pid
     info["_proc"] = p
     Modules.task_registry[task_id] = info
-    Modules.computer_use_running = True
-    Modules.active_computer_use_task_id = task_id
 
 
-async def _poll_results_loop():
+def _summarize_result(info: Dict[str, Any]) -> str:
+    summary = "任务已完成"
+    try:
+        # Build a compact result summary if possible
+        r = info.get("result")
+        if isinstance(r, dict):
+            detail = r.get("result") or r.get("message") or r.get("reason") or ""
+        else:
+            detail = str(r) if r is not None else ""
+        # Include task description if available
+        params = info.get("params") or {}
+        desc = params.get("query") or params.get("instruction") or ""
+        if detail and desc:
+            summary = f"你的任务 “{desc}” 已完成：{detail}"[:240]
+        elif detail:
+            summary = f"你的任务已完成：{detail}"[:240]
+        elif desc:
+            summary = f"你的任务 “{desc}” 已完成"[:240]
+    except Exception:
+        pass
+    return summary
+
+
+def _handle_worker_result(msg: Dict[str, Any]) -> None:
+    tid = msg.get("task_id")
+    if not tid or tid not in Modules.task_registry:
+        return
+    info = Modules.task_registry[tid]
+    if msg.get("exited"):
+        # 子进程退出事件总是排在它写入的结果之后；仍在运行说明进程没写结果就退出了（崩溃或被终止）
+        if info.get("status") == "running":
+            info["status"] = "failed"
+            info["error"] = f"worker exited without result (exitcode={msg.get('exitcode')})"
+            logger.warning(f"[ComputerUse] ❌ Task {tid} {info['error']}")
+        if Modules.active_computer_use_task_id == tid:
+            _finish_computer_use()
+        return
+    info["status"] = "completed" if msg.get("success") else "failed"
+    if "result" in msg:
+        info["result"] = msg["result"]
+    if "error" in msg:
+        info["error"] = msg["error"]
+    # Notify main server about completion so it can insert an extra reply next turn
+    _notify_main_server(_summarize_result(info), info.get("lanlan_name"))
+    # If this was the active computer-use task, allow next to run
+    if Modules.active_computer_use_task_id == tid:
+        _finish_computer_use()
+
+
+async def _result_dispatch_loop():
+    """子进程结果到达（或子进程退出）时才被唤醒，见 brain.result_bus.ResultBus"""
+    _get_result_queue()
     while True:
-        await asyncio.sleep(0.1)
+        msg = await Modules.result_bus.get()
+        if not isinstance(msg, dict):
+            continue
         try:
-            if Modules.result_queue is None:
-                continue
-            while True:
-                try:
-                    msg = Modules.result_queue.get_nowait()
-                except Exception:
-                    break
-                if not isinstance(msg, dict):
-                    continue
-                tid = msg.get("task_id")
-                if not tid or tid not in Modules.task_registry:
-                    continue
-                info = Modules.task_registry[tid]
-                info["status"] = "completed" if msg.get("success") else "failed"
-                if "result" in msg:
-                    info["result"] = msg["result"]
-                if "error" in msg:
-                    info["error"] = msg["error"]
-                # If this was the active computer-use task, allow next to run
-                if Modules.active_computer_use_task_id == tid:
-                    Modules.computer_use_running = False
-                    Modules.active_computer_use_task_id = None
-                # Notify main server about completion so it can insert an extra reply next turn
-                try:
-                    summary = "任务已完成"
-                    try:
-                        # Build a compact result summary if possible
-                        r = info.get("result")
-                        if isinstance(r, dict):
-                            detail = r.get("result") or r.get("message") or r.get("reason") or ""
-                        else:
-                            detail = str(r) if r is not None else ""
-                        # Include task description if available
-                        params = info.get("params") or {}
-                        desc = params.get("query") or params.get("instruction") or ""
-                        if detail and desc:
-                            summary = f"你的任务 “{desc}” 已完成：{detail}"[:240]
-                        elif detail:
-                            summary = f"你的任务已完成：{detail}"[:240]
-                        elif desc:
-                            summary = f"你的任务 “{desc}” 已完成"[:240]
-                    except Exception:
-                        pass
-                    async with httpx.AsyncClient(timeout=0.5) as _client:
-                        await _client.post(
-                            f"http://localhost:{MAIN_SERVER_PORT}/api/agent/notify_task_result",
-                            json={"text": summary, "lanlan_name": info.get("lanlan_name")},
-                        )
-                except Exception:
-                    pass
-        except Exception:
-            pass
+            _handle_worker_result(msg)
+        except Exception as e:
+            logger.error(f"[Agent] Failed to handle worker result: {e}")
 
 
 async def _computer_use_scheduler_loop():
@@ -329,24 +373,23 @@ async def _computer_use_scheduler_loop():
     # Initialize queue if missing
     if Modules.computer_use_queue is None:
         Modules.computer_use_queue = asyncio.Queue()
+    idle = _get_computer_use_idle()
     while True:
         try:
-            await asyncio.sleep(0.05)
-            # If a task is running, check if it finished (poller will clear flags)
-            if Modules.computer_use_running:
-                continue
-            # No active task: try to dequeue next
-            if Modules.computer_use_queue.empty():
-                continue
+            # 当前任务结束（结果到达、进程退出或 end_all）时才继续
+            await idle.wait()
             next_task = await Modules.computer_use_queue.get()
             # Validate registry presence
             tid = next_task.get("task_id")
             if not tid or tid not in Modules.task_registry:
                 continue
             # Start the process for this queued task
-            _start_computer_use_process(next_task)
-        except Exception:
+            await _start_computer_use_process(next_task)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
             # Never crash the scheduler
+            logger.error(f"[ComputerUse] Scheduler error: {e}")
             await asyncio.sleep(0.1)
 
 
@@ -429,15 +472,8 @@ async def _background_analyze_and_plan(messages: list[dict[str, Any]], lanlan_na
                         pass
                 
                 # 通知 main_server
-                try:
-                    async with httpx.AsyncClient(timeout=0.5) as _client:
-                        await _client.post(
-                            f"http://localhost:{MAIN_SERVER_PORT}/api/agent/notify_task_result",
-                            json={"text": summary[:240], "lanlan_name": lanlan_name},
-                        )
-                    logger.info(f"[TaskExecutor] ✅ MCP task completed and notified: {result.task_description}")
-                except Exception as e:
-                    logger.warning(f"[TaskExecutor] Failed to notify main_server: {e}")
+                _notify_main_server(summary, lanlan_name)
+                logger.info(f"[TaskExecutor] ✅ MCP task completed and notified: {result.task_description}")
             else:
                 logger.error(f"[TaskExecutor] ❌ MCP task failed: {result.error}")
         
@@ -509,20 +545,38 @@ async def startup():
     except Exception as e:
         logger.warning(f"[Agent] Failed to set http plugin_list_provider: {e}")
 
-    # Start result poller (for computer_use tasks)
+    # Start result dispatcher (for computer_use tasks) and the main_server notifier
     if Modules.poller_task is None:
-        Modules.poller_task = asyncio.create_task(_poll_results_loop())
+        Modules.poller_task = asyncio.create_task(_result_dispatch_loop())
+    if Modules.notifier is None:
+        Modules.notifier = TaskNotifier(f"http://localhost:{MAIN_SERVER_PORT}/api/agent/notify_task_result")
+    Modules.notifier.start()
     # Start computer-use scheduler
     asyncio.create_task(_computer_use_scheduler_loop())
     
     logger.info("[Agent] ✅ Agent server started with simplified task executor")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    if Modules.notifier is not None:
+        await Modules.notifier.close()
+    if Modules.result_bus is not None:
+        Modules.result_bus.close()
+    await aclose_pools()
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "agent_flags": Modules.agent_flags}
 
 
+@app.get("/llm_pool_stats")
+async def llm_pool_stats():
+    """本进程各LLM端点的客户端复用与连接池统计（见 utils.llm_client）"""
+    return get_pool_stats()
+
+
 # 1) 处理器模块：接受自然语言query，直接执行MCP工具（不再使用子进程）
 @app.post("/process")
 async def process_query(payload: Dict[str, Any]):
@@ -566,14 +620,7 @@ async def process_query(payload: Dict[str, Any]):
             # 通知 main_server
             if result.get('can_execute'):
                 summary = f'你的任务"{query[:50]}"已完成'
-                try:
-                    async with httpx.AsyncClient(timeout=0.5) as _client:
-                        await _client.post(
-                            f"http://localhost:{MAIN_SERVER_PORT}/api/agent/notify_task_result",
-                            json={"text": summary[:240], "lanlan_name": lanlan_name},
-                        )
-                except Exception:
-                    pass
+                _notify_main_server(summary, lanlan_name)
             logger.info(f"[MCP] ✅ Process task {task_id} completed")
         except Exception as e:
             info["status"] = "failed"
@@ -644,15 +691,7 @@ async def plugin_execute_direct(payload: Dict[str, Any]):
                 info["error"] = res.error
             # Only notify main server when actually accepted
             if accepted:
-                try:
-                    summary = f'插件任务 "{plugin_id}" 已接受'
-                    async with httpx.AsyncClient(timeout=0.5) as _client:
-                        await _client.post(
-                            f"http://localhost:{MAIN_SERVER_PORT}/api/agent/notify_task_result",
-                            json={"text": summary[:240], "lanlan_name": lanlan_name},
-                        )
-                except Exception:
-                    pass
+                _notify_main_server(f'插件任务 "{plugin_id}" 已接受', lanlan_name)
         except Exception as e:
             info["status"] = "failed"
             info["error"] = str(e)
@@ -1045,8 +1084,7 @@ async def admin_control(payload: Dict[str, Any]):
                 pass
         Modules.task_registry.clear()
         # Clear scheduling state and queue
-        Modules.computer_use_running = False
-        Modules.active_computer_use_task_id = None
+        _finish_computer_use()
         try:
             if Modules.computer_use_queue is not None:
                 while not Modules.computer_use_queue.empty():
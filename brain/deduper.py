@@ -1,9 +1,7 @@
 from typing import List, Dict, Any, Optional, Tuple
 import asyncio
-from langchain_openai import ChatOpenAI
 from openai import APIConnectionError, InternalServerError, RateLimitError
-from config import get_extra_body
-from utils.config_manager import get_config_manager
+from utils.llm_client import get_model_llm
 import logging
 import json
 
@@ -17,16 +15,9 @@ class TaskDeduper:
     duplicate (equivalent or strict subset) of an existing one.
     """
 
-    def __init__(self):
-        config_manager = get_config_manager()
-        api_config = config_manager.get_model_api_config('summary')
-        self.llm = ChatOpenAI(
-            model=api_config['model'],
-            base_url=api_config['base_url'],
-            api_key=api_config['api_key'],
-            temperature=0,
-            extra_body=get_extra_body(api_config['model']) or None
-        )
+    def _get_llm(self):
+        """获取LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('summary', temperature=0)
 
     def _build_prompt(self, new_task: str, candidates: List[Tuple[str, str]]) -> str:
         lines = ["New task:", new_task.strip(), "\nExisting tasks:"]
@@ -52,7 +43,7 @@ class TaskDeduper:
         
         for attempt in range(max_retries):
             try:
-                resp = await self.llm.ainvoke([
+                resp = await self._get_llm().ainvoke([
                     {"role": "system", "content": "You are a careful deduplication judge."},
                     {"role": "user", "content": prompt},
                 ])
@@ -4,10 +4,9 @@ import json
 import uuid
 from typing import Dict, Any, List, Optional
 from dataclasses import dataclass, field
-from langchain_openai import ChatOpenAI
 from openai import APIConnectionError, InternalServerError, RateLimitError
-from config import get_extra_body
 from utils.config_manager import get_config_manager
+from utils.llm_client import get_model_llm
 from .mcp_client import McpRouterClient, McpToolCatalog
 from .computer_use import ComputerUseAdapter
 
@@ -38,9 +37,8 @@ class TaskPlanner:
         self._config_manager = get_config_manager()
     
     def _get_llm(self):
-        """动态获取LLM实例以支持配置热重载"""
-        api_config = self._config_manager.get_model_api_config('summary')
-        return ChatOpenAI(model=api_config['model'], base_url=api_config['base_url'], api_key=api_config['api_key'], temperature=0, extra_body=get_extra_body(api_config['model']) or None)
+        """获取LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('summary', temperature=0)
 
     async def refresh_capabilities(self, force_refresh: bool = True) -> Dict[str, Dict[str, Any]]:
         """
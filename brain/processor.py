@@ -1,10 +1,9 @@
 from typing import Dict, Any, Optional
 import asyncio
 import logging
-from langchain_openai import ChatOpenAI
 from openai import APIConnectionError, InternalServerError, RateLimitError
-from config import get_extra_body
 from utils.config_manager import get_config_manager
+from utils.llm_client import get_model_llm
 from .mcp_client import McpRouterClient, McpToolCatalog
 
 # Configure logging
@@ -22,9 +21,8 @@ class Processor:
         self._config_manager = get_config_manager()
     
     def _get_llm(self):
-        """动态获取LLM实例以支持配置热重载"""
-        api_config = self._config_manager.get_model_api_config('summary')
-        return ChatOpenAI(model=api_config['model'], base_url=api_config['base_url'], api_key=api_config['api_key'], temperature=0, extra_body=get_extra_body(api_config['model']) or None)
+        """获取LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('summary', temperature=0)
 
     async def process(self, query: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         capabilities = await self.catalog.get_capabilities()
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+agent_server 的任务结果总线与完成通知
+
+原先 computer-use 子进程把结果写进 mp.Queue，_poll_results_loop 每 100ms 醒来取一次；
+_computer_use_scheduler_loop 每 50ms 醒来检查一个布尔值；每完成一个任务都新建一个
+httpx.AsyncClient 去 POST /api/agent/notify_task_result。任务完成到通知送达要等上百毫秒，
+空闲时两个循环仍然每秒醒来 30 次；子进程崩溃（没写结果就退出）时调度器会永远等下去。
+
+- ResultBus：一个守护线程用 multiprocessing.connection.wait 同时等待结果队列与被监视子进程的
+  sentinel，有结果就通过 ThreadChannel 唤醒事件循环；子进程退出时补发一条 exited 事件
+  （总是排在该进程已写入的结果之后），调度器据此在崩溃时也能继续
+- TaskNotifier：一个常驻 httpx.AsyncClient 串行发送通知；请求进行中到达的通知合并为一批，
+  连接失败或 5xx 时按指数退避重试
+
+运行 `python -m brain.result_bus` 比较轮询与事件驱动两种方式下完成到通知的延迟。
+"""
+import asyncio
+import logging
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import connection
+from queue import Empty
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from utils.thread_channel import ThreadChannel
+
+logger = logging.getLogger(__name__)
+
+# 单次通知请求超时（秒）、一批最多合并的通知数
+NOTIFY_TIMEOUT = 0.5
+NOTIFY_MAX_BATCH = 32
+# 失败后的重试次数与首次退避（秒），之后每次翻倍
+NOTIFY_RETRIES = 3
+NOTIFY_RETRY_BACKOFF = 0.1
+
+
+class ResultBus:
+    """子进程结果 -> asyncio：有结果或子进程退出时才唤醒"""
+
+    def __init__(self, result_queue: mp.Queue):
+        self.result_queue = result_queue
+        self.channel = ThreadChannel()
+        # sentinel -> (task_id, process)
+        self._watched: Dict[int, Tuple[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = mp.Pipe(duplex=False)
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="agent-result-bus", daemon=True)
+            self._thread.start()
+
+    def watch(self, task_id: str, process) -> None:
+        """监视子进程：进程退出时在总线上发出 {"task_id", "exited": True, "exitcode"}"""
+        with self._lock:
+            self._watched[process.sentinel] = (task_id, process)
+        self._wake()
+
+    def close(self):
+        self._closed = True
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send_bytes(b'\0')
+        except (OSError, ValueError):
+            pass
+
+    def _drain_queue(self):
+        while True:
+            try:
+                msg = self.result_queue.get_nowait()
+            except Empty:
+                return
+            except (EOFError, OSError, ValueError):
+                return
+            self.channel.put(msg)
+
+    def _run(self):
+        reader = self.result_queue._reader
+        while not self._closed:
+            with self._lock:
+                sentinels = list(self._watched)
+            try:
+                ready = connection.wait([reader, self._wake_r, *sentinels])
+            except (OSError, ValueError) as e:
+                logger.error(f"[ResultBus] wait failed: {e}")
+                time.sleep(0.1)
+                continue
+            if self._wake_r in ready:
+                while self._wake_r.poll():
+                    self._wake_r.recv_bytes()
+            # 先取完已写入的结果：子进程退出前写入的结果必须排在它的 exited 事件之前
+            self._drain_queue()
+            for sentinel in ready:
+                if sentinel is reader or sentinel is self._wake_r:
+                    continue
+                with self._lock:
+                    entry = self._watched.pop(sentinel, None)
+                if entry is None:
+                    continue
+                task_id, process = entry
+                process.join(timeout=0)
+                self.channel.put({"task_id": task_id, "exited": True, "exitcode": process.exitcode})
+
+    async def get(self) -> Dict[str, Any]:
+        return await self.channel.aget()
+
+
+class TaskNotifier:
+    """任务完成通知 -> main_server，常驻连接、批量、重试"""
+
+    def __init__(self, url: str, timeout: float = NOTIFY_TIMEOUT, max_batch: int = NOTIFY_MAX_BATCH,
+                 retries: int = NOTIFY_RETRIES):
+        self.url = url
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.retries = retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.batches = 0
+        self.retried = 0
+        self.dropped = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+            self._task = asyncio.create_task(self._run())
+
+    def notify(self, text: str, lanlan_name: Optional[str] = None) -> None:
+        """入队后立即返回；未 start 时自动启动（需要在事件循环内调用）"""
+        if self._task is None:
+            self.start()
+        self._queue.put_nowait((time.monotonic(), {"text": text[:240], "lanlan_name": lanlan_name}))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            # 上一个请求进行期间到达的通知一起发送
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._send(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"[Notifier] unexpected error, dropped {len(batch)} notification(s): {e}")
+
+    async def _send(self, batch: List[Tuple[float, Dict[str, Any]]]):
+        items = [item for _, item in batch]
+        # 单条通知保持原来的请求格式
+        payload = items[0] if len(items) == 1 else {"items": items}
+        delay = NOTIFY_RETRY_BACKOFF
+        for attempt in range(self.retries + 1):
+            try:
+                r = await self._client.post(self.url, json=payload)
+                if r.status_code < 500:
+                    if r.status_code >= 400:
+                        logger.warning(f"[Notifier] main_server rejected notification: {r.status_code} {r.text[:200]}")
+                    now = time.monotonic()
+                    for enqueued_at, _ in batch:
+                        self.last_latency = now - enqueued_at
+                        self.max_latency = max(self.max_latency, self.last_latency)
+                    self.sent += len(batch)
+                    self.batches += 1
+                    return
+                error = f"HTTP {r.status_code}"
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt < self.retries:
+                self.retried += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+        self.dropped += len(batch)
+        logger.warning(f"[Notifier] failed to notify main_server after {self.retries + 1} attempts ({error}), "
+                       f"dropped {len(batch)} notification(s)")
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': self._queue.qsize() if self._queue is not None else 0,
+            'sent': self.sent,
+            'batches': self.batches,
+            'retried': self.retried,
+            'dropped': self.dropped,
+            'last_latency_ms': round(self.last_latency * 1000, 1),
+            'max_latency_ms': round(self.max_latency * 1000, 1),
+        }
+
+
+def _bench_worker(task_id: str, work: float, queue: mp.Queue):
+    started = time.time()
+    time.sleep(work)
+    queue.put({"task_id": task_id, "success": True, "result": {"started": started}, "finished": time.time()})
+
+
+def _run_benchmark(n_tasks: int = 40, work: float = 0.02) -> None:
+    """
+    n_tasks 个独占的子进程任务依次执行（每个工作 work 秒），结果经本机 HTTP 端点接收。
+    报告：子进程写入结果 -> 通知送达的延迟；上一个任务写入结果 -> 下一个任务进程开始运行的调度间隔；
+    以及空闲 1 秒内事件循环被唤醒的次数。
+    polling：复刻原来的 100ms 结果轮询 + 50ms 调度轮询 + 每次新建 AsyncClient；
+    event：ResultBus + 完成事件驱动调度 + TaskNotifier。
+    """
+    from aiohttp import web
+
+    async def run(mode: str):
+        latencies, gaps, finished, started = [], [], {}, {}
+        done = asyncio.Event()
+
+        async def handler(request):
+            data = await request.json()
+            now = time.time()
+            for item in data.get("items", [data]):
+                latencies.append(now - finished[item["text"]])
+            if len(latencies) == n_tasks:
+                done.set()
+            return web.json_response({"success": True})
+
+        app = web.Application()
+        app.router.add_post('/notify', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/notify"
+
+        result_queue = mp.Queue()
+        pending = asyncio.Queue()
+        for i in range(n_tasks):
+            pending.put_nowait(f"task-{i}")
+        wakeups = [0]
+        idle = asyncio.Event()
+        idle.set()
+        running = [False]
+
+        def record(msg):
+            finished[msg["task_id"]] = msg["finished"]
+            started[msg["task_id"]] = msg["result"]["started"]
+
+        def start_next(tid, bus=None):
+            p = mp.Process(target=_bench_worker, args=(tid, work, result_queue), daemon=True)
+            p.start()
+            if bus is not None:
+                bus.watch(tid, p)
+            return p
+
+        tasks = []
+        if mode == 'polling':
+            async def poll():
+                while True:
+                    await asyncio.sleep(0.1)
+                    wakeups[0] += 1
+                    while True:
+                        try:
+                            msg = result_queue.get_nowait()
+                        except Exception:
+                            break
+                        record(msg)
+                        running[0] = False
+                        async with httpx.AsyncClient(timeout=0.5) as client:
+                            await client.post(url, json={"text": msg["task_id"], "lanlan_name": None})
+
+            async def schedule():
+                while True:
+                    await asyncio.sleep(0.05)
+                    wakeups[0] += 1
+                    if running[0] or pending.empty():
+                        continue
+                    running[0] = True
+                    start_next(await pending.get())
+
+            tasks = [asyncio.create_task(poll()), asyncio.create_task(schedule())]
+        else:
+            bus = ResultBus(result_queue)
+            bus.start()
+            notifier = TaskNotifier(url)
+
+            async def dispatch():
+                while True:
+                    msg = await bus.get()
+                    wakeups[0] += 1
+                    if msg.get("exited"):
+                        continue
+                    record(msg)
+                    notifier.notify(msg["task_id"])
+                    idle.set()
+
+            async def schedule():
+                while True:
+                    await idle.wait()
+                    tid = await pending.get()
+                    wakeups[0] += 1
+                    idle.clear()
+                    # 进程创建（fork/spawn）放到线程里，不阻塞正在发送的通知
+                    await asyncio.get_running_loop().run_in_executor(None, start_next, tid, bus)
+
+            tasks = [asyncio.create_task(dispatch()), asyncio.create_task(schedule())]
+
+        t0 = time.perf_counter()
+        await asyncio.wait_for(done.wait(), 60)
+        elapsed = time.perf_counter() - t0
+        ids = [f"task-{i}" for i in range(n_tasks)]
+        gaps = [started[b] - finished[a] for a, b in zip(ids, ids[1:])]
+        wakeups[0] = 0
+        await asyncio.sleep(1.0)
+        idle_wakeups = wakeups[0]
+        for t in tasks:
+            t.cancel()
+        if mode != 'polling':
+            await notifier.close()
+            bus.close()
+        await runner.cleanup()
+        return sorted(latencies), sorted(gaps), elapsed, idle_wakeups
+
+    def pct(values, q):
+        return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+    print(f"{n_tasks} exclusive worker processes, {work * 1000:.0f} ms of work each")
+    for mode in ('polling', 'event'):
+        latencies, gaps, elapsed, idle_wakeups = asyncio.run(run(mode))
+        print(f"  {mode:<8} result->notify p50 {pct(latencies, 0.5):6.1f} ms  p95 {pct(latencies, 0.95):6.1f} ms   "
+              f"result->next start p50 {pct(gaps, 0.5):6.1f} ms   total {elapsed:5.2f} s   idle wakeups {idle_wakeups}/s")
+
+
+if __name__ == "__main__":
+    _run_benchmark()
@@ -41,6 +41,48 @@ DEFAULT_OPENROUTER_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 # 屏幕分享模式的原生图片输入限流配置（秒）
 NATIVE_IMAGE_MIN_INTERVAL = 1.5
 
+# 麦克风音频上行攒批时长（毫秒，20–100）：凑够该时长再发送一次 input_audio_buffer.append
+AUDIO_INPUT_BATCH_MS = 40
+
+# 麦克风音频 DSP（RNNoise/AGC/重采样）工作进程数；0 表示在主进程的线程池中处理
+AUDIO_DSP_WORKERS = 0
+
+# 上行音频门限（需要 pyrnnoise 提供语音概率：未启用降噪时 RNNoise 只做分析，上行的仍是原始音频；
+# pyrnnoise 不可用时门限不生效，所有音频照常上行）
+# 默认关闭：开启后每个会话的每帧麦克风音频都要经过 RNNoise，每 10ms 帧约 0.9ms CPU（不开约 0.05ms，
+# 见 `python -m utils.audio_processor`），即每路会话约占 9% 的单核；上行带宽紧张时再开启，
+# 并建议同时设置 AUDIO_DSP_WORKERS > 0，把分析放到DSP工作进程中
+# open/close_threshold: 打开/开始计算静音的语音概率（滞回）；open_frames: 连续多少帧超过阈值才打开
+# pre_roll_ms: 打开时补发的历史音频；hang_over_ms: 语音结束后继续发送的静音，需长于服务端 VAD 的 silence_duration_ms
+# false_cut_ms: 关闭后在此时长内重新打开计为一次误切
+AUDIO_VAD_GATE = {
+    'enabled': False,
+    'open_threshold': 0.6,
+    'close_threshold': 0.3,
+    'open_frames': 2,
+    'pre_roll_ms': 300,
+    'hang_over_ms': 900,
+    'false_cut_ms': 600,
+}
+
+# 文本模式下送入TTS的分句参数（按语言，时长单位为 estimate_speech_time 估算的秒数）
+# first_min: 首句最短时长，越小首音频越快；之后每句最短时长乘以 growth，直到 max_min
+# hard_max: 一直没有标点时强制切出的时长；idle_flush: LLM停顿超过该秒数时送出已缓存的文本
+TTS_CHUNK_PROFILES = {
+    'zh': {'first_min': 0.9, 'growth': 2.0, 'max_min': 4.5, 'hard_max': 9.0, 'comma_split': True, 'idle_flush': 0.4},
+    'ja': {'first_min': 0.8, 'growth': 2.0, 'max_min': 4.0, 'hard_max': 8.0, 'comma_split': True, 'idle_flush': 0.4},
+    'en': {'first_min': 0.6, 'growth': 2.0, 'max_min': 4.5, 'hard_max': 9.0, 'comma_split': True, 'idle_flush': 0.4},
+}
+
+# 主服务器 -> 监控服务器同步连接中的语音编码：'pcm16' 原样转发；'opus' 需要 PyAV（libopus），约 32kbps，
+# 由监控服务器解码回 PCM16 后再广播给查看端
+MONITOR_SYNC_AUDIO_CODEC = 'pcm16'
+
+# 发往浏览器的语音编码（见 utils.audio_egress）：'pcm16' 原样下发；'ogg_opus' 对声明支持的客户端
+# 改发 OGG Opus（需要 PyAV/libopus），未声明或不可用时仍退回 PCM16。码率单位 bit/s
+AUDIO_EGRESS_CODEC = 'pcm16'
+AUDIO_EGRESS_OPUS_BITRATE = 32000
+
 # 用户自定义模型配置的默认 Provider/URL/API_KEY（空字符串表示使用全局配置）
 DEFAULT_SUMMARY_MODEL_PROVIDER = ""
 DEFAULT_SUMMARY_MODEL_URL = ""
@@ -325,6 +367,13 @@ __all__ = [
     'TFLINK_UPLOAD_URL',
     'TFLINK_ALLOWED_HOSTS',
     'NATIVE_IMAGE_MIN_INTERVAL',
+    'AUDIO_INPUT_BATCH_MS',
+    'AUDIO_DSP_WORKERS',
+    'AUDIO_VAD_GATE',
+    'TTS_CHUNK_PROFILES',
+    'MONITOR_SYNC_AUDIO_CODEC',
+    'AUDIO_EGRESS_CODEC',
+    'AUDIO_EGRESS_OPUS_BITRATE',
     # API 和模型配置的默认值
     'DEFAULT_CORE_API_KEY',
     'DEFAULT_AUDIO_API_KEY',
@@ -52,6 +52,30 @@ further_summarize_prompt = """请总结以下内容，生成简洁但信息丰
 
 你的摘要应该保留关键信息、重要事实和主要讨论点，且不能具有误导性或产生歧义，不得超过500字。请以key为"对话摘要"、value为字符串的json字典格式返回。"""
 
+rolling_summary_prompt = """以下是先前对话的备忘录，以及备忘录之后新发生的对话。请将新对话的内容合并进备忘录，生成更新后的摘要：
+
+======以下为先前的备忘录======
+%s
+======以上为先前的备忘录======
+
+======以下为新增对话======
+%s
+======以上为新增对话======
+
+你的摘要应该保留关键信息、重要事实和主要讨论点，且不能具有误导性或产生歧义，不得超过500字。请以key为"对话摘要"、value为字符串的json字典格式返回。"""
+
+detailed_rolling_summary_prompt = """以下是先前对话的备忘录，以及备忘录之后新发生的对话。请将新对话的内容合并进备忘录，生成更新后的摘要：
+
+======以下为先前的备忘录======
+%s
+======以上为先前的备忘录======
+
+======以下为新增对话======
+%s
+======以上为新增对话======
+
+你的摘要应该尽可能多地保留有效且清晰的信息，不得超过500字。请以key为"对话摘要"、value为字符串的json字典格式返回。"""
+
 settings_extractor_prompt = """从以下对话中提取关于{LANLAN_NAME}和{MASTER_NAME}的重要个人信息，用于个人备忘录以及未来的角色扮演，以json格式返回。
 请以JSON格式返回，格式为:
 {
@@ -2,9 +2,9 @@
 本文件是主逻辑文件，负责管理整个对话流程。当选择不使用TTS时，将会通过OpenAI兼容接口使用Omni模型的原生语音输出。
 当选择使用TTS时，将会通过额外的TTS API去合成语音。注意，TTS API的输出是流式输出、且需要与用户输入进行交互，实现打断逻辑。
 TTS部分使用了两个队列，原本只需要一个，但是阿里的TTS API回调函数只支持同步函数，所以增加了一个response queue来异步向前端发送音频数据。
+两个队列都是 ThreadChannel：工作线程 put 时直接唤醒主循环中等待的协程，不再定时轮询。
 """
 import asyncio
-import json
 import struct  # For packing audio data
 import re
 import logging
@@ -18,19 +18,26 @@ from utils.screenshot_utils import process_screen_data
 from main_logic.omni_realtime_client import OmniRealtimeClient
 from main_logic.omni_offline_client import OmniOfflineClient
 from main_logic.tts_client import get_tts_worker
-from config import MEMORY_SERVER_PORT
+from main_logic.tts_output_stage import AudioOutputStage
+from config import MEMORY_SERVER_PORT, MONITOR_SYNC_AUDIO_CODEC
 from utils.config_manager import get_config_manager
 from utils.language_utils import normalize_language_code
+from utils.thread_channel import ThreadChannel
+from utils import audio_egress, json_codec, opus_codec
+from utils.tts_chunker import StreamingTTSChunker
 from threading import Thread
-from queue import Queue
+from collections import OrderedDict
 from uuid import uuid4
-import numpy as np
-import soxr
 import httpx 
 
 # Setup logger for this module
 logger = logging.getLogger(__name__)
 
+# 浏览器上行的二进制帧：2字节头（类型 + 保留字节）+ 负载
+# 类型 0x01：麦克风音频，负载为 int16 小端 PCM（48kHz 每帧480样本，16kHz 每帧512样本）
+BINARY_FRAME_HEADER_SIZE = 2
+BINARY_FRAME_AUDIO = 0x01
+
 # --- 一个带有定期上下文压缩+在线热切换的语音会话管理器 ---
 class LLMSessionManager:
     def __init__(self, sync_message_queue, lanlan_name, lanlan_prompt):
@@ -41,11 +48,20 @@ class LLMSessionManager:
         self.is_active = False
         self.active_session_is_idle = False
         self.current_expression = None
-        self.tts_request_queue = Queue()  # TTS request (线程队列)
-        self.tts_response_queue = Queue()  # TTS response (线程队列)
+        self.tts_request_queue = ThreadChannel()  # TTS request (线程队列)
+        self.tts_response_queue = ThreadChannel()  # TTS response (线程队列，主循环 await 读取)
         self.tts_thread = None  # TTS线程
-        # 流式音频重采样器（24kHz→48kHz）- 维护内部状态避免 chunk 边界不连续
-        self.audio_resampler = soxr.ResampleStream(24000, 48000, 1, dtype='float32')
+        # 首音频字节延迟：speech_id -> 第一段文本交给TTS的时间（monotonic）
+        self._tts_request_started = OrderedDict()
+        self._tts_first_audio_seen = set()
+        self.tts_latency_samples = []  # 最近的 (speech_id, 首音频延迟毫秒)
+        self.tts_latency_history_size = 100
+        # 原生音频输出级（24kHz→48kHz 整帧）- 维护内部状态避免 chunk 边界不连续
+        self.audio_output_stage = AudioOutputStage(24000)
+        # 下行语音编码：主终端协商的编码，以及本角色共享的 Opus 编码流（主终端与监控同步共用）
+        self.audio_codec = audio_egress.CODEC_PCM16
+        self.audio_egress = audio_egress.EgressEncoder()
+        self._sync_opus = MONITOR_SYNC_AUDIO_CODEC == 'opus' and opus_codec.OPUS_AVAILABLE
         self.lock = asyncio.Lock()  # 使用异步锁替代同步锁
         self.websocket_lock = None  # websocket操作的共享锁，由main_server设置
         self.current_speech_id = None
@@ -129,6 +145,10 @@ class LLMSessionManager:
         self.tts_ready = False  # TTS是否完全就绪
         self.tts_pending_chunks = []  # 待处理的TTS文本chunk: [(speech_id, text), ...]
         self.tts_cache_lock = asyncio.Lock()  # 保护缓存的锁
+        # 文本模式的流式分句器：LLM delta 攒成整句/分句后再送入TTS
+        self.tts_chunker = StreamingTTSChunker()
+        self._tts_idle_flush_handle = None  # LLM 停顿时送出残句的定时器
+        self._background_tasks = set()  # 定时器触发的后台任务（保留引用，防止运行中被回收）
         
         # 输入数据缓存机制：确保session初始化期间的输入不丢失
         self.session_ready = False  # Session是否完全就绪
@@ -156,15 +176,12 @@ class LLMSessionManager:
 
     async def handle_new_message(self):
         """处理新模型输出：清空TTS队列并通知前端"""
-        # 重置音频重采样器状态（新轮次音频不应与上轮次连续）
-        self.audio_resampler.clear()
+        # 重置音频输出级状态（新轮次音频不应与上轮次连续）
+        self.audio_output_stage.reset()
+        self.audio_egress.reset()
         if self.use_tts and self.tts_thread and self.tts_thread.is_alive():
             # 清空响应队列中待发送的音频数据
-            while not self.tts_response_queue.empty():
-                try:
-                    self.tts_response_queue.get_nowait()
-                except: # noqa
-                    break
+            self.tts_response_queue.clear()
             # 发送终止信号以清空TTS请求队列并停止当前合成
             try:
                 self.tts_request_queue.put((None, None))
@@ -172,6 +189,7 @@ class LLMSessionManager:
                 logger.warning(f"⚠️ 发送TTS中断信号失败: {e}")
         
         # 清空待处理的TTS缓存
+        self._reset_tts_chunker()
         async with self.tts_cache_lock:
             self.tts_pending_chunks.clear()
         
@@ -183,42 +201,98 @@ class LLMSessionManager:
         async with self.lock:
             self.current_speech_id = str(uuid4())
 
+    async def _enqueue_tts_text(self, speech_id, text: str):
+        """将一段文本送入TTS队列；TTS未就绪时先缓存"""
+        async with self.tts_cache_lock:
+            self._mark_tts_request(speech_id)
+            # 检查TTS是否就绪
+            if self.tts_ready and self.tts_thread and self.tts_thread.is_alive():
+                # TTS已就绪，直接发送
+                try:
+                    self.tts_request_queue.put((speech_id, text))
+                except Exception as e:
+                    logger.warning(f"⚠️ 发送TTS请求失败: {e}")
+            else:
+                # TTS未就绪，先缓存
+                self.tts_pending_chunks.append((speech_id, text))
+                if len(self.tts_pending_chunks) == 1:
+                    logger.info("TTS未就绪，开始缓存文本chunk...")
+
+    def _spawn_background(self, coro, label: str):
+        """创建后台任务并保留引用，结束时移除；异常写入日志而不是被静默丢弃"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+
+        def _done(t):
+            self._background_tasks.discard(t)
+            if not t.cancelled() and t.exception() is not None:
+                logger.error(f"💥 {label}失败: {t.exception()}", exc_info=t.exception())
+
+        task.add_done_callback(_done)
+        return task
+
+    def _cancel_tts_idle_flush(self):
+        if self._tts_idle_flush_handle is not None:
+            self._tts_idle_flush_handle.cancel()
+            self._tts_idle_flush_handle = None
+
+    def _reset_tts_chunker(self):
+        """丢弃分句器中未送出的文本（打断或新回复开始时）"""
+        self._cancel_tts_idle_flush()
+        self.tts_chunker.reset()
+
+    async def flush_tts_text(self):
+        """把分句器中剩余的文本送入TTS（回复结束、发送TTS结束信号之前调用）"""
+        self._cancel_tts_idle_flush()
+        text = self.tts_chunker.flush()
+        if text:
+            await self._enqueue_tts_text(self.current_speech_id, text)
+
+    async def _idle_flush_tts(self, speech_id):
+        self._tts_idle_flush_handle = None
+        # 回复已被打断或已结束
+        if speech_id != self.current_speech_id:
+            return
+        await self.flush_tts_text()
+
     async def handle_text_data(self, text: str, is_first_chunk: bool = False):
         """文本回调：处理文本显示和TTS（用于文本模式）"""
         # 如果是新消息的第一个chunk，清空TTS队列和缓存以打断之前的语音
         if is_first_chunk and self.use_tts:
+            self._reset_tts_chunker()
             async with self.tts_cache_lock:
                 self.tts_pending_chunks.clear()
             
             if self.tts_thread and self.tts_thread.is_alive():
                 # 清空响应队列中待发送的音频数据
-                while not self.tts_response_queue.empty():
-                    try:
-                        self.tts_response_queue.get_nowait()
-                    except: # noqa
-                        break
+                self.tts_response_queue.clear()
         
         # 文本模式下，无论是否使用TTS，都要发送文本到前端显示
         await self.send_lanlan_response(text, is_first_chunk)
         
-        # 如果配置了TTS，将文本发送到TTS队列或缓存
+        # 如果配置了TTS，按分句送入TTS队列或缓存（不再逐个 delta 发送）
         if self.use_tts:
-            async with self.tts_cache_lock:
-                # 检查TTS是否就绪
-                if self.tts_ready and self.tts_thread and self.tts_thread.is_alive():
-                    # TTS已就绪，直接发送
-                    try:
-                        self.tts_request_queue.put((self.current_speech_id, text))
-                    except Exception as e:
-                        logger.warning(f"⚠️ 发送TTS请求失败: {e}")
-                else:
-                    # TTS未就绪，先缓存
-                    self.tts_pending_chunks.append((self.current_speech_id, text))
-                    if len(self.tts_pending_chunks) == 1:
-                        logger.info("TTS未就绪，开始缓存文本chunk...")
+            speech_id = self.current_speech_id
+            for chunk in self.tts_chunker.feed(text):
+                await self._enqueue_tts_text(speech_id, chunk)
+            self._cancel_tts_idle_flush()
+            if self.tts_chunker.pending.strip():
+                # LLM 停顿时不让残句一直等在缓冲区里
+                self._tts_idle_flush_handle = asyncio.get_running_loop().call_later(
+                    self.tts_chunker.profile['idle_flush'],
+                    lambda: self._spawn_background(self._idle_flush_tts(speech_id), "TTS残句定时送出"),
+                )
 
     async def handle_response_complete(self):
         """Qwen完成回调：用于处理Core API的响应完成事件，包含TTS和热切换逻辑"""
+        if self.use_tts:
+            # 先送出分句器中的残句，再发送结束信号
+            await self.flush_tts_text()
+        else:
+            # 原生音频：送出输出级中不足一帧的尾部
+            tail = self.audio_output_stage.flush()
+            if tail and self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
+                await self.send_speech(tail)
         if self.use_tts and self.tts_thread and self.tts_thread.is_alive():
             logger.info("📨 Response complete (LLM 回复结束)")
             try:
@@ -292,14 +366,10 @@ class LLMSessionManager:
         """Qwen音频回调：推送音频到WebSocket前端"""
         if not self.use_tts:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
-                # 这里假设audio_data为PCM16字节流，使用流式重采样器处理
-                audio = np.frombuffer(audio_data, dtype=np.int16)
-                audio_float = audio.astype(np.float32) / 32768.0
-                # 使用流式重采样器（维护内部状态，避免 chunk 边界不连续）
-                resampled_float = self.audio_resampler.resample_chunk(audio_float)
-                audio = (resampled_float * 32767.0).clip(-32768, 32767).astype(np.int16)
-
-                await self.send_speech(audio.tobytes())
+                # 这里假设audio_data为PCM16字节流，经输出级转换为 48kHz 整帧
+                frames = self.audio_output_stage.push(audio_data)
+                if frames:
+                    await self.send_speech(frames)
                 # 你可以根据需要加上格式、isNewMessage等标记
                 # await self.websocket.send_json({"type": "cozy_audio", "format": "blob", "isNewMessage": True})
             else:
@@ -322,7 +392,7 @@ class LLMSessionManager:
                         "type": "user_transcript",
                         "text": transcript.strip()
                     }
-                    await self.websocket.send_json(message)
+                    await self.websocket.send_text(json_codec.dumps(message))
                 except Exception as e:
                     logger.error(f"⚠️ 发送用户转录到前端失败: {e}")
         
@@ -345,19 +415,7 @@ class LLMSessionManager:
         
         # 如果配置了TTS，将文本发送到TTS队列或缓存
         if self.use_tts:
-            async with self.tts_cache_lock:
-                # 检查TTS是否就绪
-                if self.tts_ready and self.tts_thread and self.tts_thread.is_alive():
-                    # TTS已就绪，直接发送
-                    try:
-                        self.tts_request_queue.put((self.current_speech_id, text))
-                    except Exception as e:
-                        logger.warning(f"⚠️ 发送TTS请求失败: {e}")
-                else:
-                    # TTS未就绪，先缓存
-                    self.tts_pending_chunks.append((self.current_speech_id, text))
-                    if len(self.tts_pending_chunks) == 1:
-                        logger.info("TTS未就绪，开始缓存文本chunk...")
+            await self._enqueue_tts_text(self.current_speech_id, text)
 
     async def send_lanlan_response(self, text: str, is_first_chunk: bool = False):
         """Qwen输出转录回调：可用于前端显示/缓存/同步。"""
@@ -372,8 +430,10 @@ class LLMSessionManager:
                     "text": text,  
                     "isNewMessage": is_first_chunk  # 标记是否是新消息的第一个chunk
                 }
-                await self.websocket.send_json(message)
-                self.sync_message_queue.put({"type": "json", "data": message})
+                # 只序列化一次：同步服务器直接转发同一份文本
+                text = json_codec.dumps(message)
+                await self.websocket.send_text(text)
+                self.sync_message_queue.put({"type": "json", "data": message, "text": text})
                 if hasattr(self, 'is_preparing_new_session') and self.is_preparing_new_session:
                     if not hasattr(self, 'message_cache_for_new_session'):
                         self.message_cache_for_new_session = []
@@ -686,6 +746,7 @@ class LLMSessionManager:
         logger.info(f"📌 已重新加载配置: core_api={self.core_api_type}, realtime_model={_realtime_model}, text_model={_correction_model}, vision_model={_vision_model}, voice_id={self.voice_id}")
         
         # 重置TTS缓存状态
+        self._reset_tts_chunker()
         async with self.tts_cache_lock:
             self.tts_ready = False
             self.tts_pending_chunks.clear()
@@ -759,8 +820,8 @@ class LLMSessionManager:
                     has_custom_voice=has_custom_tts
                 )
                 
-                self.tts_request_queue = Queue()  # TTS request (线程队列)
-                self.tts_response_queue = Queue()  # TTS response (线程队列)
+                self.tts_request_queue = ThreadChannel()  # TTS request (线程队列)
+                self.tts_response_queue = ThreadChannel()  # TTS response (线程队列)
                 # 根据是否有自定义音色/TTS配置选择 TTS API 配置
                 if has_custom_tts:
                     tts_config = self._config_manager.get_model_api_config('tts_custom')
@@ -781,28 +842,21 @@ class LLMSessionManager:
                 start_time = time.time()
                 timeout = 8.0  # 最多等待8秒
                 
-                while time.time() - start_time < timeout:
-                    try:
-                        # 非阻塞检查队列
-                        if not self.tts_response_queue.empty():
-                            msg = self.tts_response_queue.get_nowait()
-                            # 检查是否是就绪信号
-                            if isinstance(msg, tuple) and len(msg) == 2 and msg[0] == "__ready__":
-                                tts_ready = msg[1]
-                                if tts_ready:
-                                    logger.info(f"✅ TTS进程已就绪 (用时: {time.time() - start_time:.2f}秒)")
-                                else:
-                                    logger.error("❌ TTS进程初始化失败")
-                                break
-                            else:
-                                # 不是就绪信号，放回队列
-                                self.tts_response_queue.put(msg)
-                                break
-                    except: # noqa
-                        pass
-                    
-                    # 小睡眠避免忙等
-                    await asyncio.sleep(0.05)
+                try:
+                    # 等待工作线程放入第一条消息（put 时直接唤醒，无需轮询）
+                    msg = await asyncio.wait_for(self.tts_response_queue.aget(), timeout=timeout)
+                    # 检查是否是就绪信号
+                    if isinstance(msg, tuple) and len(msg) == 2 and msg[0] == "__ready__":
+                        tts_ready = msg[1]
+                        if tts_ready:
+                            logger.info(f"✅ TTS进程已就绪 (用时: {time.time() - start_time:.2f}秒)")
+                        else:
+                            logger.error("❌ TTS进程初始化失败")
+                    else:
+                        # 不是就绪信号，放回队首
+                        self.tts_response_queue.unget(msg)
+                except asyncio.TimeoutError:
+                    pass
                 
                 if not tts_ready:
                     if time.time() - start_time >= timeout:
@@ -1044,7 +1098,7 @@ class LLMSessionManager:
                     "type": "user_activity",
                     "interrupted_speech_id": self.current_speech_id  # 告诉前端应丢弃哪个 speech_id
                 }
-                await self.websocket.send_json(message)
+                await self.websocket.send_text(json_codec.dumps(message))
         except WebSocketDisconnect:
             pass
         except Exception as e:
@@ -1375,6 +1429,18 @@ class LLMSessionManager:
         # Session已就绪，直接处理
         await self._process_stream_data_internal(message)
     
+    async def stream_binary(self, frame: bytes):
+        """处理浏览器发来的二进制帧（目前只有麦克风音频），免去 JSON 整数列表的解析与逐样本打包"""
+        if len(frame) <= BINARY_FRAME_HEADER_SIZE:
+            return
+        frame_type = frame[0]
+        if frame_type != BINARY_FRAME_AUDIO:
+            logger.warning(f"⚠️ 未知的二进制帧类型: {frame_type}")
+            return
+        # memoryview 切片不拷贝，后续由 np.frombuffer 直接读取
+        payload = memoryview(frame)[BINARY_FRAME_HEADER_SIZE:]
+        await self.stream_data({"action": "stream_data", "input_type": "audio", "data": payload})
+
     async def _process_stream_data_internal(self, message: dict):
         """内部方法：实际处理stream_data的逻辑"""
         data = message.get("data")
@@ -1494,8 +1560,16 @@ class LLMSessionManager:
                     logger.error("💥 Stream: Session websocket not available")
                     return
                 try:
-                    if isinstance(data, list):
-                        audio_bytes = struct.pack(f'<{len(data)}h', *data)
+                    if isinstance(data, (list, bytes, bytearray, memoryview)):
+                        if isinstance(data, list):
+                            # 旧版前端：JSON 整数列表
+                            audio_bytes = struct.pack(f'<{len(data)}h', *data)
+                        else:
+                            # 二进制帧：已经是 int16 小端 PCM
+                            if len(data) % 2:
+                                logger.error(f"💥 Stream: 音频帧长度不是偶数: {len(data)}")
+                                return
+                            audio_bytes = data
                         
                         # 🔧 音频预处理：RNNoise降噪 + 降采样到16kHz（在缓存之前）
                         # 检查是否为48kHz输入（480 samples = 960 bytes per 10ms chunk）
@@ -1683,18 +1757,11 @@ class LLMSessionManager:
                 self.tts_thread = None
                 
         # 清理TTS队列和缓存状态
-        try:
-            while not self.tts_request_queue.empty():
-                self.tts_request_queue.get_nowait()
-        except: # noqa
-            pass
-        try:
-            while not self.tts_response_queue.empty():
-                self.tts_response_queue.get_nowait()
-        except: # noqa
-            pass
+        self.tts_request_queue.clear()
+        self.tts_response_queue.clear()
         
         # 重置TTS缓存状态
+        self._reset_tts_chunker()
         async with self.tts_cache_lock:
             self.tts_ready = False
             self.tts_pending_chunks.clear()
@@ -1785,11 +1852,12 @@ class LLMSessionManager:
             translated_message = await self.translate_if_needed(message)
             
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
-                data = json.dumps({"type": "status", "message": translated_message})
+                message = {"type": "status", "message": translated_message}
+                data = json_codec.dumps(message)
                 await self.websocket.send_text(data)
 
                 # 同步到同步服务器（使用翻译后的消息）
-                self.sync_message_queue.put({'type': 'json', 'data': {"type": "status", "message": translated_message}})
+                self.sync_message_queue.put({'type': 'json', 'data': message, 'text': data})
         except WebSocketDisconnect:
             pass
         except Exception as e:
@@ -1798,7 +1866,7 @@ class LLMSessionManager:
     async def send_session_preparing(self, input_mode: str): # 通知前端session正在准备（静默期）
         try:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
-                data = json.dumps({"type": "session_preparing", "input_mode": input_mode})
+                data = json_codec.dumps({"type": "session_preparing", "input_mode": input_mode})
                 await self.websocket.send_text(data)
         except WebSocketDisconnect:
             pass
@@ -1808,7 +1876,7 @@ class LLMSessionManager:
     async def send_session_started(self, input_mode: str): # 通知前端session已启动
         try:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
-                data = json.dumps({"type": "session_started", "input_mode": input_mode})
+                data = json_codec.dumps({"type": "session_started", "input_mode": input_mode})
                 await self.websocket.send_text(data)
         except WebSocketDisconnect:
             pass
@@ -1859,33 +1927,98 @@ class LLMSessionManager:
             logger.error(f"💥 WS Send Response Error: {e}")
 
 
+    def set_audio_codecs(self, codecs) -> str:
+        """根据前端声明支持的编码确定下行语音编码，返回选定的编码"""
+        codec = audio_egress.negotiate(codecs)
+        if codec != self.audio_codec:
+            logger.info(f"🔊 {self.lanlan_name} 下行语音编码: {codec}")
+            # 新连接从新的 OGG 逻辑流开始
+            self.audio_egress.reset()
+        self.audio_codec = codec
+        return codec
+
+    def get_audio_egress_stats(self):
+        return {'codec': self.audio_codec, 'sync_opus': self._sync_opus, **self.audio_egress.stats}
+
     async def send_speech(self, tts_audio):
         """发送语音数据到前端，先发送 speech_id 头信息用于精确打断控制"""
         try:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
+                audio = tts_audio
+                opus_packets = None
+                if self.audio_codec == audio_egress.CODEC_OGG_OPUS or self._sync_opus:
+                    # 只编码一次：OGG 页发给主终端，Opus 包随同步消息交给监控服务器
+                    try:
+                        chunk = self.audio_egress.encode(tts_audio, self.current_speech_id)
+                        opus_packets = chunk.packets
+                        if self.audio_codec == audio_egress.CODEC_OGG_OPUS:
+                            audio = chunk.ogg
+                    except Exception as e:
+                        # 前端按 OggS 魔数区分格式，退回 PCM16 仍可播放
+                        logger.warning(f"⚠️ Opus 编码失败，本段语音以 PCM16 发送: {e}")
+                        self.audio_egress.reset()
                 # 先发送 audio_chunk 头信息，包含 speech_id
-                await self.websocket.send_json({
+                await self.websocket.send_text(json_codec.dumps({
                     "type": "audio_chunk",
                     "speech_id": self.current_speech_id
-                })
+                }))
                 # 然后发送二进制音频数据
-                await self.websocket.send_bytes(tts_audio)
+                await self.websocket.send_bytes(audio)
 
-                # 同步到同步服务器
-                self.sync_message_queue.put({"type": "binary", "data": tts_audio})
+                # 同步到同步服务器（speech_id 写入多路复用帧头）
+                self.sync_message_queue.put({"type": "binary", "data": tts_audio, "speech_id": self.current_speech_id,
+                                             "opus": opus_packets})
         except WebSocketDisconnect:
             pass
         except Exception as e:
             logger.error(f"💥 WS Send Response Error: {e}")
 
+    def _mark_tts_request(self, speech_id):
+        """记录 speech_id 第一段文本交给TTS的时间（TTS未就绪时从开始缓存算起）"""
+        if speech_id is None or speech_id in self._tts_request_started:
+            return
+        self._tts_request_started[speech_id] = time.monotonic()
+        # 只保留最近的记录，被打断、没有产生音频的 speech_id 不会无限累积
+        while len(self._tts_request_started) > self.tts_latency_history_size:
+            old_id, _ = self._tts_request_started.popitem(last=False)
+            self._tts_first_audio_seen.discard(old_id)
+
+    def _record_first_audio(self, speech_id):
+        if speech_id is None or speech_id in self._tts_first_audio_seen:
+            return
+        started = self._tts_request_started.get(speech_id)
+        if started is None:
+            return
+        self._tts_first_audio_seen.add(speech_id)
+        latency_ms = (time.monotonic() - started) * 1000
+        self.tts_latency_samples.append((speech_id, latency_ms))
+        if len(self.tts_latency_samples) > self.tts_latency_history_size:
+            del self.tts_latency_samples[0]
+        logger.debug(f"🎤 TTS首音频延迟 {latency_ms:.0f}ms (speech_id={speech_id})")
+
+    def get_tts_latency_stats(self, recent: int = 10):
+        """最近若干轮的TTS首音频字节延迟（毫秒），以及最近 recent 轮按 speech_id 的明细"""
+        samples = sorted(ms for _, ms in self.tts_latency_samples)
+        if not samples:
+            return {'count': 0, 'recent': []}
+        return {
+            'count': len(samples),
+            'last_ms': round(self.tts_latency_samples[-1][1], 1),
+            'p50_ms': round(samples[len(samples) // 2], 1),
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+            'max_ms': round(samples[-1], 1),
+            'recent': [{'speech_id': sid, 'ms': round(ms, 1)} for sid, ms in self.tts_latency_samples[-recent:]],
+        }
+
     async def tts_response_handler(self):
+        # 绑定启动时的队列：重启TTS时会创建新队列并重建本任务
+        response_queue = self.tts_response_queue
         while True:
-            while not self.tts_response_queue.empty():
-                data = self.tts_response_queue.get_nowait()
-                # 过滤掉就绪信号（格式为 ("__ready__", True/False)）
-                if isinstance(data, tuple) and len(data) == 2 and data[0] == "__ready__":
-                    # 这是就绪信号，不是音频数据，跳过
-                    continue
-                await self.send_speech(data)
-            await asyncio.sleep(0.01)
+            data = await response_queue.aget()
+            # 过滤掉就绪信号（格式为 ("__ready__", True/False)）
+            if isinstance(data, tuple) and len(data) == 2 and data[0] == "__ready__":
+                # 这是就绪信号，不是音频数据，跳过
+                continue
+            self._record_first_audio(self.current_speech_id)
+            await self.send_speech(data)
 
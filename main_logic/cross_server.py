@@ -9,15 +9,18 @@
 import ssl
 
 import asyncio
+import bisect
 import time
 import pickle
 import aiohttp
 import logging
-from config import MONITOR_SERVER_PORT, MEMORY_SERVER_PORT, COMMENTER_SERVER_PORT, TOOL_SERVER_PORT
+from config import MONITOR_SERVER_PORT, MEMORY_SERVER_PORT, COMMENTER_SERVER_PORT, TOOL_SERVER_PORT, MONITOR_SYNC_AUDIO_CODEC
 from datetime import datetime
 import json
 import re
+from queue import Empty
 from utils.frontend_utils import replace_blank, is_only_punctuation
+from utils import json_codec, opus_codec, sync_protocol
 
 # Setup logger for this module
 logger = logging.getLogger(__name__)
@@ -134,9 +137,121 @@ async def keep_reader(ws: aiohttp.ClientWebSocketResponse):
         pass
 
 
-def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_server_url=f"ws://localhost:{MONITOR_SERVER_PORT}", config=None):
-    """独立进程运行的同步连接器"""
+# 同一次唤醒中最多取出的消息数；monitor 文本消息按条数/字节数合并成一帧（以换行分隔）
+SYNC_DRAIN_LIMIT = 256
+SYNC_BATCH_MAX_MESSAGES = 64
+SYNC_BATCH_MAX_BYTES = 64 * 1024
+# 空闲时检查 shutdown_event 的间隔
+SYNC_IDLE_TIMEOUT = 1.0
+# 断线重连尝试间隔 / 应用层心跳间隔
+SYNC_RECONNECT_INTERVAL = 1.0
+SYNC_HEARTBEAT_INTERVAL = 5.0
+# 退出时等待未完成的 memory/tool HTTP 请求的最长时间
+SYNC_HTTP_DRAIN_TIMEOUT = 10.0
+
+
+
+class RelayLatencyHistogram:
+    """入队到转发完成的延迟直方图（毫秒，固定分桶）"""
+
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def snapshot(self) -> dict:
+        labels = [f"<={b}ms" for b in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count, 2) if self.count else 0.0,
+            'max_ms': round(self.max, 2),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class RelayStats:
+    """单个角色同步连接器的转发统计"""
+
+    def __init__(self):
+        self.latency = {'json': RelayLatencyHistogram(), 'binary': RelayLatencyHistogram()}
+        self.text_frames = 0
+        self.text_messages = 0
 
+    def snapshot(self) -> dict:
+        return {
+            'latency': {k: v.snapshot() for k, v in self.latency.items()},
+            'text_frames': self.text_frames,
+            'text_messages': self.text_messages,
+            'messages_per_frame': round(self.text_messages / self.text_frames, 2) if self.text_frames else 0.0,
+        }
+
+
+# lanlan_name -> RelayStats
+_relay_stats = {}
+
+
+def get_relay_stats() -> dict:
+    """各角色同步连接器的转发延迟直方图与合并帧统计"""
+    # 由主服务器的请求线程读取，同步连接器线程可能同时注册新角色
+    return {name: stats.snapshot() for name, stats in list(_relay_stats.items())}
+
+
+async def _next_batch(message_queue):
+    """
+    等待下一批消息，返回 [(入队时间, 消息)]；SYNC_IDLE_TIMEOUT 内没有消息时返回空列表
+
+    main_server 传入的是 StampedThreadChannel：put 时直接唤醒本循环，且带有入队时间。
+    普通 queue.Queue 退回到线程池中阻塞读取（入队时间按取出时刻计）。
+    """
+    adrain_stamped = getattr(message_queue, 'adrain_stamped', None)
+    if adrain_stamped is not None:
+        try:
+            return await asyncio.wait_for(adrain_stamped(SYNC_DRAIN_LIMIT), SYNC_IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return []
+    loop = asyncio.get_running_loop()
+    try:
+        first = await loop.run_in_executor(None, lambda: message_queue.get(timeout=SYNC_IDLE_TIMEOUT))
+    except Empty:
+        return []
+    now = time.monotonic()
+    batch = [(now, first)]
+    while len(batch) < SYNC_DRAIN_LIMIT:
+        try:
+            batch.append((now, message_queue.get_nowait()))
+        except Empty:
+            break
+    return batch
+
+
+def _recent_dialog(chat_history):
+    """最近的对话摘要，供 tool_server 的分析器识别潜在任务"""
+    recent = []
+    for item in chat_history[-6:]:
+        if item.get('role') in ['user', 'assistant']:
+            try:
+                txt = item['content'][0]['text'] if item.get('content') else ''
+            except Exception:
+                txt = ''
+            if txt == '':
+                continue
+            recent.append({'role': item.get('role'), 'text': txt})
+    return recent
+
+
+def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_server_url=f"ws://localhost:{MONITOR_SERVER_PORT}", config=None):
+    """独立线程运行的同步连接器（线程内有自己的事件循环）"""
     # 创建一个新的事件循环
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -145,33 +260,180 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
     if config is None:
         config = {}
     config = default_config | config
+    stats = _relay_stats[lanlan_name] = RelayStats()
+    use_opus = MONITOR_SYNC_AUDIO_CODEC == 'opus'
+    if use_opus and not opus_codec.OPUS_AVAILABLE:
+        logger.warning(f"[{lanlan_name}] PyAV/libopus 不可用，同步音频退回 PCM16")
+        use_opus = False
 
     async def maintain_connection(chat_history, lanlan_name):
-        sync_session = None
-        sync_ws = None
-        sync_reader = None
-        binary_session = None
-        binary_ws = None
-        binary_reader = None
-        bullet_session = None
+        # 与 monitor 之间的多路复用连接（见 utils.sync_protocol）：事件与音频共用一条连接，保证顺序
+        mux_ws = None
+        mux_seq = 0
+        opus_encoder = None
         bullet_ws = None
-        bullet_reader = None
+        readers = {}
+        # 所有 websocket 与 memory/tool 的 HTTP 请求共用一个 session，复用连接池
+        session = aiohttp.ClientSession()
+        # memory/tool 请求按顺序在后台执行，不阻塞实时转发
+        http_jobs = asyncio.Queue()
+        # 待发往 monitor 的文本消息：(入队时间, 文本)
+        pending_text = []
+        pending_bytes = 0
 
         user_input_cache = ''
         text_output_cache = '' # lanlan的当前消息
         current_turn = 'user'
         last_screen = None
 
+        async def connect(name, url, **kwargs):
+            old = readers.pop(name, None)
+            if old:
+                old.cancel()
+            try:
+                ws = await session.ws_connect(url, **kwargs)
+            except Exception:
+                return None
+            readers[name] = asyncio.create_task(keep_reader(ws))
+            return ws
+
+        async def maintain_links():
+            """WebSocket 连接管理（独立于消息处理）：断线重连与心跳"""
+            nonlocal mux_ws, opus_encoder, bullet_ws
+            last_heartbeat = 0.0
+            while not shutdown_event.is_set():
+                try:
+                    if config['monitor']:
+                        if mux_ws is None or mux_ws.closed:
+                            mux_ws = await connect('mux', f"{sync_server_url}/sync_mux/{lanlan_name}", heartbeat=10)
+                            # monitor 每条连接一个解码器，编码器随连接重建
+                            opus_encoder = opus_codec.OpusEncoder() if mux_ws is not None and use_opus else None
+
+                        now = time.monotonic()
+                        if now - last_heartbeat >= SYNC_HEARTBEAT_INTERVAL:
+                            last_heartbeat = now
+                            # 发送心跳（捕获异常以检测连接断开）
+                            if mux_ws:
+                                await send_frame(sync_protocol.FRAME_HEARTBEAT)
+
+                    if config['bullet'] and (bullet_ws is None or bullet_ws.closed):
+                        # Bullet 连接失败是正常的（该服务可能未启动）
+                        bullet_ws = await connect('bullet', f"wss://localhost:{COMMENTER_SERVER_PORT}/sync/{lanlan_name}",
+                                                  ssl=ssl._create_unverified_context())
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"[{lanlan_name}] Monitor连接异常: {e}", exc_info=True)
+                await asyncio.sleep(SYNC_RECONNECT_INTERVAL)
+
+        async def http_worker():
+            while True:
+                job = await http_jobs.get()
+                try:
+                    await job()
+                except Exception as e:
+                    logger.error(f"[{lanlan_name}] 后台请求异常: {e}", exc_info=True)
+                finally:
+                    http_jobs.task_done()
+
+        def queue_text(enqueued_at, text):
+            nonlocal pending_bytes
+            pending_text.append((enqueued_at, text))
+            pending_bytes += len(text)
+
+        async def send_frame(frame_type, payload=b'', stream_id=sync_protocol.STREAM_EVENTS, speech_id=None, flags=0):
+            nonlocal mux_ws, mux_seq
+            if mux_ws is None:
+                return False
+            frame = sync_protocol.encode_frame(frame_type, payload, mux_seq, stream_id, speech_id, flags)
+            mux_seq = (mux_seq + 1) & 0xFFFFFFFF
+            try:
+                await mux_ws.send_bytes(frame)
+            except Exception:
+                mux_ws = None
+                return False
+            return True
+
+        async def flush_text():
+            """把积攒的文本消息合并成一帧发给 monitor（monitor 端按换行拆分）"""
+            nonlocal pending_bytes
+            if not pending_text:
+                return
+            batch = pending_text[:]
+            pending_text.clear()
+            pending_bytes = 0
+            payload = "\n".join(text for _, text in batch).encode()
+            if not await send_frame(sync_protocol.FRAME_EVENTS, payload):
+                return
+            now = time.monotonic()
+            histogram = stats.latency['json']
+            for enqueued_at, _ in batch:
+                histogram.observe(now - enqueued_at)
+            stats.text_frames += 1
+            stats.text_messages += len(batch)
+
+        def submit_analyze(suffix=''):
+            # 非阻塞地向tool_server发送最近对话，供分析器识别潜在任务
+            recent = _recent_dialog(chat_history)
+            if not recent:
+                return
+
+            async def job():
+                try:
+                    async with session.post(
+                        f"http://localhost:{TOOL_SERVER_PORT}/analyze_and_plan",
+                        json={'messages': recent, 'lanlan_name': lanlan_name},
+                        timeout=aiohttp.ClientTimeout(total=5.0)
+                    ) as resp:
+                        await resp.read()  # 确保响应被完全读取
+                    logger.debug(f"[{lanlan_name}] 已发送对话到analyzer进行分析{suffix}")
+                except asyncio.TimeoutError:
+                    logger.warning(f"[{lanlan_name}] 发送到analyzer超时{suffix}")
+                except Exception as e:
+                    logger.warning(f"[{lanlan_name}] 发送到analyzer失败: {e}{suffix}")
+            http_jobs.put_nowait(job)
+
+        def submit_memory(endpoint, ok_message, error_message):
+            # 在清空 chat_history 之前序列化
+            input_history = json.dumps(chat_history, indent=2, ensure_ascii=False)
+
+            async def job():
+                try:
+                    async with session.post(
+                        f"http://localhost:{MEMORY_SERVER_PORT}/{endpoint}/{lanlan_name}",
+                        json={'input_history': input_history},
+                        timeout=aiohttp.ClientTimeout(total=30.0)
+                    ) as response:
+                        result = await response.json()
+                        if result.get('status') == 'error':
+                            logger.error(f"[{lanlan_name}] {error_message}: {result.get('message')}")
+                        else:
+                            logger.info(f"[{lanlan_name}] {ok_message}")
+                except Exception as e:
+                    logger.exception(f"[{lanlan_name}] 调用 /{endpoint} API 失败: {type(e).__name__}: {e}")
+            http_jobs.put_nowait(job)
+
+        maintainer = asyncio.create_task(maintain_links())
+        http_task = asyncio.create_task(http_worker())
+
         while not shutdown_event.is_set():
             try:
-                # 检查消息队列
-                while not message_queue.empty():
-                    message = message_queue.get()
+                # 有消息时立即被唤醒，一次取走当前已到达的全部消息
+                batch = await _next_batch(message_queue)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[{lanlan_name}] 读取同步队列异常: {e}", exc_info=True)
+                await asyncio.sleep(SYNC_IDLE_TIMEOUT)
+                continue
 
+            for enqueued_at, message in batch:
+                try:
                     if message["type"] == "json":
                         # Forward to monitor if enabled
-                        if config['monitor'] and sync_ws:
-                            await sync_ws.send_json(message["data"])
+                        if config['monitor'] and mux_ws:
+                            # 主服务已序列化过的消息直接转发文本，不再重复编码
+                            queue_text(enqueued_at, message.get("text") or json_codec.dumps(message["data"]))
 
                         # Only treat assistant turn when it's a gemini_response
                         if message["data"].get("type") == "gemini_response":
@@ -211,19 +473,32 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
                                 pass
 
                     elif message["type"] == "binary":
-                        if config['monitor'] and binary_ws:
-                            await binary_ws.send_bytes(message["data"])
+                        if config['monitor'] and mux_ws:
+                            # 先发出排在这段语音之前的事件，保持与主终端一致的顺序
+                            await flush_text()
+                            audio = message["data"]
+                            flags = 0
+                            if opus_encoder is not None:
+                                # 主逻辑已为本段语音编码过时直接复用（与主终端共用同一编码流）
+                                packets = message.get("opus")
+                                if packets is None:
+                                    packets = opus_encoder.encode(audio)
+                                audio = opus_codec.pack_packets(packets)
+                                flags = sync_protocol.FLAG_OPUS
+                            if await send_frame(sync_protocol.FRAME_AUDIO, audio, sync_protocol.STREAM_SPEECH,
+                                                message.get("speech_id"), flags):
+                                stats.latency['binary'].observe(time.monotonic() - enqueued_at)
 
                     elif message["type"] == "user":  # 准备转录
                         data = message["data"].get("data")
                         input_type = message["data"].get("input_type")
                         if input_type == "transcript": # 暂时只处理语音，后续还需要记录图片
-                            if user_input_cache == '' and config['monitor'] and sync_ws:
-                                await sync_ws.send_json({'type': 'user_activity'}) #用于打断前端声音播放
+                            if user_input_cache == '' and config['monitor'] and mux_ws:
+                                queue_text(enqueued_at, json_codec.dumps({'type': 'user_activity'})) #用于打断前端声音播放
                             user_input_cache += data
                             # 发送用户转录到 monitor 供副终端显示
-                            if config['monitor'] and sync_ws and data:
-                                await sync_ws.send_json({'type': 'user_transcript', 'text': data})
+                            if config['monitor'] and mux_ws and data:
+                                queue_text(enqueued_at, json_codec.dumps({'type': 'user_transcript', 'text': data}))
                         elif input_type == "screen":
                             last_screen = data
 
@@ -253,20 +528,7 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
                                 chat_history = cleanup_consecutive_assistant_messages(chat_history)
                                 
                                 logger.info(f"[{lanlan_name}] 热重置：聊天历史长度 {len(chat_history)} 条消息")
-                                try:
-                                    async with aiohttp.ClientSession() as session:
-                                        async with session.post(
-                                            f"http://localhost:{MEMORY_SERVER_PORT}/renew/{lanlan_name}",
-                                            json={'input_history': json.dumps(chat_history, indent=2, ensure_ascii=False)},
-                                            timeout=aiohttp.ClientTimeout(total=30.0)
-                                        ) as response:
-                                            result = await response.json()
-                                            if result.get('status') == 'error':
-                                                logger.error(f"[{lanlan_name}] 热重置记忆处理失败: {result.get('message')}")
-                                            else:
-                                                logger.info(f"[{lanlan_name}] 热重置记忆已成功上传到 memory_server")
-                                except Exception as e:
-                                    logger.exception(f"[{lanlan_name}] 调用 /renew API 失败: {type(e).__name__}: {e}")
+                                submit_memory('renew', "热重置记忆已成功上传到 memory_server", "热重置记忆处理失败")
                                 chat_history.clear()
 
                             if message["data"] == 'turn end': # lanlan的消息结束了
@@ -276,34 +538,9 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
                                     chat_history.append(
                                         {'role': 'assistant', 'content': [{'type': 'text', 'text': text_output_cache}]})
                                 text_output_cache = ''
-                                if config['monitor'] and sync_ws:
-                                    await sync_ws.send_json({'type': 'turn end'})
-                                # 非阻塞地向tool_server发送最近对话，供分析器识别潜在任务
-                                try:
-                                    # 构造最近的消息摘要
-                                    recent = []
-                                    for item in chat_history[-6:]:
-                                        if item.get('role') in ['user', 'assistant']:
-                                            try:
-                                                txt = item['content'][0]['text'] if item.get('content') else ''
-                                            except Exception:
-                                                txt = ''
-                                            if txt == '':
-                                                continue
-                                            recent.append({'role': item.get('role'), 'text': txt})
-                                    if recent:
-                                        async with aiohttp.ClientSession() as session:
-                                            async with session.post(
-                                                f"http://localhost:{TOOL_SERVER_PORT}/analyze_and_plan",
-                                                json={'messages': recent, 'lanlan_name': lanlan_name},
-                                                timeout=aiohttp.ClientTimeout(total=5.0)
-                                            ) as resp:
-                                                await resp.read()  # 确保响应被完全读取
-                                        logger.debug(f"[{lanlan_name}] 已发送对话到analyzer进行分析")
-                                except asyncio.TimeoutError:
-                                    logger.warning(f"[{lanlan_name}] 发送到analyzer超时")
-                                except Exception as e:
-                                    logger.warning(f"[{lanlan_name}] 发送到analyzer失败: {e}")
+                                if config['monitor'] and mux_ws:
+                                    queue_text(enqueued_at, json_codec.dumps({'type': 'turn end'}))
+                                submit_analyze()
                                 
                                 # Turn end时不保存聊天记录，只在session end或renew session时保存
 
@@ -322,164 +559,47 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
                                 text_output_cache = ''
                                 
                                 # 向tool_server发送最近对话，供分析器识别潜在任务（与turn end逻辑相同）
-                                try:
-                                    # 构造最近的消息摘要
-                                    recent = []
-                                    for item in chat_history[-6:]:
-                                        if item.get('role') in ['user', 'assistant']:
-                                            try:
-                                                txt = item['content'][0]['text'] if item.get('content') else ''
-                                            except Exception:
-                                                txt = ''
-                                            if txt == '':
-                                                continue
-                                            recent.append({'role': item.get('role'), 'text': txt})
-                                    if recent:
-                                        async with aiohttp.ClientSession() as session:
-                                            async with session.post(
-                                                f"http://localhost:{TOOL_SERVER_PORT}/analyze_and_plan",
-                                                json={'messages': recent, 'lanlan_name': lanlan_name},
-                                                timeout=aiohttp.ClientTimeout(total=5.0)
-                                            ) as resp:
-                                                await resp.read()  # 确保响应被完全读取
-                                        logger.debug(f"[{lanlan_name}] 已发送对话到analyzer进行分析 (session end)")
-                                except asyncio.TimeoutError:
-                                    logger.warning(f"[{lanlan_name}] 发送到analyzer超时 (session end)")
-                                except Exception as e:
-                                    logger.warning(f"[{lanlan_name}] 发送到analyzer失败: {e} (session end)")
+                                submit_analyze(' (session end)')
                                 
                                 # 清理连续的assistant消息（主动搭话未被响应时只保留最后一条）
                                 chat_history = cleanup_consecutive_assistant_messages(chat_history)
                                 
                                 # 处理聊天历史
                                 logger.info(f"[{lanlan_name}] 会话结束：开始处理聊天历史，共 {len(chat_history)} 条消息")
-                                try:
-                                    async with aiohttp.ClientSession() as session:
-                                        async with session.post(
-                                            f"http://localhost:{MEMORY_SERVER_PORT}/process/{lanlan_name}",
-                                            json={'input_history': json.dumps(chat_history, indent=2, ensure_ascii=False)},
-                                            timeout=aiohttp.ClientTimeout(total=30.0)
-                                        ) as response:
-                                            result = await response.json()
-                                            if result.get('status') == 'error':
-                                                logger.error(f"[{lanlan_name}] 会话记忆处理失败: {result.get('message')}")
-                                            else:
-                                                logger.info(f"[{lanlan_name}] 会话记忆已成功上传到 memory_server")
-                                except Exception:
-                                    logger.exception(f"[{lanlan_name}] 调用 /process API 失败")
+                                submit_memory('process', "会话记忆已成功上传到 memory_server", "会话记忆处理失败")
                                 chat_history.clear()
                         except Exception as e:
                             logger.error(f"[{lanlan_name}] System message error: {e}", exc_info=True)
-                    await asyncio.sleep(0.02)
-            except Exception as e:
-                logger.error(f"[{lanlan_name}] Message processing error: {e}", exc_info=True)
-                await asyncio.sleep(0.02)
-            
-            # WebSocket 连接管理（独立于消息处理）
-            try:
-                # 如果连接不存在，尝试建立连接
-                try:
-                    if config['monitor']:
-                        if sync_ws is None:
-                            if sync_session:
-                                await sync_session.close()
-                            sync_session = aiohttp.ClientSession()
-                            try:
-                                sync_ws = await sync_session.ws_connect(
-                                    f"{sync_server_url}/sync/{lanlan_name}",
-                                    heartbeat=10,
-                                )
-                                # print(f"[Sync Process] [{lanlan_name}] 文本连接已建立")
-                                sync_reader = asyncio.create_task(keep_reader(sync_ws))
-                            except Exception:
-                                # logger.warning(f"[{lanlan_name}] Monitor文本连接失败: {e}")
-                                sync_ws = None
 
-                        if binary_ws is None:
-                            if binary_session:
-                                await binary_session.close()
-                            binary_session = aiohttp.ClientSession()
-                            try:
-                                binary_ws = await binary_session.ws_connect(
-                                    f"{sync_server_url}/sync_binary/{lanlan_name}",
-                                    heartbeat=10,
-                                )
-                                # print(f"[Sync Process] [{lanlan_name}] 二进制连接已建立")
-                                binary_reader = asyncio.create_task(keep_reader(binary_ws))
-                            except Exception:
-                                # logger.warning(f"[{lanlan_name}] Monitor二进制连接失败: {e}")
-                                binary_ws = None
-
-                        # 发送心跳（捕获异常以检测连接断开）
-                        if config['monitor'] and sync_ws:
-                            try:
-                                await sync_ws.send_json({"type": "heartbeat", "timestamp": time.time()})
-                            except Exception:
-                                sync_ws = None
-                                
-                        if config['monitor'] and binary_ws:
-                            try:
-                                await binary_ws.send_bytes(b'\x00\x01\x02\x03')
-                            except Exception:
-                                binary_ws = None
-
-                except Exception as e:
-                    logger.error(f"[{lanlan_name}] Monitor连接异常: {e}", exc_info=True)
-                    sync_ws = None
-                    binary_ws = None
-
-                try:
-                    if config['bullet']:
-                        if bullet_ws is None:
-                            if bullet_session:
-                                await bullet_session.close()
-                            bullet_session = aiohttp.ClientSession()
-                            try:
-                                bullet_ws = await bullet_session.ws_connect(
-                                    f"wss://localhost:{COMMENTER_SERVER_PORT}/sync/{lanlan_name}",
-                                    ssl=ssl._create_unverified_context()
-                                )
-                                # print(f"[Sync Process] [{lanlan_name}] Bullet连接已建立")
-                                bullet_reader = asyncio.create_task(keep_reader(bullet_ws))
-                            except Exception:
-                                # Bullet 连接失败是正常的（该服务可能未启动）
-                                bullet_ws = None
+                    if len(pending_text) >= SYNC_BATCH_MAX_MESSAGES or pending_bytes >= SYNC_BATCH_MAX_BYTES:
+                        await flush_text()
+                except asyncio.CancelledError:
+                    raise
                 except Exception as e:
-                    logger.error(f"[{lanlan_name}] Bullet连接异常: {e}", exc_info=True)
-                    bullet_ws = None
-                
-                # 短暂休眠避免CPU占用过高
-                await asyncio.sleep(0.02)
+                    logger.error(f"[{lanlan_name}] Message processing error: {e}", exc_info=True)
 
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                # WebSocket 连接异常，标记连接为失败状态
-                logger.error(f"[{lanlan_name}] WebSocket连接异常: {e}")
-                sync_ws = None
-                binary_ws = None
-                bullet_ws = None
-                await asyncio.sleep(0.03)  # 重连前等待
+            # 本批处理完立即发出，不为凑批等待
+            await flush_text()
 
         # 关闭资源
-        for ws in [sync_ws, binary_ws, bullet_ws]:
+        maintainer.cancel()
+        try:
+            await asyncio.wait_for(http_jobs.join(), SYNC_HTTP_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"[{lanlan_name}] 仍有未完成的 memory/tool 请求，放弃等待")
+        http_task.cancel()
+        for ws in [mux_ws, bullet_ws]:
             if ws:
                 try:
                     await ws.close()
                 except Exception:
                     pass
-        for sess in [sync_session, binary_session, bullet_session]:
-            if sess:
-                try:
-                    await sess.close()
-                except Exception:
-                    pass
-        for rdr in [sync_reader, binary_reader, bullet_reader]:
-            if rdr:
-                try:
-                    rdr.cancel()
-                except Exception:
-                    pass
+        for rdr in readers.values():
+            rdr.cancel()
+        try:
+            await session.close()
+        except Exception:
+            pass
 
     try:
         loop.run_until_complete(maintain_connection(chat_history, lanlan_name))
@@ -2,17 +2,22 @@
 
 import asyncio
 import websockets
-import json
 import base64
+import itertools
 import time
 import logging
+from collections import deque
 
 from typing import Optional, Callable, Dict, Any, Awaitable
 from enum import Enum
-from config import NATIVE_IMAGE_MIN_INTERVAL
+from config import NATIVE_IMAGE_MIN_INTERVAL, AUDIO_INPUT_BATCH_MS, AUDIO_VAD_GATE
 from utils.config_manager import get_config_manager
 from utils.audio_processor import AudioProcessor
+from utils.audio_dsp_pool import get_dsp_pool
+from utils.audio_ring import Int16RingBuffer
 from utils.frontend_utils import calculate_text_similarity
+from utils import json_codec
+from utils.vad_gate import SpeechGate
 
 # Setup logger for this module
 logger = logging.getLogger(__name__)
@@ -23,6 +28,18 @@ class TurnDetectionMode(Enum):
 
 _config_manager = get_config_manager()
 
+# 发送队列：控制事件 > 图像帧 > 音频
+# 排队中的音频超过该时长时丢弃最旧的部分（毫秒）
+SEND_QUEUE_MAX_AUDIO_MS = 2000
+# 排队中的图像帧数上限（视频帧只需要最新的）
+SEND_QUEUE_MAX_IMAGES = 2
+# 连接变慢导致音频积压时，单条 append 最多合并的时长（毫秒）
+SEND_MERGE_MAX_AUDIO_MS = 400
+# websocket 写缓冲超过该字节数时暂停发送音频，先让控制事件和已缓冲数据发出去
+WS_WRITE_HIGH_WATER = 128 * 1024
+# 事件类型 -> 发送优先级类别
+_IMAGE_EVENT_TYPES = frozenset({"input_image_buffer.append", "input_audio_buffer.append_video_frame"})
+
 
 class OmniRealtimeClient:
     """
@@ -131,24 +148,55 @@ class OmniRealtimeClient:
         # Auto-resets after 2 seconds of no speech to prevent state drift
         # Input: 48kHz from PC, 16kHz from mobile
         # Output: 16kHz for API
-        self._audio_processor = AudioProcessor(
+        # AUDIO_DSP_WORKERS > 0 时处理状态放在DSP工作进程中，本地只保留代理
+        self._audio_processor_options = dict(
             input_sample_rate=48000,
             output_sample_rate=16000,
             noise_reduce_enabled=False,  # RNNoise with auto-reset enabled
-            on_silence_reset=self._on_silence_reset  # 静音重置时发送 input_audio_buffer.clear
+            # 上行门限需要语音概率：RNNoise 只做分析，上行的仍是未降噪的原始音频
+            vad_enabled=bool(AUDIO_VAD_GATE.get('enabled')),
         )
+        self._audio_processor = self._create_audio_processor()
         
         # 静音重置事件异步队列
         self._silence_reset_pending = False
         
+        # 上行音频攒批：处理后的16kHz样本先进环形缓冲区，凑够 AUDIO_INPUT_BATCH_MS 再发送
+        self._input_sample_rate = 16000
+        self._audio_batch_samples = self._input_sample_rate * max(20, min(100, AUDIO_INPUT_BATCH_MS)) // 1000
+        self._audio_ring = Int16RingBuffer(self._input_sample_rate * 2)  # 最多缓存2秒
+        # 上行门限：只在 AudioProcessor 提供有效语音概率（pyrnnoise 可用）时生效
+        self._vad_gate = SpeechGate(self._input_sample_rate) if AUDIO_VAD_GATE.get('enabled') else None
+        self._audio_flush_handle = None  # 不足一批时的定时发送
+        self._background_tasks = set()  # 定时器触发的后台任务（保留引用，防止运行中被回收）
+        
         # 重复度检测
         self._recent_responses = []  # 存储最近3轮助手回复
         self._repetition_threshold = 0.8  # 相似度阈值
         self._max_recent_responses = 3  # 最多存储的回复数
         self._current_response_transcript = ""  # 当前回复的转录文本
         
+        # 发送队列与发送任务：所有 websocket 写入都由 _sender_loop 串行完成
+        self._send_control = deque()  # (event, future)
+        self._send_images = deque()   # event
+        self._send_audio = deque()    # 16kHz PCM16 bytes，发送时合并编码
+        self._send_audio_bytes = 0
+        self._send_wakeup = asyncio.Event()
+        self._sender_task: Optional[asyncio.Task] = None
+        self._event_seq = itertools.count(1)
+        self._send_stats = {
+            'events_sent': 0, 'audio_appends_sent': 0, 'merged_audio_chunks': 0,
+            'dropped_audio_ms': 0, 'dropped_images': 0, 'backpressure_waits': 0,
+            'write_buffer_peak': 0,
+        }
+        # 音频/图像帧入队即返回，写入失败时记下异常，在下一次 stream_audio/stream_image 时抛给调用方
+        self._send_error: Optional[BaseException] = None
+        # 发送失败的告警限流（连接断开后每一帧都会失败）
+        self._send_warning_interval = 2.0
+        self._last_send_warning_time = 0.0
+        self._suppressed_send_warnings = 0
+        
         # Backpressure control - 防止503过载错误
-        self._send_semaphore = asyncio.Semaphore(25)  # 最多25个并发发送
         self._is_throttled = False  # 503检测后节流状态
         self._throttle_until = 0.0  # 节流结束时间戳
         self._throttle_duration = 2.0  # 节流持续时间（秒）
@@ -172,15 +220,37 @@ class OmniRealtimeClient:
         # Audio processing lock to ensure sequential processing in thread pool
         self._audio_processing_lock = asyncio.Lock()
 
+    def _create_audio_processor(self, use_pool: bool = True):
+        """创建音频处理器：优先使用DSP工作进程池，未启用或不可用时使用进程内 AudioProcessor"""
+        pool = get_dsp_pool() if use_pool else None
+        if pool is not None:
+            try:
+                return pool.open_session(on_silence_reset=self._on_silence_reset,
+                                         **self._audio_processor_options)
+            except Exception as e:
+                logger.warning(f"⚠️ DSP工作进程不可用，改为进程内处理: {e}")
+        return AudioProcessor(on_silence_reset=self._on_silence_reset,  # 静音重置时发送 input_audio_buffer.clear
+                              **self._audio_processor_options)
+
     async def process_audio_chunk_async(self, audio_chunk: bytes) -> bytes:
         """
-        Asynchronously process audio chunk using RNNoise in a separate thread.
+        Asynchronously process audio chunk using RNNoise in a separate thread
+        (or in a DSP worker process when the pool is enabled).
         This prevents blocking the main event loop during heavy calculation.
         """
         if self._audio_processor is None:
             return audio_chunk
 
         async with self._audio_processing_lock:
+            process_remote = getattr(self._audio_processor, 'process_chunk_async', None)
+            if process_remote is not None:
+                try:
+                    return await process_remote(audio_chunk)
+                except Exception as e:
+                    # 工作进程异常：本会话退回进程内处理（降噪状态重新开始）
+                    logger.error(f"❌ DSP工作进程处理失败，改为进程内处理: {e}")
+                    self._audio_processor.close()
+                    self._audio_processor = self._create_audio_processor(use_pool=False)
             # Use run_in_executor to offload heavy processing
             # None = use default ThreadPoolExecutor
             loop = asyncio.get_running_loop()
@@ -234,6 +304,11 @@ class OmniRealtimeClient:
     
     async def clear_audio_buffer(self):
         """发送 input_audio_buffer.clear 事件清空服务端缓存。"""
+        # 本地尚未发送的音频也一并丢弃
+        self._cancel_audio_flush()
+        self._audio_ring.clear()
+        if self._vad_gate is not None:
+            self._vad_gate.reset()
         clear_event = {
             "type": "input_audio_buffer.clear"
         }
@@ -247,6 +322,7 @@ class OmniRealtimeClient:
             "Authorization": f"Bearer {self.api_key}"
         } 
         self.ws = await websockets.connect(url, additional_headers=headers)
+        self._send_error = None
         
         # 启动静默检测任务（只在启用时）
         self._last_speech_time = time.time()
@@ -369,49 +445,226 @@ class OmniRealtimeClient:
         else:
             raise ValueError(f"Invalid turn detection mode: {self.turn_detection_mode}")
 
+    def _audio_throttled(self) -> bool:
+        """503 节流期内丢弃音频帧以减轻服务器压力"""
+        if not self._is_throttled:
+            return False
+        if time.time() < self._throttle_until:
+            return True
+        # 节流期结束，恢复正常发送
+        self._is_throttled = False
+        logger.info("🔄 Backpressure throttle ended, resuming sends")
+        return False
+
+    def _ensure_sender(self):
+        if self._sender_task is None or self._sender_task.done():
+            self._sender_task = asyncio.create_task(self._sender_loop())
+        self._send_wakeup.set()
+
     async def send_event(self, event) -> None:
+        """
+        把事件放入发送队列。
+
+        控制事件等待实际写入完成（保持原有的顺序与异常语义）；
+        音频和图像帧入队后立即返回，由发送任务按优先级发出。
+        """
         # 检查是否已发生致命错误，直接跳过发送
         if self._fatal_error_occurred:
             return
         
-        # Backpressure: 检查是否处于节流状态
-        if self._is_throttled:
-            if time.time() < self._throttle_until:
-                # 仍在节流期，丢弃音频帧以减轻服务器压力
-                if event.get("type") == "input_audio_buffer.append":
-                    return  # 丢弃音频帧
-            else:
-                # 节流期结束，恢复正常发送
-                self._is_throttled = False
-                logger.info("🔄 Backpressure throttle ended, resuming sends")
-        
         # 检查websocket是否有效
         if not self.ws:
             return
         
-        event['event_id'] = "event_" + str(int(time.time() * 1000))
-        async with self._send_semaphore:  # 限制并发发送数量
-            try:
-                if not self.ws:
-                    return
-                await self.ws.send(json.dumps(event))
-            except Exception as e:
-                error_msg = str(e)
-                if '1000' not in error_msg:
-                    logger.warning(f"⚠️ 发送 {event.get('type', '未知')} 事件失败: {error_msg}")
-                
-                # 检测致命错误：Response timeout 或 1011 错误码
-                if 'Response timeout' in error_msg or '1011' in error_msg:
-                    if not self._fatal_error_occurred:
-                        self._fatal_error_occurred = True
-                        logger.error("💥 检测到致命错误 (Response timeout / 1011)，立即中断语音对话")
-                        if self.on_connection_error:
-                            asyncio.create_task(self.on_connection_error("💥 连接超时 (Response timeout)，语音对话已中断。"))
-                        # 尝试关闭连接
-                        asyncio.create_task(self.close())
-                    return  # 不再抛出异常，直接返回
-                
-                raise
+        event_type = event.get("type")
+        if event_type == "input_audio_buffer.append":
+            self._enqueue_audio(base64.b64decode(event["audio"]))
+            return
+        if event_type in _IMAGE_EVENT_TYPES:
+            if self._send_error is not None:
+                return
+            self._send_images.append(event)
+            while len(self._send_images) > SEND_QUEUE_MAX_IMAGES:
+                self._send_images.popleft()
+                self._send_stats['dropped_images'] += 1
+            self._ensure_sender()
+            return
+        if event_type == "input_audio_buffer.clear":
+            # 排队中尚未发出的音频属于被清空的那段输入
+            self._drop_queued_audio()
+        
+        fut = asyncio.get_running_loop().create_future()
+        self._send_control.append((event, fut))
+        self._ensure_sender()
+        await fut
+
+    def _enqueue_audio(self, pcm: bytes):
+        if not pcm or self._fatal_error_occurred or not self.ws or self._send_error is not None:
+            return
+        if self._audio_throttled():
+            self._send_stats['dropped_audio_ms'] += len(pcm) * 1000 // (self._input_sample_rate * 2)
+            return
+        self._send_audio.append(pcm)
+        self._send_audio_bytes += len(pcm)
+        max_bytes = self._input_sample_rate * 2 * SEND_QUEUE_MAX_AUDIO_MS // 1000
+        while self._send_audio_bytes > max_bytes and len(self._send_audio) > 1:
+            dropped = self._send_audio.popleft()
+            self._send_audio_bytes -= len(dropped)
+            self._send_stats['dropped_audio_ms'] += len(dropped) * 1000 // (self._input_sample_rate * 2)
+        self._ensure_sender()
+
+    def _drop_queued_audio(self):
+        self._send_audio.clear()
+        self._send_audio_bytes = 0
+
+    def _take_audio(self) -> bytes:
+        """取出排队的音频，积压时把连续的多块合并为一条 append"""
+        max_bytes = self._input_sample_rate * 2 * SEND_MERGE_MAX_AUDIO_MS // 1000
+        chunks = [self._send_audio.popleft()]
+        size = len(chunks[0])
+        while self._send_audio and size + len(self._send_audio[0]) <= max_bytes:
+            chunk = self._send_audio.popleft()
+            chunks.append(chunk)
+            size += len(chunk)
+        self._send_audio_bytes -= size
+        if len(chunks) > 1:
+            self._send_stats['merged_audio_chunks'] += len(chunks) - 1
+            return b''.join(chunks)
+        return chunks[0]
+
+    def _ws_write_buffer_size(self) -> int:
+        transport = getattr(self.ws, 'transport', None)
+        if transport is None:
+            return 0
+        try:
+            size = transport.get_write_buffer_size()
+        except Exception:
+            return 0
+        if size > self._send_stats['write_buffer_peak']:
+            self._send_stats['write_buffer_peak'] = size
+        return size
+
+    async def _write(self, event_type: str, payload: str) -> None:
+        """写入一条消息；致命错误时中断会话并吞掉异常，其余异常抛给调用方"""
+        try:
+            await self.ws.send(payload)
+            self._send_stats['events_sent'] += 1
+        except Exception as e:
+            error_msg = str(e)
+            if '1000' not in error_msg:
+                # 限流log：2秒内只记录一次
+                now = time.monotonic()
+                if now - self._last_send_warning_time > self._send_warning_interval:
+                    suppressed = f"（期间另有 {self._suppressed_send_warnings} 次失败）" if self._suppressed_send_warnings else ""
+                    logger.warning(f"⚠️ 发送 {event_type or '未知'} 事件失败: {error_msg}{suppressed}")
+                    self._last_send_warning_time = now
+                    self._suppressed_send_warnings = 0
+                else:
+                    self._suppressed_send_warnings += 1
+            
+            # 检测致命错误：Response timeout 或 1011 错误码
+            if 'Response timeout' in error_msg or '1011' in error_msg:
+                if not self._fatal_error_occurred:
+                    self._fatal_error_occurred = True
+                    logger.error("💥 检测到致命错误 (Response timeout / 1011)，立即中断语音对话")
+                    if self.on_connection_error:
+                        asyncio.create_task(self.on_connection_error("💥 连接超时 (Response timeout)，语音对话已中断。"))
+                    # 尝试关闭连接
+                    asyncio.create_task(self.close())
+                return  # 不再抛出异常，直接返回
+            
+            raise
+
+    def _next_event_id(self) -> str:
+        return f"event_{next(self._event_seq)}"
+
+    async def _sender_loop(self):
+        """按优先级串行写入 websocket：控制事件 > 图像帧 > 音频"""
+        try:
+            while True:
+                await self._send_wakeup.wait()
+                self._send_wakeup.clear()
+                while self.ws and not self._fatal_error_occurred:
+                    if self._send_control:
+                        event, fut = self._send_control.popleft()
+                        event['event_id'] = self._next_event_id()
+                        try:
+                            await self._write(event.get("type"), json_codec.dumps(event))
+                        except Exception as e:
+                            if not fut.done():
+                                fut.set_exception(e)
+                            continue
+                        if not fut.done():
+                            fut.set_result(None)
+                    elif self._send_images:
+                        event = self._send_images.popleft()
+                        event['event_id'] = self._next_event_id()
+                        try:
+                            await self._write(event.get("type"), json_codec.dumps(event))
+                        except Exception as e:
+                            self._fail_send_queue(e)
+                            break
+                    elif self._send_audio:
+                        if self._ws_write_buffer_size() > WS_WRITE_HIGH_WATER:
+                            # 套接字写不动时先不发音频，让积压的音频在队列里合并；控制事件到达会立即唤醒
+                            self._send_stats['backpressure_waits'] += 1
+                            try:
+                                await asyncio.wait_for(self._send_wakeup.wait(), timeout=0.02)
+                            except asyncio.TimeoutError:
+                                pass
+                            self._send_wakeup.clear()
+                            continue
+                        audio_b64 = base64.b64encode(self._take_audio()).decode()
+                        # base64 不含需要转义的字符，直接拼接 JSON
+                        payload = ('{"type":"input_audio_buffer.append","audio":"' + audio_b64
+                                   + '","event_id":"' + self._next_event_id() + '"}')
+                        try:
+                            await self._write("input_audio_buffer.append", payload)
+                            self._send_stats['audio_appends_sent'] += 1
+                        except Exception as e:
+                            self._fail_send_queue(e)
+                            break
+                    else:
+                        break
+                if not self.ws or self._fatal_error_occurred:
+                    self._release_send_queue()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._release_send_queue()
+
+    def _release_send_queue(self, error: Optional[BaseException] = None):
+        """连接已关闭：丢弃排队的数据，等待中的控制事件直接返回（给出 error 时抛出该异常）"""
+        while self._send_control:
+            _, fut = self._send_control.popleft()
+            if not fut.done():
+                if error is not None:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(None)
+        self._send_images.clear()
+        self._drop_queued_audio()
+
+    def _fail_send_queue(self, error: BaseException):
+        """音频/图像帧写入失败：停止发送并清空队列，异常留给下一次 stream_audio/stream_image 抛出"""
+        self._send_error = error
+        self._release_send_queue(error)
+
+    def _raise_send_error(self):
+        """抛出发送任务记下的写入异常，交由调用方（core.stream_data）按连接关闭处理"""
+        error, self._send_error = self._send_error, None
+        if error is not None:
+            raise error
+
+    def get_send_queue_stats(self) -> Dict[str, Any]:
+        """发送队列深度、合并/丢弃计数与 websocket 写缓冲大小"""
+        stats = dict(self._send_stats)
+        stats['queued_control'] = len(self._send_control)
+        stats['queued_images'] = len(self._send_images)
+        stats['queued_audio_ms'] = self._send_audio_bytes * 1000 // (self._input_sample_rate * 2)
+        stats['write_buffer_bytes'] = self._ws_write_buffer_size() if self.ws else 0
+        stats['throttled'] = self._is_throttled
+        return stats
 
     async def update_session(self, config: Dict[str, Any]) -> None:
         """Update session configuration."""
@@ -427,10 +680,13 @@ class OmniRealtimeClient:
         Supports two input modes:
         - 48kHz from PC: Apply RNNoise then downsample to 16kHz
         - 16kHz from mobile: Pass through directly (no RNNoise)
+        
+        处理后的音频先进入环形缓冲区，攒够 AUDIO_INPUT_BATCH_MS 后合并为一条 append 事件发送。
         """
         # 检查是否已发生致命错误，如果是则直接返回
         if self._fatal_error_occurred:
             return
+        self._raise_send_error()
         
         # Detect input sample rate based on chunk size
         # 48kHz: 480 samples (10ms) = 960 bytes
@@ -452,14 +708,58 @@ class OmniRealtimeClient:
             if self._silence_reset_pending:
                 self._silence_reset_pending = False
                 await self.clear_audio_buffer()
+            
+            # 门限关闭时丢弃静音；从打开变为关闭时立即发出拖尾，不等攒批
+            gate = self._vad_gate
+            if gate is not None and getattr(self._audio_processor, 'vad_available', False):
+                was_open = gate.is_open
+                audio_chunk = gate.process(audio_chunk, self._audio_processor.speech_probability)
+                if was_open and not gate.is_open:
+                    self._audio_ring.write(audio_chunk)
+                    await self.flush_input_audio()
+                    return
         
-        audio_b64 = base64.b64encode(audio_chunk).decode()
+        if len(audio_chunk) == 0:
+            return
+        self._audio_ring.write(audio_chunk)
+        if len(self._audio_ring) >= self._audio_batch_samples:
+            await self.flush_input_audio()
+        elif self._audio_flush_handle is None:
+            # 输入中断时不让不足一批的尾音滞留
+            self._audio_flush_handle = asyncio.get_running_loop().call_later(
+                self._audio_batch_samples / self._input_sample_rate,
+                lambda: self._spawn_background(self.flush_input_audio(), "尾音定时发送"),
+            )
 
-        append_event = {
-            "type": "input_audio_buffer.append",
-            "audio": audio_b64
-        }
-        await self.send_event(append_event)
+    def _spawn_background(self, coro, label: str):
+        """创建后台任务并保留引用，结束时移除；异常写入日志而不是被静默丢弃"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+
+        def _done(t):
+            self._background_tasks.discard(t)
+            if not t.cancelled() and t.exception() is not None:
+                logger.error(f"💥 {label}失败: {t.exception()}", exc_info=t.exception())
+
+        task.add_done_callback(_done)
+        return task
+
+    def get_vad_gate_stats(self) -> Optional[Dict[str, Any]]:
+        """上行门限的丢弃比例与误切统计；未启用门限时返回 None"""
+        return self._vad_gate.stats if self._vad_gate is not None else None
+
+    def _cancel_audio_flush(self):
+        if self._audio_flush_handle is not None:
+            self._audio_flush_handle.cancel()
+            self._audio_flush_handle = None
+
+    async def flush_input_audio(self) -> None:
+        """把环形缓冲区中累积的音频作为一条 input_audio_buffer.append 发送"""
+        self._cancel_audio_flush()
+        if len(self._audio_ring) == 0 or self._fatal_error_occurred:
+            return
+        # read() 返回的视图在下一次写入前有效，这里立即复制进发送队列（编码在发送任务中进行）
+        self._enqueue_audio(self._audio_ring.read().tobytes())
 
     async def _analyze_image_with_vision_model(self, image_b64: str) -> str:
         """Use VISION_MODEL to analyze image and return description."""
@@ -499,6 +799,7 @@ class OmniRealtimeClient:
         """Stream raw image data to the API."""
 
         try:
+            self._raise_send_error()
             if '实时屏幕截图或相机画面正在分析中' in self._image_description and self.model in ['step', 'free']:
                 await self._analyze_image_with_vision_model(image_b64)
                 return
@@ -686,7 +987,13 @@ class OmniRealtimeClient:
                 return
                 
             async for message in self.ws:
-                event = json.loads(message)
+                # 音频增量是最频繁的事件：直接切出 base64 字段，不解析整条消息
+                audio_b64 = json_codec.extract_audio_delta(message)
+                if audio_b64 is not None:
+                    if self.on_audio_delta and not self._skip_until_next_response and not self._interrupted:
+                        await self.on_audio_delta(base64.b64decode(audio_b64))
+                    continue
+                event = json_codec.loads(message)
                 event_type = event.get("type")
                 
                 # if event_type not in ["response.audio.delta", "response.audio_transcript.delta",  "response.output_audio.delta", "response.output_audio_transcript.delta"]:
@@ -832,6 +1139,16 @@ class OmniRealtimeClient:
 
     async def close(self) -> None:
         """Close the WebSocket connection."""
+        self._cancel_audio_flush()
+        self._audio_ring.clear()
+        # 停止发送任务，排队中的事件随连接一起丢弃
+        if self._sender_task is not None and not self._sender_task.done():
+            self._sender_task.cancel()
+            try:
+                await self._sender_task
+            except asyncio.CancelledError:
+                pass
+        self._sender_task = None
         # 取消静默检测任务
         if self._silence_check_task:
             self._silence_check_task.cancel()
@@ -850,6 +1167,9 @@ class OmniRealtimeClient:
                 self._audio_processor.save_debug_audio()
             except Exception as e:
                 logger.error(f"Error saving debug audio: {e}")
+            close_processor = getattr(self._audio_processor, 'close', None)
+            if close_processor is not None:
+                close_processor()
         
         if self.ws:
             try:
@@ -3,7 +3,6 @@ TTS Helper模块
 负责处理TTS语音合成，支持自定义音色（阿里云CosyVoice）和默认音色（各core_api的原生TTS）
 """
 import numpy as np
-import soxr
 import time
 import json
 import base64
@@ -15,40 +14,12 @@ import aiohttp
 import asyncio
 from functools import partial
 from utils.config_manager import get_config_manager
+from utils.thread_channel import channel_get
+from main_logic.tts_session_pool import TTSSessionPool, PooledTTSSession
+from main_logic.tts_output_stage import AudioOutputStage
 logger = logging.getLogger(__name__)
 
 
-def _resample_audio(audio_int16: np.ndarray, src_rate: int, dst_rate: int, 
-                    resampler: 'soxr.ResampleStream | None' = None) -> bytes:
-    """使用 soxr 进行高质量音频重采样
-    
-    Args:
-        audio_int16: int16 格式的音频 numpy 数组
-        src_rate: 源采样率
-        dst_rate: 目标采样率
-        resampler: 可选的流式重采样器，用于维护 chunk 间状态
-        
-    Returns:
-        重采样后的 bytes
-    """
-    if src_rate == dst_rate:
-        return audio_int16.tobytes()
-    
-    # 转换为 float32 进行高质量重采样
-    audio_float = audio_int16.astype(np.float32) / 32768.0
-    
-    if resampler is not None:
-        # 使用流式重采样器（维护 chunk 边界状态）
-        resampled_float = resampler.resample_chunk(audio_float)
-    else:
-        # 无状态重采样（不推荐用于流式音频）
-        resampled_float = soxr.resample(audio_float, src_rate, dst_rate, quality='HQ')
-    
-    # 转回 int16
-    resampled_int16 = (resampled_float * 32768.0).clip(-32768, 32767).astype(np.int16)
-    return resampled_int16.tobytes()
-
-
 def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice_id, free_mode=False):
     """
     StepFun实时TTS worker（用于默认音色）
@@ -72,279 +43,175 @@ def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
             tts_url = "wss://lanlan.tech/tts"
         else:
             tts_url = "wss://api.stepfun.com/v1/realtime/audio?model=step-tts-2"
-        ws = None
+        headers = {"Authorization": f"Bearer {audio_api_key}"}
+        session = None  # 当前 speech_id 使用的会话
         current_speech_id = None
         receive_task = None
-        session_id = None
-        session_ready = asyncio.Event()
         response_done = asyncio.Event()  # 用于标记当前响应是否完成
-        # 流式重采样器（24kHz→48kHz）- 维护 chunk 边界状态
-        resampler = soxr.ResampleStream(24000, 48000, 1, dtype='float32')
+        # 输出级（24kHz→48kHz 整帧）- 维护 chunk 边界状态
+        output_stage = AudioOutputStage(24000)
         
-        try:
-            # 连接WebSocket
-            headers = {"Authorization": f"Bearer {audio_api_key}"}
-            
-            ws = await websockets.connect(tts_url, additional_headers=headers)
-            
-            # 等待连接成功事件
-            async def wait_for_connection():
-                """等待连接成功"""
-                nonlocal session_id
-                try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        if event_type == "tts.connection.done":
-                            session_id = event.get("data", {}).get("session_id")
-                            session_ready.set()
-                            break
-                        elif event_type == "tts.response.error":
-                            logger.error(f"TTS服务器错误: {event}")
-                            break
-                except Exception as e:
-                    logger.error(f"等待连接时出错: {e}")
-            
-            # 等待连接成功
+        async def open_session():
+            """建立连接，等待 tts.connection.done 并创建会话（由会话池在后台调用）"""
+            conn = await websockets.connect(tts_url, additional_headers=headers)
             try:
-                await asyncio.wait_for(wait_for_connection(), timeout=5.0)
-            except asyncio.TimeoutError:
-                logger.error("等待连接超时")
-                # 发送失败信号
-                response_queue.put(("__ready__", False))
-                return
-            
-            if not session_ready.is_set() or not session_id:
-                logger.error("连接未能正确建立")
-                # 发送失败信号
-                response_queue.put(("__ready__", False))
-                return
-            
-            # 发送创建会话事件
-            create_event = {
-                "type": "tts.create",
-                "data": {
-                    "session_id": session_id,
-                    "voice_id": voice_id,
-                    "response_format": "wav",
-                    "sample_rate": 24000
-                }
-            }
-            await ws.send(json.dumps(create_event))
-            
-            # 等待会话创建成功
-            async def wait_for_session_ready():
-                try:
-                    async for message in ws:
+                session_id = None
+                async for message in conn:
+                    event = json.loads(message)
+                    event_type = event.get("type")
+                    if event_type == "tts.connection.done":
+                        session_id = event.get("data", {}).get("session_id")
+                        break
+                    elif event_type == "tts.response.error":
+                        raise RuntimeError(f"TTS服务器错误: {event}")
+                if not session_id:
+                    raise RuntimeError("连接未能正确建立")
+                
+                # 发送创建会话事件
+                await conn.send(json.dumps({
+                    "type": "tts.create",
+                    "data": {
+                        "session_id": session_id,
+                        "voice_id": voice_id,
+                        "response_format": "wav",
+                        "sample_rate": 24000
+                    }
+                }))
+                
+                # 等待会话创建成功
+                async def wait_for_session_created():
+                    async for message in conn:
                         event = json.loads(message)
                         event_type = event.get("type")
-                        
                         if event_type == "tts.response.created":
                             break
                         elif event_type == "tts.response.error":
                             logger.error(f"创建会话错误: {event}")
                             break
-                except Exception as e:
-                    logger.error(f"等待会话创建时出错: {e}")
-            
+                
+                try:
+                    await asyncio.wait_for(wait_for_session_created(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    logger.warning("会话创建超时")
+            except BaseException:
+                await conn.close()
+                raise
+            return PooledTTSSession(conn, {"session_id": session_id})
+        
+        async def receive_messages(conn):
+            """接收当前会话的音频"""
             try:
-                await asyncio.wait_for(wait_for_session_ready(), timeout=1.0)
-            except asyncio.TimeoutError:
-                logger.warning("会话创建超时")
+                async for message in conn:
+                    event = json.loads(message)
+                    event_type = event.get("type")
+                    
+                    if event_type == "tts.response.error":
+                        logger.error(f"TTS错误: {event}")
+                    elif event_type == "tts.response.audio.delta":
+                        try:
+                            # StepFun 返回 BASE64 编码的完整音频（包含 wav header）
+                            audio_b64 = event.get("data", {}).get("audio", "")
+                            if audio_b64:
+                                audio_bytes = base64.b64decode(audio_b64)
+                                # 使用 wave 模块读取 WAV 数据
+                                with io.BytesIO(audio_bytes) as wav_io:
+                                    with wave.open(wav_io, 'rb') as wav_file:
+                                        # 读取音频数据
+                                        pcm_data = wav_file.readframes(wav_file.getnframes())
+                                
+                                # 转换为 numpy 数组
+                                audio_array = np.frombuffer(pcm_data, dtype=np.int16)
+                                # 输出级 24000Hz -> 48000Hz
+                                frames = output_stage.push(audio_array)
+                                if frames:
+                                    response_queue.put(frames)
+                        except Exception as e:
+                            logger.error(f"处理音频数据时出错: {e}")
+                    elif event_type in ["tts.response.done", "tts.response.audio.done"]:
+                        # 服务器明确表示音频生成完成，送出尾帧并设置完成标志
+                        logger.debug(f"收到响应完成事件: {event_type}")
+                        tail = output_stage.flush()
+                        if tail:
+                            response_queue.put(tail)
+                        response_done.set()
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            except Exception as e:
+                logger.error(f"消息接收出错: {e}")
+        
+        async def close_current():
+            """关闭当前会话（会话只使用一次）"""
+            nonlocal session, receive_task
+            if receive_task and not receive_task.done():
+                receive_task.cancel()
+                try:
+                    await receive_task
+                except asyncio.CancelledError:
+                    pass
+            receive_task = None
+            if session:
+                await session.close()
+                session = None
+        
+        pool = TTSSessionPool('step', voice_id, open_session)
+        try:
+            # 预热第一个会话，成功即视为就绪
+            if not await pool.prewarm():
+                response_queue.put(("__ready__", False))
+                return
             
             # 发送就绪信号，通知主进程 TTS 已经可以使用
             logger.info("StepFun TTS 已就绪，发送就绪信号")
             response_queue.put(("__ready__", True))
             
-            # 初始接收任务
-            async def receive_messages_initial():
-                """初始接收任务"""
-                try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        if event_type == "tts.response.error":
-                            logger.error(f"TTS错误: {event}")
-                        elif event_type == "tts.response.audio.delta":
-                            try:
-                                # StepFun 返回 BASE64 编码的完整音频（包含 wav header）
-                                audio_b64 = event.get("data", {}).get("audio", "")
-                                if audio_b64:
-                                    audio_bytes = base64.b64decode(audio_b64)
-                                    # 使用 wave 模块读取 WAV 数据
-                                    with io.BytesIO(audio_bytes) as wav_io:
-                                        with wave.open(wav_io, 'rb') as wav_file:
-                                            # 读取音频数据
-                                            pcm_data = wav_file.readframes(wav_file.getnframes())
-                                    
-                                    # 转换为 numpy 数组
-                                    audio_array = np.frombuffer(pcm_data, dtype=np.int16)
-                                    # 使用流式重采样器 24000Hz -> 48000Hz
-                                    response_queue.put(_resample_audio(audio_array, 24000, 48000, resampler))
-                            except Exception as e:
-                                logger.error(f"处理音频数据时出错: {e}")
-                        elif event_type in ["tts.response.done", "tts.response.audio.done"]:
-                            # 服务器明确表示音频生成完成，设置完成标志
-                            logger.debug(f"收到响应完成事件: {event_type}")
-                            response_done.set()
-                except websockets.exceptions.ConnectionClosed:
-                    pass
-                except Exception as e:
-                    logger.error(f"消息接收出错: {e}")
-            
-            receive_task = asyncio.create_task(receive_messages_initial())
-            
             # 主循环：处理请求队列
-            loop = asyncio.get_running_loop()
             while True:
                 try:
-                    sid, tts_text = await loop.run_in_executor(None, request_queue.get)
+                    sid, tts_text = await channel_get(request_queue)
                 except Exception:
                     break
                 
                 if sid is None:
                     # 提交缓冲区完成当前合成
-                    if ws and session_id and current_speech_id is not None:
+                    if session and current_speech_id is not None:
                         try:
                             response_done.clear()  # 清除完成标志，准备等待新的完成事件
                             done_event = {
                                 "type": "tts.text.done",
-                                "data": {"session_id": session_id}
+                                "data": {"session_id": session.info["session_id"]}
                             }
-                            await ws.send(json.dumps(done_event))
+                            await session.ws.send(json.dumps(done_event))
                             # 等待服务器返回响应完成事件，然后关闭连接
                             try:
                                 await asyncio.wait_for(response_done.wait(), timeout=20.0)
                                 logger.debug("音频生成完成，主动关闭连接")
                             except asyncio.TimeoutError:
-                                logger.warning("等待响应完成超时（30秒），强制关闭连接")
-                            
-                            # 主动关闭连接，避免连接一直保持到超时
-                            if ws:
-                                try:
-                                    await ws.close()
-                                except:  # noqa: E722
-                                    pass
-                                ws = None
-                            if receive_task and not receive_task.done():
-                                receive_task.cancel()
-                                try:
-                                    await receive_task
-                                except asyncio.CancelledError:
-                                    pass
-                                receive_task = None
-                            session_id = None
-                            session_ready.clear()
-                            current_speech_id = None  # 清空ID以便下次重连
+                                logger.warning("等待响应完成超时（20秒），强制关闭连接")
                         except Exception as e:
                             logger.error(f"完成生成失败: {e}")
+                        # 主动关闭连接，避免连接一直保持到超时
+                        await close_current()
+                        current_speech_id = None
                     continue
                 
-                # 新的语音ID，重新建立连接
+                # 新的语音ID：关闭旧会话（打断旧语音），换用预热好的会话
                 if current_speech_id != sid:
                     current_speech_id = sid
                     response_done.clear()
-                    resampler.clear()  # 重置重采样器状态（新轮次音频不应与上轮次连续）
-                    if ws:
-                        try:
-                            await ws.close()
-                        except:  # noqa: E722
-                            pass
-                    if receive_task and not receive_task.done():
-                        receive_task.cancel()
-                        try:
-                            await receive_task
-                        except asyncio.CancelledError:
-                            pass
-                    
-                    # 建立新连接
+                    output_stage.reset()  # 重置输出级状态（新轮次音频不应与上轮次连续）
+                    await close_current()
                     try:
-                        ws = await websockets.connect(tts_url, additional_headers=headers)
-                        
-                        # 等待连接成功
-                        session_id = None
-                        session_ready.clear()
-                        
-                        async def wait_conn():
-                            nonlocal session_id
-                            try:
-                                async for message in ws:
-                                    event = json.loads(message)
-                                    if event.get("type") == "tts.connection.done":
-                                        session_id = event.get("data", {}).get("session_id")
-                                        session_ready.set()
-                                        break
-                            except Exception:
-                                pass
-                        
-                        try:
-                            await asyncio.wait_for(wait_conn(), timeout=1.0)
-                        except asyncio.TimeoutError:
-                            logger.warning("新连接超时")
-                            continue
-                        
-                        if not session_id:
-                            continue
-                        
-                        # 创建会话
-                        await ws.send(json.dumps({
-                            "type": "tts.create",
-                            "data": {
-                                "session_id": session_id,
-                                "voice_id": voice_id,
-                                "response_format": "wav",
-                                "sample_rate": 24000
-                            }
-                        }))
-                        
-                        # 启动新的接收任务
-                        async def receive_messages():
-                            try:
-                                async for message in ws:
-                                    event = json.loads(message)
-                                    event_type = event.get("type")
-                                    
-                                    if event_type == "tts.response.error":
-                                        logger.error(f"TTS错误: {event}")
-                                    elif event_type == "tts.response.audio.delta":
-                                        try:
-                                            audio_b64 = event.get("data", {}).get("audio", "")
-                                            if audio_b64:
-                                                audio_bytes = base64.b64decode(audio_b64)
-                                                # 使用 wave 模块读取 WAV 数据
-                                                with io.BytesIO(audio_bytes) as wav_io:
-                                                    with wave.open(wav_io, 'rb') as wav_file:
-                                                        # 读取音频数据
-                                                        pcm_data = wav_file.readframes(wav_file.getnframes())
-                                                
-                                                # 转换为 numpy 数组
-                                                audio_array = np.frombuffer(pcm_data, dtype=np.int16)
-                                                # 使用流式重采样器 24000Hz -> 48000Hz
-                                                response_queue.put(_resample_audio(audio_array, 24000, 48000, resampler))
-                                        except Exception as e:
-                                            logger.error(f"处理音频数据时出错: {e}")
-                                    elif event_type in ["tts.response.done", "tts.response.audio.done"]:
-                                        # 服务器明确表示音频生成完成，设置完成标志
-                                        logger.debug(f"收到响应完成事件: {event_type}")
-                                        response_done.set()
-                            except websockets.exceptions.ConnectionClosed:
-                                pass
-                            except Exception as e:
-                                logger.error(f"消息接收出错: {e}")
-                        
-                        receive_task = asyncio.create_task(receive_messages())
-                        
+                        session = await pool.acquire()
                     except Exception as e:
-                        logger.error(f"重新建立连接失败: {e}")
+                        logger.error(f"获取TTS会话失败: {e}")
                         continue
+                    receive_task = asyncio.create_task(receive_messages(session.ws))
                 
                 # 检查文本有效性
                 if not tts_text or not tts_text.strip():
                     continue
                 
-                if not ws or not session_id:
+                if not session:
                     continue
                 
                 # 发送文本
@@ -352,36 +219,23 @@ def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
                     text_event = {
                         "type": "tts.text.delta",
                         "data": {
-                            "session_id": session_id,
+                            "session_id": session.info["session_id"],
                             "text": tts_text
                         }
                     }
-                    await ws.send(json.dumps(text_event))
+                    await session.ws.send(json.dumps(text_event))
                 except Exception as e:
                     logger.error(f"发送TTS文本失败: {e}")
-                    # 连接已关闭，标记为无效以便下次重连
-                    ws = None
-                    session_id = None
-                    current_speech_id = None  # 清空ID以强制下次重连
-                    if receive_task and not receive_task.done():
-                        receive_task.cancel()
+                    # 连接已关闭，丢弃会话以便下次重新获取
+                    await close_current()
+                    current_speech_id = None
         
         except Exception as e:
             logger.error(f"StepFun实时TTS Worker错误: {e}")
         finally:
             # 清理资源
-            if receive_task and not receive_task.done():
-                receive_task.cancel()
-                try:
-                    await receive_task
-                except asyncio.CancelledError:
-                    pass
-            
-            if ws:
-                try:
-                    await ws.close()
-                except Exception:
-                    pass
+            await close_current()
+            await pool.close()
     
     # 运行异步worker
     try:
@@ -409,19 +263,16 @@ def qwen_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
     async def async_worker():
         """异步TTS worker主循环"""
         tts_url = "wss://dashscope.aliyuncs.com/api-ws/v1/realtime?model=qwen3-tts-flash-realtime-2025-09-18"
-        ws = None
+        headers = {"Authorization": f"Bearer {audio_api_key}"}
+        session = None  # 当前 speech_id 使用的会话
         current_speech_id = None
         receive_task = None
-        session_ready = asyncio.Event()
         response_done = asyncio.Event()  # 用于标记当前响应是否完成
-        # 流式重采样器（24kHz→48kHz）- 维护 chunk 边界状态
-        resampler = soxr.ResampleStream(24000, 48000, 1, dtype='float32')
+        # 输出级（24kHz→48kHz 整帧）- 维护 chunk 边界状态
+        output_stage = AudioOutputStage(24000)
         
-        try:
-            # 连接WebSocket
-            headers = {"Authorization": f"Bearer {audio_api_key}"}
-            
-            # 配置会话消息模板（在重连时复用）
+        async def open_session():
+            """建立连接并完成 session.update 配置（由会话池在后台调用）"""
             # 使用 SERVER_COMMIT 模式：多次 append 文本，最后手动 commit 触发合成
             # 这样可以累积文本，避免"一个字一个字往外蹦"的问题
             config_message = {
@@ -436,40 +287,73 @@ def qwen_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
                     "bit_depth": 16
                 }
             }
-            
-            ws = await websockets.connect(tts_url, additional_headers=headers)
-            
-            # 等待并处理初始消息
-            async def wait_for_session_ready():
-                """等待会话创建确认"""
-                try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        # Qwen TTS API 返回 session.updated 而不是 session.created
-                        if event_type in ["session.created", "session.updated"]:
-                            session_ready.set()
-                            break
-                        elif event_type == "error":
-                            logger.error(f"TTS服务器错误: {event}")
-                            break
-                except Exception as e:
-                    logger.error(f"等待会话就绪时出错: {e}")
-            
-            # 发送配置
-            await ws.send(json.dumps(config_message))
-            
-            # 等待会话就绪（超时5秒）
+            conn = await websockets.connect(tts_url, additional_headers=headers)
             try:
-                await asyncio.wait_for(wait_for_session_ready(), timeout=5.0)
-            except asyncio.TimeoutError:
-                logger.error("❌ 等待会话就绪超时")
-                response_queue.put(("__ready__", False))
-                return
-            
-            if not session_ready.is_set():
-                logger.error("❌ 会话未能正确初始化")
+                await conn.send(json.dumps(config_message))
+                async for message in conn:
+                    event = json.loads(message)
+                    event_type = event.get("type")
+                    # Qwen TTS API 返回 session.updated 而不是 session.created
+                    if event_type in ["session.created", "session.updated"]:
+                        break
+                    elif event_type == "error":
+                        raise RuntimeError(f"TTS服务器错误: {event}")
+                else:
+                    raise RuntimeError("会话未能正确初始化")
+            except BaseException:
+                await conn.close()
+                raise
+            return PooledTTSSession(conn)
+        
+        async def receive_messages(conn):
+            """接收当前会话的音频"""
+            try:
+                async for message in conn:
+                    event = json.loads(message)
+                    event_type = event.get("type")
+                    
+                    if event_type == "error":
+                        logger.error(f"TTS错误: {event}")
+                    elif event_type == "response.audio.delta":
+                        try:
+                            audio_bytes = base64.b64decode(event.get("delta", ""))
+                            audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
+                            # 输出级 24000Hz -> 48000Hz
+                            frames = output_stage.push(audio_array)
+                            if frames:
+                                response_queue.put(frames)
+                        except Exception as e:
+                            logger.error(f"处理音频数据时出错: {e}")
+                    elif event_type in ["response.done", "response.audio.done", "output.done"]:
+                        # 服务器明确表示音频生成完成，送出尾帧并设置完成标志
+                        logger.debug(f"收到响应完成事件: {event_type}")
+                        tail = output_stage.flush()
+                        if tail:
+                            response_queue.put(tail)
+                        response_done.set()
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            except Exception as e:
+                logger.error(f"消息接收出错: {e}")
+        
+        async def close_current():
+            """关闭当前会话（会话只使用一次）"""
+            nonlocal session, receive_task
+            if receive_task and not receive_task.done():
+                receive_task.cancel()
+                try:
+                    await receive_task
+                except asyncio.CancelledError:
+                    pass
+            receive_task = None
+            if session:
+                await session.close()
+                session = None
+        
+        pool = TTSSessionPool('qwen', voice_id, open_session)
+        try:
+            # 预热第一个会话，成功即视为就绪
+            if not await pool.prewarm():
                 response_queue.put(("__ready__", False))
                 return
             
@@ -477,50 +361,19 @@ def qwen_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
             logger.info("Qwen TTS 已就绪，发送就绪信号")
             response_queue.put(("__ready__", True))
             
-            # 初始接收任务（会在每次新 speech_id 时重新创建）
-            async def receive_messages_initial():
-                """初始接收任务"""
-                try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        if event_type == "error":
-                            logger.error(f"TTS错误: {event}")
-                        elif event_type == "response.audio.delta":
-                            try:
-                                audio_bytes = base64.b64decode(event.get("delta", ""))
-                                audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
-                                # 使用流式重采样器 24000Hz -> 48000Hz
-                                response_queue.put(_resample_audio(audio_array, 24000, 48000, resampler))
-                            except Exception as e:
-                                logger.error(f"处理音频数据时出错: {e}")
-                        elif event_type in ["response.done", "response.audio.done", "output.done"]:
-                            # 服务器明确表示音频生成完成，设置完成标志
-                            logger.debug(f"收到响应完成事件: {event_type}")
-                            response_done.set()
-                except websockets.exceptions.ConnectionClosed:
-                    pass
-                except Exception as e:
-                    logger.error(f"消息接收出错: {e}")
-            
-            receive_task = asyncio.create_task(receive_messages_initial())
-            
             # 主循环：处理请求队列
-            loop = asyncio.get_running_loop()
             while True:
-                # 非阻塞检查队列
                 try:
-                    sid, tts_text = await loop.run_in_executor(None, request_queue.get)
+                    sid, tts_text = await channel_get(request_queue)
                 except Exception:
                     break
                 
                 if sid is None:
                     # 提交缓冲区完成当前合成（仅当之前有文本时）
-                    if ws and session_ready.is_set() and current_speech_id is not None:
+                    if session and current_speech_id is not None:
                         try:
                             response_done.clear()  # 清除完成标志，准备等待新的完成事件
-                            await ws.send(json.dumps({
+                            await session.ws.send(json.dumps({
                                 "type": "input_text_buffer.commit",
                                 "event_id": f"event_{int(time.time() * 1000)}_interrupt_commit"
                             }))
@@ -529,145 +382,53 @@ def qwen_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
                                 await asyncio.wait_for(response_done.wait(), timeout=20.0)
                                 logger.debug("音频生成完成，主动关闭连接")
                             except asyncio.TimeoutError:
-                                logger.warning("等待响应完成超时（30秒），强制关闭连接")
-                            
-                            # 主动关闭连接，避免连接一直保持到超时
-                            if ws:
-                                try:
-                                    await ws.close()
-                                except:  # noqa: E722
-                                    pass
-                                ws = None
-                            if receive_task and not receive_task.done():
-                                receive_task.cancel()
-                                try:
-                                    await receive_task
-                                except asyncio.CancelledError:
-                                    pass
-                                receive_task = None
-                            session_ready.clear()
-                            current_speech_id = None  # 清空ID以便下次重连
+                                logger.warning("等待响应完成超时（20秒），强制关闭连接")
                         except Exception as e:
                             logger.error(f"提交缓冲区失败: {e}")
+                        # 主动关闭连接，避免连接一直保持到超时
+                        await close_current()
+                        current_speech_id = None
                     continue
                 
-                # 新的语音ID，重新建立连接（类似 speech_synthesis_worker 的逻辑）
-                # 直接关闭旧连接，打断旧语音
+                # 新的语音ID：关闭旧会话（打断旧语音），换用预热好的会话
                 if current_speech_id != sid:
                     current_speech_id = sid
                     response_done.clear()
-                    resampler.clear()  # 重置重采样器状态（新轮次音频不应与上轮次连续）
-                    if ws:
-                        try:
-                            await ws.close()
-                        except:  # noqa: E722
-                            pass
-                    if receive_task and not receive_task.done():
-                        receive_task.cancel()
-                        try:
-                            await receive_task
-                        except asyncio.CancelledError:
-                            pass
-                    
-                    # 建立新连接
+                    output_stage.reset()  # 重置输出级状态（新轮次音频不应与上轮次连续）
+                    await close_current()
                     try:
-                        ws = await websockets.connect(tts_url, additional_headers=headers)
-                        await ws.send(json.dumps(config_message))
-                        
-                        # 等待 session.created
-                        session_ready.clear()
-                        
-                        async def wait_ready():
-                            try:
-                                async for message in ws:
-                                    event = json.loads(message)
-                                    event_type = event.get("type")
-                                    # Qwen TTS API 返回 session.updated 而不是 session.created
-                                    if event_type in ["session.created", "session.updated"]:
-                                        session_ready.set()
-                                        break
-                                    elif event_type == "error":
-                                        logger.error(f"等待期间收到错误: {event}")
-                                        break
-                            except Exception as e:
-                                logger.error(f"wait_ready 异常: {e}")
-                        
-                        try:
-                            await asyncio.wait_for(wait_ready(), timeout=2.0)
-                        except asyncio.TimeoutError:
-                            logger.warning("新会话创建超时")
-                        
-                        # 启动新的接收任务
-                        async def receive_messages():
-                            try:
-                                async for message in ws:
-                                    event = json.loads(message)
-                                    event_type = event.get("type")
-                                    
-                                    if event_type == "error":
-                                        logger.error(f"TTS错误: {event}")
-                                    elif event_type == "response.audio.delta":
-                                        try:
-                                            audio_bytes = base64.b64decode(event.get("delta", ""))
-                                            audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
-                                            # 使用流式重采样器 24000Hz -> 48000Hz
-                                            response_queue.put(_resample_audio(audio_array, 24000, 48000, resampler))
-                                        except Exception as e:
-                                            logger.error(f"处理音频数据时出错: {e}")
-                                    elif event_type in ["response.done", "response.audio.done", "output.done"]:
-                                        # 服务器明确表示音频生成完成，设置完成标志
-                                        logger.debug(f"收到响应完成事件: {event_type}")
-                                        response_done.set()
-                            except websockets.exceptions.ConnectionClosed:
-                                pass
-                            except Exception as e:
-                                logger.error(f"消息接收出错: {e}")
-                        
-                        receive_task = asyncio.create_task(receive_messages())
-                        
+                        session = await pool.acquire()
                     except Exception as e:
-                        logger.error(f"重新建立连接失败: {e}")
+                        logger.error(f"获取TTS会话失败: {e}")
                         continue
+                    receive_task = asyncio.create_task(receive_messages(session.ws))
                 
                 # 检查文本有效性
                 if not tts_text or not tts_text.strip():
                     continue
                 
-                if not ws or not session_ready.is_set():
+                if not session:
                     continue
                 
                 # 追加文本到缓冲区（不立即提交，等待响应完成时的终止信号再 commit）
                 try:
-                    await ws.send(json.dumps({
+                    await session.ws.send(json.dumps({
                         "type": "input_text_buffer.append",
                         "event_id": f"event_{int(time.time() * 1000)}",
                         "text": tts_text
                     }))
                 except Exception as e:
                     logger.error(f"发送TTS文本失败: {e}")
-                    # 连接已关闭，标记为无效以便下次重连
-                    ws = None
-                    current_speech_id = None  # 清空ID以强制下次重连
-                    session_ready.clear()
-                    if receive_task and not receive_task.done():
-                        receive_task.cancel()
+                    # 连接已关闭，丢弃会话以便下次重新获取
+                    await close_current()
+                    current_speech_id = None
         
         except Exception as e:
             logger.error(f"Qwen实时TTS Worker错误: {e}")
         finally:
             # 清理资源
-            if receive_task and not receive_task.done():
-                receive_task.cancel()
-                try:
-                    await receive_task
-                except asyncio.CancelledError:
-                    pass
-            
-            if ws:
-                try:
-                    await ws.close()
-                except Exception:
-                    pass
+            await close_current()
+            await pool.close()
     
     # 运行异步worker
     try:
@@ -726,11 +487,7 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
     synthesizer = None
     
     while True:
-        # 非阻塞检查队列，优先处理打断
-        if request_queue.empty():
-            time.sleep(0.01)
-            continue
-
+        # 阻塞等待下一个请求（有数据才唤醒）
         sid, tts_text = request_queue.get()
 
         if sid is None:
@@ -838,17 +595,17 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
         tts_url = "https://open.bigmodel.cn/api/paas/v4/audio/speech"
         current_speech_id = None
         text_buffer = []  # 累积文本缓冲区
+        # 输出级：CogTTS 默认 24kHz，实际采样率以返回的 return_sample_rate 为准；开头 10ms 淡入
+        output_stage = AudioOutputStage(24000, fade_in_ms=10)
         
         # CogTTS 是基于 HTTP 的，无需建立持久连接，直接发送就绪信号
         logger.info("CogTTS TTS 已就绪，发送就绪信号")
         response_queue.put(("__ready__", True))
         
         try:
-            loop = asyncio.get_running_loop()
-            
             while True:
                 try:
-                    sid, tts_text = await loop.run_in_executor(None, request_queue.get)
+                    sid, tts_text = await channel_get(request_queue)
                 except Exception:
                     break
                 
@@ -881,6 +638,7 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
                                 }
                                 
                                 # 使用异步HTTP客户端流式接收SSE响应
+                                output_stage.reset()
                                 async with aiohttp.ClientSession() as session:
                                     async with session.post(tts_url, headers=headers, json=payload) as resp:
                                         if resp.status == 200:
@@ -927,8 +685,7 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
                                                                     # 从返回的 return_sample_rate 获取采样率
                                                                     sample_rate = delta.get('return_sample_rate', 24000)
                                                                     
-                                                                    # 转换为 float32 进行高质量重采样
-                                                                    audio_array = np.frombuffer(audio_bytes, dtype=np.int16).astype(np.float32) / 32768.0
+                                                                    audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
                                                                     
                                                                     # 对第一个音频块，裁剪掉开头的噪音部分（CogTTS有初始化噪音）
                                                                     if not first_audio_received:
@@ -938,21 +695,18 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
                                                                         if len(audio_array) > trim_samples:
                                                                             audio_array = audio_array[trim_samples:]
                                                                             logger.debug(f"裁剪第一个音频块的前 {trim_samples} 个采样点（{trim_samples/sample_rate:.2f}秒）")
-                                                                        # 对裁剪后的开头应用短淡入（10ms），平滑过渡
-                                                                        fade_samples = min(int(sample_rate * 0.01), len(audio_array))
-                                                                        if fade_samples > 0:
-                                                                            fade_curve = np.linspace(0.0, 1.0, fade_samples)
-                                                                            audio_array[:fade_samples] *= fade_curve
                                                                     
-                                                                    # 使用 soxr 进行高质量重采样
-                                                                    resampled = soxr.resample(audio_array, sample_rate, 48000, quality='HQ')
-                                                                    # 转回 int16 格式
-                                                                    resampled_int16 = (resampled * 32768.0).clip(-32768, 32767).astype(np.int16)
-                                                                    response_queue.put(resampled_int16.tobytes())
+                                                                    # 输出级：裁剪后的开头淡入，流式重采样到 48kHz 整帧
+                                                                    frames = output_stage.push(audio_array, src_rate=sample_rate)
+                                                                    if frames:
+                                                                        response_queue.put(frames)
                                                         except json.JSONDecodeError as e:
                                                             logger.warning(f"解析SSE JSON失败: {e}")
                                                         except Exception as e:
                                                             logger.error(f"处理音频数据时出错: {e}")
+                                            tail = output_stage.flush()
+                                            if tail:
+                                                response_queue.put(tail)
                                         else:
                                             error_text = await resp.text()
                                             logger.error(f"CogTTS API错误 ({resp.status}): {error_text}")
@@ -1058,6 +812,7 @@ def local_cosyvoice_worker(request_queue, response_queue, audio_api_key, voice_i
     特性：
     - 双工流：发送和接收独立运行，互不阻塞
     - 打断支持：speech_id 变化时关闭旧连接，打断旧语音
+    - 预热：下一条连接由 TTSSessionPool 提前建立并发送配置，新 speech_id 直接取用
     - 非阻塞：异步架构，不会卡住主循环
     
     注意：audio_api_key 参数未使用（本地模式不需要 API Key），保留是为了与其他 worker 保持统一签名
@@ -1102,11 +857,11 @@ def local_cosyvoice_worker(request_queue, response_queue, audio_api_key, voice_i
     SRC_RATE = 22050
 
     async def async_worker():
-        ws = None
+        session = None  # 当前 speech_id 使用的会话
         receive_task = None
         current_speech_id = None
         
-        resampler = soxr.ResampleStream(SRC_RATE, 48000, 1, dtype='float32')
+        output_stage = AudioOutputStage(SRC_RATE)
 
         async def receive_loop(ws_conn):
             """独立接收任务，处理音频流"""
@@ -1114,9 +869,13 @@ def local_cosyvoice_worker(request_queue, response_queue, audio_api_key, voice_i
                 async for message in ws_conn:
                     if isinstance(message, bytes):
                         # 服务器返回 16-bit PCM @ 22050Hz
-                        audio_array = np.frombuffer(message, dtype=np.int16)
-                        resampled_bytes = _resample_audio(audio_array, SRC_RATE, 48000, resampler)
-                        response_queue.put(resampled_bytes)
+                        frames = output_stage.push(message)
+                        if frames:
+                            response_queue.put(frames)
+                # 服务端合成结束后关闭连接：送出尾帧
+                tail = output_stage.flush()
+                if tail:
+                    response_queue.put(tail)
             except websockets.exceptions.ConnectionClosed:
                 logger.debug("本地 WebSocket 连接已关闭")
             except asyncio.CancelledError:
@@ -1132,79 +891,78 @@ def local_cosyvoice_worker(request_queue, response_queue, audio_api_key, voice_i
             except Exception as e:
                 logger.error(f"发送结束信号失败: {e}")
 
-        async def create_connection():
-            """创建新连接并发送配置"""
-            nonlocal ws, receive_task, resampler
-            
-            # 清理旧连接
+        async def open_session():
+            """创建新连接并发送配置（由会话池在后台调用）"""
+            logger.debug(f"🔄 [LocalTTS] 正在连接: {WS_URL}")
+            conn = await websockets.connect(WS_URL, ping_interval=None)
+            try:
+                # 发送配置
+                config = {
+                    "voice": voice_name,
+                    "speed": speech_speed,
+                }
+                await conn.send(json.dumps(config))
+                logger.debug(f"发送配置: {config}")
+            except BaseException:
+                await conn.close()
+                raise
+            return PooledTTSSession(conn)
+
+        async def close_current():
+            """关闭当前会话（会话只使用一次）"""
+            nonlocal session, receive_task
             if receive_task and not receive_task.done():
                 receive_task.cancel()
                 try:
                     await receive_task
                 except asyncio.CancelledError:
                     pass
-            if ws:
-                try:
-                    await ws.close()
-                except Exception:
-                    pass
-            
-            # 重置 resampler
-            resampler = soxr.ResampleStream(SRC_RATE, 48000, 1, dtype='float32')
-            
-            logger.info(f"🔄 [LocalTTS] 正在连接: {WS_URL}")
-            ws = await websockets.connect(WS_URL, ping_interval=None)
-            logger.info("✅ [LocalTTS] 连接成功")
-            
-            # 发送配置
-            config = {
-                "voice": voice_name,
-                "speed": speech_speed,
-            }
-            await ws.send(json.dumps(config))
-            logger.debug(f"发送配置: {config}")
-            
-            # 启动接收任务
-            receive_task = asyncio.create_task(receive_loop(ws))
-            return ws
+            receive_task = None
+            if session:
+                await session.close()
+                session = None
 
-        # 初始连接
-        try:
-            await create_connection()
+        pool = TTSSessionPool('local_cosyvoice', voice_id or voice_name, open_session)
+
+        # 初始连接：预热第一个会话
+        if await pool.prewarm():
+            logger.info("✅ [LocalTTS] 连接成功")
             response_queue.put(("__ready__", True))
-        except Exception as e:
-            logger.error(f"❌ [LocalTTS] 初始连接失败: {e}")
+        else:
+            logger.error("❌ [LocalTTS] 初始连接失败")
             logger.error("请确保服务器已运行且端口正确")
             response_queue.put(("__ready__", False))
+            await pool.close()
             return
 
         # 主循环
-        loop = asyncio.get_running_loop()
         while True:
             try:
-                sid, tts_text = await loop.run_in_executor(None, request_queue.get)
+                sid, tts_text = await channel_get(request_queue)
             except Exception as e:
                 logger.error(f'队列获取异常: {e}')
                 break
 
-            # speech_id 变化 -> 打断旧语音，建立新连接
+            # speech_id 变化 -> 打断旧语音，换用预热好的连接
             if sid != current_speech_id and sid is not None:
                 # 发送结束信号（文本已在实时流中发送过了）
-                if ws:
-                    await send_end_signal(ws)
+                if session:
+                    await send_end_signal(session.ws)
+                await close_current()
                 
                 current_speech_id = sid
+                output_stage.reset()  # 重置输出级
                 try:
-                    await create_connection()
+                    session = await pool.acquire()
                 except Exception as e:
                     logger.error(f"重连失败: {e}")
-                    ws = None
                     continue
+                receive_task = asyncio.create_task(receive_loop(session.ws))
 
             if sid is None:
                 # 终止信号：发送结束信号
-                if ws:
-                    await send_end_signal(ws)
+                if session:
+                    await send_end_signal(session.ws)
                 current_speech_id = None
                 continue
 
@@ -1212,26 +970,17 @@ def local_cosyvoice_worker(request_queue, response_queue, audio_api_key, voice_i
                 continue
             
             # 同时发送（bistream 模式允许边发边收）
-            if ws:
+            if session:
                 try:
-                    await ws.send(json.dumps({"text": tts_text}))
+                    await session.ws.send(json.dumps({"text": tts_text}))
                     logger.debug(f"发送合成片段: {tts_text}")
                 except Exception as e:
                     logger.error(f"发送失败: {e}")
-                    ws = None
+                    await close_current()
 
         # 清理
-        if receive_task and not receive_task.done():
-            receive_task.cancel()
-            try:
-                await receive_task
-            except asyncio.CancelledError:
-                pass
-        if ws:
-            try:
-                await ws.close()
-            except Exception:
-                pass
+        await close_current()
+        await pool.close()
 
     # 运行 Asyncio 循环
     try:
@@ -0,0 +1,150 @@
+"""
+TTS 音频输出级
+
+各 TTS worker 收到的音频采样率不同（24kHz / 22.05kHz / CogTTS 按返回值），原先各自转换：
+有的用持久的 ResampleStream，有的每块调用无状态的 soxr.resample（块边界不连续、产生咔哒声），
+每块都要分配 float32 副本，淡入曲线也每次用 np.linspace 重新生成。
+
+AudioOutputStage 统一这一步：
+- 每个 worker 持有一个持久的 soxr.ResampleStream，新轮次时 reset() 清空状态
+- int16 -> float32 / float32 -> int16 的转换复用预分配缓冲区
+- 淡入曲线按 (采样率, 时长) 预先计算并缓存
+- 输出固定为 48kHz，并按 OUTPUT_FRAME_MS 对齐：每次送出整数帧，不足一帧的尾部留到下一块，
+  flush() 时补零成整帧。所有服务的输出块长度一致，下游（前端播放、编码）按帧处理即可
+"""
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import soxr
+
+OUTPUT_SAMPLE_RATE = 48000
+# 输出帧时长（毫秒）：48kHz 下 960 个采样点
+OUTPUT_FRAME_MS = 20
+OUTPUT_FRAME_SAMPLES = OUTPUT_SAMPLE_RATE * OUTPUT_FRAME_MS // 1000
+
+_INT16_TO_FLOAT = np.float32(1.0 / 32768.0)
+_FLOAT_TO_INT16 = np.float32(32768.0)
+
+# (采样率, 淡入毫秒) -> float32 淡入曲线
+_fade_curves: Dict[Tuple[int, float], np.ndarray] = {}
+
+
+def get_fade_in_curve(sample_rate: int, fade_ms: float) -> np.ndarray:
+    """返回缓存的线性淡入曲线（只读）"""
+    key = (sample_rate, fade_ms)
+    curve = _fade_curves.get(key)
+    if curve is None:
+        curve = np.linspace(0.0, 1.0, max(1, int(sample_rate * fade_ms / 1000)), dtype=np.float32)
+        curve.flags.writeable = False
+        _fade_curves[key] = curve
+    return curve
+
+
+class AudioOutputStage:
+    """单个 TTS worker 的 int16 PCM -> 48kHz 整帧 PCM16 输出级"""
+
+    def __init__(self, src_rate: int, fade_in_ms: float = 0.0, quality: str = 'HQ'):
+        """
+        Args:
+            src_rate: 服务返回音频的采样率（可在 push 时按块覆盖）
+            fade_in_ms: 每轮开头的淡入时长，0 表示不淡入
+        """
+        self.quality = quality
+        self.fade_in_ms = fade_in_ms
+        self.src_rate = None
+        self._resampler: Optional[soxr.ResampleStream] = None
+        self._in_float = np.zeros(0, dtype=np.float32)
+        self._out_int16 = np.zeros(0, dtype=np.int16)
+        # 不足一帧的尾部（已转换为 int16）
+        self._pending = np.zeros(OUTPUT_FRAME_SAMPLES, dtype=np.int16)
+        self._pending_len = 0
+        self._fade_pos = 0
+        self._fade_curve = None
+        self._set_src_rate(src_rate)
+        self.reset()
+
+    def _set_src_rate(self, src_rate: int):
+        if src_rate == self.src_rate:
+            return
+        self.src_rate = src_rate
+        self._resampler = None
+        if src_rate != OUTPUT_SAMPLE_RATE:
+            self._resampler = soxr.ResampleStream(src_rate, OUTPUT_SAMPLE_RATE, 1,
+                                                  dtype='float32', quality=self.quality)
+        self._fade_curve = get_fade_in_curve(src_rate, self.fade_in_ms) if self.fade_in_ms > 0 else None
+
+    def reset(self, src_rate: Optional[int] = None):
+        """开始新的一轮：清空重采样状态与未送出的尾部，重新启用淡入"""
+        if src_rate is not None:
+            self._set_src_rate(src_rate)
+        if self._resampler is not None:
+            self._resampler.clear()
+        self._pending_len = 0
+        self._fade_pos = 0
+
+    @staticmethod
+    def _grow(buf: np.ndarray, n: int) -> np.ndarray:
+        if len(buf) >= n:
+            return buf
+        return np.zeros(max(n, len(buf) * 2), dtype=buf.dtype)
+
+    def push(self, pcm: Union[bytes, bytearray, memoryview, np.ndarray], src_rate: Optional[int] = None) -> bytes:
+        """
+        输入一块 int16 PCM，返回可以立即播放的 48kHz 整帧 PCM16（不足一帧时为空）
+        """
+        if src_rate is not None and src_rate != self.src_rate:
+            # 采样率变化时之前的滤波状态不再适用
+            self._set_src_rate(src_rate)
+        samples = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype=np.int16)
+        n = len(samples)
+        if n == 0:
+            return b''
+        self._in_float = self._grow(self._in_float, n)
+        work = self._in_float[:n]
+        np.multiply(samples, _INT16_TO_FLOAT, out=work)
+
+        curve = self._fade_curve
+        if curve is not None and self._fade_pos < len(curve):
+            m = min(len(curve) - self._fade_pos, n)
+            work[:m] *= curve[self._fade_pos:self._fade_pos + m]
+            self._fade_pos += m
+
+        out = self._resampler.resample_chunk(work) if self._resampler is not None else work
+        return self._emit(out)
+
+    def flush(self) -> bytes:
+        """本轮结束：取出重采样器里剩余的音频，尾部补零成整帧后送出，并为下一轮复位"""
+        tail = b''
+        if self._resampler is not None:
+            rest = self._resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+            tail = self._emit(rest)
+        if self._pending_len:
+            self._pending[self._pending_len:] = 0
+            tail += self._pending.tobytes()
+        self.reset()
+        return tail
+
+    def _emit(self, out: np.ndarray) -> bytes:
+        m = len(out)
+        total = self._pending_len + m
+        frames_len = total - total % OUTPUT_FRAME_SAMPLES
+        if frames_len == 0:
+            if m:
+                self._to_int16(out, self._pending[self._pending_len:total])
+            self._pending_len = total
+            return b''
+        self._out_int16 = self._grow(self._out_int16, total)
+        buf = self._out_int16[:total]
+        buf[:self._pending_len] = self._pending[:self._pending_len]
+        self._to_int16(out, buf[self._pending_len:])
+        rest = total - frames_len
+        self._pending[:rest] = buf[frames_len:]
+        self._pending_len = rest
+        return buf[:frames_len].tobytes()
+
+    @staticmethod
+    def _to_int16(src: np.ndarray, dst: np.ndarray):
+        # src 是本级的工作缓冲区或 resampler 的新输出，可以原地缩放
+        np.multiply(src, _FLOAT_TO_INT16, out=src)
+        np.clip(src, -32768, 32767, out=src)
+        np.copyto(dst, src, casting='unsafe')
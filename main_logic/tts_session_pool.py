@@ -0,0 +1,193 @@
+"""
+TTS websocket 会话预热池
+
+实时TTS worker 每个 speech_id 只使用一个会话：新回复开始时关闭旧连接（打断旧语音），
+回复结束时等待合成完成后关闭。原先新连接在新回复的第一段文本到达时才建立，
+TLS握手 + 会话配置（session.update / tts.create）全部计入首音频延迟。
+
+TTSSessionPool 按 (provider, voice_id) 维护一到两个已完成配置的会话：
+- 新 speech_id 到来时直接取出预热好的会话，随即在后台补充
+- 预热会话在服务端空闲超时（max_idle）之前主动轮换，不会拿到已被服务端关闭的连接
+- 长时间没有新回复（keep_warm 秒）后停止预热，释放连接；下次按需建立
+会话只使用一次，用完即关闭，与原有的打断语义一致。
+
+池运行在 worker 线程自己的事件循环中，websocket 连接不跨线程共享。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 各服务的会话空闲超时规则（秒）：预热会话在此时间之前轮换
+# DashScope 实时接口约 23 秒无数据即断开；阶跃星辰按同等保守值处理；本地服务不设限制
+PROVIDER_MAX_IDLE = {
+    'qwen': 18.0,
+    'step': 18.0,
+    'local_cosyvoice': 120.0,
+}
+# 最后一次使用后继续保持预热的时长（秒）
+POOL_KEEP_WARM = 300.0
+# 每个 (provider, voice_id) 保持的预热会话数
+POOL_SIZE = 1
+# 建立单个会话的超时（秒）
+POOL_CONNECT_TIMEOUT = 5.0
+
+# "provider:voice_id" -> 统计（跨 worker 线程累计）
+_pool_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def get_tts_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """返回每个 (provider, voice_id) 的预热命中、建连与失败统计"""
+    return {key: dict(stats) for key, stats in _pool_stats.items()}
+
+
+class PooledTTSSession:
+    """一个已完成握手与配置的TTS会话"""
+
+    def __init__(self, ws, info: Optional[Dict[str, Any]] = None):
+        self.ws = ws
+        self.info = info or {}  # 服务相关的会话信息（例如 StepFun 的 session_id）
+        self.created_at = time.monotonic()
+
+    def is_open(self) -> bool:
+        return getattr(self.ws, 'close_code', None) is None
+
+    def is_fresh(self, max_idle: float) -> bool:
+        return self.is_open() and time.monotonic() - self.created_at < max_idle
+
+    async def close(self):
+        try:
+            await self.ws.close()
+        except Exception:
+            pass
+
+
+class TTSSessionPool:
+    """单个 worker 内的预热会话池"""
+
+    def __init__(self, provider: str, voice_id: str,
+                 open_session: Callable[[], Awaitable[PooledTTSSession]],
+                 size: int = POOL_SIZE, max_idle: Optional[float] = None,
+                 keep_warm: float = POOL_KEEP_WARM, connect_timeout: float = POOL_CONNECT_TIMEOUT):
+        """
+        Args:
+            open_session: 建立连接并完成会话配置的协程函数，失败时抛出异常
+            max_idle: 预热会话的最长保留时间，缺省按 PROVIDER_MAX_IDLE
+        """
+        self.provider = provider
+        self.voice_id = voice_id
+        self._open_session = open_session
+        self.size = max(1, size)
+        self.max_idle = max_idle if max_idle is not None else PROVIDER_MAX_IDLE.get(provider, 18.0)
+        self.keep_warm = keep_warm
+        self.connect_timeout = connect_timeout
+        self._warm = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+        self._maintain_task: Optional[asyncio.Task] = None
+        self._last_used = time.monotonic()
+        self._closed = False
+        self.stats = _pool_stats.setdefault(f"{provider}:{voice_id}", {
+            'opened': 0, 'warm_hits': 0, 'cold_opens': 0, 'expired': 0, 'failures': 0,
+            'last_acquire_ms': None,
+        })
+
+    async def _open(self) -> PooledTTSSession:
+        session = await asyncio.wait_for(self._open_session(), timeout=self.connect_timeout)
+        self.stats['opened'] += 1
+        return session
+
+    async def prewarm(self) -> bool:
+        """建立第一个预热会话（worker 启动时调用，结果即就绪信号）"""
+        try:
+            self._warm.append(await self._open())
+        except Exception as e:
+            self.stats['failures'] += 1
+            logger.error(f"[{self.provider}] TTS会话预热失败: {e}")
+            return False
+        self._maintain_task = asyncio.create_task(self._maintain())
+        self._schedule_refill()
+        return True
+
+    async def acquire(self) -> PooledTTSSession:
+        """取出一个可用会话：优先使用预热会话，没有时当场建立"""
+        start = time.monotonic()
+        self._last_used = start
+        session = None
+        while self._warm:
+            candidate = self._warm.popleft()
+            if candidate.is_fresh(self.max_idle):
+                session = candidate
+                self.stats['warm_hits'] += 1
+                break
+            self.stats['expired'] += 1
+            await candidate.close()
+        if session is None:
+            self.stats['cold_opens'] += 1
+            session = await self._open()
+        self.stats['last_acquire_ms'] = round((time.monotonic() - start) * 1000, 1)
+        self._schedule_refill()
+        return session
+
+    def _wants_warm(self) -> bool:
+        return not self._closed and time.monotonic() - self._last_used < self.keep_warm
+
+    def _schedule_refill(self):
+        if not self._wants_warm() or len(self._warm) >= self.size:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        failures = 0
+        while self._wants_warm() and len(self._warm) < self.size:
+            try:
+                session = await self._open()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                self.stats['failures'] += 1
+                logger.warning(f"[{self.provider}] 补充TTS预热会话失败 ({failures}): {e}")
+                if failures >= 3:
+                    # 交给定期维护重试，避免服务不可用时密集重连
+                    return
+                await asyncio.sleep(min(2.0 ** failures, 10.0))
+                continue
+            if self._closed:
+                await session.close()
+                return
+            self._warm.append(session)
+
+    async def _maintain(self):
+        """定期轮换即将空闲超时的会话；长时间未使用则释放全部预热会话"""
+        interval = max(1.0, self.max_idle / 3)
+        try:
+            while not self._closed:
+                await asyncio.sleep(interval)
+                keep = self._wants_warm()
+                # 距离空闲超时不足一个检查周期的会话提前关闭，由 refill 换新
+                deadline = self.max_idle - interval
+                for session in list(self._warm):
+                    if not keep or not session.is_fresh(deadline):
+                        self._warm.remove(session)
+                        if keep:
+                            self.stats['expired'] += 1
+                        await session.close()
+                self._schedule_refill()
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        self._closed = True
+        for task in (self._refill_task, self._maintain_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        while self._warm:
+            await self._warm.popleft().close()
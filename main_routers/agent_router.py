@@ -245,6 +245,16 @@ async def notify_task_result(request: Request):
         data = await request.json()
         # 如果未显式提供，则使用当前默认角色
         _, her_name_current, _, _, _, _, _, _, _, _ = _config_manager.get_character_data()
+        # agent_server 会把同时完成的多条通知合并为 {"items": [...]} 一次发送
+        if isinstance(data.get('items'), list):
+            accepted = 0
+            for item in data['items']:
+                text = (item.get('text') or '').strip() if isinstance(item, dict) else ''
+                mgr = session_manager.get(item.get('lanlan_name') or her_name_current) if text else None
+                if mgr:
+                    mgr.pending_extra_replies.append(text)
+                    accepted += 1
+            return {"success": True, "accepted": accepted}
         lanlan = data.get('lanlan_name') or her_name_current
         text = (data.get('text') or '').strip()
         if not text:
@@ -17,6 +17,8 @@ from pathlib import Path
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
 
+from utils.history_journal import read_history_dicts, journal_path_for
+
 
 router = APIRouter(prefix="/api/memory", tags=["memory"])
 
@@ -186,8 +188,8 @@ async def get_recent_file(filename: str):
     if not resolved_path.exists():
         return JSONResponse({"success": False, "error": "文件不存在"}, status_code=404)
     
-    with open(resolved_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    # 快照之后的新消息可能还在追加日志中，合并后返回完整内容
+    content = json.dumps(read_history_dicts(str(resolved_path)), ensure_ascii=False, indent=2)
     return {"content": content}
 
 
@@ -316,16 +318,20 @@ async def update_catgirl_name(request: Request):
             logger.warning(f"记忆文件不存在: {old_file_path}")
             return JSONResponse({"success": False, "error": f"记忆文件不存在: {old_filename}"}, status_code=404)
         
+        # 读取完整内容（快照 + 追加日志）
+        file_content = read_history_dicts(str(old_file_path))
+        
         # 如果新文件已存在，先删除
         if os.path.exists(new_file_path):
             os.remove(new_file_path)
         
-        # 重命名文件
+        # 重命名文件，旧的追加日志已合并进内容，直接删除
         os.rename(old_file_path, new_file_path)
+        for journal_file in (journal_path_for(str(old_file_path)), journal_path_for(str(new_file_path))):
+            if os.path.exists(journal_file):
+                os.remove(journal_file)
         
         # 2. 更新文件内容中的猫娘名称引用
-        with open(new_file_path, 'r', encoding='utf-8') as f:
-            file_content = json.load(f)
         
         # 遍历所有消息，仅在特定字段中更新猫娘名称
         for item in file_content:
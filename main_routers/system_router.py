@@ -7,6 +7,7 @@ Handles system-related endpoints including:
 - Emotion analysis
 - Steam achievements
 - File utilities (file-exists, find-first-image, proxy-image)
+- Audio egress stats
 """
 
 import os
@@ -31,6 +32,9 @@ from config.prompts_sys import emotion_analysis_prompt, proactive_chat_prompt, p
 from utils.workshop_utils import get_workshop_path
 from utils.screenshot_utils import analyze_screenshot_from_data_url
 from utils.language_utils import detect_language, translate_text, normalize_language_code
+from utils.llm_client import get_pool_stats
+from main_logic.tts_session_pool import get_tts_pool_stats
+from main_logic.cross_server import get_relay_stats
 
 router = APIRouter(prefix="/api", tags=["system"])
 logger = logging.getLogger("Main")
@@ -245,6 +249,53 @@ async def list_achievements():
         return JSONResponse(content={"error": "Steamworks未初始化"}, status_code=500)
 
 
+@router.get('/audio_egress_stats')
+async def audio_egress_stats():
+    """各角色下行语音的编码、PCM/OGG 字节率与编码 CPU（见 utils.audio_egress）"""
+    session_manager = get_session_manager()
+    return {name: mgr.get_audio_egress_stats() for name, mgr in session_manager.items()}
+
+
+@router.get('/relay_stats')
+async def relay_stats():
+    """各角色同步连接器（主服务器 -> 监控服务器）的转发延迟直方图与合并帧统计（见 main_logic.cross_server）"""
+    return get_relay_stats()
+
+
+@router.get('/session_stats')
+async def session_stats():
+    """各角色当前会话的运行统计：TTS首音频延迟；语音模式下另有上行发送队列与上行门限（启用时）"""
+    session_manager = get_session_manager()
+    result = {}
+    for name, mgr in session_manager.items():
+        session = mgr.session
+        result[name] = {
+            'tts_latency': mgr.get_tts_latency_stats(),
+            'send_queue': session.get_send_queue_stats() if hasattr(session, 'get_send_queue_stats') else None,
+            'vad_gate': session.get_vad_gate_stats() if hasattr(session, 'get_vad_gate_stats') else None,
+        }
+    return result
+
+
+@router.get('/tts_pool_stats')
+async def tts_pool_stats():
+    """TTS会话预热池按 (provider, voice_id) 的命中、未命中与失败统计（见 main_logic.tts_session_pool）"""
+    return get_tts_pool_stats()
+
+
+@router.get('/llm_pool_stats')
+async def llm_pool_stats():
+    """主服务器与记忆服务器各LLM端点的客户端复用与连接池统计（见 utils.llm_client）"""
+    result = {'main_server': get_pool_stats()}
+    try:
+        async with httpx.AsyncClient() as client:
+            resp = await client.get(f"http://localhost:{MEMORY_SERVER_PORT}/llm_pool_stats", timeout=2.0)
+            result['memory_server'] = resp.json()
+    except Exception as e:
+        result['memory_server'] = {'error': str(e)}
+    return result
+
+
 @router.get('/file-exists')
 async def check_file_exists(path: str = None):
     """
@@ -1041,6 +1092,8 @@ async def proactive_chat(request: Request):
                 await asyncio.sleep(0.15)  # 小延迟模拟流式
             
             # 发送TTS结束信号，触发TTS的commit（对于Qwen TTS的server_commit模式尤为重要）
+            if mgr.use_tts:
+                await mgr.flush_tts_text()
             if mgr.use_tts and mgr.tts_thread and mgr.tts_thread.is_alive():
                 try:
                     mgr.tts_request_queue.put((None, None))
@@ -68,11 +68,15 @@ async def websocket_endpoint(websocket: WebSocket, lanlan_name: str):
     # 立即设置websocket到session manager，以支持主动搭话
     # 注意：这里设置后，即使cleanup()被调用，websocket也会在start_session时重新设置
     session_manager[lanlan_name].websocket = websocket
+    # 新连接在声明支持的编码之前按 PCM16 下发语音
+    session_manager[lanlan_name].set_audio_codecs(())
     logger.info(f"✅ 已设置 {lanlan_name} 的WebSocket连接")
 
     try:
         while True:
-            data = await websocket.receive_text()
+            ws_message = await websocket.receive()
+            if ws_message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(ws_message.get("code", 1000), ws_message.get("reason"))
             # 安全检查：如果角色已被重命名或删除，lanlan_name 可能不再存在
             if lanlan_name not in session_id or lanlan_name not in session_manager:
                 logger.info(f"角色 {lanlan_name} 已被重命名或删除，关闭旧连接")
@@ -82,7 +86,11 @@ async def websocket_endpoint(websocket: WebSocket, lanlan_name: str):
                 await session_manager[lanlan_name].send_status("{lanlan_name}正在前往另一个终端...")
                 await websocket.close()
                 break
-            message = json.loads(data)
+            # 二进制帧：麦克风音频（见 LLMSessionManager.stream_binary）
+            if ws_message.get("bytes") is not None:
+                asyncio.create_task(session_manager[lanlan_name].stream_binary(ws_message["bytes"]))
+                continue
+            message = json.loads(ws_message["text"])
             action = message.get("action")
             
             # 处理语言设置（可以在任何消息中携带）
@@ -115,6 +123,11 @@ async def websocket_endpoint(websocket: WebSocket, lanlan_name: str):
                 session_manager[lanlan_name].active_session_is_idle = True
                 asyncio.create_task(session_manager[lanlan_name].end_session())
 
+            elif action == "audio_codecs":
+                # 前端声明可解码的语音编码，协商下行编码（见 utils.audio_egress）
+                codec = session_manager[lanlan_name].set_audio_codecs(message.get("codecs") or [])
+                await websocket.send_text(json.dumps({"type": "audio_codec", "codec": codec}))
+
             elif action == "ping":
                 # 心跳保活消息，回复pong
                 await websocket.send_text(json.dumps({"type": "pong"}))
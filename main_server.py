@@ -39,7 +39,7 @@ from fastapi.staticfiles import StaticFiles # noqa
 from main_logic import core as core, cross_server as cross_server # noqa
 from fastapi.templating import Jinja2Templates # noqa
 from threading import Thread, Event as ThreadEvent # noqa
-from queue import Queue # noqa
+from utils.thread_channel import StampedThreadChannel # noqa
 import atexit # noqa
 import httpx # noqa
 from config import MAIN_SERVER_PORT, MONITOR_SERVER_PORT # noqa
@@ -130,7 +130,7 @@ _config_manager = get_config_manager()
 def cleanup():
     logger.info("Starting cleanup process")
     for k in sync_message_queue:
-        # 清空队列（queue.Queue 没有 close/join_thread 方法）
+        # 清空队列（StampedThreadChannel 与 queue.Queue 一样没有 close/join_thread 方法）
         try:
             while sync_message_queue[k] and not sync_message_queue[k].empty():
                 sync_message_queue[k].get_nowait()
@@ -181,7 +181,7 @@ async def initialize_character_data():
     for k in catgirl_names:
         is_new_character = False
         if k not in sync_message_queue:
-            sync_message_queue[k] = Queue()
+            sync_message_queue[k] = StampedThreadChannel()
             sync_shutdown_event[k] = ThreadEvent()
             session_id[k] = None
             sync_process[k] = None
@@ -310,7 +310,7 @@ async def initialize_character_data():
             except Exception as e:
                 logger.warning(f"停止角色 {k} 的同步连接器线程时出错: {e}")
         
-        # 清理队列（queue.Queue 没有 close/join_thread 方法）
+        # 清理队列（StampedThreadChannel 与 queue.Queue 一样没有 close/join_thread 方法）
         if k in sync_message_queue:
             try:
                 while not sync_message_queue[k].empty():
@@ -531,6 +531,9 @@ def _sync_preload_modules():
         _dummy_audio = np.zeros(480, dtype=np.int16).tobytes()
         _ = _warmup_processor.process_chunk(_dummy_audio)
         del _warmup_processor, _dummy_audio
+        # 启用 AUDIO_DSP_WORKERS 时提前启动DSP工作进程，避免首个会话等待进程启动
+        from utils.audio_dsp_pool import get_dsp_pool
+        get_dsp_pool()
         logger.debug("  ✓ AudioProcessor warmed up")
     except Exception as e:
         logger.debug(f"  ✗ AudioProcessor warmup: {e}")
@@ -598,6 +601,14 @@ async def on_startup():
         except Exception as e:
             logger.warning(f"全局语言初始化失败: {e}，将使用默认值")
 
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """服务器关闭时释放共享的LLM连接池"""
+    from utils.llm_client import aclose_pools
+    await aclose_pools()
+
+
 # 使用 FastAPI 的 app.state 来管理启动配置
 def get_start_config():
     """从 app.state 获取启动配置"""
@@ -0,0 +1,162 @@
+"""
+/new_dialog 与 /get_recent_history 的预渲染上下文缓存
+
+会话开始时 main_server 会请求 /new_dialog。原先每次请求都要重新读取角色配置、
+序列化设定、重新加载近期记录并对每条消息跑一遍去括号正则，耗时随历史长度增长。
+这里按角色缓存渲染结果：
+
+- 设定部分按 (配置快照版本, 设定文件指纹) 缓存
+- 历史部分按近期记录的内容版本缓存，版本变化时只渲染新出现的消息
+  （每条消息的渲染结果按消息对象缓存，追加/折叠后未变的消息直接复用）
+- 响应带 ETag，客户端携带 If-None-Match 且内容未变时返回 304
+"""
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+from utils.config_manager import get_config_manager
+from utils.frontend_utils import get_timestamp
+
+logger = logging.getLogger(__name__)
+
+# 删除所有类型括号及其内容（包括[]、()、{}、<>、【】、（）等）
+BRACKETS_PATTERN = re.compile(r'(\[.*?\]|\(.*?\)|（.*?）|【.*?】|\{.*?\}|<.*?>)')
+
+
+def _render_dialog_line(msg, name_mapping):
+    if type(msg.content) == str:
+        cleaned_content = BRACKETS_PATTERN.sub('', msg.content).strip()
+        return f"{name_mapping[msg.type]} | {cleaned_content}\n"
+    texts = [BRACKETS_PATTERN.sub('', j['text']).strip() for j in msg.content if j['type'] == 'text']
+    return f"{name_mapping[msg.type]} | " + "\n".join(texts) + "\n"
+
+
+def _render_recent_line(msg, name_mapping):
+    if msg.type == 'system':
+        return msg.content + "\n"
+    if isinstance(msg.content, str):
+        joined = msg.content
+    else:
+        joined = "\n".join(j['text'] for j in msg.content if j['type'] == 'text')
+    return f"{name_mapping[msg.type]} | {joined}\n"
+
+
+@dataclass
+class _ContextEntry:
+    settings_version: Optional[tuple] = None
+    header: str = ""
+    history_version: Optional[tuple] = None
+    dialog_text: str = ""
+    recent_text: str = ""
+    digest: str = ""
+    # id(消息对象) -> (消息对象, new_dialog 行, get_recent_history 行)；持有对象引用，避免 id 被复用
+    lines: Dict[int, tuple] = field(default_factory=dict)
+
+
+class DialogContextCache:
+    """按角色缓存渲染好的对话上下文"""
+
+    def __init__(self, get_recent_manager: Callable, get_settings_manager: Callable):
+        """
+        Args:
+            get_recent_manager / get_settings_manager: 返回当前组件实例的函数（/reload 后实例会被替换）
+        """
+        self._get_recent_manager = get_recent_manager
+        self._get_settings_manager = get_settings_manager
+        self._config_manager = get_config_manager()
+        self._entries: Dict[str, _ContextEntry] = {}
+        self.stats = {'hits': 0, 'rebuilds': 0, 'lines_rendered': 0, 'not_modified': 0}
+
+    def _entry(self, lanlan_name) -> _ContextEntry:
+        entry = self._entries.get(lanlan_name)
+        if entry is None:
+            entry = self._entries[lanlan_name] = _ContextEntry()
+        return entry
+
+    def _refresh_header(self, lanlan_name, entry, master_name):
+        settings_manager = self._get_settings_manager()
+        version = (id(settings_manager), settings_manager.get_settings_version(lanlan_name))
+        if entry.settings_version == version:
+            return False
+        settings_text = json.dumps(settings_manager.get_settings(lanlan_name), ensure_ascii=False)
+        entry.header = f"\n========以下是{lanlan_name}的内心活动========\n{lanlan_name}的脑海里经常想着自己和{master_name}的事情，她记得{settings_text}\n\n"
+        entry.settings_version = version
+        return True
+
+    def _refresh_history(self, lanlan_name, entry, name_mapping):
+        recent_manager = self._get_recent_manager()
+        version = (id(recent_manager), recent_manager.get_history_version(lanlan_name), tuple(sorted(name_mapping.items())))
+        if entry.history_version == version:
+            return False
+        history = recent_manager.get_recent_history(lanlan_name)
+        # 名称映射变化时所有行都要重新渲染
+        old_lines = entry.lines if entry.history_version and entry.history_version[2] == version[2] else {}
+        lines = {}
+        dialog_parts = []
+        recent_parts = []
+        for msg in history:
+            cached = old_lines.get(id(msg))
+            if cached is None or cached[0] is not msg:
+                cached = (msg, _render_dialog_line(msg, name_mapping), _render_recent_line(msg, name_mapping))
+                self.stats['lines_rendered'] += 1
+            lines[id(msg)] = cached
+            dialog_parts.append(cached[1])
+            recent_parts.append(cached[2])
+        entry.lines = lines
+        entry.dialog_text = "".join(dialog_parts)
+        entry.recent_text = "".join(recent_parts)
+        entry.history_version = version
+        return True
+
+    def refresh(self, lanlan_name: str) -> _ContextEntry:
+        """检查版本并按需重建（对话处理后调用可提前完成渲染）"""
+        entry = self._entry(lanlan_name)
+        master_name, _, _, _, name_mapping, _, _, _, _, _ = self._config_manager.get_character_data()
+        name_mapping['ai'] = lanlan_name
+        changed = self._refresh_header(lanlan_name, entry, master_name)
+        changed = self._refresh_history(lanlan_name, entry, name_mapping) or changed
+        if changed:
+            self.stats['rebuilds'] += 1
+            entry.digest = hashlib.sha1((entry.header + entry.dialog_text + entry.recent_text).encode('utf-8')).hexdigest()[:16]
+        else:
+            self.stats['hits'] += 1
+        return entry
+
+    def prefetch(self, lanlan_name: str):
+        """在后台提前完成渲染，失败时只记录日志（请求到来时会再试一次）"""
+        try:
+            self.refresh(lanlan_name)
+        except Exception as e:
+            logger.warning(f"预渲染 {lanlan_name} 的对话上下文失败: {e}")
+
+    def new_dialog(self, lanlan_name: str) -> Tuple[str, str]:
+        """返回 (new_dialog 上下文, ETag)"""
+        entry = self.refresh(lanlan_name)
+        timestamp = get_timestamp()
+        result = entry.header
+        result += f"现在时间是{timestamp}。开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
+        result += entry.dialog_text
+        # 时间戳精确到分钟，同一分钟内内容未变时 ETag 不变
+        etag = f'"{entry.digest}-{hashlib.sha1(timestamp.encode("utf-8")).hexdigest()[:8]}"'
+        return result, etag
+
+    def recent_history(self, lanlan_name: str) -> Tuple[str, str]:
+        """返回 (get_recent_history 文本, ETag)"""
+        entry = self.refresh(lanlan_name)
+        result = f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n" + entry.recent_text
+        return result, f'"{entry.digest}-r"'
+
+    def is_not_modified(self, if_none_match: Optional[str], etag: str) -> bool:
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            self.stats['not_modified'] += 1
+            return True
+        return False
+
+    def invalidate(self, lanlan_name: Optional[str] = None):
+        if lanlan_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(lanlan_name, None)
@@ -0,0 +1,249 @@
+"""
+语义记忆的批量嵌入管线
+
+- 跨轮次、跨角色收集待嵌入文本，攒够 max_batch 条或等待 max_delay 秒后合并为一次嵌入请求
+- 以文本内容哈希为键的嵌入缓存，按模型名分文件持久化到磁盘，相同文本只嵌入一次；
+  更换嵌入模型后重建索引时，切换回用过的模型可直接命中缓存
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.config_manager import get_config_manager
+
+# 单次嵌入请求的最大文本数（DashScope text-embedding 系列单次最多10条）
+EMBEDDING_BATCH_SIZE = 10
+# 第一条文本入队后最多等待多久就发起请求（秒）
+EMBEDDING_MAX_DELAY = 0.5
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _truncate(path: str, size: int):
+    """文件长于 size 时截断（崩溃留下的半截写入）"""
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+class EmbeddingCache:
+    """单个嵌入模型的 内容哈希 -> 向量 缓存，追加写入 {model}.keys / {model}.f16"""
+
+    def __init__(self, cache_dir: str, model: str):
+        safe_model = re.sub(r'[^\w.\-]', '_', model)
+        self.model = model
+        self._keys_path = os.path.join(cache_dir, f'{safe_model}.keys')
+        self._vectors_path = os.path.join(cache_dir, f'{safe_model}.f16')
+        self._meta_path = os.path.join(cache_dir, f'{safe_model}.json')
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        # 文件中的向量行数（重复的键也占一行，不能用 len(self._rows) 代替）
+        self._row_count = 0
+        self._matrix: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, encoding='utf-8') as f:
+            self.dim = json.load(f).get('dim')
+        if not self.dim:
+            return
+        vector_rows = os.path.getsize(self._vectors_path) // (2 * self.dim) if os.path.exists(self._vectors_path) else 0
+        rows = 0
+        keys_end = 0
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, 'rb') as f:
+                for line in f:
+                    digest = line.strip().decode('ascii', 'replace')
+                    # 键与向量行数不一致（写入时崩溃）或末行只写了一半时以较短者为准
+                    if rows >= vector_rows or not line.endswith(b'\n') or len(digest) != 64:
+                        break
+                    self._rows.setdefault(digest, rows)
+                    rows += 1
+                    keys_end += len(line)
+        # 截掉多出的部分，否则之后追加的键与向量会错位
+        _truncate(self._keys_path, keys_end)
+        _truncate(self._vectors_path, rows * 2 * self.dim)
+        self._row_count = rows
+
+    def _get_matrix(self) -> np.ndarray:
+        rows = self._row_count
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float16, mode='r', shape=(rows, self.dim))
+        return self._matrix
+
+    def get_many(self, digests: List[str]) -> Dict[str, np.ndarray]:
+        with self._lock:
+            hits = {d: self._rows[d] for d in digests if d in self._rows}
+            if not hits:
+                return {}
+            matrix = self._get_matrix()
+            return {d: np.asarray(matrix[row], dtype=np.float32) for d, row in hits.items()}
+
+    def put_many(self, digests: List[str], vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            new = [(d, v) for d, v in zip(digests, vectors) if d not in self._rows]
+            if not new:
+                return
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({'model': self.model, 'dim': self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                return
+            # 先写向量再写键，加载时以两者较短者为准并截掉多出的部分
+            with open(self._vectors_path, 'ab') as f:
+                f.write(np.stack([v for _, v in new]).astype(np.float16).tobytes())
+            with open(self._keys_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{d}\n" for d, _ in new))
+            for d, _ in new:
+                self._rows[d] = self._row_count
+                self._row_count += 1
+
+
+class EmbeddingPipeline:
+    """跨角色共享的批量嵌入管线"""
+
+    def __init__(self, cache_dir: str, max_batch: int = EMBEDDING_BATCH_SIZE, max_delay: float = EMBEDDING_MAX_DELAY):
+        self.cache_dir = cache_dir
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._caches: Dict[str, EmbeddingCache] = {}
+        # (model, base_url) -> {digest: (text, [futures])}
+        self._pending: Dict[tuple, Dict[str, tuple]] = {}
+        self._clients: Dict[tuple, object] = {}
+        self._timers: Dict[tuple, asyncio.TimerHandle] = {}
+        self.stats = {'requests': 0, 'texts_embedded': 0, 'cache_hits': 0}
+
+    def get_cache(self, model: str) -> EmbeddingCache:
+        cache = self._caches.get(model)
+        if cache is None:
+            cache = self._caches[model] = EmbeddingCache(self.cache_dir, model)
+        return cache
+
+    async def embed(self, texts: List[str], embeddings, model: str) -> List[np.ndarray]:
+        """
+        获取一组文本的嵌入向量；缓存未命中的文本会与其他调用方的请求合并后批量嵌入
+
+        Args:
+            texts: 待嵌入文本
+            embeddings: 该模型对应的 langchain Embeddings 实例（用于实际请求）
+            model: 嵌入模型名，决定使用哪份缓存
+        """
+        if not texts:
+            return []
+        digests = [text_digest(t) for t in texts]
+        cache = self.get_cache(model)
+        results = cache.get_many(digests)
+        self.stats['cache_hits'] += sum(1 for d in digests if d in results)
+
+        missing = {d: t for d, t in zip(digests, texts) if d not in results}
+        if missing:
+            loop = asyncio.get_running_loop()
+            key = (model, getattr(embeddings, 'openai_api_base', None))
+            self._clients[key] = embeddings
+            pending = self._pending.setdefault(key, {})
+            futures = {}
+            for d, t in missing.items():
+                if d not in pending:
+                    pending[d] = (t, [])
+                future = loop.create_future()
+                pending[d][1].append(future)
+                futures[d] = future
+            if len(pending) >= self.max_batch:
+                self._flush_now(key)
+            elif key not in self._timers:
+                self._timers[key] = loop.call_later(self.max_delay, self._flush_now, key)
+            for d, future in futures.items():
+                results[d] = await future
+        return [results[d] for d in digests]
+
+    def _flush_now(self, key):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        pending = self._pending.pop(key, None)
+        if pending:
+            asyncio.create_task(self._flush(key, pending))
+
+    async def _flush(self, key, pending):
+        model = key[0]
+        digests = list(pending)
+        texts = [pending[d][0] for d in digests]
+        try:
+            self.stats['requests'] += 1
+            self.stats['texts_embedded'] += len(texts)
+            vectors = await self._clients[key].aembed_documents(texts)
+            await asyncio.to_thread(self.get_cache(model).put_many, digests, vectors)
+        except Exception as e:
+            for d in digests:
+                for future in pending[d][1]:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for d, vector in zip(digests, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            for future in pending[d][1]:
+                if not future.done():
+                    future.set_result(vector)
+
+
+_pipeline: Optional[EmbeddingPipeline] = None
+
+
+def get_embedding_pipeline() -> EmbeddingPipeline:
+    """获取全局共享的嵌入管线（缓存位于 memory/embedding_cache）"""
+    global _pipeline
+    if _pipeline is None:
+        config_manager = get_config_manager()
+        config_manager.ensure_memory_directory()
+        _pipeline = EmbeddingPipeline(str(config_manager.memory_dir / 'embedding_cache'))
+    return _pipeline
+
+
+def _run_self_check() -> None:
+    """
+    崩溃恢复自检：在两次写入之间"崩溃"（多出一行孤儿向量、键文件末行只写了一半），
+    重新加载后再写入一条，确认读回的向量与写入的一致
+    """
+    import tempfile
+
+    eye = np.eye(4, dtype=np.float32)
+    a, b, c, d = (text_digest(t) for t in 'abcd')
+
+    def crash_orphan_vector(cache):
+        with open(cache._vectors_path, 'ab') as f:
+            f.write(eye[2:3].astype(np.float16).tobytes())
+
+    def crash_torn_key(cache):
+        crash_orphan_vector(cache)
+        with open(cache._keys_path, 'a', encoding='utf-8') as f:
+            f.write(text_digest('x')[:20])
+
+    for name, crash in (('orphan vector row', crash_orphan_vector), ('torn keys line', crash_torn_key)):
+        with tempfile.TemporaryDirectory() as root:
+            cache = EmbeddingCache(root, 'm')
+            cache.put_many([a, b, c], eye[:3])
+            crash(cache)
+            cache = EmbeddingCache(root, 'm')
+            cache.put_many([d], eye[3:])
+            got = EmbeddingCache(root, 'm').get_many([a, d])
+            ok = np.array_equal(got.get(a), eye[0]) and np.array_equal(got.get(d), eye[3])
+            print(f"  {name:<18} d -> {got.get(d)}  {'OK' if ok else 'FAILED'}")
+            assert ok, name
+
+
+if __name__ == "__main__":
+    _run_self_check()
@@ -1,20 +1,46 @@
 from datetime import datetime
-from config import get_extra_body
 from utils.config_manager import get_config_manager
-from langchain_openai import ChatOpenAI
+from utils.history_journal import HistoryJournal
+from utils.llm_client import get_model_llm
 from langchain_core.messages import SystemMessage, messages_to_dict, messages_from_dict, HumanMessage, AIMessage
 import json
 import os
+import re
 import asyncio
+import hashlib
 import logging
+from collections import OrderedDict
 from openai import APIConnectionError, InternalServerError, RateLimitError
 
-from config.prompts_sys import recent_history_manager_prompt, detailed_recent_history_manager_prompt, further_summarize_prompt, history_review_prompt
+from config.prompts_sys import recent_history_manager_prompt, detailed_recent_history_manager_prompt, further_summarize_prompt, history_review_prompt, rolling_summary_prompt, detailed_rolling_summary_prompt
 
 # Setup logger
 from utils.logger_config import setup_logging
 logger, log_config = setup_logging(service_name="RecentMemory", log_level=logging.INFO)
 
+# 滚动摘要（备忘录）消息的前缀
+MEMO_PREFIX = "先前对话的备忘录: "
+# 折叠后原样保留的近期消息的估算token预算（低水位）
+RECENT_TOKEN_BUDGET = 1500
+# 未折叠消息的估算token超过该值时触发折叠（高水位）
+HISTORY_TOKEN_LIMIT = 3000
+# 未折叠消息条数超过 max_history_length - 1 + HISTORY_FOLD_SLACK 时触发折叠；
+# 折叠后回落到 max_history_length - 1 条以内，之后几轮对话都不需要调用LLM
+HISTORY_FOLD_SLACK = 6
+# 折叠时至少原样保留的近期消息数
+MIN_RECENT_MESSAGES = 2
+# 摘要结果缓存条数（时间索引、语义记忆对同一批消息的摘要只请求一次）
+SUMMARY_CACHE_SIZE = 64
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算token数：中日韩字符约1个token，其余字符约4个一个token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
 class CompressedRecentHistoryManager:
     def __init__(self, max_history_length=10):
         self._config_manager = get_config_manager()
@@ -24,34 +50,75 @@ class CompressedRecentHistoryManager:
         self.log_file_path = recent_log
         self.name_mapping = name_mapping
         self.user_histories = {}
+        # 内存中的 user_histories 是权威副本，磁盘上是快照 + 追加日志
+        self._journals = {}
+        self._compaction_tasks = {}
+        # 每个角色一把折叠锁：同一角色同时只有一次"计算溢出 -> 等待LLM -> 拼接"在进行
+        self._fold_locks = {}
+        self._summary_cache = OrderedDict()
+        self.fold_stats = {'checks': 0, 'folds': 0, 'llm_calls': 0, 'summary_cache_hits': 0}
+        # 每个角色近期记录的内容版本，任何修改（新消息、折叠、整理、外部编辑）都会递增
+        self._versions = {}
         for ln in self.log_file_path:
-            if os.path.exists(self.log_file_path[ln]):
-                with open(self.log_file_path[ln], encoding='utf-8') as f:
-                    self.user_histories[ln] = messages_from_dict(json.load(f))
-            else:
-                self.user_histories[ln] = []
+            self._sync_from_disk(ln)
+
+    def _sync_from_disk(self, lanlan_name):
+        """仅当文件首次加载或被外部修改（如记忆浏览器编辑）时才从磁盘重新读取"""
+        path = str(self.log_file_path[lanlan_name])
+        journal = self._journals.get(lanlan_name)
+        if journal is None or journal.snapshot_path != path:
+            journal = HistoryJournal(path)
+            self._journals[lanlan_name] = journal
+        elif not journal.is_stale():
+            return journal
+        try:
+            self.user_histories[lanlan_name] = messages_from_dict(journal.load())
+        except Exception as e:
+            logger.warning(f"读取 {lanlan_name} 的历史记录文件失败: {e}，使用空列表")
+            self.user_histories[lanlan_name] = []
+        self._bump_version(lanlan_name)
+        return journal
+
+    def _bump_version(self, lanlan_name):
+        self._versions[lanlan_name] = self._versions.get(lanlan_name, 0) + 1
+
+    def get_history_version(self, lanlan_name):
+        """返回近期记录的内容版本（会先检查文件是否被外部修改）"""
+        if lanlan_name in self.log_file_path:
+            self._sync_from_disk(lanlan_name)
+        else:
+            # 新角色：由 get_recent_history 补全文件路径并加载
+            self.get_recent_history(lanlan_name)
+        return self._versions.get(lanlan_name, 0)
+
+    def _save_full(self, lanlan_name):
+        """将完整的内存副本写成快照（原子重命名），并清空日志"""
+        journal = self._journals.get(lanlan_name)
+        if journal is None or journal.snapshot_path != str(self.log_file_path[lanlan_name]):
+            journal = HistoryJournal(self.log_file_path[lanlan_name])
+            self._journals[lanlan_name] = journal
+        journal.compact(messages_to_dict(self.user_histories.get(lanlan_name, [])))
+
+    def _schedule_compaction(self, lanlan_name):
+        """日志累积到阈值后，在后台线程中合并为新快照"""
+        journal = self._journals.get(lanlan_name)
+        if journal is None or not journal.needs_compaction():
+            return
+        task = self._compaction_tasks.get(lanlan_name)
+        if task and not task.done():
+            return
+        history = messages_to_dict(self.user_histories[lanlan_name])
+        self._compaction_tasks[lanlan_name] = asyncio.create_task(
+            asyncio.to_thread(journal.compact, history, journal.seq)
+        )
     
     def _get_llm(self):
-        """动态获取LLM实例以支持配置热重载"""
-        api_config = self._config_manager.get_model_api_config('summary')
-        return ChatOpenAI(
-            model=api_config['model'],
-            base_url=api_config['base_url'],
-            api_key=api_config['api_key'] if api_config['api_key'] else None,
-            temperature=0.3,
-            extra_body=get_extra_body(api_config['model']) or None
-        )
+        """获取LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('summary', temperature=0.3)
     
     def _get_review_llm(self):
-        """动态获取审核LLM实例以支持配置热重载"""
-        api_config = self._config_manager.get_model_api_config('correction')
-        return ChatOpenAI(
-            model=api_config['model'],
-            base_url=api_config['base_url'],
-            api_key=api_config['api_key'] if api_config['api_key'] else None,
-            temperature=0.1,
-            extra_body=get_extra_body(api_config['model']) or None
-        )
+        """获取审核LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('correction', temperature=0.1)
 
     async def update_history(self, new_messages, lanlan_name, detailed=False):
         # 检查角色是否存在于配置中，如果不存在则创建默认路径
@@ -87,60 +154,52 @@ class CompressedRecentHistoryManager:
         if lanlan_name not in self.user_histories:
             self.user_histories[lanlan_name] = []
         
-        # 如果文件存在，加载历史记录
-        if lanlan_name in self.log_file_path and os.path.exists(self.log_file_path[lanlan_name]):
-            try:
-                with open(self.log_file_path[lanlan_name], encoding='utf-8') as f:
-                    file_content = json.load(f)
-                    if file_content:
-                        self.user_histories[lanlan_name] = messages_from_dict(file_content)
-            except (json.JSONDecodeError, Exception) as e:
-                logger.warning(f"读取 {lanlan_name} 的历史记录文件失败: {e}，使用空列表")
-                self.user_histories[lanlan_name] = []
+        # 文件被外部修改过时才重新加载历史记录
+        journal = self._sync_from_disk(lanlan_name)
 
         try:
             self.user_histories[lanlan_name].extend(new_messages)
+            self._bump_version(lanlan_name)
             logger.info(f"[RecentHistory] {lanlan_name} 添加了 {len(new_messages)} 条新消息，当前共 {len(self.user_histories[lanlan_name])} 条")
 
-            # 确保文件目录存在
-            file_path = self.log_file_path[lanlan_name]
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            with open(file_path, "w", encoding='utf-8') as f:  # Save the updated history to file before compressing
-                json.dump(messages_to_dict(self.user_histories[lanlan_name]), f, indent=2, ensure_ascii=False)
-
-            if len(self.user_histories[lanlan_name]) > self.max_history_length:
-                # 压缩旧消息
-                to_compress = self.user_histories[lanlan_name][:-self.max_history_length+1]
-                compressed = [(await self.compress_history(to_compress, lanlan_name, detailed))[0]]
+            # 压缩前先持久化新消息：只追加本轮的新消息，没有快照时才写完整文件
+            if journal.has_snapshot():
+                journal.append(messages_to_dict(new_messages))
+            else:
+                self._save_full(lanlan_name)
 
-                # 只保留最近的max_history_length条消息
-                self.user_histories[lanlan_name] = compressed + self.user_histories[lanlan_name][-self.max_history_length+1:]
+            # 超出预算时把溢出的旧消息折叠进滚动摘要（每轮最多一次LLM调用，通常为零次）。
+            # 追加与持久化之间没有await，不需要加锁；折叠要等待LLM，重叠的调用在锁上排队，
+            # 拿到锁后按最新的历史重新判断是否还需要折叠
+            async with self._fold_locks.setdefault(lanlan_name, asyncio.Lock()):
+                fold = await self._fold_overflow(lanlan_name, detailed)
+                if fold is not None:
+                    folded, memo = fold
+                    history = self.user_histories[lanlan_name]
+                    count = len(folded)
+                    if len(history) >= count and all(a is b for a, b in zip(history, folded)):
+                        # 以当前列表为准拼接，等待LLM期间追加的消息不会丢失
+                        self.user_histories[lanlan_name] = [memo] + history[count:]
+                        self._bump_version(lanlan_name)
+                        journal.splice(count, messages_to_dict([memo]))
+                    else:
+                        # 等待LLM期间历史被整理或外部编辑过，开头的消息已不是被摘要的那些
+                        logger.info(f"[RecentHistory] {lanlan_name} 的历史记录在折叠期间发生了变化，放弃本次折叠")
         except Exception as e:
             logger.error(f"[RecentHistory] 更新历史记录时出错: {e}", exc_info=True)
             # 即使出错，也尝试保存当前状态
             try:
-                file_path = self.log_file_path[lanlan_name]
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                with open(file_path, "w", encoding='utf-8') as f:
-                    json.dump(messages_to_dict(self.user_histories.get(lanlan_name, [])), f, indent=2, ensure_ascii=False)
+                self._save_full(lanlan_name)
             except Exception as save_error:
                 logger.error(f"[RecentHistory] 保存历史记录失败: {save_error}", exc_info=True)
             return
 
-        # 最终保存
-        try:
-            file_path = self.log_file_path[lanlan_name]
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, "w", encoding='utf-8') as f:
-                json.dump(messages_to_dict(self.user_histories[lanlan_name]), f, indent=2, ensure_ascii=False)
-            logger.info(f"[RecentHistory] {lanlan_name} 历史记录已保存到文件: {file_path}")
-        except Exception as e:
-            logger.error(f"[RecentHistory] 最终保存历史记录失败: {e}", exc_info=True)
+        logger.info(f"[RecentHistory] {lanlan_name} 历史记录已保存到文件: {journal.snapshot_path}")
+        # 日志过长时在后台合并为快照
+        self._schedule_compaction(lanlan_name)
 
 
-    # detailed: 保留尽可能多的细节
-    async def compress_history(self, messages, lanlan_name, detailed=False):
+    def _format_messages(self, messages, lanlan_name):
         name_mapping = self.name_mapping.copy()
         name_mapping['ai'] = lanlan_name
         lines = []
@@ -162,18 +221,83 @@ class CompressedRecentHistoryManager:
                 joined = "\n".join(parts)
                 line = f"{role} | {joined}"
             lines.append(line)
-        messages_text = "\n".join(lines)
-        if not detailed:
-            prompt = recent_history_manager_prompt % messages_text
-        else:
-            prompt = detailed_recent_history_manager_prompt % messages_text
+        return "\n".join(lines)
+
+    @staticmethod
+    def _message_tokens(msg):
+        content = getattr(msg, 'content', '')
+        if not isinstance(content, str):
+            try:
+                content = "".join(item.get('text', '') if isinstance(item, dict) else str(item) for item in content)
+            except Exception:
+                content = str(content)
+        return estimate_tokens(content) + 4
+
+    @staticmethod
+    def _split_memo(history):
+        """返回 (滚动摘要, 未折叠消息的起始下标)；history[0] 不是备忘录时摘要为None"""
+        if history and isinstance(history[0], SystemMessage) and isinstance(history[0].content, str) \
+                and history[0].content.startswith(MEMO_PREFIX):
+            return history[0].content[len(MEMO_PREFIX):], 1
+        return None, 0
 
+    def _recent_split(self, tokens):
+        """按token预算从末尾向前选取原样保留的近期消息，返回需要折叠的消息数"""
+        keep = 0
+        used = 0
+        for count in reversed(tokens):
+            if keep >= MIN_RECENT_MESSAGES and (used + count > RECENT_TOKEN_BUDGET or keep >= self.max_history_length - 1):
+                break
+            used += count
+            keep += 1
+        return len(tokens) - keep
+
+    async def _fold_overflow(self, lanlan_name, detailed=False):
+        """
+        把超出预算的旧消息折叠进滚动摘要
+
+        history 的结构为 [备忘录] + 未折叠的消息。未折叠部分的条数或估算token超过高水位时，
+        只把新溢出的消息连同已有摘要交给LLM合并一次，然后回落到低水位。
+
+        Returns:
+            (folded, memo): 被替换的开头消息（含旧备忘录）与新的备忘录消息；无需折叠时返回None
+        """
+        self.fold_stats['checks'] += 1
+        history = self.user_histories.get(lanlan_name, [])
+        summary, start = self._split_memo(history)
+        body = history[start:]
+        tokens = [self._message_tokens(m) for m in body]
+        if len(body) <= self.max_history_length - 1 + HISTORY_FOLD_SLACK and sum(tokens) <= HISTORY_TOKEN_LIMIT:
+            return None
+        split = self._recent_split(tokens)
+        if split == 0:
+            return None
+
+        previous = summary if summary else "无"
+        template = detailed_rolling_summary_prompt if detailed else rolling_summary_prompt
+        prompt = template % (previous, self._format_messages(body[:split], lanlan_name))
+        new_summary = await self._request_summary(prompt, "滚动摘要")
+        if new_summary is None:
+            if len(body) <= self.max_history_length * 4:
+                logger.warning(f"[RecentHistory] {lanlan_name} 的滚动摘要失败，保留原始消息，下一轮再试")
+                return None
+            # 长时间无法摘要时丢弃最旧的消息，保留原有摘要，避免历史无限增长
+            logger.warning(f"[RecentHistory] {lanlan_name} 的滚动摘要持续失败，丢弃 {split} 条旧消息")
+            new_summary = previous
+
+        self.fold_stats['folds'] += 1
+        logger.info(f"[RecentHistory] {lanlan_name} 折叠了 {split} 条消息进滚动摘要，保留 {len(body) - split} 条")
+        return history[:start + split], SystemMessage(content=f"{MEMO_PREFIX}{new_summary}")
+
+    async def _request_summary(self, prompt, label="摘要"):
+        """调用摘要模型并解析 {"对话摘要": ...}，失败时返回None"""
         retries = 0
         max_retries = 3
         while retries < max_retries:
             try:
                 # 尝试将响应内容解析为JSON
                 llm = self._get_llm()
+                self.fold_stats['llm_calls'] += 1
                 response_content = (await llm.ainvoke(prompt)).content
                 # 修复类型问题：确保response_content是字符串
                 if isinstance(response_content, list):
@@ -183,33 +307,54 @@ class CompressedRecentHistoryManager:
                 summary_json = json.loads(response_content)
                 # 从JSON字典中提取对话摘要，假设摘要存储在名为'key'的键下
                 if '对话摘要' in summary_json:
-                    print(f"💗摘要结果：{summary_json['对话摘要']}")
-                    summary = summary_json['对话摘要']
-                    if len(summary) > 500:
-                        summary = await self.further_compress(summary)
-                        if summary is None:
-                            continue
-                    # Listen. Here, summary_json['对话摘要'] is not supposed to be anything else than str, but Qwen is shit.
-                    return SystemMessage(content=f"先前对话的备忘录: {summary}"), str(summary_json['对话摘要'])
+                    print(f"💗{label}结果：{summary_json['对话摘要']}")
+                    return summary_json['对话摘要']
                 else:
-                    print('💥 摘要failed: ', response_content)
+                    print(f'💥 {label}failed: ', response_content)
                     retries += 1
             except (APIConnectionError, InternalServerError, RateLimitError) as e:
                 logger.info(f"ℹ️ 捕获到 {type(e).__name__} 错误")
                 retries += 1
                 if retries >= max_retries:
-                    print(f'❌ 摘要模型失败，已达到最大重试次数: {e}')
+                    print(f'❌ {label}模型失败，已达到最大重试次数: {e}')
                     break
                 # 指数退避: 1, 2, 4 秒
                 wait_time = 2 ** (retries - 1)
                 print(f'⚠️ 遇到网络或429错误，等待 {wait_time} 秒后重试 (第 {retries}/{max_retries} 次)')
                 await asyncio.sleep(wait_time)
             except Exception as e:
-                print(f'❌ 摘要模型失败：{e}')
+                print(f'❌ {label}模型失败：{e}')
                 # 如果解析失败，重试
                 retries += 1
-        # 如果所有重试都失败，返回None
-        return SystemMessage(content=f"先前对话的备忘录: 无。"), ""
+        return None
+
+    # detailed: 保留尽可能多的细节
+    async def compress_history(self, messages, lanlan_name, detailed=False):
+        messages_text = self._format_messages(messages, lanlan_name)
+        cache_key = (lanlan_name, detailed, hashlib.sha256(messages_text.encode('utf-8')).hexdigest())
+        cached = self._summary_cache.get(cache_key)
+        if cached is not None:
+            self._summary_cache.move_to_end(cache_key)
+            self.fold_stats['summary_cache_hits'] += 1
+            return SystemMessage(content=f"{MEMO_PREFIX}{cached[0]}"), cached[1]
+
+        if not detailed:
+            prompt = recent_history_manager_prompt % messages_text
+        else:
+            prompt = detailed_recent_history_manager_prompt % messages_text
+
+        raw_summary = await self._request_summary(prompt)
+        if raw_summary is None:
+            # 如果所有重试都失败，返回空摘要
+            return SystemMessage(content=f"{MEMO_PREFIX}无。"), ""
+        summary = raw_summary
+        if len(summary) > 500:
+            summary = await self.further_compress(summary) or summary
+        # Listen. Here, summary_json['对话摘要'] is not supposed to be anything else than str, but Qwen is shit.
+        self._summary_cache[cache_key] = (summary, str(raw_summary))
+        if len(self._summary_cache) > SUMMARY_CACHE_SIZE:
+            self._summary_cache.popitem(last=False)
+        return SystemMessage(content=f"{MEMO_PREFIX}{summary}"), str(raw_summary)
 
     async def further_compress(self, initial_summary):
         retries = 0
@@ -278,43 +423,46 @@ class CompressedRecentHistoryManager:
         if lanlan_name not in self.user_histories:
             self.user_histories[lanlan_name] = []
         
-        # 如果文件存在，加载历史记录
-        if lanlan_name in self.log_file_path and os.path.exists(self.log_file_path[lanlan_name]):
-            try:
-                with open(self.log_file_path[lanlan_name], encoding='utf-8') as f:
-                    file_content = json.load(f)
-                    if file_content:
-                        self.user_histories[lanlan_name] = messages_from_dict(file_content)
-            except (json.JSONDecodeError, Exception) as e:
-                logger.warning(f"读取 {lanlan_name} 的历史记录文件失败: {e}，使用空列表")
-                self.user_histories[lanlan_name] = []
+        # 文件被外部修改过时才重新加载历史记录
+        if lanlan_name in self.log_file_path:
+            self._sync_from_disk(lanlan_name)
         
         return self.user_histories.get(lanlan_name, [])
 
-    async def review_history(self, lanlan_name, cancel_event=None):
+    def is_auto_review_enabled(self):
+        """core_config.json 中的 recent_memory_auto_review 开关（读取配置快照，未修改时不访问磁盘）"""
+        try:
+            config_data = self._config_manager.load_json_config('core_config.json', default_value={})
+            return config_data.get('recent_memory_auto_review', True) is not False
+        except Exception as e:
+            print(f"⚠️ 读取配置文件失败：{e}，继续执行审阅")
+            return True
+
+    def _review_interrupted(self, lanlan_name, cancel_event, expected_version, stage):
+        """在LLM调用前后的安全点检查：任务被取消或历史记录已变化时放弃本次整理"""
+        if cancel_event and cancel_event.is_set():
+            print(f"⚠️ {lanlan_name} 的记忆整理被取消（{stage}）")
+            return True
+        if expected_version is not None and self.get_history_version(lanlan_name) != expected_version:
+            print(f"💡 {lanlan_name} 的历史记录在整理期间发生了变化，放弃本次结果（{stage}）")
+            return True
+        return False
+
+    async def review_history(self, lanlan_name, cancel_event=None, expected_version=None):
         """
         审阅历史记录，寻找并修正矛盾、冗余、逻辑混乱或复读的部分
         :param lanlan_name: 角色名称
         :param cancel_event: asyncio.Event对象，用于取消操作
+        :param expected_version: 任务创建时的历史内容版本；整理结果只在版本未变时写回
         """
         # 检查是否被取消
-        if cancel_event and cancel_event.is_set():
-            print(f"⚠️ {lanlan_name} 的记忆整理被取消（启动前）")
+        if self._review_interrupted(lanlan_name, cancel_event, expected_version, "启动前"):
             return False
             
-        # 检查配置文件中是否禁用自动审阅
-        try:
-            from utils.config_manager import get_config_manager
-            config_manager = get_config_manager()
-            config_path = str(config_manager.get_config_path('core_config.json'))
-            if os.path.exists(config_path):
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config_data = json.load(f)
-                    if 'recent_memory_auto_review' in config_data and not config_data['recent_memory_auto_review']:
-                        print(f"💡 {lanlan_name} 的自动记忆整理已禁用，跳过审阅")
-                        return False
-        except Exception as e:
-            print(f"⚠️ 读取配置文件失败：{e}，继续执行审阅")
+        # 检查配置中是否禁用自动审阅
+        if not self.is_auto_review_enabled():
+            print(f"💡 {lanlan_name} 的自动记忆整理已禁用，跳过审阅")
+            return False
         
         # 获取当前历史记录
         
@@ -325,8 +473,7 @@ class CompressedRecentHistoryManager:
             return False
         
         # 检查是否被取消
-        if cancel_event and cancel_event.is_set():
-            print(f"⚠️ {lanlan_name} 的记忆整理被取消（获取历史后）")
+        if self._review_interrupted(lanlan_name, cancel_event, expected_version, "获取历史后"):
             return False
         
         # 将消息转换为可读的文本格式
@@ -353,8 +500,7 @@ class CompressedRecentHistoryManager:
             history_text += f"{role}: {content}\n\n"
         
         # 检查是否被取消
-        if cancel_event and cancel_event.is_set():
-            print(f"⚠️ {lanlan_name} 的记忆整理被取消（准备调用LLM前）")
+        if self._review_interrupted(lanlan_name, cancel_event, expected_version, "准备调用LLM前"):
             return False
         
         retries = 0
@@ -367,8 +513,7 @@ class CompressedRecentHistoryManager:
                 response_content = (await review_llm.ainvoke(prompt)).content
                 
                 # 检查是否被取消（LLM调用后）
-                if cancel_event and cancel_event.is_set():
-                    print(f"⚠️ {lanlan_name} 的记忆整理被取消（LLM调用后，保存前）")
+                if self._review_interrupted(lanlan_name, cancel_event, expected_version, "LLM调用后，保存前"):
                     return False
                 
                 # 确保response_content是字符串
@@ -401,12 +546,12 @@ class CompressedRecentHistoryManager:
                             # 默认作为用户消息处理
                             corrected_messages.append(HumanMessage(content=content))
                     
-                    # 更新历史记录
+                    # 更新历史记录（解析期间没有await，版本检查之后不会再有新消息插入）
                     self.user_histories[lanlan_name] = corrected_messages
+                    self._bump_version(lanlan_name)
                     
-                    # 保存到文件
-                    with open(self.log_file_path[lanlan_name], "w", encoding='utf-8') as f:
-                        json.dump(messages_to_dict(corrected_messages), f, indent=2, ensure_ascii=False)
+                    # 保存到文件（整体替换，直接写快照）
+                    self._save_full(lanlan_name)
                     
                     print(f"✅ {lanlan_name} 的记忆已修正并保存")
                     return True
@@ -425,8 +570,7 @@ class CompressedRecentHistoryManager:
                 print(f'⚠️ 遇到网络或429错误，等待 {wait_time} 秒后重试 (第 {retries}/{max_retries} 次)')
                 await asyncio.sleep(wait_time)
                 # 检查是否被取消
-                if cancel_event and cancel_event.is_set():
-                    print(f"⚠️ {lanlan_name} 的记忆整理在重试等待期间被取消")
+                if self._review_interrupted(lanlan_name, cancel_event, expected_version, "重试等待期间"):
                     return False
             except Exception as e:
                 logger.error(f"❌ 历史记录审阅失败：{e}")
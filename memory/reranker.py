@@ -0,0 +1,192 @@
+"""
+语义记忆的本地重排：BM25（中日韩按字/二元组切分，拉丁文按词切分）与向量相似度排名
+通过倒数排名融合（RRF）合并，无需调用LLM。两种排名分歧较大时才建议由LLM做第二轮重排。
+"""
+import math
+import re
+from collections import Counter
+from typing import List, Sequence
+
+# 拉丁字母/数字按词切分；中日韩文字按单字 + 相邻二元组切分
+_LATIN_PATTERN = re.compile(r'[a-z0-9]+(?:[\'\-][a-z0-9]+)*')
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+
+# RRF 平滑常数
+RRF_K = 60
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+# BM25 与向量检索的前 k 名重合比例低于该值时，认为排序不确定
+RERANK_AGREEMENT_THRESHOLD = 0.4
+
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower()
+    tokens = _LATIN_PATTERN.findall(text)
+    for run in _CJK_PATTERN.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def bm25_scores(query: str, documents: Sequence[str]) -> List[float]:
+    """在候选集合内计算BM25分数（IDF也在候选集合内统计）"""
+    query_terms = set(tokenize(query))
+    if not query_terms or not documents:
+        return [0.0] * len(documents)
+    doc_counts = [Counter(tokenize(doc)) for doc in documents]
+    doc_lengths = [sum(counts.values()) for counts in doc_counts]
+    avg_length = (sum(doc_lengths) / len(doc_lengths)) or 1.0
+    n = len(documents)
+    idf = {}
+    for term in query_terms:
+        df = sum(1 for counts in doc_counts if term in counts)
+        idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+    scores = []
+    for counts, length in zip(doc_counts, doc_lengths):
+        score = 0.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        for term in query_terms:
+            tf = counts.get(term)
+            if tf:
+                score += idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def _ranking(scores: Sequence[float]) -> List[int]:
+    return sorted(range(len(scores)), key=lambda i: -scores[i])
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> List[float]:
+    """rankings 中每个元素是按相关度从高到低排列的候选下标"""
+    size = max((len(r) for r in rankings), default=0)
+    fused = [0.0] * size
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking):
+            fused[idx] += 1.0 / (k + rank + 1)
+    return fused
+
+
+def local_rerank(query: str, documents: Sequence[str], vector_ranking: Sequence[int] = None, top_k: int = 5):
+    """
+    融合BM25与向量排名
+
+    Args:
+        query: 查询文本
+        documents: 候选文本
+        vector_ranking: 向量检索给出的候选下标顺序，缺省时认为 documents 已按相似度排序
+        top_k: 需要的结果数
+
+    Returns:
+        (order, ambiguous): 融合后的候选下标顺序，以及两种排名是否分歧较大
+    """
+    if vector_ranking is None:
+        vector_ranking = list(range(len(documents)))
+    lexical_ranking = _ranking(bm25_scores(query, documents))
+    fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking])
+    order = _ranking(fused)
+    k = min(top_k, len(documents))
+    if k == 0:
+        return order, False
+    agreement = len(set(vector_ranking[:k]) & set(lexical_ranking[:k])) / k
+    return order, agreement < RERANK_AGREEMENT_THRESHOLD
+
+
+# 基准用的固定语料：记忆片段与 (查询, 相关片段下标)；查询与片段只部分共享用词
+_FIXTURE_CORPUS = [
+    "主人说他最喜欢的水果是芒果，夏天经常买一整箱",
+    "主人养了一只叫团子的橘猫，今年三岁，特别能吃",
+    "主人在一家游戏公司做客户端程序员，最近在赶版本",
+    "主人周末喜欢去江边骑自行车，一般骑二十公里左右",
+    "主人对花生过敏，吃了会起疹子，点外卖要备注",
+    "主人的生日是十一月七号，去年收到了一把机械键盘",
+    "主人最近在学日语，准备明年去京都旅行",
+    "主人说他晚上经常失眠，睡前会听白噪音",
+    "主人喜欢喝冰美式，每天上班前都要来一杯",
+    "主人的妹妹今年高考，他很关心志愿填报",
+    "主人玩的是原神和怪物猎人，最喜欢用太刀",
+    "主人租的房子在城东，通勤要坐四十分钟地铁",
+    "主人说他小时候在海边长大，很会游泳",
+    "主人最近迷上了做饭，昨天第一次做了红烧肉",
+    "主人讨厌下雨天，因为会让他心情低落",
+    "主人在健身房办了年卡，但一个月只去了两次",
+    "主人最喜欢的电影是星际穿越，看过五遍",
+    "主人说想换一台新显卡，在等下一代发布",
+    "主人的老家在四川，过年会回去吃火锅",
+    "主人每天晚上十一点左右会和我聊天",
+    "主人喜欢听后摇滚，最近常听 Mogwai 和 Explosions in the Sky",
+    "主人的笔记本电脑是 ThinkPad，用了五年了",
+    "主人说他不太会拒绝别人，经常帮同事加班",
+    "主人最近在读三体，已经读到第二部",
+    "主人养了几盆多肉，放在阳台上晒太阳",
+    "主人说他怕黑，晚上睡觉要开小夜灯",
+    "主人打算年底换工作，想去做独立游戏",
+    "主人喜欢吃辣，但胃不太好，医生让他少吃",
+    "主人和大学室友每年都会一起去露营",
+    "主人说他喜欢冬天，因为可以窝在被子里打游戏",
+]
+_FIXTURE_QUERIES = [
+    ("我喜欢吃什么水果", 0),
+    ("团子最近怎么样", 1),
+    ("我是做什么工作的", 2),
+    ("我有什么东西不能吃", 4),
+    ("我生日是哪天", 5),
+    ("我为什么在学日语", 6),
+    ("我睡不着的时候会做什么", 7),
+    ("我早上一般喝什么咖啡", 8),
+    ("我妹妹的高考志愿", 9),
+    ("我在怪物猎人里用什么武器", 10),
+    ("我上班通勤多久", 11),
+    ("上次我做的菜是什么", 13),
+    ("我去健身房的频率", 15),
+    ("我最喜欢哪部电影", 16),
+    ("我想买什么显卡", 17),
+    ("过年我回哪里", 18),
+    ("我平时听什么音乐 Mogwai", 20),
+    ("我的电脑用了几年", 21),
+    ("三体我读到哪了", 23),
+    ("我为什么想换工作", 26),
+]
+
+
+def _run_benchmark(trials: int = 200, max_vector_rank: int = 12, top_k: int = 5) -> None:
+    """
+    在固定语料上比较召回率@k 与耗时：每个查询以全部片段为候选，
+    模拟向量检索把相关片段排在 0..max_vector_rank 的随机名次（其余候选随机排列），
+    比较向量顺序、纯BM25与RRF融合后的 recall@k，并统计需要LLM第二轮重排的比例。
+    """
+    import random
+    import time
+
+    rng = random.Random(0)
+    n = len(_FIXTURE_CORPUS)
+    hits = {'vector': 0, 'bm25': 0, 'fused': 0}
+    ambiguous = 0
+    elapsed = 0.0
+    total = 0
+    for query, relevant in _FIXTURE_QUERIES:
+        for _ in range(trials):
+            others = [i for i in range(n) if i != relevant]
+            rng.shuffle(others)
+            vector_ranking = others[:]
+            vector_ranking.insert(rng.randint(0, max_vector_rank), relevant)
+            started = time.perf_counter()
+            order, is_ambiguous = local_rerank(query, _FIXTURE_CORPUS, vector_ranking, top_k)
+            elapsed += time.perf_counter() - started
+            lexical = _ranking(bm25_scores(query, _FIXTURE_CORPUS))
+            hits['vector'] += relevant in vector_ranking[:top_k]
+            hits['bm25'] += relevant in lexical[:top_k]
+            hits['fused'] += relevant in order[:top_k]
+            ambiguous += is_ambiguous
+            total += 1
+    print(f"{len(_FIXTURE_QUERIES)} queries x {trials} trials, {n} candidates, "
+          f"relevant fragment at vector rank 0..{max_vector_rank}")
+    for name, count in hits.items():
+        print(f"  recall@{top_k} {name:<7} {count / total:.3f}")
+    print(f"  local rerank {elapsed / total * 1000:.3f} ms/query, "
+          f"LLM second pass needed for {ambiguous / total:.1%} of queries")
+
+
+if __name__ == "__main__":
+    _run_benchmark()
@@ -0,0 +1,167 @@
+"""
+近期记忆整理（review_history）的后台调度器
+
+原先每次 /process、/renew 都会取消正在运行的整理任务并重新开始，用户连续对话时
+整理任务始终在"取消-重启"之间循环，白白消耗LLM调用。调度器按角色合并这些请求：
+
+- 防抖：对话进行中（/process）每来一轮就把整理推迟到 REVIEW_DEBOUNCE 秒之后
+- 空闲触发：会话结束（/renew）后只等待较短的 REVIEW_IDLE_DELAY 秒
+- 最长延迟：历史第一次变脏后最多 REVIEW_MAX_STALENESS 秒一定会整理一次
+- 每个任务记录开始时的历史内容版本，整理结果只在版本未变时写回；
+  取消与过期都在LLM调用前后的安全点生效，不会中途强行打断写入
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 对话进行中，最后一轮对话后等待多久再整理（秒）
+REVIEW_DEBOUNCE = 30.0
+# 会话结束后等待多久再整理（秒）
+REVIEW_IDLE_DELAY = 3.0
+# 历史变脏后最长多久必须整理一次（秒）
+REVIEW_MAX_STALENESS = 300.0
+
+
+@dataclass
+class _ReviewState:
+    dirty_since: Optional[float] = None
+    timer: Optional[asyncio.TimerHandle] = None
+    task: Optional[asyncio.Task] = None
+    cancel_event: Optional[asyncio.Event] = None
+    stats: Dict[str, int] = field(default_factory=lambda: {
+        'requests': 0, 'runs': 0, 'applied': 0, 'discarded': 0, 'cancelled': 0,
+    })
+
+
+class ReviewScheduler:
+    """按角色合并整理请求的调度器"""
+
+    def __init__(self, get_manager: Callable, debounce: float = REVIEW_DEBOUNCE,
+                 idle_delay: float = REVIEW_IDLE_DELAY, max_staleness: float = REVIEW_MAX_STALENESS,
+                 on_applied: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            get_manager: 返回当前 CompressedRecentHistoryManager 的函数（/reload 后实例会被替换）
+            on_applied: 整理结果写回后的回调（参数为角色名）
+        """
+        self._get_manager = get_manager
+        self._on_applied = on_applied
+        self.debounce = debounce
+        self.idle_delay = idle_delay
+        self.max_staleness = max_staleness
+        self._states: Dict[str, _ReviewState] = {}
+
+    def _state(self, lanlan_name) -> _ReviewState:
+        state = self._states.get(lanlan_name)
+        if state is None:
+            state = self._states[lanlan_name] = _ReviewState()
+        return state
+
+    def notify(self, lanlan_name: str, idle: bool = False):
+        """
+        历史记录有新内容时调用
+
+        Args:
+            idle: 会话已结束（/renew），用较短的空闲延迟代替防抖窗口
+        """
+        state = self._state(lanlan_name)
+        state.stats['requests'] += 1
+        if state.dirty_since is None:
+            state.dirty_since = time.monotonic()
+        self._arm(lanlan_name, self.idle_delay if idle else self.debounce)
+
+    def _arm(self, lanlan_name, delay):
+        state = self._state(lanlan_name)
+        if state.dirty_since is None:
+            return
+        # 不晚于最长延迟的截止时间
+        deadline = state.dirty_since + self.max_staleness - time.monotonic()
+        delay = max(0.0, min(delay, deadline))
+        if state.timer is not None:
+            state.timer.cancel()
+        state.timer = asyncio.get_running_loop().call_later(delay, self._fire, lanlan_name)
+
+    def _fire(self, lanlan_name):
+        state = self._state(lanlan_name)
+        state.timer = None
+        if state.task is not None and not state.task.done():
+            # 上一次整理还没结束：它会在安全点发现版本已变而放弃，结束后重新排期
+            return
+        manager = self._get_manager()
+        try:
+            version = manager.get_history_version(lanlan_name)
+        except Exception as e:
+            logger.warning(f"获取 {lanlan_name} 的历史版本失败: {e}")
+            return
+        dirty_since = state.dirty_since
+        state.dirty_since = None
+        state.cancel_event = asyncio.Event()
+        state.task = asyncio.create_task(self._run(lanlan_name, manager, version, dirty_since, state.cancel_event))
+
+    async def _run(self, lanlan_name, manager, version, dirty_since, cancel_event):
+        state = self._state(lanlan_name)
+        state.stats['runs'] += 1
+        applied = False
+        try:
+            applied = await manager.review_history(lanlan_name, cancel_event, expected_version=version)
+            if applied:
+                state.stats['applied'] += 1
+                logger.info(f"✅ {lanlan_name} 的记忆整理任务完成")
+                if self._on_applied is not None:
+                    self._on_applied(lanlan_name)
+        except asyncio.CancelledError:
+            logger.info(f"⚠️ {lanlan_name} 的记忆整理任务被取消")
+            raise
+        except Exception as e:
+            logger.error(f"❌ {lanlan_name} 的记忆整理任务出错: {e}")
+        finally:
+            state.task = None
+            if not applied:
+                interrupted = cancel_event.is_set()
+                try:
+                    interrupted = interrupted or manager.get_history_version(lanlan_name) != version
+                except Exception:
+                    pass
+                if interrupted:
+                    # 被取消或结果过期：恢复脏标记（保留最初的时间，最长延迟照常生效）
+                    state.stats['cancelled' if cancel_event.is_set() else 'discarded'] += 1
+                    if state.dirty_since is None or (dirty_since is not None and dirty_since < state.dirty_since):
+                        state.dirty_since = dirty_since
+            if state.dirty_since is not None and state.timer is None:
+                self._arm(lanlan_name, self.debounce)
+
+    def cancel(self, lanlan_name: str) -> bool:
+        """
+        请求中断正在运行的整理任务（在下一个安全点生效），未整理的变化稍后重新排期
+
+        Returns:
+            bool: 是否有正在运行的任务
+        """
+        state = self._states.get(lanlan_name)
+        if state is None or state.task is None or state.task.done():
+            return False
+        state.cancel_event.set()
+        return True
+
+    def get_stats(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        return {
+            name: {
+                **state.stats,
+                'running': state.task is not None and not state.task.done(),
+                'dirty_for': None if state.dirty_since is None else round(now - state.dirty_since, 1),
+            }
+            for name, state in self._states.items()
+        }
+
+    def shutdown(self):
+        for state in self._states.values():
+            if state.timer is not None:
+                state.timer.cancel()
+                state.timer = None
+            if state.cancel_event is not None:
+                state.cancel_event.set()
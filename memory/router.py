@@ -8,9 +8,9 @@ from langgraph.graph import StateGraph, END
 from typing import TypedDict, List, Dict, Any
 from langchain_core.messages import BaseMessage
 import json
-from langchain_openai import ChatOpenAI
 from config import ROUTER_MODEL
 from utils.config_manager import get_config_manager
+from utils.llm_client import get_model_llm
 
 class RouterState(TypedDict):
     messages: List[BaseMessage]
@@ -27,9 +27,8 @@ class MemoryQueryRouter:
         self.graph = self._build_graph()
     
     def _get_llm(self):
-        """动态获取LLM实例以支持配置热重载"""
-        api_config = self._config_manager.get_model_api_config('summary')
-        return ChatOpenAI(model=ROUTER_MODEL, base_url=api_config['base_url'], api_key=api_config['api_key'])
+        """获取LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('summary', model=ROUTER_MODEL, with_extra_body=False)
 
     def _build_graph(self):
         # 构建LangGraph流程图
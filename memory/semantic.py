@@ -1,17 +1,49 @@
-# from langchain_chroma import Chroma
-# ↑ 这个库引入了Chroma和onnx依赖，显著增大了一键包体积，暂时注释掉
+# Chroma 会引入 onnx 等依赖，显著增大一键包体积，改用基于 NumPy 的本地向量索引
 from typing import List
 from langchain_core.documents import Document
 from datetime import datetime
 from memory.recent import CompressedRecentHistoryManager
-from config import SEMANTIC_MODEL, RERANKER_MODEL, get_extra_body
+from memory.vector_index import LocalVectorStore
+from memory.embedding_pipeline import get_embedding_pipeline, EMBEDDING_BATCH_SIZE
+from memory.reranker import local_rerank
+from config import SEMANTIC_MODEL, RERANKER_MODEL
 from utils.config_manager import get_config_manager
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from utils.llm_client import get_model_llm
+from langchain_openai import OpenAIEmbeddings
 from config.prompts_sys import semantic_manager_prompt
 import json
 import asyncio
 from openai import APIConnectionError, InternalServerError, RateLimitError
 
+def _time_metadata(now: datetime) -> dict:
+    # 同一批写入共用一次时间计算
+    return {
+        "year": str(now.year),
+        "month": "%02d" % now.month,
+        "day": "%02d" % now.day,
+        "weekday": "%02d" % now.weekday(),
+        "hour": "%02d" % now.hour,
+        "minute": "%02d" % now.minute,
+        "timestamp": now.isoformat()
+    }
+
+
+async def _add_to_vectorstore(vectorstore: LocalVectorStore, embeddings, texts, metadatas):
+    # 经由共享管线批量嵌入（带内容哈希缓存），再追加到本地索引
+    vectors = await get_embedding_pipeline().embed(texts, embeddings, SEMANTIC_MODEL)
+    await asyncio.to_thread(vectorstore.add_embeddings, texts, vectors, metadatas, None, SEMANTIC_MODEL)
+
+
+async def _reindex_if_model_changed(vectorstore: LocalVectorStore, embeddings):
+    """索引由其他嵌入模型生成时，用当前模型重建（已嵌入过的文本直接命中缓存）"""
+    if vectorstore.model in (None, SEMANTIC_MODEL):
+        return
+    print(f"💡 嵌入模型由 {vectorstore.model} 变更为 {SEMANTIC_MODEL}，重建 {vectorstore.directory} 的索引")
+    texts, metadatas, ids = vectorstore.live_entries()
+    vectors = await get_embedding_pipeline().embed(texts, embeddings, SEMANTIC_MODEL)
+    await asyncio.to_thread(vectorstore.rebuild, texts, vectors, metadatas, ids, SEMANTIC_MODEL)
+
+
 class SemanticMemory:
     def __init__(self, recent_history_manager: CompressedRecentHistoryManager, persist_directory=None):
         self._config_manager = get_config_manager()
@@ -26,19 +58,21 @@ class SemanticMemory:
             self.compressed_memory[i] = SemanticMemoryCompressed(persist_directory, i, recent_history_manager, name_mapping)
     
     def _get_reranker(self):
-        """动态获取Reranker LLM实例以支持配置热重载"""
-        api_config = self._config_manager.get_model_api_config('summary')
-        return ChatOpenAI(model=RERANKER_MODEL, base_url=api_config['base_url'], api_key=api_config['api_key'], temperature=0.1, extra_body=get_extra_body(RERANKER_MODEL) or None)
+        """获取Reranker LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('summary', model=RERANKER_MODEL, temperature=0.1)
 
     async def store_conversation(self, event_id, messages, lanlan_name):
-        self.original_memory[lanlan_name].store_conversation(event_id, messages)
+        await self.original_memory[lanlan_name].store_conversation(event_id, messages)
         await self.compressed_memory[lanlan_name].store_compressed_summary(event_id, messages)
 
     async def hybrid_search(self, query, lanlan_name, with_rerank=True, k=10):
         # 从原始和压缩记忆中获取结果
-        original_results = self.original_memory[lanlan_name].retrieve_by_query(query, k)
-        compressed_results = self.compressed_memory[lanlan_name].retrieve_by_query(query, k)
-        combined = original_results + compressed_results
+        original_results, compressed_results = await asyncio.gather(
+            self.original_memory[lanlan_name].aretrieve_with_score(query, k),
+            self.compressed_memory[lanlan_name].aretrieve_with_score(query, k),
+        )
+        # 按向量相似度合并两路结果，作为重排的向量排名
+        combined = [doc for doc, _ in sorted(original_results + compressed_results, key=lambda x: -x[1])]
 
         if with_rerank:
             return await self.rerank_results(query, combined)
@@ -52,7 +86,21 @@ class SemanticMemory:
         ])
         return f"""======{lanlan_name}尝试回忆=====\n{query}\n\n====={lanlan_name}的相关记忆=====\n{results_text}"""
 
-    async def rerank_results(self, query, results: list, k=5) -> list:
+    async def rerank_results(self, query, results: list, k=5, llm_fallback=True) -> list:
+        """
+        本地重排：BM25 与向量排名做倒数排名融合（results 需已按向量相似度排序）。
+        仅当两种排名分歧较大时，才把融合后的前 2k 条交给LLM做第二轮重排。
+        """
+        if not results:
+            return []
+        order, ambiguous = local_rerank(query, [doc.page_content for doc in results], top_k=k)
+        ranked = [results[i] for i in order]
+        if not (ambiguous and llm_fallback):
+            return ranked[:k]
+        llm_ranked = await self._llm_rerank(query, ranked[:2 * k], k)
+        return llm_ranked or ranked[:k]
+
+    async def _llm_rerank(self, query, results: list, k=5) -> list:
         # 使用LLM重新排序结果
         results_text = "\n\n".join([
             f"记忆片段 {i + 1}:\n{doc.page_content}"
@@ -102,20 +150,21 @@ class SemanticMemoryOriginal:
     def __init__(self, persist_directory, lanlan_name, name_mapping):
         config_manager = get_config_manager()
         api_config = config_manager.get_model_api_config('summary')
-        self.embeddings = OpenAIEmbeddings(base_url=api_config['base_url'], model=SEMANTIC_MODEL, api_key=api_config['api_key'])
-        # self.vectorstore = Chroma(
-        #     collection_name="Origin",
-        #     persist_directory=persist_directory[lanlan_name],
-        #     embedding_function=self.embeddings
-        # )
-        self.vectorstore = None
+        self.embeddings = OpenAIEmbeddings(base_url=api_config['base_url'], model=SEMANTIC_MODEL, api_key=api_config['api_key'], chunk_size=EMBEDDING_BATCH_SIZE)
+        self.vectorstore = LocalVectorStore(
+            collection_name="Origin",
+            persist_directory=persist_directory[lanlan_name],
+            embedding_function=self.embeddings
+        )
         self.lanlan_name = lanlan_name
         self.name_mapping = name_mapping
 
-    def store_conversation(self, event_id, messages):
+    async def store_conversation(self, event_id, messages):
+        await _reindex_if_model_changed(self.vectorstore, self.embeddings)
         # 将对话转换为文本
         texts = []
         metadatas = []
+        time_metadata = _time_metadata(datetime.now())
         name_mapping = self.name_mapping.copy()
         name_mapping['ai'] = self.lanlan_name
 
@@ -131,25 +180,21 @@ class SemanticMemoryOriginal:
             except Exception:
                 joined = str(message.content)
             texts.append(f"{name_mapping[message.type]} | {joined}\n")
-            metadatas.append({
-                "event_id": event_id,
-                "role": message.type,
-                "year": str(datetime.now().year),
-                "month": "%02d" % (datetime.now().month),
-                "day": "%02d" % (datetime.now().day),
-                "weekday": "%02d" % (datetime.now().weekday()),
-                "hour": "%02d" % (datetime.now().hour),
-                "minute": "%02d" % (datetime.now().minute),
-                "timestamp": datetime.now().isoformat()
-            })
+            metadatas.append({"event_id": event_id, "role": message.type, **time_metadata})
 
         # 存储到向量数据库
-        self.vectorstore.add_texts(texts=texts, metadatas=metadatas)
+        await _add_to_vectorstore(self.vectorstore, self.embeddings, texts, metadatas)
 
     def retrieve_by_query(self, query, k=10):
         # 在原始对话上进行精确语义搜索
         return self.vectorstore.similarity_search(query, k=k)
 
+    async def aretrieve_by_query(self, query, k=10):
+        return await self.vectorstore.asimilarity_search(query, k=k)
+
+    async def aretrieve_with_score(self, query, k=10):
+        return await self.vectorstore.asimilarity_search_with_score(query, k=k)
+
 
 class SemanticMemoryCompressed:
     def __init__(self, persist_directory, lanlan_name, recent_history_manager: CompressedRecentHistoryManager, name_mapping):
@@ -157,13 +202,12 @@ class SemanticMemoryCompressed:
         self.name_mapping = name_mapping
         config_manager = get_config_manager()
         api_config = config_manager.get_model_api_config('summary')
-        self.embeddings = OpenAIEmbeddings(base_url=api_config['base_url'], model=SEMANTIC_MODEL, api_key=api_config['api_key'])
-        self.vectorstore = None
-        # self.vectorstore = Chroma(
-        #     collection_name="Compressed",
-        #     persist_directory=persist_directory[lanlan_name],
-        #     embedding_function=self.embeddings
-        # )
+        self.embeddings = OpenAIEmbeddings(base_url=api_config['base_url'], model=SEMANTIC_MODEL, api_key=api_config['api_key'], chunk_size=EMBEDDING_BATCH_SIZE)
+        self.vectorstore = LocalVectorStore(
+            collection_name="Compressed",
+            persist_directory=persist_directory[lanlan_name],
+            embedding_function=self.embeddings
+        )
         self.recent_history_manager = recent_history_manager
 
     async def store_compressed_summary(self, event_id, messages):
@@ -171,21 +215,20 @@ class SemanticMemoryCompressed:
         _, summary = await self.recent_history_manager.compress_history(messages, self.lanlan_name)
         if not summary:
             return
-        self.vectorstore.add_texts(
-            texts=[summary],
-            metadatas=[{
-                "event_id": event_id,
-                "role": "SYSTEM_SUMMARY",
-                "year": str(datetime.now().year),
-                "month": "%02d" % (datetime.now().month),
-                "day": "%02d" % (datetime.now().day),
-                "weekday": "%02d" % (datetime.now().weekday()),
-                "hour": "%02d" % (datetime.now().hour),
-                "minute": "%02d" % (datetime.now().minute),
-                "timestamp": datetime.now().isoformat()
-            }]
+        await _reindex_if_model_changed(self.vectorstore, self.embeddings)
+        await _add_to_vectorstore(
+            self.vectorstore,
+            self.embeddings,
+            [summary],
+            [{"event_id": event_id, "role": "SYSTEM_SUMMARY", **_time_metadata(datetime.now())}]
         )
 
     def retrieve_by_query(self, query, k=10):
         # 在压缩摘要上进行语义搜索
-        return self.vectorstore.similarity_search(query, k=k)
\ No newline at end of file
+        return self.vectorstore.similarity_search(query, k=k)
+
+    async def aretrieve_by_query(self, query, k=10):
+        return await self.vectorstore.asimilarity_search(query, k=k)
+
+    async def aretrieve_with_score(self, query, k=10):
+        return await self.vectorstore.asimilarity_search_with_score(query, k=k)
@@ -1,9 +1,10 @@
 import json
+import os
 import asyncio
-from langchain_openai import ChatOpenAI
 from openai import APIConnectionError, InternalServerError, RateLimitError
 from config import SETTING_PROPOSER_MODEL, SETTING_VERIFIER_MODEL
 from utils.config_manager import get_config_manager
+from utils.llm_client import get_model_llm
 from config.prompts_sys import settings_extractor_prompt, settings_verifier_prompt
 
 
@@ -14,14 +15,12 @@ class ImportantSettingsManager:
         self._config_manager = get_config_manager()
     
     def _get_proposer(self):
-        """动态获取Proposer LLM实例以支持配置热重载"""
-        api_config = self._config_manager.get_model_api_config('summary')
-        return ChatOpenAI(model=SETTING_PROPOSER_MODEL, base_url=api_config['base_url'], api_key=api_config['api_key'], temperature=0.5)
+        """获取Proposer LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('summary', model=SETTING_PROPOSER_MODEL, with_extra_body=False, temperature=0.5)
     
     def _get_verifier(self):
-        """动态获取Verifier LLM实例以支持配置热重载"""
-        api_config = self._config_manager.get_model_api_config('summary')
-        return ChatOpenAI(model=SETTING_VERIFIER_MODEL, base_url=api_config['base_url'], api_key=api_config['api_key'], temperature=0.5)
+        """获取Verifier LLM实例（共享连接池，配置变化后自动重建）"""
+        return get_model_llm('summary', model=SETTING_VERIFIER_MODEL, with_extra_body=False, temperature=0.5)
 
     def load_settings(self):
         # It is important to update the settings with the latest character on-disk files
@@ -41,6 +40,16 @@ class ImportantSettingsManager:
             except (FileNotFoundError, json.JSONDecodeError):
                 self.settings[i] = {i: {}, self.name_mapping['human']: {}}
 
+    def get_settings_version(self, lanlan_name):
+        """设定内容的版本：角色配置快照版本 + 设定文件指纹（不读取文件内容）"""
+        setting_store = self._config_manager.get_character_data()[8]
+        try:
+            st = os.stat(setting_store[lanlan_name])
+            stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except (KeyError, OSError):
+            stamp = None
+        return self._config_manager.get_config_version(), stamp
+
     def save_settings(self, lanlan_name):
         with open(self.settings_file[lanlan_name], 'w', encoding='utf-8') as f:
             json.dump(self.settings[lanlan_name], f, indent=2, ensure_ascii=False)
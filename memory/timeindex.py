@@ -1,49 +1,116 @@
-from langchain_community.chat_message_histories import SQLChatMessageHistory
-from langchain_core.messages import SystemMessage
-from sqlalchemy import create_engine, text
+from langchain_core.messages import SystemMessage, message_to_dict
+from sqlalchemy import create_engine, event, text
 from config import TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME
 from utils.config_manager import get_config_manager
 from datetime import datetime
+import asyncio
+import json
 import logging
 import os
+import threading
 
 logger = logging.getLogger(__name__)
 
+# 表结构版本（PRAGMA user_version），用于跳过已完成的迁移；索引定义变化时必须递增
+# 1: 时间范围覆盖索引 (timestamp, session_id, id, message)
+# 2: 索引去掉 message 列（message 经 rowid 回表读取，避免索引复制整份消息 JSON）
+TIME_SCHEMA_VERSION = 2
+
+# 每个数据库文件一个长期存活的引擎，重新加载记忆组件时复用
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def get_time_engine(db_path):
+    """获取（或创建）指定数据库文件的共享引擎：WAL + synchronous=NORMAL + 连接池"""
+    key = os.path.abspath(db_path)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = create_engine(
+                f"sqlite:///{db_path}",
+                pool_size=4,
+                max_overflow=4,
+                pool_pre_ping=False,
+                connect_args={"check_same_thread": False},
+            )
+            event.listen(engine, "connect", _set_sqlite_pragmas)
+            _engines[key] = engine
+        return engine
+
+
+def _to_db_time(value):
+    # 与 sqlite3 默认的 datetime 适配器格式一致（YYYY-MM-DD HH:MM:SS[.ffffff]），兼容已有数据
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+
 class TimeIndexedMemory:
     def __init__(self, recent_history_manager):
         self.engine = {}
         self.recent_history_manager = recent_history_manager
         _, _, _, _, _, _, _, time_store, _, _ = get_config_manager().get_character_data()
         for i in time_store:
-            self.engine[i] = create_engine(f"sqlite:///{time_store[i]}")
+            self._init_engine(i, time_store[i])
 
-            _ = SQLChatMessageHistory(
-                connection=self.engine[i],
-                session_id="",
-                table_name=TIME_ORIGINAL_TABLE_NAME,
-            )
+    def _init_engine(self, lanlan_name, db_path):
+        self.engine[lanlan_name] = get_time_engine(db_path)
+        self.check_table_schema(lanlan_name)
 
-            _ = SQLChatMessageHistory(
-                connection=self.engine[i],
-                session_id="",
-                table_name=TIME_COMPRESSED_TABLE_NAME,
-            )
-            self.check_table_schema(i)
-
-    def add_timestamp_column(self, lanlan_name):
+    def check_table_schema(self, lanlan_name):
+        """建表并迁移旧数据库：补充 timestamp 列，创建按时间范围查询的索引"""
         with self.engine[lanlan_name].connect() as conn:
-            conn.execute(text(f"ALTER TABLE {TIME_ORIGINAL_TABLE_NAME} ADD COLUMN timestamp DATETIME"))
-            conn.execute(text(f"ALTER TABLE {TIME_COMPRESSED_TABLE_NAME} ADD COLUMN timestamp DATETIME"))
+            if conn.execute(text("PRAGMA user_version")).scalar() >= TIME_SCHEMA_VERSION:
+                return
+            # 与 SQLChatMessageHistory 的表结构保持一致
+            for table in (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME):
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {table} "
+                    f"(id INTEGER NOT NULL PRIMARY KEY, session_id TEXT, message TEXT, timestamp DATETIME)"
+                ))
+            for table in (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME):
+                columns = conn.execute(text(f"PRAGMA table_info({table})")).fetchall()
+                if not any(i[1] == 'timestamp' for i in columns):
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN timestamp DATETIME"))
+                # 版本 1 的索引包含 message 列，数据库体积几乎翻倍
+                conn.execute(text(f"DROP INDEX IF EXISTS idx_{table}_timestamp"))
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS idx_{table}_time_range ON {table} (timestamp, session_id, id)"
+                ))
+            conn.execute(text(f"PRAGMA user_version = {TIME_SCHEMA_VERSION}"))
             conn.commit()
 
-    def check_table_schema(self, lanlan_name):
-        with self.engine[lanlan_name].connect() as conn:
-            result = conn.execute(text(f"PRAGMA table_info({TIME_ORIGINAL_TABLE_NAME})"))
-            columns = result.fetchall()
-            for i in columns:
-                if i[1] == 'timestamp':
-                    return
-            self.add_timestamp_column(lanlan_name)
+    def _insert_conversation(self, lanlan_name, event_id, messages, summary, timestamp):
+        """在同一事务中批量写入原始消息与摘要，时间戳随行写入"""
+        timestamp = _to_db_time(timestamp)
+        original_rows = [
+            {"session_id": event_id, "message": json.dumps(message_to_dict(m)), "timestamp": timestamp}
+            for m in messages
+        ]
+        compressed_row = {
+            "session_id": event_id,
+            "message": json.dumps(message_to_dict(SystemMessage(summary))),
+            "timestamp": timestamp,
+        }
+        with self.engine[lanlan_name].begin() as conn:
+            if original_rows:
+                conn.execute(
+                    text(f"INSERT INTO {TIME_ORIGINAL_TABLE_NAME} (session_id, message, timestamp) VALUES (:session_id, :message, :timestamp)"),
+                    original_rows
+                )
+            conn.execute(
+                text(f"INSERT INTO {TIME_COMPRESSED_TABLE_NAME} (session_id, message, timestamp) VALUES (:session_id, :message, :timestamp)"),
+                [compressed_row]
+            )
 
     async def store_conversation(self, event_id, messages, lanlan_name, timestamp=None):
         # 检查角色是否存在于配置中，如果不存在则创建默认路径
@@ -64,18 +131,7 @@ class TimeIndexedMemory:
             if lanlan_name not in self.engine:
                 # 创建数据库引擎和表
                 db_path = time_store[lanlan_name]
-                self.engine[lanlan_name] = create_engine(f"sqlite:///{db_path}")
-                _ = SQLChatMessageHistory(
-                    connection=self.engine[lanlan_name],
-                    session_id="",
-                    table_name=TIME_ORIGINAL_TABLE_NAME,
-                )
-                _ = SQLChatMessageHistory(
-                    connection=self.engine[lanlan_name],
-                    session_id="",
-                    table_name=TIME_COMPRESSED_TABLE_NAME,
-                )
-                self.check_table_schema(lanlan_name)
+                self._init_engine(lanlan_name, db_path)
                 logger.info(f"[TimeIndexedMemory] 为角色 {lanlan_name} 创建数据库引擎: {db_path}")
         except Exception as e:
             logger.error(f"检查角色配置失败: {e}")
@@ -87,18 +143,7 @@ class TimeIndexedMemory:
                 memory_base = str(config_mgr.memory_dir)
                 default_path = os.path.join(memory_base, f'time_indexed_{lanlan_name}')
                 if lanlan_name not in self.engine:
-                    self.engine[lanlan_name] = create_engine(f"sqlite:///{default_path}")
-                    _ = SQLChatMessageHistory(
-                        connection=self.engine[lanlan_name],
-                        session_id="",
-                        table_name=TIME_ORIGINAL_TABLE_NAME,
-                    )
-                    _ = SQLChatMessageHistory(
-                        connection=self.engine[lanlan_name],
-                        session_id="",
-                        table_name=TIME_COMPRESSED_TABLE_NAME,
-                    )
-                    self.check_table_schema(lanlan_name)
+                    self._init_engine(lanlan_name, default_path)
                     logger.info(f"[TimeIndexedMemory] 使用默认路径创建数据库: {default_path}")
             except Exception as e2:
                 logger.error(f"创建默认数据库失败: {e2}")
@@ -111,37 +156,14 @@ class TimeIndexedMemory:
             logger.error(f"角色 '{lanlan_name}' 的数据库引擎不存在")
             return
 
-        origin_history = SQLChatMessageHistory(
-            connection=self.engine[lanlan_name],
-            session_id=event_id,
-            table_name=TIME_ORIGINAL_TABLE_NAME,
-        )
-
-        compressed_history = SQLChatMessageHistory(
-            connection=self.engine[lanlan_name],
-            session_id=event_id,
-            table_name=TIME_COMPRESSED_TABLE_NAME,
-        )
-
-        origin_history.add_messages(messages)
-        compressed_history.add_message(SystemMessage((await self.recent_history_manager.compress_history(messages, lanlan_name))[1]))
-
-        with self.engine[lanlan_name].connect() as conn:
-            conn.execute(
-                text(f"UPDATE {TIME_ORIGINAL_TABLE_NAME} SET timestamp = :timestamp WHERE session_id = :session_id"),
-                {"timestamp": timestamp, "session_id": event_id}
-            )
-            conn.execute(
-                text(f"UPDATE {TIME_COMPRESSED_TABLE_NAME} SET timestamp = :timestamp WHERE session_id = :session_id"),
-                {"timestamp": timestamp, "session_id": event_id}
-            )
-            conn.commit()
+        summary = (await self.recent_history_manager.compress_history(messages, lanlan_name))[1]
+        await asyncio.to_thread(self._insert_conversation, lanlan_name, event_id, messages, summary, timestamp)
 
     def retrieve_summary_by_timeframe(self, lanlan_name, start_time, end_time):
         with self.engine[lanlan_name].connect() as conn:
             result = conn.execute(
-                text(f"SELECT session_id, message FROM {TIME_COMPRESSED_TABLE_NAME} WHERE timestamp BETWEEN :start_time AND :end_time"),
-                {"start_time": start_time, "end_time": end_time}
+                text(f"SELECT session_id, message FROM {TIME_COMPRESSED_TABLE_NAME} WHERE timestamp BETWEEN :start_time AND :end_time ORDER BY timestamp, session_id, id"),
+                {"start_time": _to_db_time(start_time), "end_time": _to_db_time(end_time)}
             )
             return result.fetchall()
 
@@ -149,7 +171,128 @@ class TimeIndexedMemory:
         # 查询指定时间范围内的对话
         with self.engine[lanlan_name].connect() as conn:
             result = conn.execute(
-                text(f"SELECT session_id, message FROM {TIME_ORIGINAL_TABLE_NAME} WHERE timestamp BETWEEN :start_time AND :end_time"),
-                {"start_time": start_time, "end_time": end_time}
+                text(f"SELECT session_id, message FROM {TIME_ORIGINAL_TABLE_NAME} WHERE timestamp BETWEEN :start_time AND :end_time ORDER BY timestamp, session_id, id"),
+                {"start_time": _to_db_time(start_time), "end_time": _to_db_time(end_time)}
             )
-            return result.fetchall()
\ No newline at end of file
+            return result.fetchall()
+
+def _run_benchmark(sizes=(10 ** 5, 10 ** 6), turns=200, queries=50) -> None:
+    """
+    在 10^5 / 10^6 行的数据库上比较旧写法与当前实现：
+    - 旧写法：无索引，每条消息单独 INSERT 并提交，随后按 session_id 两次 UPDATE 回填时间戳；范围查询全表扫描
+    - 当前实现：_insert_conversation 单事务批量写入；retrieve_original_by_timeframe 走 (timestamp, session_id, id) 索引
+    每轮 4 条消息、间隔 30 秒，范围查询取 1 小时。同时把版本 1 的数据库（索引含 message 列）迁移到当前版本，
+    报告迁移前后的文件大小。
+    """
+    import random
+    import shutil
+    import sqlite3
+    import tempfile
+    import time
+    from datetime import timedelta
+    from langchain_core.messages import HumanMessage, AIMessage
+
+    origin = datetime(2024, 1, 1)
+    messages = [HumanMessage(content="今天天气怎么样？要不要一起出去散步，顺便买点水果回来。"),
+                AIMessage(content="外面阳光很好，气温也合适，我们可以去公园走一圈，然后去超市买些苹果和葡萄。")] * 2
+    message_json = [json.dumps(message_to_dict(m)) for m in messages]
+    summary_json = json.dumps(message_to_dict(SystemMessage("两人商量出门散步并买水果。")))
+
+    def rows(n_rows):
+        for i in range(n_rows // 4):
+            ts = _to_db_time(origin + timedelta(seconds=30 * i))
+            for m in message_json:
+                yield (f"event-{i}", m, ts)
+
+    def summaries(n_rows):
+        for i in range(n_rows // 4):
+            yield (f"event-{i}", summary_json, _to_db_time(origin + timedelta(seconds=30 * i)))
+
+    def hour_ranges(n_rows):
+        span = n_rows // 4 * 30
+        rng = random.Random(0)
+        for _ in range(queries):
+            start = origin + timedelta(seconds=rng.randrange(0, max(1, span - 3600)))
+            yield start, start + timedelta(hours=1)
+
+    for n_rows in sizes:
+        root = tempfile.mkdtemp()
+        try:
+            path = os.path.join(root, 'current.db')
+            with sqlite3.connect(path) as conn:
+                for table in (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME):
+                    conn.execute(f"CREATE TABLE {table} (id INTEGER NOT NULL PRIMARY KEY, session_id TEXT, "
+                                 f"message TEXT, timestamp DATETIME)")
+                conn.executemany(f"INSERT INTO {TIME_ORIGINAL_TABLE_NAME} (session_id, message, timestamp) "
+                                 f"VALUES (?, ?, ?)", rows(n_rows))
+                conn.executemany(f"INSERT INTO {TIME_COMPRESSED_TABLE_NAME} (session_id, message, timestamp) "
+                                 f"VALUES (?, ?, ?)", summaries(n_rows))
+            legacy_path = os.path.join(root, 'legacy.db')
+            shutil.copyfile(path, legacy_path)
+
+            # 旧写法
+            legacy = sqlite3.connect(legacy_path)
+            started = time.perf_counter()
+            for i in range(turns):
+                event_id = f"new-{i}"
+                for m in message_json:
+                    legacy.execute(f"INSERT INTO {TIME_ORIGINAL_TABLE_NAME} (session_id, message) VALUES (?, ?)",
+                                   (event_id, m))
+                    legacy.commit()
+                legacy.execute(f"INSERT INTO {TIME_COMPRESSED_TABLE_NAME} (session_id, message) VALUES (?, ?)",
+                               (event_id, summary_json))
+                legacy.commit()
+                ts = _to_db_time(datetime.now())
+                for table in (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME):
+                    legacy.execute(f"UPDATE {table} SET timestamp = ? WHERE session_id = ?", (ts, event_id))
+                legacy.commit()
+            legacy_insert = (time.perf_counter() - started) / turns
+            started = time.perf_counter()
+            for start, end in hour_ranges(n_rows):
+                legacy.execute(f"SELECT session_id, message FROM {TIME_ORIGINAL_TABLE_NAME} "
+                               f"WHERE timestamp BETWEEN ? AND ?", (_to_db_time(start), _to_db_time(end))).fetchall()
+            legacy_query = (time.perf_counter() - started) / queries
+            legacy.close()
+
+            # 版本 1 的数据库：覆盖索引包含 message 列
+            with sqlite3.connect(path) as conn:
+                for table in (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME):
+                    conn.execute(f"CREATE INDEX idx_{table}_timestamp ON {table} (timestamp, session_id, id, message)")
+                conn.execute("PRAGMA user_version = 1")
+            v1_size = os.path.getsize(path)
+
+            # 当前实现（迁移到当前版本后回收空间，比较文件大小）
+            memory = TimeIndexedMemory.__new__(TimeIndexedMemory)
+            memory.engine = {'bench': get_time_engine(path)}
+            memory.check_table_schema('bench')
+            with sqlite3.connect(path) as conn:
+                conn.execute("VACUUM")
+                plan = conn.execute(f"EXPLAIN QUERY PLAN SELECT session_id, message FROM {TIME_ORIGINAL_TABLE_NAME} "
+                                    f"WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp, session_id, id",
+                                    ('a', 'b')).fetchall()
+            current_size = os.path.getsize(path)
+            started = time.perf_counter()
+            for i in range(turns):
+                memory._insert_conversation('bench', f"new-{i}", messages, "两人商量出门散步并买水果。", datetime.now())
+            current_insert = (time.perf_counter() - started) / turns
+            started = time.perf_counter()
+            hits = 0
+            for start, end in hour_ranges(n_rows):
+                hits += len(memory.retrieve_original_by_timeframe('bench', start, end))
+            current_query = (time.perf_counter() - started) / queries
+            memory.engine['bench'].dispose()
+
+            print(f"{n_rows:>9,} rows ({hits // queries} rows per 1h query)")
+            print(f"  insert/turn   {legacy_insert * 1000:8.2f} -> {current_insert * 1000:6.2f} ms")
+            print(f"  range query   {legacy_query * 1000:8.2f} -> {current_query * 1000:6.2f} ms")
+            print(f"  db size       {v1_size / 2 ** 20:8.1f} MB with v1 index -> {current_size / 2 ** 20:6.1f} MB")
+            print(f"  query plan    {plan[-1][-1]}")
+        finally:
+            with _engines_lock:
+                for key in [k for k in _engines if k.startswith(os.path.abspath(root))]:
+                    _engines.pop(key).dispose()
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    _run_benchmark()
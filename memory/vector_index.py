@@ -0,0 +1,462 @@
+"""
+基于 NumPy 的本地向量索引，替代体积过大的 Chroma
+
+每个集合（collection）一个目录：
+    vectors.f16      归一化后的 float16 向量，按行追加，检索时内存映射
+    docs.jsonl       每行一条 {"id", "text", "metadata"}，与向量按行对应
+    tombstones.txt   已删除的行号（墓碑），检索时过滤
+    ivf.npz          IVF 聚类中心与各行的簇分配（条目较多时才会训练）
+    meta.json        维度、量化比例与生成向量所用的嵌入模型
+
+条目较少时直接暴力检索；超过 IVF_MIN_ROWS 后训练 IVF，只扫描最近的 nprobe 个簇。
+粗排使用内存中的 int8 量化副本（float16 转 float32 的开销远大于矩阵乘法本身），
+再从 float16 原始向量中精排前 RERANK_FACTOR * k 条。
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+# 少于该条目数时暴力检索，超过后启用IVF
+IVF_MIN_ROWS = 4096
+# 检索时探查的簇数
+IVF_NPROBE = 8
+# 条目数增长到上次训练时的该倍数后重新训练
+IVF_RETRAIN_GROWTH = 2.0
+# k-means 训练样本数与迭代次数
+IVF_TRAIN_SAMPLE = 8192
+IVF_TRAIN_ITERS = 8
+# 精排候选数为 k 的倍数
+RERANK_FACTOR = 8
+# 分块处理时每块的行数
+_BLOCK_ROWS = 8192
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """将向量分配到最近（内积最大）的聚类中心"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _truncate(path: str, size: int):
+    """文件长于 size 时截断（崩溃留下的半截写入）"""
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+def _kmeans(sample: np.ndarray, nlist: int, iters: int, seed: int = 0) -> np.ndarray:
+    """球面 k-means（向量均已归一化，按内积聚类）"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = np.bincount(labels, minlength=nlist) == 0
+        # 空簇重新随机选点
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=True)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class LocalVectorStore:
+    """单个角色单个集合的本地向量存储，接口与 Chroma 的常用方法保持一致"""
+
+    def __init__(self, collection_name: str, persist_directory: str, embedding_function=None):
+        self.collection_name = collection_name
+        self.directory = os.path.join(persist_directory, collection_name)
+        self.embedding_function = embedding_function
+        self._vectors_path = os.path.join(self.directory, 'vectors.f16')
+        self._docs_path = os.path.join(self.directory, 'docs.jsonl')
+        self._tombstones_path = os.path.join(self.directory, 'tombstones.txt')
+        self._ivf_path = os.path.join(self.directory, 'ivf.npz')
+        self._lock = threading.RLock()
+        self._init_state()
+        self._load()
+
+    def _init_state(self):
+        self.dim: Optional[int] = None
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._deleted = np.zeros(0, dtype=bool)
+        self._matrix: Optional[np.memmap] = None
+        # 粗排用的 int8 量化副本（按容量倍增，避免每次追加都复制）
+        self._code_scale: Optional[float] = None
+        self._codes = np.zeros((0, 0), dtype=np.int8)
+
+        # IVF 状态
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: Optional[List[np.ndarray]] = None
+        self._trained_rows = 0
+        # 生成向量所用的嵌入模型（更换模型后需要重建索引）
+        self.model: Optional[str] = None
+
+    def __len__(self):
+        return len(self._ids) - int(self._deleted.sum())
+
+    # ---------- 持久化 ----------
+
+    def _load(self):
+        # 每条完整文档行结束处的文件偏移，用于截掉不完整的尾部
+        line_ends = []
+        if os.path.exists(self._docs_path):
+            with open(self._docs_path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # 末行写入不完整（崩溃），丢弃其后的内容
+                        break
+                    try:
+                        doc = json.loads(line)
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        break
+                    offset += len(line)
+                    line_ends.append(offset)
+                    self._id_to_row[doc['id']] = len(self._ids)
+                    self._ids.append(doc['id'])
+                    self._texts.append(doc['text'])
+                    self._metadatas.append(doc.get('metadata') or {})
+        self.dim, self._code_scale, self.model = self._read_meta()
+        if self._ids:
+            vector_bytes = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+            rows = vector_bytes // (2 * self.dim) if self.dim else 0
+            # 向量与文档行数不一致时以较短者为准
+            if rows < len(self._ids):
+                for doc_id in self._ids[rows:]:
+                    self._id_to_row.pop(doc_id, None)
+                del self._ids[rows:], self._texts[rows:], self._metadatas[rows:]
+        # 磁盘上也截到对齐的行数：否则之后的追加会写在孤儿向量 / 残缺文档行之后，行号整体错位
+        rows = len(self._ids)
+        _truncate(self._docs_path, line_ends[rows - 1] if rows else 0)
+        _truncate(self._vectors_path, rows * 2 * self.dim if self.dim else 0)
+        self._deleted = np.zeros(len(self._ids), dtype=bool)
+        if self._ids:
+            matrix = self._get_matrix()
+            for start in range(0, len(matrix), _BLOCK_ROWS):
+                self._append_codes(start, np.asarray(matrix[start:start + _BLOCK_ROWS], dtype=np.float32))
+        if os.path.exists(self._tombstones_path):
+            stale = False
+            with open(self._tombstones_path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line.isdigit() and int(line) < len(self._ids):
+                        self._deleted[int(line)] = True
+                    elif line:
+                        stale = True
+            if stale:
+                # 指向被截掉的行的墓碑会误删之后复用这些行号的新条目
+                self._write_tombstones()
+        if os.path.exists(self._ivf_path) and self._ids:
+            stale = False
+            try:
+                data = np.load(self._ivf_path)
+                self._centroids = data['centroids']
+                self._assignments = data['assignments'][:len(self._ids)]
+                self._trained_rows = int(data['trained_rows'])
+                stale = len(data['assignments']) > len(self._ids)
+            except Exception:
+                self._centroids = None
+                self._assignments = np.zeros(0, dtype=np.int32)
+            if self._centroids is not None and len(self._assignments) < len(self._ids):
+                # 上次训练之后追加的条目只在内存中分配过簇，这里补上
+                self._assignments = np.concatenate(
+                    [self._assignments, _assign(self._get_matrix()[len(self._assignments):], self._centroids)])
+            if stale and self._centroids is not None:
+                # 文件中多出的簇分配属于被截掉的行，之后复用这些行号的条目不能沿用
+                self._save_ivf()
+
+    def _read_meta(self):
+        meta_path = os.path.join(self.directory, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            return meta.get('dim'), meta.get('code_scale'), meta.get('model')
+        return None, None, None
+
+    def _write_meta(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'dtype': 'float16', 'normalized': True,
+                       'code_scale': self._code_scale, 'model': self.model}, f)
+
+    def _append_codes(self, start: int, vectors: np.ndarray):
+        rows = start + len(vectors)
+        if self._codes.shape[0] < rows or self._codes.shape[1] != self.dim:
+            grown = np.zeros((max(rows, 2 * self._codes.shape[0], 1024), self.dim), dtype=np.int8)
+            if start:
+                grown[:start] = self._codes[:start]
+            self._codes = grown
+        self._codes[start:rows] = np.clip(np.rint(vectors * self._code_scale), -127, 127)
+
+    def _get_matrix(self) -> np.ndarray:
+        """按需（重新）映射向量文件"""
+        rows = len(self._ids)
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            if rows == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float16)
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float16, mode='r', shape=(rows, self.dim))
+        return self._matrix
+
+    def _write_tombstones(self):
+        tmp_path = self._tombstones_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(f"{row}\n" for row in np.flatnonzero(self._deleted)))
+        os.replace(tmp_path, self._tombstones_path)
+
+    def _save_ivf(self):
+        tmp_path = self._ivf_path + '.tmp.npz'
+        np.savez(tmp_path, centroids=self._centroids, assignments=self._assignments,
+                 trained_rows=np.int64(self._trained_rows))
+        os.replace(tmp_path, self._ivf_path)
+
+    # ---------- 写入 ----------
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[Dict[str, Any]]] = None,
+                  ids: Optional[List[str]] = None) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(texts, embeddings, metadatas, ids)
+
+    def add_embeddings(self, texts: List[str], embeddings, metadatas: Optional[List[Dict[str, Any]]] = None,
+                       ids: Optional[List[str]] = None, model: Optional[str] = None) -> List[str]:
+        """追加已计算好的向量，只写入新增部分"""
+        vectors = _normalize(embeddings)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError("embeddings 与 texts 数量不一致")
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self.model = model
+                # 量化比例取首批数据的最大分量并留出余量
+                self._code_scale = 127.0 / min(1.0, 1.5 * float(np.abs(vectors).max()) or 1.0)
+                self._write_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致，请重建索引")
+            os.makedirs(self.directory, exist_ok=True)
+            # 先写向量再写文档：加载时以两者较短者为准，崩溃不会产生错位
+            with open(self._vectors_path, 'ab') as f:
+                f.write(vectors.astype(np.float16).tobytes())
+            with open(self._docs_path, 'ab') as f:
+                for doc_id, text, metadata in zip(ids, texts, metadatas):
+                    line = json.dumps({'id': doc_id, 'text': text, 'metadata': metadata}, ensure_ascii=False)
+                    f.write(line.encode('utf-8') + b'\n')
+            start = len(self._ids)
+            for offset, doc_id in enumerate(ids):
+                self._id_to_row[doc_id] = start + offset
+            self._ids.extend(ids)
+            self._texts.extend(texts)
+            self._metadatas.extend(metadatas)
+            self._append_codes(start, vectors)
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(ids), dtype=bool)])
+            if self._centroids is not None:
+                self._assignments = np.concatenate([self._assignments, _assign(vectors, self._centroids)])
+                self._lists = None
+            self._maybe_train()
+        return ids
+
+    def delete(self, ids: List[str]):
+        """墓碑删除：只记录行号，检索时过滤"""
+        with self._lock:
+            rows = [self._id_to_row.pop(doc_id) for doc_id in ids if doc_id in self._id_to_row]
+            if not rows:
+                return
+            self._deleted[rows] = True
+            with open(self._tombstones_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{row}\n" for row in rows))
+
+    def live_entries(self):
+        """返回未删除条目的 (texts, metadatas, ids)，用于重建索引"""
+        with self._lock:
+            rows = [i for i in range(len(self._ids)) if not self._deleted[i]]
+            return ([self._texts[i] for i in rows], [self._metadatas[i] for i in rows],
+                    [self._ids[i] for i in rows])
+
+    def rebuild(self, texts: List[str], embeddings, metadatas: List[Dict[str, Any]], ids: List[str],
+                model: Optional[str] = None):
+        """
+        用新的向量整体重建集合（如更换嵌入模型后），同时清除墓碑与IVF
+        新数据先写入临时目录，完成后再替换旧目录
+        """
+        with self._lock:
+            staging_dir = self.directory + '.rebuild'
+            backup_dir = self.directory + '.old'
+            for path in (staging_dir, backup_dir):
+                shutil.rmtree(path, ignore_errors=True)
+            staging = LocalVectorStore(os.path.basename(staging_dir), os.path.dirname(staging_dir))
+            if texts:
+                staging.add_embeddings(texts, embeddings, metadatas, ids, model=model)
+            staging._matrix = None
+            # Windows 下被映射的文件无法重命名，先释放映射
+            self._matrix = None
+            if os.path.exists(self.directory):
+                os.replace(self.directory, backup_dir)
+            if os.path.exists(staging_dir):
+                os.replace(staging_dir, self.directory)
+            shutil.rmtree(backup_dir, ignore_errors=True)
+            self._init_state()
+            self._load()
+
+    # ---------- IVF ----------
+
+    def _maybe_train(self):
+        rows = len(self._ids)
+        if rows < IVF_MIN_ROWS:
+            return
+        if self._centroids is not None and rows < self._trained_rows * IVF_RETRAIN_GROWTH:
+            if len(self._assignments) < rows:
+                self._assignments = np.concatenate(
+                    [self._assignments, _assign(self._get_matrix()[len(self._assignments):], self._centroids)])
+                self._lists = None
+            return
+        self.train_ivf()
+
+    def train_ivf(self):
+        """训练IVF聚类中心并为全部条目分配簇"""
+        with self._lock:
+            matrix = self._get_matrix()
+            rows = len(matrix)
+            if rows < IVF_MIN_ROWS:
+                return
+            nlist = max(16, int(np.sqrt(rows)))
+            rng = np.random.default_rng(rows)
+            sample_idx = np.sort(rng.choice(rows, min(rows, IVF_TRAIN_SAMPLE), replace=False))
+            sample = np.asarray(matrix[sample_idx], dtype=np.float32)
+            self._centroids = _kmeans(sample, min(nlist, len(sample)), IVF_TRAIN_ITERS)
+            self._assignments = _assign(matrix, self._centroids)
+            self._trained_rows = rows
+            self._lists = None
+            self._save_ivf()
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        if self._lists is None:
+            order = np.argsort(self._assignments, kind='stable')
+            bounds = np.searchsorted(self._assignments[order], np.arange(len(self._centroids) + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self._centroids))]
+        return self._lists
+
+    # ---------- 检索 ----------
+
+    def search_by_vector(self, embedding, k: int = 10) -> List[tuple]:
+        """返回 [(行号, 相似度)]，按相似度降序"""
+        with self._lock:
+            if not self._ids or self.dim is None:
+                return []
+            query = _normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+            matrix = self._get_matrix()
+            if self._centroids is not None and len(self._assignments) == len(self._ids):
+                lists = self._inverted_lists()
+                nprobe = min(IVF_NPROBE, len(lists))
+                probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+                candidates = np.concatenate([lists[i] for i in probe])
+                candidates.sort()
+            else:
+                candidates = np.arange(len(self._ids))
+            candidates = candidates[~self._deleted[candidates]]
+            if len(candidates) == 0:
+                return []
+            # 粗排：int8 副本
+            if len(candidates) == len(self._ids):
+                codes = self._codes[:len(candidates)]
+            else:
+                codes = self._codes[candidates]
+            coarse = codes.astype(np.float32) @ query
+            shortlist_size = min(len(candidates), max(k, 1) * RERANK_FACTOR)
+            shortlist = candidates[np.argpartition(-coarse, shortlist_size - 1)[:shortlist_size]]
+            shortlist.sort()
+            # 精排：float16 原始向量
+            scores = np.asarray(matrix[shortlist], dtype=np.float32) @ query
+            k = min(k, len(shortlist))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(shortlist[i]), float(scores[i])) for i in top]
+
+    def _to_document(self, row: int) -> Document:
+        return Document(page_content=self._texts[row], metadata=self._metadatas[row], id=self._ids[row])
+
+    def similarity_search_by_vector(self, embedding, k: int = 10) -> List[Document]:
+        return [self._to_document(row) for row, _ in self.search_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 10) -> List[tuple]:
+        embedding = self.embedding_function.embed_query(query)
+        return [(self._to_document(row), score) for row, score in self.search_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 10) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 10) -> List[tuple]:
+        embedding = await self.embedding_function.aembed_query(query)
+        return [(self._to_document(row), score) for row, score in self.search_by_vector(embedding, k)]
+
+    async def asimilarity_search(self, query: str, k: int = 10) -> List[Document]:
+        embedding = await self.embedding_function.aembed_query(query)
+        return self.similarity_search_by_vector(embedding, k)
+
+
+def _run_self_check() -> None:
+    """
+    崩溃恢复自检：在两次写入之间"崩溃"（多出一行孤儿向量、文档末行只写了一半、墓碑指向未写完的行），
+    重新加载后再追加一条，确认新条目的行号与向量仍然对应
+    """
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    dim = 16
+
+    def vec():
+        return rng.normal(size=(1, dim)).astype(np.float32)
+
+    def crash_orphan_vector(store):
+        with open(store._vectors_path, 'ab') as f:
+            f.write(_normalize(vec()).astype(np.float16).tobytes())
+
+    def crash_torn_doc(store):
+        crash_orphan_vector(store)
+        with open(store._docs_path, 'ab') as f:
+            f.write(b'{"id": "torn", "te')
+
+    def crash_stale_tombstone(store):
+        crash_orphan_vector(store)
+        with open(store._tombstones_path, 'a', encoding='utf-8') as f:
+            f.write("3\n")
+
+    for name, crash in (('orphan vector row', crash_orphan_vector), ('torn docs.jsonl line', crash_torn_doc),
+                        ('tombstone past the end', crash_stale_tombstone)):
+        with tempfile.TemporaryDirectory() as root:
+            store = LocalVectorStore('c', root)
+            store.add_embeddings(['a', 'b', 'c'], np.concatenate([vec(), vec(), vec()]), ids=['a', 'b', 'c'])
+            crash(store)
+            store = LocalVectorStore('c', root)
+            d = vec()
+            store.add_embeddings(['d'], d, ids=['d'])
+            store = LocalVectorStore('c', root)
+            hits = store.search_by_vector(d[0], 1)
+            ok = len(store) == 4 and hits and hits[0][0] == 3 and store._ids[3] == 'd' and hits[0][1] > 0.99
+            print(f"  {name:<24} top hit {hits[0] if hits else None}  {'OK' if ok else 'FAILED'}")
+            assert ok, name
+
+
+if __name__ == "__main__":
+    _run_self_check()
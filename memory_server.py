@@ -3,20 +3,21 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from memory import CompressedRecentHistoryManager, SemanticMemory, ImportantSettingsManager, TimeIndexedMemory
-from fastapi import FastAPI
-from fastapi.responses import PlainTextResponse
+from memory.review_scheduler import ReviewScheduler
+from memory.context_cache import DialogContextCache
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse, JSONResponse
 import json
 import uvicorn
 from langchain_core.messages import convert_to_messages
 from uuid import uuid4
 from config import MEMORY_SERVER_PORT
 from utils.config_manager import get_config_manager
+from utils.llm_client import aclose_pools, get_pool_stats
 from pydantic import BaseModel
-import re
 import asyncio
 import logging
 import argparse
-from utils.frontend_utils import get_timestamp
 
 # Setup logger
 from utils.logger_config import setup_logging
@@ -69,9 +70,10 @@ async def reload_memory_components():
 shutdown_event = asyncio.Event()
 # 全局变量控制是否响应退出请求
 enable_shutdown = False
-# 全局变量用于管理correction任务
-correction_tasks = {}  # {lanlan_name: asyncio.Task}
-correction_cancel_flags = {}  # {lanlan_name: asyncio.Event}
+# 预渲染的 new_dialog / get_recent_history 上下文
+dialog_context_cache = DialogContextCache(lambda: recent_history_manager, lambda: settings_manager)
+# 记忆整理（correction）任务的调度器，按角色合并整理请求；整理写回后提前重建上下文
+review_scheduler = ReviewScheduler(lambda: recent_history_manager, on_applied=dialog_context_cache.prefetch)
 
 @app.post("/shutdown")
 async def shutdown_memory_server():
@@ -93,44 +95,23 @@ async def shutdown_memory_server():
 async def shutdown_event_handler():
     """应用关闭时执行清理工作"""
     logger.info("Memory server正在关闭...")
-    # 这里可以添加任何需要的清理工作
+    review_scheduler.shutdown()
+    await aclose_pools()
     logger.info("Memory server已关闭")
 
 
-async def _run_review_in_background(lanlan_name: str):
-    """在后台运行review_history，支持取消"""
-    global correction_tasks, correction_cancel_flags
-    
-    # 获取该角色的取消标志
-    cancel_event = correction_cancel_flags.get(lanlan_name)
-    if not cancel_event:
-        cancel_event = asyncio.Event()
-        correction_cancel_flags[lanlan_name] = cancel_event
-    
-    try:
-        # 直接异步调用review_history方法
-        await recent_history_manager.review_history(lanlan_name, cancel_event)
-        logger.info(f"✅ {lanlan_name} 的记忆整理任务完成")
-    except asyncio.CancelledError:
-        logger.info(f"⚠️ {lanlan_name} 的记忆整理任务被取消")
-    except Exception as e:
-        logger.error(f"❌ {lanlan_name} 的记忆整理任务出错: {e}")
-    finally:
-        # 清理任务记录
-        if lanlan_name in correction_tasks:
-            del correction_tasks[lanlan_name]
-        # 重置取消标志
-        if lanlan_name in correction_cancel_flags:
-            correction_cancel_flags[lanlan_name].clear()
+@app.get("/llm_pool_stats")
+async def llm_pool_stats():
+    """本进程各LLM端点的客户端复用与连接池统计（见 utils.llm_client）"""
+    return get_pool_stats()
+
 
 @app.post("/process/{lanlan_name}")
 async def process_conversation(request: HistoryRequest, lanlan_name: str):
-    global correction_tasks
     try:
         # 检查角色是否存在于配置中，如果不存在则记录信息但继续处理（允许新角色）
         try:
-            character_data = _config_manager.load_characters()
-            catgirl_names = list(character_data.get('猫娘', {}).keys())
+            catgirl_names = _config_manager.get_catgirl_names()
             if lanlan_name not in catgirl_names:
                 logger.info(f"[MemoryServer] 角色 '{lanlan_name}' 不在配置中，但继续处理（可能是新创建的角色）")
         except Exception as e:
@@ -147,18 +128,10 @@ async def process_conversation(request: HistoryRequest, lanlan_name: str):
         # await semantic_manager.store_conversation(uid, input_history, lanlan_name)
         await time_manager.store_conversation(uid, input_history, lanlan_name)
         
-        # 在后台启动review_history任务
-        if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
-            # 如果已有任务在运行，取消它
-            correction_tasks[lanlan_name].cancel()
-            try:
-                await correction_tasks[lanlan_name]
-            except asyncio.CancelledError:
-                pass
-        
-        # 启动新的review任务
-        task = asyncio.create_task(_run_review_in_background(lanlan_name))
-        correction_tasks[lanlan_name] = task
+        # 提前渲染下次会话开始时的上下文
+        dialog_context_cache.prefetch(lanlan_name)
+        # 安排后台记忆整理：对话进行中按防抖窗口合并，不再每轮取消重启
+        review_scheduler.notify(lanlan_name)
         
         return {"status": "processed"}
     except Exception as e:
@@ -167,12 +140,10 @@ async def process_conversation(request: HistoryRequest, lanlan_name: str):
 
 @app.post("/renew/{lanlan_name}")
 async def process_conversation_for_renew(request: HistoryRequest, lanlan_name: str):
-    global correction_tasks
     try:
         # 检查角色是否存在于配置中，如果不存在则记录信息但继续处理（允许新角色）
         try:
-            character_data = _config_manager.load_characters()
-            catgirl_names = list(character_data.get('猫娘', {}).keys())
+            catgirl_names = _config_manager.get_catgirl_names()
             if lanlan_name not in catgirl_names:
                 logger.info(f"[MemoryServer] renew: 角色 '{lanlan_name}' 不在配置中，但继续处理（可能是新创建的角色）")
         except Exception as e:
@@ -186,29 +157,20 @@ async def process_conversation_for_renew(request: HistoryRequest, lanlan_name: s
         # await semantic_manager.store_conversation(uid, input_history, lanlan_name)
         await time_manager.store_conversation(uid, input_history, lanlan_name)
         
-        # 在后台启动review_history任务
-        if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
-            # 如果已有任务在运行，取消它
-            correction_tasks[lanlan_name].cancel()
-            try:
-                await correction_tasks[lanlan_name]
-            except asyncio.CancelledError:
-                pass
-        
-        # 启动新的review任务
-        task = asyncio.create_task(_run_review_in_background(lanlan_name))
-        correction_tasks[lanlan_name] = task
+        # 提前渲染下次会话开始时的上下文
+        dialog_context_cache.prefetch(lanlan_name)
+        # 会话结束，短暂空闲后即可整理
+        review_scheduler.notify(lanlan_name, idle=True)
         
         return {"status": "processed"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.get("/get_recent_history/{lanlan_name}")
-def get_recent_history(lanlan_name: str):
+def get_recent_history(lanlan_name: str, request: Request):
     # 检查角色是否存在于配置中
     try:
-        character_data = _config_manager.load_characters()
-        catgirl_names = list(character_data.get('猫娘', {}).keys())
+        catgirl_names = _config_manager.get_catgirl_names()
         if lanlan_name not in catgirl_names:
             logger.warning(f"角色 '{lanlan_name}' 不在配置中，返回空历史记录")
             return "开始聊天前，没有历史记录。\n"
@@ -216,18 +178,10 @@ def get_recent_history(lanlan_name: str):
         logger.error(f"检查角色配置失败: {e}")
         return "开始聊天前，没有历史记录。\n"
     
-    history = recent_history_manager.get_recent_history(lanlan_name)
-    _, _, _, _, name_mapping, _, _, _, _, _ = _config_manager.get_character_data()
-    name_mapping['ai'] = lanlan_name
-    result = f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
-    for i in history:
-        if i.type == 'system':
-            result += i.content + "\n"
-        else:
-            texts = [j['text'] for j in i.content if j['type']=='text']
-            joined = "\n".join(texts)
-            result += f"{name_mapping[i.type]} | {joined}\n"
-    return result
+    result, etag = dialog_context_cache.recent_history(lanlan_name)
+    if dialog_context_cache.is_not_modified(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(result, headers={"ETag": etag})
 
 @app.get("/search_for_memory/{lanlan_name}/{query}")
 async def get_memory(query: str, lanlan_name:str):
@@ -237,8 +191,7 @@ async def get_memory(query: str, lanlan_name:str):
 def get_settings(lanlan_name: str):
     # 检查角色是否存在于配置中
     try:
-        character_data = _config_manager.load_characters()
-        catgirl_names = list(character_data.get('猫娘', {}).keys())
+        catgirl_names = _config_manager.get_catgirl_names()
         if lanlan_name not in catgirl_names:
             logger.warning(f"角色 '{lanlan_name}' 不在配置中，返回空设置")
             return f"{lanlan_name}记得{{}}"
@@ -265,34 +218,19 @@ async def reload_config():
 @app.post("/cancel_correction/{lanlan_name}")
 async def cancel_correction(lanlan_name: str):
     """中断指定角色的记忆整理任务（用于记忆编辑后立即生效）"""
-    global correction_tasks, correction_cancel_flags
-    
-    if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
+    if review_scheduler.cancel(lanlan_name):
+        # 任务在下一个安全点（LLM调用前后、写回前）退出，不会覆盖刚编辑的记忆
         logger.info(f"🛑 收到取消请求，中断 {lanlan_name} 的correction任务")
-        
-        if lanlan_name in correction_cancel_flags:
-            correction_cancel_flags[lanlan_name].set()
-        
-        correction_tasks[lanlan_name].cancel()
-        try:
-            await correction_tasks[lanlan_name]
-        except asyncio.CancelledError:
-            logger.info(f"✅ {lanlan_name} 的correction任务已成功中断")
-        except Exception as e:
-            logger.warning(f"⚠️ 中断 {lanlan_name} 的correction任务时出现异常: {e}")
-        
         return {"status": "cancelled"}
     
     return {"status": "no_task"}
 
 @app.get("/new_dialog/{lanlan_name}")
-async def new_dialog(lanlan_name: str):
-    global correction_tasks, correction_cancel_flags
+async def new_dialog(lanlan_name: str, request: Request):
     
     # 检查角色是否存在于配置中
     try:
-        character_data = _config_manager.load_characters()
-        catgirl_names = list(character_data.get('猫娘', {}).keys())
+        catgirl_names = _config_manager.get_catgirl_names()
         if lanlan_name not in catgirl_names:
             logger.warning(f"角色 '{lanlan_name}' 不在配置中，返回空上下文")
             return PlainTextResponse("")
@@ -300,37 +238,15 @@ async def new_dialog(lanlan_name: str):
         logger.error(f"检查角色配置失败: {e}")
         return PlainTextResponse("")
     
-    # 中断正在进行的correction任务
-    if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
+    # 中断正在进行的correction任务（在安全点退出，之后重新排期）
+    if review_scheduler.cancel(lanlan_name):
         logger.info(f"🛑 收到new_dialog请求，中断 {lanlan_name} 的correction任务")
-        
-        # 设置取消标志
-        if lanlan_name in correction_cancel_flags:
-            correction_cancel_flags[lanlan_name].set()
-        
-        # 取消任务
-        correction_tasks[lanlan_name].cancel()
-        try:
-            await correction_tasks[lanlan_name]
-        except asyncio.CancelledError:
-            logger.info(f"✅ {lanlan_name} 的correction任务已成功中断")
-        except Exception as e:
-            logger.warning(f"⚠️ 中断 {lanlan_name} 的correction任务时出现异常: {e}")
     
-    # 正则表达式：删除所有类型括号及其内容（包括[]、()、{}、<>、【】、（）等）
-    brackets_pattern = re.compile(r'(\[.*?\]|\(.*?\)|（.*?）|【.*?】|\{.*?\}|<.*?>)')
-    master_name, _, _, _, name_mapping, _, _, _, _, _ = _config_manager.get_character_data()
-    name_mapping['ai'] = lanlan_name
-    result = f"\n========以下是{lanlan_name}的内心活动========\n{lanlan_name}的脑海里经常想着自己和{master_name}的事情，她记得{json.dumps(settings_manager.get_settings(lanlan_name), ensure_ascii=False)}\n\n"
-    result += f"现在时间是{get_timestamp()}。开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
-    for i in recent_history_manager.get_recent_history(lanlan_name):
-        if type(i.content) == str:
-            cleaned_content = brackets_pattern.sub('', i.content).strip()
-            result += f"{name_mapping[i.type]} | {cleaned_content}\n"
-        else:
-            texts = [brackets_pattern.sub('', j['text']).strip() for j in i.content if j['type'] == 'text']
-            result += f"{name_mapping[i.type]} | " + "\n".join(texts) + "\n"
-    return PlainTextResponse(result)
+    # 上下文已按版本预渲染，这里只拼接当前时间
+    result, etag = dialog_context_cache.new_dialog(lanlan_name)
+    if dialog_context_cache.is_not_modified(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return PlainTextResponse(result, headers={"ETag": etag})
 
 if __name__ == "__main__":
     import threading
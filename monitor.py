@@ -7,6 +7,7 @@ import asyncio
 import json
 import os
 import logging
+from typing import Dict
 from config import MONITOR_SERVER_PORT
 from utils.config_manager import get_config_manager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
@@ -17,6 +18,8 @@ from fastapi.templating import Jinja2Templates
 from utils.frontend_utils import find_models, find_model_config_file, find_model_directory
 from utils.workshop_utils import get_default_workshop_folder
 from utils.preferences import load_user_preferences
+from utils import audio_egress, json_codec, opus_codec, sync_protocol
+from utils.ws_broadcast import BroadcastHub
 
 # Setup logger
 from utils.logger_config import setup_logging
@@ -170,12 +173,46 @@ async def get_index(request: Request, lanlan_name: str):
     })
 
 
-# 存储所有连接的客户端
-connected_clients = set()
-subtitle_clients = set()
+# 查看端按角色分组广播，字幕端不区分角色（见 utils.ws_broadcast）
+viewer_hubs: Dict[str, BroadcastHub] = {}
+subtitle_hub = BroadcastHub("SUBTITLE")
+# 各角色多路复用同步连接的序号统计（丢失/乱序）
+sync_trackers: Dict[str, sync_protocol.SequenceTracker] = {}
+# 每个角色一份 OGG 封装，所有协商了 ogg_opus 的查看端共享同一份字节
+ogg_writers: Dict[str, audio_egress.OggOpusWriter] = {}
 current_subtitle = ""
 should_clear_next = False
 
+_CLEAR_MESSAGE = json_codec.dumps({"type": "clear"})
+_HEARTBEAT_MESSAGE = json_codec.dumps({"type": "heartbeat"})
+
+
+def get_viewer_hub(lanlan_name: str) -> BroadcastHub:
+    hub = viewer_hubs.get(lanlan_name)
+    if hub is None:
+        hub = viewer_hubs[lanlan_name] = BroadcastHub(f"CLIENT:{lanlan_name}")
+    return hub
+
+
+def get_ogg_writer(lanlan_name: str) -> audio_egress.OggOpusWriter:
+    writer = ogg_writers.get(lanlan_name)
+    if writer is None:
+        writer = ogg_writers[lanlan_name] = audio_egress.OggOpusWriter()
+    return writer
+
+
+def _latest_subtitle(old: str, new: str) -> str:
+    # 字幕消息携带完整文本，落后的客户端只需要最新状态
+    return new
+
+
+def _append_text_delta(old: str, new: str) -> str:
+    # 落后的查看端把尚未发出的文本增量拼成一条
+    merged = json_codec.loads(old)
+    merged["text"] = merged.get("text", "") + json_codec.loads(new).get("text", "")
+    return json_codec.dumps(merged)
+
+
 def is_japanese(text):
     import re
     # 检测平假名、片假名、汉字
@@ -193,16 +230,16 @@ async def subtitle_websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     print(f"字幕客户端已连接: {websocket.client}")
 
-    # 添加到字幕客户端集合
-    subtitle_clients.add(websocket)
+    # 添加到字幕广播
+    channel = subtitle_hub.add(websocket)
 
     try:
         # 发送当前字幕（如果有）
         if current_subtitle:
-            await websocket.send_json({
+            channel.push_text(json_codec.dumps({
                 "type": "subtitle",
                 "text": current_subtitle
-            })
+            }))
 
         # 保持连接
         while True:
@@ -210,93 +247,82 @@ async def subtitle_websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         print(f"字幕客户端已断开: {websocket.client}")
     finally:
-        subtitle_clients.discard(websocket)
+        subtitle_hub.discard(websocket)
+
+
+def publish_subtitle(text: str):
+    subtitle_hub.publish_text(json_codec.dumps({
+        "type": "subtitle",
+        "text": text
+    }), coalesce_key="subtitle", merge=_latest_subtitle)
 
 
 # 广播字幕到所有字幕客户端
-async def broadcast_subtitle():
-    global current_subtitle, should_clear_next
+def broadcast_subtitle():
+    global should_clear_next
     if should_clear_next:
-        await clear_subtitle()
+        clear_subtitle()
         should_clear_next = False
-        # 给一个短暂的延迟让清空动画完成
-        await asyncio.sleep(0.3)
+        # 给一个短暂的延迟让清空动画完成（只暂停字幕端的发送，不阻塞同步读取）
+        subtitle_hub.publish_pause(0.3)
 
-    clients = subtitle_clients.copy()
-    for client in clients:
-        try:
-            await client.send_json({
-                "type": "subtitle",
-                "text": current_subtitle
-            })
-        except Exception as e:
-            print(f"字幕广播错误: {e}")
-            subtitle_clients.discard(client)
+    publish_subtitle(current_subtitle)
 
 
 # 清空字幕
-async def clear_subtitle():
+def clear_subtitle():
     global current_subtitle
     current_subtitle = ""
+    subtitle_hub.publish_text(_CLEAR_MESSAGE)
+
+async def handle_sync_message(hub: BroadcastHub, raw: str):
+    """处理主服务器同步过来的一条消息：更新字幕，并把原始文本转发给查看端"""
+    global current_subtitle, should_clear_next
+    # 只解析一次用于分发，转发给查看端的仍是原始文本
+    data = json_codec.loads(raw)
+    msg_type = data.get("type", "unknown")
+
+    if msg_type == "gemini_response":
+        # 发送到字幕显示
+        subtitle_text = data.get("text", "")
+        current_subtitle += subtitle_text
+        if subtitle_text:
+            broadcast_subtitle()
+
+    elif msg_type == "turn end":
+        # 处理回合结束
+        if current_subtitle:
+            # 检查是否为日文，如果是则翻译
+            if is_japanese(current_subtitle):
+                translated_text = await translate_japanese_to_chinese(current_subtitle)
+                current_subtitle = translated_text
+                publish_subtitle(translated_text)
+
+        # 清空字幕区域，准备下一条
+        should_clear_next = True
+
+    if msg_type == "gemini_response":
+        # 新消息只作为合并目标；后续增量在客户端落后时拼接到它上面
+        hub.publish_text(raw, coalesce_key="gemini_response",
+                         merge=None if data.get("isNewMessage") else _append_text_delta)
+    elif msg_type != "heartbeat":
+        hub.publish_text(raw)
 
-    clients = subtitle_clients.copy()
-    for client in clients:
-        try:
-            await client.send_json({
-                "type": "clear"
-            })
-        except Exception as e:
-            print(f"清空字幕错误: {e}")
-            subtitle_clients.discard(client)
 
 # 主服务器连接端点
 @app.websocket("/sync/{lanlan_name}")
 async def sync_endpoint(websocket: WebSocket, lanlan_name:str):
     await websocket.accept()
     print(f"✅ [SYNC] 主服务器已连接: {websocket.client}")
+    hub = get_viewer_hub(lanlan_name)
 
     try:
         while True:
             try:
-                global current_subtitle
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=25)
-
-                # 广播到所有连接的客户端
-                data = json.loads(data)
-                msg_type = data.get("type", "unknown")
-
-
-                if msg_type == "gemini_response":
-                    # 发送到字幕显示
-                    subtitle_text = data.get("text", "")
-                    current_subtitle += subtitle_text
-                    if subtitle_text:
-                        await broadcast_subtitle()
-
-                elif msg_type == "turn end":
-                    # 处理回合结束
-                    if current_subtitle:
-                        # 检查是否为日文，如果是则翻译
-                        if is_japanese(current_subtitle):
-                            translated_text = await translate_japanese_to_chinese(current_subtitle)
-                            current_subtitle = translated_text
-                            clients = subtitle_clients.copy()
-                            for client in clients:
-                                try:
-                                    await client.send_json({
-                                        "type": "subtitle",
-                                        "text": translated_text
-                                    })
-                                except Exception as e:
-                                    print(f"翻译字幕广播错误: {e}")
-                                    subtitle_clients.discard(client)
-
-                    # 清空字幕区域，准备下一条
-                    global should_clear_next
-                    should_clear_next = True
-
-                if msg_type != "heartbeat":
-                    await broadcast_message(data)
+                frame = await asyncio.wait_for(websocket.receive_text(), timeout=25)
+                # 同步连接器把同一批文本消息以换行拼成一帧（紧凑 JSON 本身不含换行）
+                for raw in frame.split("\n"):
+                    await handle_sync_message(hub, raw)
             except asyncio.exceptions.TimeoutError:
                 pass
     except WebSocketDisconnect:
@@ -310,13 +336,14 @@ async def sync_endpoint(websocket: WebSocket, lanlan_name:str):
 async def sync_binary_endpoint(websocket: WebSocket, lanlan_name:str):
     await websocket.accept()
     print(f"✅ [BINARY] 主服务器二进制连接已建立: {websocket.client}")
+    hub = get_viewer_hub(lanlan_name)
 
     try:
         while True:
             try:
                 data = await asyncio.wait_for(websocket.receive_bytes(), timeout=25)
                 if len(data)>4:
-                    await broadcast_binary(data)
+                    hub.publish_bytes(data)
             except asyncio.exceptions.TimeoutError:
                 pass
     except WebSocketDisconnect:
@@ -325,86 +352,95 @@ async def sync_binary_endpoint(websocket: WebSocket, lanlan_name:str):
         logger.error(f"❌ [BINARY] 二进制同步端点错误: {e}")
 
 
+# 多路复用同步端点：事件与语音共用一条连接，按发送顺序到达（帧格式见 utils.sync_protocol）
+@app.websocket("/sync_mux/{lanlan_name}")
+async def sync_mux_endpoint(websocket: WebSocket, lanlan_name:str):
+    await websocket.accept()
+    print(f"✅ [MUX] 主服务器多路复用连接已建立: {websocket.client}")
+    hub = get_viewer_hub(lanlan_name)
+    tracker = sync_protocol.SequenceTracker()
+    sync_trackers[lanlan_name] = tracker
+    decoder = None
+
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(websocket.receive_bytes(), timeout=25)
+            except asyncio.exceptions.TimeoutError:
+                continue
+            frame = sync_protocol.decode_frame(data)
+            tracker.observe(frame.seq)
+            if frame.frame_type == sync_protocol.FRAME_EVENTS:
+                for raw in bytes(frame.payload).decode().split("\n"):
+                    await handle_sync_message(hub, raw)
+            elif frame.frame_type == sync_protocol.FRAME_AUDIO:
+                if frame.flags & sync_protocol.FLAG_OPUS:
+                    packets = opus_codec.unpack_packets(frame.payload)
+                    codecs = hub.audio_codecs()
+                    # 每种编码只生成一次：OGG 页给协商了 ogg_opus 的查看端，解码出的 PCM16 给其余查看端
+                    if audio_egress.CODEC_OGG_OPUS in codecs:
+                        ogg = get_ogg_writer(lanlan_name).write(packets, frame.speech_id)
+                        hub.publish_bytes(ogg, audio_egress.CODEC_OGG_OPUS)
+                    if audio_egress.CODEC_PCM16 in codecs:
+                        if decoder is None:
+                            decoder = opus_codec.OpusDecoder()
+                        hub.publish_bytes(decoder.decode(packets), audio_egress.CODEC_PCM16)
+                else:
+                    # PCM16 发给所有查看端（前端按 OggS 魔数区分格式）
+                    hub.publish_bytes(bytes(frame.payload))
+    except WebSocketDisconnect:
+        print(f"❌ [MUX] 主服务器多路复用连接已断开: {websocket.client}")
+    except Exception as e:
+        logger.error(f"❌ [MUX] 多路复用同步端点错误: {e}")
+
+
 # 客户端连接端点
 @app.websocket("/ws/{lanlan_name}")
 async def websocket_endpoint(websocket: WebSocket, lanlan_name:str):
     await websocket.accept()
-    print(f"✅ [CLIENT] 查看客户端已连接: {websocket.client}, 当前总数: {len(connected_clients) + 1}")
+    hub = get_viewer_hub(lanlan_name)
+    print(f"✅ [CLIENT] 查看客户端已连接: {websocket.client}, 当前总数: {len(hub) + 1}")
 
-    # 添加到连接集合
-    connected_clients.add(websocket)
+    # 添加到广播（每个客户端独立的发送队列），声明支持的编码之前按 PCM16 下发语音
+    channel = hub.add(websocket, audio_egress.CODEC_PCM16)
 
     try:
         # 保持连接直到客户端断开
         while True:
             # 接收任何类型的消息（文本或二进制），主要用于保持连接
-            try:
-                await websocket.receive_text()
-            except:
-                # 如果收到的是二进制数据，receive_text() 会失败，尝试 receive_bytes()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("text"):
                 try:
-                    await websocket.receive_bytes()
-                except:
-                    # 如果两者都失败，等待一下再继续
-                    await asyncio.sleep(0.1)
+                    data = json.loads(message["text"])
+                except ValueError:
+                    continue
+                if isinstance(data, dict) and data.get("action") == "audio_codecs":
+                    codec = audio_egress.negotiate(data.get("codecs") or [])
+                    if codec == audio_egress.CODEC_OGG_OPUS and channel.audio_codec != codec:
+                        # 新加入的查看端需要从 BOS 页开始解码，共享流从下一段语音起开始新的逻辑流
+                        get_ogg_writer(lanlan_name).restart()
+                    channel.audio_codec = codec
+                    channel.push_text(json_codec.dumps({"type": "audio_codec", "codec": codec}))
     except WebSocketDisconnect:
         print(f"❌ [CLIENT] 查看客户端已断开: {websocket.client}")
     except Exception as e:
         print(f"❌ [CLIENT] 客户端连接异常: {e}")
     finally:
         # 安全地移除客户端（即使已经被移除也不会报错）
-        connected_clients.discard(websocket)
-        print(f"🗑️ [CLIENT] 已移除客户端，当前剩余: {len(connected_clients)}")
-
-
-# 广播消息到所有客户端
-async def broadcast_message(message):
-    clients = connected_clients.copy()
-    success_count = 0
-    fail_count = 0
-    disconnected_clients = []
-    
-    for client in clients:
-        try:
-            await client.send_json(message)
-            success_count += 1
-        except Exception as e:
-            print(f"❌ [BROADCAST] 广播错误到 {client.client}: {e}")
-            fail_count += 1
-            disconnected_clients.append(client)
-    
-    # 移除所有断开的客户端
-    for client in disconnected_clients:
-        connected_clients.discard(client)
-        print(f"🗑️ [BROADCAST] 移除断开的客户端: {client.client}")
-    
-    if success_count > 0:
-        print(f"✅ [BROADCAST] 成功广播到 {success_count} 个客户端" + (f", 失败并移除 {fail_count} 个" if fail_count > 0 else ""))
-
-
-# 广播二进制数据到所有客户端
-async def broadcast_binary(data):
-    clients = connected_clients.copy()
-    success_count = 0
-    fail_count = 0
-    disconnected_clients = []
-    
-    for client in clients:
-        try:
-            await client.send_bytes(data)
-            success_count += 1
-        except Exception as e:
-            print(f"❌ [BINARY BROADCAST] 二进制广播错误到 {client.client}: {e}")
-            fail_count += 1
-            disconnected_clients.append(client)
-    
-    # 移除所有断开的客户端
-    for client in disconnected_clients:
-        connected_clients.discard(client)
-        print(f"🗑️ [BINARY BROADCAST] 移除断开的客户端: {client.client}")
-    
-    if success_count > 0:
-        print(f"✅ [BINARY BROADCAST] 成功广播音频到 {success_count} 个客户端" + (f", 失败并移除 {fail_count} 个" if fail_count > 0 else ""))
+        hub.discard(websocket)
+        print(f"🗑️ [CLIENT] 已移除客户端，当前剩余: {len(hub)}")
+
+
+@app.get("/api/broadcast_stats")
+async def get_broadcast_stats():
+    """各广播组的客户端数、排队深度、丢弃/合并次数与发送延迟，以及各角色同步连接的丢失/乱序统计"""
+    return {
+        "subtitle": subtitle_hub.stats,
+        "viewers": {name: hub.stats for name, hub in viewer_hubs.items()},
+        "sync": {name: tracker.stats for name, tracker in sync_trackers.items()},
+    }
 
 
 # 定期清理断开的连接
@@ -416,13 +452,9 @@ async def startup_event():
 async def cleanup_disconnected_clients():
     while True:
         try:
-            # 检查并移除已断开的客户端
-            for client in list(connected_clients):
-                try:
-                    await client.send_json({"type": "heartbeat"})
-                except Exception as e:
-                    print("广播错误:", e)
-                    connected_clients.remove(client)
+            # 发送心跳，发送失败的客户端由各自的写任务移除
+            for hub in list(viewer_hubs.values()):
+                hub.publish_text(_HEARTBEAT_MESSAGE)
             await asyncio.sleep(60)  # 每分钟检查一次
         except Exception as e:
             print(f"清理客户端错误: {e}")
@@ -292,6 +292,14 @@ function init_app() {
         socket.onopen = () => {
             console.log('WebSocket连接已建立');
 
+            // 声明可解码的语音编码，服务器据此选择下行编码（OGG Opus 或 PCM16）
+            if (window["ogg-opus-decoder"]) {
+                socket.send(JSON.stringify({
+                    action: 'audio_codecs',
+                    codecs: ['ogg_opus', 'pcm16']
+                }));
+            }
+
             // 启动心跳保活机制
             if (heartbeatInterval) {
                 clearInterval(heartbeatInterval);
@@ -361,6 +369,8 @@ function init_app() {
                     }
                     
                     skipNextAudioBlob = false;  // 允许接收后续的二进制数据
+                } else if (response.type === 'audio_codec') {
+                    console.log('下行语音编码:', response.codec);
                 } else if (response.type === 'cozy_audio') {
                     // 处理音频响应
                     console.log("收到新的音频头")
@@ -2497,11 +2507,11 @@ function init_app() {
                 }
 
                 if (isRecording && socket.readyState === WebSocket.OPEN) {
-                    socket.send(JSON.stringify({
-                        action: 'stream_data',
-                        data: Array.from(audioData),
-                        input_type: 'audio'
-                    }));
+                    // 二进制帧：[0x01 麦克风音频, 保留字节] + int16 小端 PCM，后端直接按字节读取
+                    const frame = new Uint8Array(2 + audioData.byteLength);
+                    frame[0] = 0x01;
+                    frame.set(new Uint8Array(audioData.buffer, audioData.byteOffset, audioData.byteLength), 2);
+                    socket.send(frame.buffer);
                 }
             };
 
@@ -2710,6 +2720,10 @@ function init_app() {
         if (isOgg) {
             // OGG OPUS 格式，用 WASM 流式解码
             try {
+                // BOS 页（header_type 0x02）表示服务器开始了新的逻辑流，旧的解码器状态不再适用
+                if (arrayBuffer.byteLength > 5 && (new Uint8Array(arrayBuffer, 5, 1)[0] & 0x02)) {
+                    await resetOggOpusDecoder();
+                }
                 const result = await decodeOggOpusChunk(new Uint8Array(arrayBuffer));
                 if (!result) {
                     // 数据不足，等待更多
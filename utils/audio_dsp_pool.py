@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+音频 DSP 工作进程池（可选）
+
+每个 OmniRealtimeClient 持有一个 AudioProcessor，原先在默认线程池里执行 RNNoise + 重采样。
+多个角色或监控客户端同时在线时，这些数值计算与事件循环争抢 GIL，上行音频越多主循环越卡。
+
+启用 AUDIO_DSP_WORKERS 后：
+- 音频处理放到独立的工作进程，每个会话的 AudioProcessor（RNNoise/AGC/重采样状态）只存在于工作进程中
+- 音频数据经 multiprocessing.shared_memory 中的单生产者/单消费者环形缓冲区传递，
+  管道里只传递很小的控制消息（会话号、序号、样本数）
+- 主进程用一个后台线程接收工作进程的回复，再通过 call_soon_threadsafe 唤醒等待的协程，
+  事件循环只做内存拷贝，不做任何数值计算
+AUDIO_DSP_WORKERS 为 0（默认）或工作进程异常时，使用进程内的 AudioProcessor。
+"""
+import asyncio
+import atexit
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 每个方向的环形缓冲区容量（样本数，48kHz 下 1 秒）
+RING_CAPACITY = 48000
+# 环形缓冲区头部：写入位置、读取位置（单调递增的样本计数）
+_RING_HEADER_BYTES = 16
+# 等待工作进程处理一个音频块的超时（秒）
+DSP_REQUEST_TIMEOUT = 2.0
+# 会话的第一个音频块需要等待工作进程启动并创建 AudioProcessor（秒）
+DSP_OPEN_TIMEOUT = 20.0
+# 允许通过控制消息调用的 AudioProcessor 方法
+_REMOTE_METHODS = frozenset({
+    'reset', 'request_reset', 'set_enabled', 'set_agc_enabled', 'set_limiter_enabled',
+})
+
+_pool_stats: Dict[str, Any] = {
+    'workers': 0, 'sessions': 0, 'chunks': 0, 'failures': 0,
+    'last_roundtrip_ms': None, 'max_roundtrip_ms': 0.0,
+}
+
+
+def get_dsp_pool_stats() -> Dict[str, Any]:
+    """返回工作进程池的会话数、处理块数与往返耗时统计"""
+    return dict(_pool_stats)
+
+
+class DSPWorkerError(RuntimeError):
+    """工作进程不可用或处理超时"""
+
+
+class SharedPCMRing:
+    """
+    共享内存中的 int16 单生产者/单消费者环形缓冲区
+
+    生产者只修改写入位置，消费者只修改读取位置；数据写完后才更新写入位置，
+    再经管道通知对方，因此不需要跨进程锁。
+    """
+
+    def __init__(self, buf, offset: int, capacity: int):
+        self.capacity = capacity
+        self._pos = np.ndarray((2,), dtype=np.int64, buffer=buf, offset=offset)
+        self._data = np.ndarray((capacity,), dtype=np.int16, buffer=buf,
+                                offset=offset + _RING_HEADER_BYTES)
+
+    @staticmethod
+    def nbytes(capacity: int) -> int:
+        return _RING_HEADER_BYTES + capacity * 2
+
+    def reset(self):
+        self._pos[:] = 0
+
+    def __len__(self) -> int:
+        return int(self._pos[0] - self._pos[1])
+
+    def write(self, samples: np.ndarray) -> int:
+        """写入样本，空间不足时只写入能容纳的部分，返回写入的样本数"""
+        write_pos, read_pos = int(self._pos[0]), int(self._pos[1])
+        n = min(len(samples), self.capacity - (write_pos - read_pos))
+        if n <= 0:
+            return 0
+        start = write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        if first < n:
+            self._data[:n - first] = samples[first:n]
+        self._pos[0] = write_pos + n
+        return n
+
+    def read_into(self, out: np.ndarray, n: Optional[int] = None) -> int:
+        """读出最多 n 个样本到 out，返回读出的样本数"""
+        write_pos, read_pos = int(self._pos[0]), int(self._pos[1])
+        n = min(write_pos - read_pos, len(out) if n is None else n)
+        if n <= 0:
+            return 0
+        start = read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._data[start:start + first]
+        if first < n:
+            out[first:n] = self._data[:n - first]
+        self._pos[1] = read_pos + n
+        return n
+
+    def read_bytes(self, n: int) -> bytes:
+        out = np.empty(min(n, len(self)), dtype=np.int16)
+        self.read_into(out)
+        return out.tobytes()
+
+
+def _session_rings(buf) -> Tuple[SharedPCMRing, SharedPCMRing]:
+    """一个会话的共享内存布局：上行（48kHz 原始）环 + 下行（处理后）环"""
+    size = SharedPCMRing.nbytes(RING_CAPACITY)
+    return SharedPCMRing(buf, 0, RING_CAPACITY), SharedPCMRing(buf, size, RING_CAPACITY)
+
+
+def _dsp_worker_main(cmd_conn, res_conn) -> None:
+    """工作进程入口：按控制消息处理各会话的音频"""
+    from utils.audio_processor import AudioProcessor
+
+    sessions: Dict[int, Dict[str, Any]] = {}
+    scratch = np.empty(RING_CAPACITY, dtype=np.int16)
+
+    def silence_flag(state):
+        def _on_silence_reset():
+            state['silence_reset'] = True
+        return _on_silence_reset
+
+    while True:
+        try:
+            msg = cmd_conn.recv()
+        except (EOFError, OSError):
+            break
+        op, sid = msg[0], msg[1]
+        try:
+            if op == 'open':
+                shm_name, options = msg[2], msg[3]
+                state = {'silence_reset': False}
+                # 共享内存由主进程创建并负责 unlink（spawn 的子进程与主进程共用 resource_tracker）
+                shm = shared_memory.SharedMemory(name=shm_name)
+                in_ring, out_ring = _session_rings(shm.buf)
+                state.update(shm=shm, in_ring=in_ring, out_ring=out_ring,
+                             processor=AudioProcessor(on_silence_reset=silence_flag(state), **options))
+                sessions[sid] = state
+                res_conn.send(('opened', sid, None))
+            elif op == 'process':
+                seq = msg[2]
+                state = sessions[sid]
+                n = state['in_ring'].read_into(scratch)
+                processed = state['processor'].process_chunk(scratch[:n].tobytes()) if n else b''
+                written = state['out_ring'].write(np.frombuffer(processed, dtype=np.int16))
+                silence_reset, state['silence_reset'] = state['silence_reset'], False
+                processor = state['processor']
+                res_conn.send(('done', sid, (seq, written, processor.speech_probability,
+                                             processor.vad_available, silence_reset)))
+            elif op == 'call':
+                method, args = msg[2], msg[3]
+                if method in _REMOTE_METHODS and sid in sessions:
+                    getattr(sessions[sid]['processor'], method)(*args)
+            elif op == 'close':
+                state = sessions.pop(sid, None)
+                if state is not None:
+                    state['processor'] = state['in_ring'] = state['out_ring'] = None
+                    state['shm'].close()
+            elif op == 'stop':
+                break
+        except Exception as e:
+            res_conn.send(('error', sid, repr(e)))
+    for state in sessions.values():
+        try:
+            state['shm'].close()
+        except Exception:
+            pass
+
+
+class _DSPWorker:
+    """主进程侧的单个工作进程句柄"""
+
+    def __init__(self, ctx, index: int):
+        self.index = index
+        cmd_recv, self._cmd_send = ctx.Pipe(duplex=False)
+        self._res_recv, res_send = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=_dsp_worker_main, args=(cmd_recv, res_send),
+                                   name=f"AudioDSP-{index}", daemon=True)
+        self.process.start()
+        # 子进程持有这两端，主进程关闭副本后才能在子进程退出时收到 EOF
+        cmd_recv.close()
+        res_send.close()
+        self._send_lock = threading.Lock()
+        self.sessions: Dict[int, 'RemoteAudioProcessor'] = {}
+        self.alive = True
+        self._stopping = False
+        self._reader = threading.Thread(target=self._read_results, name=f"AudioDSP-{index}-reader", daemon=True)
+        self._reader.start()
+
+    def send(self, msg: tuple):
+        if not self.alive:
+            raise DSPWorkerError(f"DSP worker {self.index} is not running")
+        with self._send_lock:
+            self._cmd_send.send(msg)
+
+    def _read_results(self):
+        while True:
+            try:
+                kind, sid, payload = self._res_recv.recv()
+            except (EOFError, OSError):
+                break
+            session = self.sessions.get(sid)
+            if session is not None:
+                session._on_result(kind, payload)
+        self.alive = False
+        if not self._stopping:
+            logger.error(f"❌ 音频DSP工作进程 {self.index} 意外退出")
+        for session in list(self.sessions.values()):
+            session._on_result('error', 'worker exited')
+
+    def stop(self, timeout: float = 2.0):
+        self._stopping = True
+        try:
+            self.send(('stop', 0))
+        except Exception:
+            pass
+        self.process.join(timeout=timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=timeout)
+        self.alive = False
+        for conn in (self._cmd_send, self._res_recv):
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class RemoteAudioProcessor:
+    """
+    运行在工作进程中的 AudioProcessor 的代理
+
+    接口与 OmniRealtimeClient 使用的 AudioProcessor 子集一致，
+    process_chunk_async 代替在线程池里调用 process_chunk。同一会话的调用需顺序执行。
+    """
+
+    def __init__(self, worker: _DSPWorker, sid: int, on_silence_reset: Optional[Callable] = None, **options):
+        self._worker = worker
+        self._sid = sid
+        self.on_silence_reset = on_silence_reset
+        self._speech_prob = 0.0
+        self._vad_available = False
+        self._seq = itertools.count()
+        self._pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._closed = False
+        self._opened = False
+        self._shm = shared_memory.SharedMemory(create=True, size=2 * SharedPCMRing.nbytes(RING_CAPACITY))
+        self._in_ring, self._out_ring = _session_rings(self._shm.buf)
+        self._in_ring.reset()
+        self._out_ring.reset()
+        worker.sessions[sid] = self
+        worker.send(('open', sid, self._shm.name, options))
+
+    @property
+    def speech_probability(self) -> float:
+        return self._speech_prob
+
+    @property
+    def vad_available(self) -> bool:
+        return self._vad_available
+
+    def _on_result(self, kind: str, payload):
+        """在结果读取线程中调用：把结果交给等待中的协程"""
+        if kind == 'opened':
+            self._opened = True
+            return
+        if kind == 'done':
+            entry = self._pending.pop(payload[0], None)
+            targets = [entry] if entry else []
+        elif kind == 'error':
+            targets = list(self._pending.values())
+            self._pending.clear()
+            payload = DSPWorkerError(payload)
+        else:
+            return
+        for loop, fut in targets:
+            try:
+                loop.call_soon_threadsafe(self._resolve, fut, payload)
+            except RuntimeError:
+                pass
+
+    @staticmethod
+    def _resolve(fut: asyncio.Future, payload):
+        if fut.done():
+            return
+        if isinstance(payload, Exception):
+            fut.set_exception(payload)
+        else:
+            fut.set_result(payload)
+
+    async def process_chunk_async(self, audio_bytes: bytes) -> bytes:
+        """把一个 PCM16 块交给工作进程处理，返回处理后的 PCM16 字节（可能为空）"""
+        if self._closed:
+            raise DSPWorkerError("session closed")
+        samples = np.frombuffer(audio_bytes, dtype=np.int16)
+        if self._in_ring.write(samples) < len(samples):
+            logger.warning("⚠️ DSP上行环形缓冲区已满，丢弃部分音频")
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        seq = next(self._seq)
+        self._pending[seq] = (loop, fut)
+        start = time.perf_counter()
+        try:
+            self._worker.send(('process', self._sid, seq))
+            _, written, speech_prob, vad_available, silence_reset = await asyncio.wait_for(
+                fut, timeout=DSP_REQUEST_TIMEOUT if self._opened else DSP_OPEN_TIMEOUT)
+        except Exception as e:
+            self._pending.pop(seq, None)
+            _pool_stats['failures'] += 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise DSPWorkerError("DSP worker timed out") from e
+            raise
+        roundtrip_ms = round((time.perf_counter() - start) * 1000, 2)
+        _pool_stats['chunks'] += 1
+        _pool_stats['last_roundtrip_ms'] = roundtrip_ms
+        _pool_stats['max_roundtrip_ms'] = max(_pool_stats['max_roundtrip_ms'], roundtrip_ms)
+        self._speech_prob = speech_prob
+        self._vad_available = vad_available
+        if silence_reset and self.on_silence_reset:
+            try:
+                self.on_silence_reset()
+            except Exception as e:
+                logger.error(f"❌ on_silence_reset callback error: {e}")
+        return self._out_ring.read_bytes(written)
+
+    def _call(self, method: str, *args):
+        try:
+            self._worker.send(('call', self._sid, method, args))
+        except Exception as e:
+            logger.warning(f"⚠️ DSP工作进程调用 {method} 失败: {e}")
+
+    def reset(self) -> None:
+        self._call('reset')
+
+    def request_reset(self) -> None:
+        self._call('request_reset')
+
+    def set_enabled(self, enabled: bool) -> None:
+        self._call('set_enabled', enabled)
+
+    def set_agc_enabled(self, enabled: bool) -> None:
+        self._call('set_agc_enabled', enabled)
+
+    def set_limiter_enabled(self, enabled: bool) -> None:
+        self._call('set_limiter_enabled', enabled)
+
+    def save_debug_audio(self) -> None:
+        """debug 音频录制只在进程内模式下可用"""
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._worker.sessions.pop(self._sid, None)
+        try:
+            self._worker.send(('close', self._sid))
+        except Exception:
+            pass
+        self._in_ring = self._out_ring = None
+        try:
+            self._shm.close()
+            self._shm.unlink()
+        except Exception:
+            pass
+        _pool_stats['sessions'] = max(0, _pool_stats['sessions'] - 1)
+
+
+class DSPWorkerPool:
+    """固定数量的音频DSP工作进程，会话按当前负载分配"""
+
+    def __init__(self, num_workers: int):
+        # 始终使用 spawn：主进程里有事件循环和多个线程，fork 不安全；Windows 也只支持 spawn
+        ctx = multiprocessing.get_context('spawn')
+        self._workers = [_DSPWorker(ctx, i) for i in range(num_workers)]
+        self._sid_counter = itertools.count(1)
+        self._lock = threading.Lock()
+        _pool_stats['workers'] = num_workers
+        logger.info(f"🎛️ 音频DSP工作进程池已启动：{num_workers} 个进程")
+
+    def open_session(self, on_silence_reset: Optional[Callable] = None, **options) -> RemoteAudioProcessor:
+        """在负载最低的存活工作进程中创建一个会话，options 传给 AudioProcessor"""
+        with self._lock:
+            alive = [w for w in self._workers if w.alive]
+            if not alive:
+                raise DSPWorkerError("no DSP worker available")
+            worker = min(alive, key=lambda w: len(w.sessions))
+            session = RemoteAudioProcessor(worker, next(self._sid_counter),
+                                           on_silence_reset=on_silence_reset, **options)
+        _pool_stats['sessions'] += 1
+        return session
+
+    def shutdown(self):
+        for worker in self._workers:
+            for session in list(worker.sessions.values()):
+                session.close()
+            worker.stop()
+        self._workers = []
+        _pool_stats['workers'] = 0
+
+
+_pool: Optional[DSPWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_dsp_pool() -> Optional[DSPWorkerPool]:
+    """按 AUDIO_DSP_WORKERS 懒启动进程池；未启用或启动失败时返回 None（使用进程内处理）"""
+    global _pool
+    from config import AUDIO_DSP_WORKERS
+    if AUDIO_DSP_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = DSPWorkerPool(AUDIO_DSP_WORKERS)
+                atexit.register(shutdown_dsp_pool)
+            except Exception as e:
+                logger.error(f"❌ 音频DSP工作进程池启动失败，使用进程内处理: {e}")
+                return None
+        return _pool
+
+
+def shutdown_dsp_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
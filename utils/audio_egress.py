@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+语音下行编码（TTS 输出 -> 浏览器）
+
+send_speech 原先把 48kHz PCM16（约 768kbps）原样发给前端，再复制一份进 sync_message_queue
+由监控服务器扇出，查看端在远程时带宽几乎都花在这里。这里提供可选的 OGG Opus 下行：
+
+- 按连接协商：客户端连上后发送 {"action": "audio_codecs", "codecs": ["ogg_opus", "pcm16"]}，
+  negotiate() 结合 AUDIO_EGRESS_CODEC 决定该连接的编码；未声明、未开启或 PyAV 不可用时为 pcm16
+- OggOpusWriter：把 Opus 包封装成 OGG 页。每个 speech_id 一条新的逻辑流，首页为带 OpusHead 的 BOS 页，
+  前端（static/app.js、templates/viewer.html）看到 BOS 页即重置 WASM 解码器
+- EgressEncoder：每个角色一个，每段音频只编码一次。得到的 Opus 包既封装后发给主终端，也随同步消息
+  交给监控服务器（中继不再重复编码），监控服务器为所有协商了 ogg_opus 的查看端只封装一次、共享同一份字节
+- EgressEncoder.stats：输入 PCM 与输出 OGG 的字节率、编码 CPU（编码所在线程的 thread_time）
+
+运行 `python -m utils.audio_egress` 比较不同码率下的字节率与编码 CPU。
+"""
+import logging
+import os
+import struct
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from config import AUDIO_EGRESS_CODEC, AUDIO_EGRESS_OPUS_BITRATE
+from utils import opus_codec
+
+logger = logging.getLogger(__name__)
+
+CODEC_PCM16 = 'pcm16'
+CODEC_OGG_OPUS = 'ogg_opus'
+
+# libopus 在 48kHz 下的编码延迟（样本数），编码器没有给出 OpusHead 时使用
+OPUS_PRE_SKIP = 312
+_VENDOR = b'Xiao8'
+
+_PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+_HEADER_BOS = 0x02
+
+
+def _crc_table() -> Tuple[int, ...]:
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ((r << 1) ^ 0x04C11DB7) if r & 0x80000000 else (r << 1)
+        table.append(r & 0xFFFFFFFF)
+    return tuple(table)
+
+
+_CRC_TABLE = _crc_table()
+
+
+def _ogg_crc(data: bytes) -> int:
+    # OGG 使用不反射的 CRC-32（多项式 0x04C11DB7），与 zlib.crc32 不同
+    crc = 0
+    table = _CRC_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ b]
+    return crc
+
+
+def opus_head(pre_skip: int = OPUS_PRE_SKIP) -> bytes:
+    return struct.pack('<8sBBHIhB', b'OpusHead', 1, 1, pre_skip, opus_codec.OPUS_SAMPLE_RATE, 0, 0)
+
+
+def negotiate(codecs: Iterable[str]) -> str:
+    """根据客户端声明支持的编码选择下行编码"""
+    if AUDIO_EGRESS_CODEC == CODEC_OGG_OPUS and opus_codec.OPUS_AVAILABLE and CODEC_OGG_OPUS in set(codecs or ()):
+        return CODEC_OGG_OPUS
+    return CODEC_PCM16
+
+
+def is_ogg_bos(data: bytes) -> bool:
+    return len(data) > 5 and data[:4] == b'OggS' and bool(data[5] & _HEADER_BOS)
+
+
+class OggOpusWriter:
+    """
+    单声道 Opus 包 -> OGG 页
+
+    write(packets, stream_key) 在 stream_key 变化（或调用过 restart）时开始一条新的逻辑流，
+    返回的字节以 OpusHead / OpusTags 两页开头；之后每次调用输出一页（包太多时拆成多页）。
+    """
+
+    def __init__(self, head: Optional[bytes] = None):
+        self.head = head or opus_head()
+        self.stream_key = None
+        self._started = False
+        self._serial = 0
+        self._page_seq = 0
+        self._granule = 0
+
+    def restart(self):
+        """下一次 write 开始新的逻辑流（例如有新的查看端加入，需要重新看到 OpusHead）"""
+        self._started = False
+
+    def _page(self, packets: List[bytes], header_type: int = 0) -> bytes:
+        lacing = bytearray()
+        for packet in packets:
+            lacing.extend(b'\xff' * (len(packet) // 255))
+            lacing.append(len(packet) % 255)
+        header = _PAGE_HEADER.pack(b'OggS', 0, header_type, self._granule, self._serial,
+                                   self._page_seq, 0, len(lacing))
+        page = bytearray(header + lacing + b''.join(packets))
+        struct.pack_into('<I', page, 22, _ogg_crc(page))
+        self._page_seq += 1
+        return bytes(page)
+
+    def _start(self) -> bytes:
+        self._serial = int.from_bytes(os.urandom(4), 'little')
+        self._page_seq = 0
+        self._granule = 0
+        self._started = True
+        tags = b'OpusTags' + struct.pack('<I', len(_VENDOR)) + _VENDOR + struct.pack('<I', 0)
+        return self._page([self.head], _HEADER_BOS) + self._page([tags])
+
+    def write(self, packets: List[bytes], stream_key=None) -> bytes:
+        out = []
+        if not self._started or stream_key != self.stream_key:
+            self.stream_key = stream_key
+            out.append(self._start())
+        page_packets = []
+        segments = 0
+        for packet in packets:
+            n = len(packet) // 255 + 1
+            if page_packets and segments + n > 255:
+                out.append(self._page(page_packets))
+                page_packets, segments = [], 0
+            page_packets.append(packet)
+            segments += n
+            self._granule += opus_codec.OPUS_FRAME_SAMPLES
+        if page_packets:
+            out.append(self._page(page_packets))
+        return b''.join(out)
+
+
+class EgressChunk(NamedTuple):
+    packets: List[bytes]
+    ogg: bytes
+
+
+class EgressEncoder:
+    """一个角色的共享下行编码流：每段 48kHz PCM16 只编码一次"""
+
+    def __init__(self, bitrate: int = AUDIO_EGRESS_OPUS_BITRATE):
+        self.bitrate = bitrate
+        self._encoder: Optional[opus_codec.OpusEncoder] = None
+        self._writer: Optional[OggOpusWriter] = None
+        self._speech_id = None
+        self.created_at = time.monotonic()
+        self.chunks = 0
+        self.streams = 0
+        self.pcm_bytes = 0
+        self.ogg_bytes = 0
+        self.encode_cpu = 0.0
+
+    def reset(self):
+        """新轮次（被打断）时调用，下一段音频开始新的编码器与 OGG 逻辑流"""
+        self._encoder = None
+
+    def encode(self, pcm: bytes, speech_id: Optional[str]) -> EgressChunk:
+        started = time.thread_time()
+        if self._encoder is None or speech_id != self._speech_id:
+            # 每条逻辑流使用新的编码器，使 OpusHead 中的 pre-skip 与流的开头对应
+            self._encoder = opus_codec.OpusEncoder(self.bitrate)
+            self._writer = OggOpusWriter(self._encoder.header or None)
+            self._speech_id = speech_id
+            self.streams += 1
+        packets = self._encoder.encode(pcm)
+        ogg = self._writer.write(packets, speech_id)
+        self.encode_cpu += time.thread_time() - started
+        self.chunks += 1
+        self.pcm_bytes += len(pcm)
+        self.ogg_bytes += len(ogg)
+        return EgressChunk(packets, ogg)
+
+    @property
+    def stats(self) -> Dict:
+        audio_seconds = self.pcm_bytes / 2 / opus_codec.OPUS_SAMPLE_RATE
+        return {
+            'bitrate': self.bitrate,
+            'chunks': self.chunks,
+            'streams': self.streams,
+            'audio_seconds': round(audio_seconds, 2),
+            'pcm_bytes_per_second': round(self.pcm_bytes / audio_seconds) if audio_seconds else 0,
+            'ogg_bytes_per_second': round(self.ogg_bytes / audio_seconds) if audio_seconds else 0,
+            'compression_ratio': round(self.pcm_bytes / self.ogg_bytes, 1) if self.ogg_bytes else 0.0,
+            'encode_cpu_ms': round(self.encode_cpu * 1000, 1),
+            # 编码 CPU 占音频时长的比例（1.0 即单核实时）
+            'encode_cpu_ratio': round(self.encode_cpu / audio_seconds, 4) if audio_seconds else 0.0,
+        }
+
+
+def _run_benchmark(seconds: float = 60.0, chunk_ms: int = 100, viewers: int = 10) -> None:
+    """
+    用合成语音（带基频起伏与音节包络的谐波 + 噪声）按 chunk_ms 分段、每 3 秒一个 speech_id 编码，
+    报告各码率下发往每个客户端的字节率与编码 CPU；并用 PyAV 的 OGG 解复用器回读，确认流可以正常解码。
+    最后比较 viewers 个查看端各自编码与共享一份编码流的 CPU。
+    """
+    import io
+    import uuid
+
+    if not opus_codec.OPUS_AVAILABLE:
+        print("PyAV/libopus 不可用，跳过")
+        return
+
+    import av
+    import numpy as np
+
+    sr = opus_codec.OPUS_SAMPLE_RATE
+    t = np.arange(int(seconds * sr)) / sr
+    f0 = 180 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 3.5 * t), 0, None) ** 0.5
+    rng = np.random.default_rng(0)
+    pcm = ((voiced * envelope * 0.35 + rng.normal(0, 0.01, len(t))) * 32767).clip(-32768, 32767).astype(np.int16)
+    chunk_samples = sr * chunk_ms // 1000
+    chunks = [pcm[i:i + chunk_samples].tobytes() for i in range(0, len(pcm), chunk_samples)]
+    per_stream = max(1, 3000 // chunk_ms)
+    speech_ids = [str(uuid.uuid4()) for _ in range(len(chunks) // per_stream + 1)]
+
+    print(f"{seconds:.0f} s of 48kHz mono speech, {chunk_ms} ms chunks, new speech_id every 3 s")
+    print(f"  {'pcm16':<14} {len(pcm) * 2 / seconds / 1000:8.1f} KB/s  {len(pcm) * 16 / seconds / 1000:6.0f} kbps")
+    for bitrate in (24000, 32000, 48000, 64000):
+        encoder = EgressEncoder(bitrate)
+        out = io.BytesIO()
+        for i, chunk in enumerate(chunks):
+            out.write(encoder.encode(chunk, speech_ids[i // per_stream]).ogg)
+        stats = encoder.stats
+        # 回读第一条逻辑流验证封装（PyAV 只读链式 OGG 的第一条流）
+        first = out.getvalue()
+        second_bos = first.find(b'OggS\x00\x02', 1)
+        decoded = 0
+        with av.open(io.BytesIO(first[:second_bos] if second_bos > 0 else first), format='ogg') as container:
+            for frame in container.decode(audio=0):
+                decoded += frame.samples
+        print(f"  ogg_opus {bitrate // 1000:>2}k   {stats['ogg_bytes_per_second'] / 1000:8.1f} KB/s  "
+              f"{stats['ogg_bytes_per_second'] * 8 / 1000:6.0f} kbps  x{stats['compression_ratio']:<5} "
+              f"encode CPU {stats['encode_cpu_ms']:7.1f} ms ({stats['encode_cpu_ratio'] * 100:.2f}% of realtime)  "
+              f"first stream decodes to {decoded / sr:.2f} s")
+
+    started = time.thread_time()
+    for _ in range(viewers):
+        encoder = EgressEncoder()
+        for i, chunk in enumerate(chunks):
+            encoder.encode(chunk, speech_ids[i // per_stream])
+    per_viewer = time.thread_time() - started
+    started = time.thread_time()
+    encoder = EgressEncoder()
+    for i, chunk in enumerate(chunks):
+        encoder.encode(chunk, speech_ids[i // per_stream])
+    shared = time.thread_time() - started
+    print(f"  {viewers} viewers: per-viewer encoding {per_viewer * 1000:.0f} ms CPU, shared stream {shared * 1000:.0f} ms CPU")
+
+
+if __name__ == "__main__":
+    _run_benchmark()
@@ -8,6 +8,14 @@ RNNoise 是 Mozilla 开发的实时降噪算法，使用 GRU 神经网络，
 
 处理链：RNNoise -> AGC -> Limiter -> 降采样
 
+帧引擎：输入样本先进预分配的环形缓冲区，每次调用把所有完整的 10ms 帧一次性送入 RNNoise；
+AGC / Limiter 在预分配的 float32 工作区上原地计算，降采样使用持久的 soxr.ResampleStream，
+稳态下每帧只有 resampler 输出和返回的 bytes 两次分配。
+运行 `python -m utils.audio_processor` 输出每帧耗时与临时内存的基准。
+
+仅分析模式（noise_reduce_enabled=False, vad_enabled=True）：帧仍送入 RNNoise 以得到
+speech_probability（供上行门限 utils.vad_gate 使用），但输出的是未降噪的原始音频。
+
 AGC（Automatic Gain Control）：自动增益控制，使音量稳定
 Limiter：限幅器，防止音频削波
 
@@ -23,6 +31,8 @@ import time
 import os
 import wave
 
+from utils.audio_ring import Int16RingBuffer
+
 logger = logging.getLogger(__name__)
 
 # ============== DEBUG 音频存储功能 ==============
@@ -71,8 +81,9 @@ class AudioProcessor:
     
     Thread Safety:
         This class is NOT safe for concurrent use. The following mutable
-        state is unprotected: _frame_buffer, _last_speech_prob,
-        _last_speech_time, _needs_reset, _denoiser.
+        state is unprotected: _frame_ring, the preallocated work buffers,
+        _resampler, _last_speech_prob, _last_speech_time, _needs_reset,
+        _denoiser.
         
         Callers must NOT invoke process_chunk() or reset() from multiple
         threads or coroutines simultaneously. If concurrent access is
@@ -84,6 +95,9 @@ class AudioProcessor:
     RNNOISE_FRAME_SIZE = 480     # 10ms at 48kHz
     API_SAMPLE_RATE = 16000      # API expects 16kHz
     
+    # Frame ring capacity: older samples are dropped beyond this
+    MAX_BUFFER_SECONDS = 1.0
+    
     # Reset denoiser if no speech detected for this many seconds
     RESET_TIMEOUT_SECONDS = 4.0
     
@@ -104,6 +118,7 @@ class AudioProcessor:
         input_sample_rate: int = 48000,
         output_sample_rate: int = 16000,
         noise_reduce_enabled: bool = True,
+        vad_enabled: bool = False,
         agc_enabled: bool = True,
         limiter_enabled: bool = True,
         on_silence_reset: Optional[callable] = None
@@ -111,6 +126,8 @@ class AudioProcessor:
         self.input_sample_rate = input_sample_rate
         self.output_sample_rate = output_sample_rate
         self.noise_reduce_enabled = noise_reduce_enabled
+        # 降噪关闭时仍运行 RNNoise 计算语音概率（输出原始音频）
+        self.vad_enabled = vad_enabled
         self.agc_enabled = agc_enabled
         self.limiter_enabled = limiter_enabled
         # 静音重置回调：当检测到4秒静音并重置状态时调用
@@ -120,8 +137,20 @@ class AudioProcessor:
         self._denoiser = None
         self._init_denoiser()
         
-        # Buffer for incomplete frames (int16 for pyrnnoise)
-        self._frame_buffer = np.array([], dtype=np.int16)
+        # Ring buffer for incomplete frames (int16 for pyrnnoise)
+        self._frame_ring = Int16RingBuffer(int(self.MAX_BUFFER_SECONDS * self.RNNOISE_SAMPLE_RATE))
+        
+        # Preallocated work buffers, grown on demand by _ensure_capacity()
+        self._capacity = 0
+        self._ensure_capacity(self._frame_ring.capacity)
+        
+        # Persistent streaming resampler (keeps filter state across chunks)
+        self._resampler = None
+        if self.input_sample_rate != self.output_sample_rate:
+            self._resampler = soxr.ResampleStream(
+                self.input_sample_rate, self.output_sample_rate, 1,
+                dtype='float32', quality='HQ'
+            )
         
         # Track voice activity for auto-reset
         self._last_speech_prob = 0.0
@@ -142,11 +171,26 @@ class AudioProcessor:
         
         logger.info(f"🎤 AudioProcessor initialized: input={input_sample_rate}Hz, "
                    f"output={output_sample_rate}Hz, rnnoise={self._denoiser is not None}, "
+                   f"denoise={noise_reduce_enabled}, vad={vad_enabled}, "
                    f"agc={agc_enabled}, limiter={limiter_enabled}")
     
+    def _ensure_capacity(self, n: int) -> None:
+        """Make sure the preallocated work buffers can hold n samples."""
+        if n <= self._capacity:
+            return
+        self._capacity = n
+        self._denoised = np.zeros(n, dtype=np.int16)
+        self._work = np.zeros(n, dtype=np.float32)
+        self._abs = np.zeros(n, dtype=np.float32)
+        self._out_float = np.zeros(n, dtype=np.float32)
+        self._out_int16 = np.zeros(n, dtype=np.int16)
+        max_frames = n // self.RNNOISE_FRAME_SIZE + 1
+        self._frame_energy = np.zeros(max_frames, dtype=np.float32)
+        self._frame_gain = np.zeros(max_frames, dtype=np.float32)
+    
     def _init_denoiser(self) -> None:
         """Initialize RNNoise denoiser if available."""
-        if not self.noise_reduce_enabled:
+        if not (self.noise_reduce_enabled or self.vad_enabled):
             return
         
         # RNNoise requires input at exactly 48kHz
@@ -187,16 +231,17 @@ class AudioProcessor:
                 self._reset_internal_state()
                 self._last_speech_time = current_time  # Prevent infinite reset loop
                 logger.debug("🔄 RNNoise state auto-reset after silence")
-                # 调用静音重置回调（仅在静音触发时，非手动请求时）
-                if silence_triggered and self.on_silence_reset:
+                # 调用静音重置回调（仅在静音触发时，非手动请求时；仅分析模式下上行的是原始音频，不触发）
+                if silence_triggered and self.on_silence_reset and self.noise_reduce_enabled:
                     try:
                         self.on_silence_reset()
                     except Exception as e:
                         logger.error(f"❌ on_silence_reset callback error: {e}")
             self._needs_reset = False
         
-        # Apply RNNoise if available (processes int16, returns int16)
-        if self._denoiser is not None and self.noise_reduce_enabled:
+        # Apply RNNoise if available (processes int16, returns int16;
+        # in analysis-only mode returns the original frames)
+        if self.vad_available:
             # DEBUG: 记录 RNNoise 处理前的音频
             if DEBUG_SAVE_AUDIO:
                 self._debug_audio_before.append(audio_int16.copy())
@@ -211,75 +256,91 @@ class AudioProcessor:
             
             audio_int16 = processed
         
+        n = len(audio_int16)
+        if n == 0:
+            return b''
+        self._ensure_capacity(n)
+        
+        # int16 -> float32 into the work buffer (no temporaries)
+        work = self._work[:n]
+        np.multiply(audio_int16, np.float32(1.0 / 32768.0), out=work)
+        
         # Apply AGC (Automatic Gain Control) after RNNoise
-        if self.agc_enabled and len(audio_int16) > 0:
-            audio_int16 = self._apply_agc(audio_int16)
+        if self.agc_enabled:
+            self._apply_agc(work)
         
         # Apply Limiter to prevent clipping
-        if self.limiter_enabled and len(audio_int16) > 0:
-            audio_int16 = self._apply_limiter(audio_int16)
-        
-        # Downsample from 48kHz to 16kHz using high-quality soxr
-        if self.input_sample_rate != self.output_sample_rate and len(audio_int16) > 0:
-            # Convert to float for soxr, resample, then back to int16
-            audio_float = audio_int16.astype(np.float32) / 32768.0
-            audio_float = soxr.resample(
-                audio_float, 
-                self.input_sample_rate, 
-                self.output_sample_rate, 
-                quality='HQ'
-            )
-            audio_int16 = (audio_float * 32768.0).clip(-32768, 32767).astype(np.int16)
-        return audio_int16.tobytes()
+        if self.limiter_enabled:
+            self._apply_limiter(work)
+        
+        # Downsample from 48kHz to 16kHz using the persistent soxr stream
+        if self._resampler is not None:
+            resampled = self._resampler.resample_chunk(work)
+            m = len(resampled)
+            if m == 0:
+                return b''  # Resampler filter delay (first chunk only)
+            self._ensure_capacity(m)
+            out = self._out_float[:m]
+            np.multiply(resampled, np.float32(32768.0), out=out)
+        else:
+            m = n
+            out = work
+            np.multiply(out, np.float32(32768.0), out=out)
+        np.clip(out, -32768, 32767, out=out)
+        out_int16 = self._out_int16[:m]
+        np.copyto(out_int16, out, casting='unsafe')
+        return out_int16.tobytes()
     
     def _process_with_rnnoise(self, audio: np.ndarray) -> np.ndarray:
-        """Process audio through RNNoise frame by frame.
+        """Process all complete frames in the ring buffer through RNNoise.
         
         Args:
             audio: int16 numpy array
             
         Returns:
-            Denoised int16 numpy array
+            Denoised int16 array (a view of a preallocated buffer, valid
+            until the next call); empty while less than one frame is buffered.
+            In analysis-only mode (noise reduction off, VAD on) the original
+            frames are returned and only speech_probability is updated.
         """
-        # Add to frame buffer (int16)
-        self._frame_buffer = np.concatenate([self._frame_buffer, audio])
-        
-        # Limit buffer size to prevent memory issues (max 1 seconds of audio)
-        max_buffer_samples = 1 * self.RNNOISE_SAMPLE_RATE
-        if len(self._frame_buffer) > max_buffer_samples:
-            self._frame_buffer = self._frame_buffer[-max_buffer_samples:]
-        
-        # Process complete frames
-        output_frames = []
-        while len(self._frame_buffer) >= self.RNNOISE_FRAME_SIZE:
-            frame = self._frame_buffer[:self.RNNOISE_FRAME_SIZE]
-            self._frame_buffer = self._frame_buffer[self.RNNOISE_FRAME_SIZE:]
-            
-            # RNNoise expects [channels, samples] format with int16
-            frame_2d = frame.reshape(1, -1)
-            
-            try:
-                # Process frame - pyrnnoise takes int16 and returns int16
-                for speech_prob, denoised_frame in self._denoiser.denoise_chunk(frame_2d):
-                    prob = float(speech_prob[0])
-                    self._last_speech_prob = prob
-                    
-                    # Track last time speech was detected
-                    if prob > 0.2:
-                        self._last_speech_time = time.time()
-                    
-                    output_frames.append(denoised_frame.flatten())
-            except Exception as e:
-                logger.error(f"❌ RNNoise processing error: {e}")
-                output_frames.append(frame)
+        self._frame_ring.write(audio)
+        
+        frame_size = self.RNNOISE_FRAME_SIZE
+        n = (len(self._frame_ring) // frame_size) * frame_size
+        if n == 0:
+            return self._denoised[:0]
         
-        if output_frames:
-            return np.concatenate(output_frames)
-        return np.array([], dtype=np.int16)
+        self._ensure_capacity(n)
+        batch = self._frame_ring.read(n)
+        output = self._denoised[:n]
+        denoise = self.noise_reduce_enabled
+        
+        # Feed the whole batch at once; pyrnnoise yields one result per frame
+        pos = 0
+        try:
+            for speech_prob, denoised_frame in self._denoiser.denoise_chunk(batch.reshape(1, -1)):
+                prob = float(speech_prob[0])
+                self._last_speech_prob = prob
+                
+                # Track last time speech was detected
+                if prob > 0.2:
+                    self._last_speech_time = time.time()
+                
+                if denoise:
+                    output[pos:pos + frame_size] = denoised_frame.reshape(-1)
+                pos += frame_size
+        except Exception as e:
+            logger.error(f"❌ RNNoise processing error: {e}")
+            if denoise:
+                output[pos:] = batch[pos:]
+        
+        return output if denoise else batch
     
     def _reset_internal_state(self) -> None:
         """Reset RNNoise internal state without full reinitialization."""
-        self._frame_buffer = np.array([], dtype=np.int16)
+        self._frame_ring.clear()
+        if self._resampler is not None:
+            self._resampler.clear()
         self._last_speech_prob = 0.0
         # Reset AGC gain state
         self._agc_gain = 1.0
@@ -350,6 +411,11 @@ class AudioProcessor:
         """Get the last detected speech probability (0.0-1.0)."""
         return self._last_speech_prob
     
+    @property
+    def vad_available(self) -> bool:
+        """Whether speech_probability is live (RNNoise loaded, denoising or analysis-only)."""
+        return self._denoiser is not None and (self.noise_reduce_enabled or self.vad_enabled)
+    
     def set_enabled(self, enabled: bool) -> None:
         """Enable or disable noise reduction."""
         self.noise_reduce_enabled = enabled
@@ -369,66 +435,68 @@ class AudioProcessor:
         self.limiter_enabled = enabled
         logger.info(f"🎤 Limiter {'enabled' if enabled else 'disabled'}")
     
-    def _apply_agc(self, audio: np.ndarray) -> np.ndarray:
+    def _apply_agc(self, audio: np.ndarray) -> None:
         """
-        Apply Automatic Gain Control to normalize audio levels.
+        Apply Automatic Gain Control to normalize audio levels, in place.
         
         Uses a simple peak-following AGC with attack/release dynamics.
+        The gain is updated once per 10ms frame (or once for the whole chunk
+        when it is not a whole number of frames).
         
         Args:
-            audio: int16 numpy array
-            
-        Returns:
-            Gain-adjusted int16 numpy array
+            audio: float32 work array in [-1.0, 1.0), modified in place
         """
-        # Convert to float for processing
-        audio_float = audio.astype(np.float32) / 32768.0
-        
-        # Calculate RMS of the current chunk
-        rms = np.sqrt(np.mean(audio_float ** 2) + 1e-10)
-        
-        # Calculate desired gain with noise floor protection
-        if rms > self.AGC_NOISE_FLOOR:
-            # Real signal detected - calculate normal gain
-            desired_gain = self.AGC_TARGET_LEVEL / rms
-            desired_gain = np.clip(desired_gain, self.AGC_MIN_GAIN, self.AGC_MAX_GAIN)
+        n = len(audio)
+        frame_size = self.RNNOISE_FRAME_SIZE
+        if n % frame_size == 0:
+            frames = audio.reshape(-1, frame_size)
         else:
-            # Below noise floor: don't increase gain to avoid amplifying background noise
-            # Only allow gain to stay same or decrease, cap at 1.0
-            desired_gain = min(self._agc_gain, 1.0)
-        
-        # Smooth gain changes using attack/release coefficients
-        if desired_gain < self._agc_gain:
-            # Attack: fast response to loud signals
-            self._agc_gain = (self._agc_attack_coeff * self._agc_gain + 
-                             (1 - self._agc_attack_coeff) * desired_gain)
-        else:
-            # Release: slow return to higher gain
-            self._agc_gain = (self._agc_release_coeff * self._agc_gain + 
-                             (1 - self._agc_release_coeff) * desired_gain)
+            frames = audio.reshape(1, -1)
+        num_frames, block = frames.shape
         
-        # Apply gain
-        audio_float = audio_float * self._agc_gain
+        # Per-frame energy in one pass
+        energy = self._frame_energy[:num_frames]
+        np.einsum('ij,ij->i', frames, frames, out=energy)
+        gains = self._frame_gain[:num_frames]
         
-        # Convert back to int16 (clipping will be handled by limiter)
-        return (audio_float * 32768.0).clip(-32768, 32767).astype(np.int16)
+        gain = self._agc_gain
+        for i in range(num_frames):
+            rms = float(np.sqrt(energy[i] / block + 1e-10))
+            
+            # Calculate desired gain with noise floor protection
+            if rms > self.AGC_NOISE_FLOOR:
+                # Real signal detected - calculate normal gain
+                desired_gain = min(max(self.AGC_TARGET_LEVEL / rms, self.AGC_MIN_GAIN), self.AGC_MAX_GAIN)
+            else:
+                # Below noise floor: don't increase gain to avoid amplifying background noise
+                # Only allow gain to stay same or decrease, cap at 1.0
+                desired_gain = min(gain, 1.0)
+            
+            # Smooth gain changes using attack/release coefficients
+            if desired_gain < gain:
+                # Attack: fast response to loud signals
+                gain = self._agc_attack_coeff * gain + (1 - self._agc_attack_coeff) * desired_gain
+            else:
+                # Release: slow return to higher gain
+                gain = self._agc_release_coeff * gain + (1 - self._agc_release_coeff) * desired_gain
+            gains[i] = gain
+        self._agc_gain = gain
+        
+        # Apply gain; clip to the int16 range (clipping will be handled by limiter)
+        np.multiply(frames, gains[:, None], out=frames)
+        np.clip(audio, -1.0, 32767.0 / 32768.0, out=audio)
     
-    def _apply_limiter(self, audio: np.ndarray) -> np.ndarray:
+    def _apply_limiter(self, audio: np.ndarray) -> None:
         """
-        Apply a soft limiter to prevent clipping.
+        Apply a soft limiter to prevent clipping, in place.
         
         Uses a soft-knee limiter to gently compress peaks above threshold.
+        Only samples above the knee are touched, so quiet frames cost a
+        single abs/max pass.
         
         Args:
-            audio: int16 numpy array
-            
-        Returns:
-            Limited int16 numpy array
+            audio: float32 work array in [-1.0, 1.0), modified in place
         """
-        # Convert to float (-1.0 to 1.0 range)
-        audio_float = audio.astype(np.float32) / 32768.0
-        
-        # Apply soft-knee limiting
         threshold = self.LIMITER_THRESHOLD
         knee = self.LIMITER_KNEE
         
@@ -436,36 +504,81 @@ class AudioProcessor:
         knee_start = threshold - knee / 2
         knee_end = threshold + knee / 2
         
-        # Get absolute values for comparison
-        abs_audio = np.abs(audio_float)
+        abs_audio = self._abs[:len(audio)]
+        np.abs(audio, out=abs_audio)
+        if abs_audio.max() <= knee_start:
+            return
         
         # Apply soft knee compression
         # Below knee_start: pass through
         # In knee region: gentle compression
         # Above knee_end: hard limiting
+        idx = np.flatnonzero(abs_audio > knee_start)
+        peaks = abs_audio[idx]
+        sign = np.sign(audio[idx])
         
-        output = np.copy(audio_float)
+        # Knee region: quadratic compression
+        knee_ratio = (peaks - knee_start) / knee
+        limited = knee_start + (peaks - knee_start) * (1 - 0.5 * knee_ratio ** 2)
         
-        # Knee region (soft transition)
-        in_knee = (abs_audio > knee_start) & (abs_audio <= knee_end)
-        if np.any(in_knee):
-            # Quadratic compression in knee region
-            knee_ratio = (abs_audio[in_knee] - knee_start) / knee
-            compression = 1 - 0.5 * knee_ratio ** 2
-            output[in_knee] = np.sign(audio_float[in_knee]) * (
-                knee_start + (abs_audio[in_knee] - knee_start) * compression
-            )
+        # Above knee: soft saturation using tanh
+        above_knee = peaks > knee_end
+        if above_knee.any():
+            excess = peaks[above_knee] - threshold
+            limited[above_knee] = threshold + 0.5 * np.tanh(excess * 2) * (1 - threshold)
         
-        # Above knee (hard limiting with soft saturation)
-        above_knee = abs_audio > knee_end
-        if np.any(above_knee):
-            # Soft saturation using tanh
-            excess = abs_audio[above_knee] - threshold
-            limited = threshold + 0.5 * np.tanh(excess * 2) * (1 - threshold)
-            output[above_knee] = np.sign(audio_float[above_knee]) * limited
+        audio[idx] = sign * limited
         
         # Final clip to ensure no samples exceed 1.0
-        output = np.clip(output, -1.0, 1.0)
-        
-        # Convert back to int16
-        return (output * 32768.0).clip(-32768, 32767).astype(np.int16)
+        np.clip(audio, -1.0, 1.0, out=audio)
+
+
+def _run_benchmark(seconds: float = 20.0) -> None:
+    """Micro-benchmark: µs and transient heap bytes per 10ms input frame."""
+    import tracemalloc
+    
+    frame_size = AudioProcessor.RNNOISE_FRAME_SIZE
+    sample_rate = AudioProcessor.RNNOISE_SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    # Amplitude-modulated tone plus noise: exercises AGC attack/release and the limiter
+    signal = (np.sin(2 * np.pi * 220 * t) * (0.3 + 0.25 * np.sin(2 * np.pi * 0.5 * t)) * 0.6 * 32767
+              + rng.normal(0, 300, len(t))).astype(np.int16)
+    frames = [signal[i:i + frame_size].tobytes() for i in range(0, len(signal), frame_size)]
+    
+    for label, noise_reduce, vad in (('off', False, False), ('vad', False, True), ('on ', True, False)):
+        processor = AudioProcessor(noise_reduce_enabled=noise_reduce, vad_enabled=vad)
+        if (noise_reduce or vad) and processor._denoiser is None:
+            print(f"rnnoise={label}: pyrnnoise not available, skipped")
+            continue
+        if vad:
+            # Analysis-only mode must pass the original audio through unchanged
+            plain = AudioProcessor(noise_reduce_enabled=False)
+            out = b''.join(processor.process_chunk(frame) for frame in frames[:100])
+            expected = b''.join(plain.process_chunk(frame) for frame in frames[:100])
+            print(f"rnnoise=vad: output identical to rnnoise=off: {out == expected}, "
+                  f"speech_probability={processor.speech_probability:.2f}")
+        for frame in frames[:200]:
+            processor.process_chunk(frame)
+        
+        start = time.perf_counter()
+        for frame in frames:
+            processor.process_chunk(frame)
+        us_per_frame = (time.perf_counter() - start) / len(frames) * 1e6
+        
+        sample = frames[:500]
+        transient = 0
+        tracemalloc.start()
+        for frame in sample:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            processor.process_chunk(frame)
+            transient += tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        
+        print(f"rnnoise={label}: {us_per_frame:7.1f} µs/frame, "
+              f"{transient / len(sample):7.0f} B transient/frame")
+
+
+if __name__ == "__main__":
+    _run_benchmark()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+预分配的 int16 PCM 环形缓冲区
+
+音频上行按 10ms 一帧到达，逐帧 base64 + json.dumps 的开销远大于音频本身。
+Int16RingBuffer 在固定容量的数组里累积样本，凑够一批后一次性取出：
+- 写入/读取只做 numpy 切片拷贝，没有逐样本的 Python 循环
+- 数据未跨越数组末尾时直接返回视图，跨越时拷贝到预分配的临时数组
+- 写满后丢弃最旧的样本（上行音频宁可丢旧数据也不能无限堆积）
+"""
+import numpy as np
+
+
+class Int16RingBuffer:
+    """单声道 int16 环形缓冲区"""
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._buf = np.zeros(capacity, dtype=np.int16)
+        self._scratch = np.zeros(capacity, dtype=np.int16)
+        self._start = 0
+        self._size = 0
+        self.dropped = 0  # 因溢出丢弃的样本数
+
+    def __len__(self) -> int:
+        return self._size
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+    def write(self, samples) -> int:
+        """
+        写入样本（np.ndarray 或 PCM16 字节），返回因溢出丢弃的旧样本数
+        """
+        if not isinstance(samples, np.ndarray):
+            samples = np.frombuffer(samples, dtype=np.int16)
+        n = len(samples)
+        if n == 0:
+            return 0
+        dropped = 0
+        if n >= self.capacity:
+            # 新数据本身就超过容量：只保留最后 capacity 个样本
+            dropped = self._size + n - self.capacity
+            self._buf[:] = samples[-self.capacity:]
+            self._start = 0
+            self._size = self.capacity
+            self.dropped += dropped
+            return dropped
+        overflow = self._size + n - self.capacity
+        if overflow > 0:
+            self._start = (self._start + overflow) % self.capacity
+            self._size -= overflow
+            dropped = overflow
+            self.dropped += dropped
+        end = (self._start + self._size) % self.capacity
+        first = min(n, self.capacity - end)
+        self._buf[end:end + first] = samples[:first]
+        if first < n:
+            self._buf[:n - first] = samples[first:]
+        self._size += n
+        return dropped
+
+    def read(self, n: int = None) -> np.ndarray:
+        """
+        取出最多 n 个样本（缺省取出全部）
+
+        返回的数组可能是内部缓冲区的视图，在下一次 write 之前使用（例如立即 base64 编码）。
+        """
+        n = self._size if n is None else min(n, self._size)
+        if n == 0:
+            return self._buf[:0]
+        start = self._start
+        if start + n <= self.capacity:
+            out = self._buf[start:start + n]
+        else:
+            first = self.capacity - start
+            out = self._scratch[:n]
+            out[:first] = self._buf[start:]
+            out[first:] = self._buf[:n - first]
+        self._start = (start + n) % self.capacity
+        self._size -= n
+        if self._size == 0:
+            self._start = 0
+        return out
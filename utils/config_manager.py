@@ -8,6 +8,7 @@ import os
 import json
 import shutil
 import logging
+import threading
 from copy import deepcopy
 from pathlib import Path
 
@@ -29,6 +30,27 @@ from utils.api_config_loader import (
 
 logger = logging.getLogger(__name__)
 
+# 配置文件不存在时快照中保存的占位值
+_MISSING = object()
+
+
+def _file_stamp(path):
+    """文件指纹（mtime_ns、ctime_ns、大小、inode），文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino)
+
+
+def _copy_json(value):
+    """复制JSON结构（dict/list嵌套标量），比deepcopy快得多"""
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
 
 class ConfigManager:
     """配置文件管理器"""
@@ -53,6 +75,15 @@ class ConfigManager:
 
         self.project_config_dir = self._get_project_config_directory()
         self.project_memory_dir = self._get_project_memory_directory()
+
+        # 配置文件快照缓存：路径 -> (文件指纹, 版本号, 解析结果)
+        # 解析结果在缓存内视为只读，对外一律返回副本；文件指纹变化或本进程写入时版本号递增
+        self._snapshot_lock = threading.RLock()
+        self._snapshots = {}
+        # 由快照派生的结果（核心配置、角色数据）：键 -> (所依赖的快照版本, 结果)
+        self._derived = {}
+        self._config_version = 0
+        self.cache_stats = {'hits': 0, 'misses': 0}
     
     def _log(self, msg):
         """仅在主进程中打印调试信息"""
@@ -344,6 +375,80 @@ class ConfigManager:
         
         # 都不存在，返回我的文档路径（用于创建新文件）
         return docs_config_path
+
+    # --- Config snapshot cache ---
+
+    def _json_snapshot(self, path):
+        """
+        读取JSON配置文件的快照（只读，调用方不得修改）
+
+        仅做一次 stat 比较文件指纹，未变化时直接返回缓存的解析结果；
+        文件被其他进程修改、替换或删除后自动重新加载。
+
+        Returns:
+            tuple: (版本号, 解析结果)，文件不存在时解析结果为 _MISSING
+        """
+        key = os.path.normcase(os.path.abspath(str(path)))
+        stamp = _file_stamp(key)
+        with self._snapshot_lock:
+            cached = self._snapshots.get(key)
+            if cached is not None and cached[0] == stamp:
+                self.cache_stats['hits'] += 1
+                return cached[1], cached[2]
+            self.cache_stats['misses'] += 1
+            if stamp is None:
+                data = _MISSING
+            else:
+                # 先取指纹再读取：读取期间文件若被改写，下次 stat 必然不一致而重新加载
+                with open(key, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            self._config_version += 1
+            self._snapshots[key] = (stamp, self._config_version, data)
+            return self._config_version, data
+
+    def _derived_snapshot(self, name, version):
+        """返回依赖版本仍为 version 的派生结果，否则返回None"""
+        with self._snapshot_lock:
+            cached = self._derived.get(name)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        return None
+
+    def _store_derived(self, name, version, value):
+        with self._snapshot_lock:
+            self._derived[name] = (version, value)
+
+    def invalidate_config_cache(self, path=None):
+        """
+        使配置快照失效（本进程写入配置文件后调用，其他进程的修改由文件指纹自动发现）
+
+        Args:
+            path: 配置文件路径，为None时清空全部快照
+        """
+        with self._snapshot_lock:
+            if path is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(os.path.normcase(os.path.abspath(str(path))), None)
+            self._derived.clear()
+            self._config_version += 1
+
+    def _write_json_atomic(self, path, data):
+        """以临时文件 + 原子重命名写入JSON，并在同一把锁内使快照失效"""
+        path = str(path)
+        tmp_path = f"{path}.tmp"
+        with self._snapshot_lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self.invalidate_config_cache(path)
+
+    def get_config_version(self):
+        """配置快照的全局版本号，任一配置文件变化后递增"""
+        with self._snapshot_lock:
+            return self._config_version
     
     def migrate_config_files(self):
         """
@@ -436,15 +541,25 @@ class ConfigManager:
             character_json_path = str(self.get_config_path('characters.json'))
 
         try:
-            with open(character_json_path, 'r', encoding='utf-8') as f:
-                character_data = json.load(f)
-        except FileNotFoundError:
+            _, character_data = self._json_snapshot(character_json_path)
+        except Exception as e:
+            logger.error("读取猫娘配置文件出错: %s，使用默认人设。", e)
+            return self.get_default_characters()
+        if character_data is _MISSING:
             logger.info("未找到猫娘配置文件 %s，使用默认配置。", character_json_path)
-            character_data = self.get_default_characters()
+            return self.get_default_characters()
+        return _copy_json(character_data)
+
+    def get_catgirl_names(self):
+        """获取当前配置中的猫娘名称列表（直接读取快照，不复制整份角色配置）"""
+        try:
+            _, character_data = self._json_snapshot(self.get_config_path('characters.json'))
         except Exception as e:
             logger.error("读取猫娘配置文件出错: %s，使用默认人设。", e)
-            character_data = self.get_default_characters()
-        return character_data
+            character_data = _MISSING
+        if not isinstance(character_data, dict):
+            character_data = DEFAULT_CHARACTERS_CONFIG
+        return list((character_data.get('猫娘') or {}).keys())
 
     def save_characters(self, data, character_json_path=None):
         """保存角色配置"""
@@ -454,8 +569,7 @@ class ConfigManager:
         # 确保config目录存在
         self.ensure_config_directory()
 
-        with open(character_json_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self._write_json_atomic(character_json_path, data)
 
     # --- Voice storage helpers ---
 
@@ -543,7 +657,19 @@ class ConfigManager:
     # --- Character metadata helpers ---
 
     def get_character_data(self):
-        """获取角色基础数据及相关路径"""
+        """获取角色基础数据及相关路径（按 characters.json 的快照版本缓存）"""
+        try:
+            version, _ = self._json_snapshot(self.get_config_path('characters.json'))
+        except Exception:
+            version = None
+        cached = self._derived_snapshot('character_data', version) if version is not None else None
+        if cached is None:
+            cached = self._build_character_data()
+            if version is not None:
+                self._store_derived('character_data', version, cached)
+        return tuple(_copy_json(item) for item in cached)
+
+    def _build_character_data(self):
         character_data = self.load_characters()
         defaults = self.get_default_characters()
 
@@ -598,7 +724,19 @@ class ConfigManager:
     # --- Core config helpers ---
 
     def get_core_config(self):
-        """动态读取核心配置"""
+        """动态读取核心配置（core_config.json 未变化时直接返回缓存结果的副本）"""
+        try:
+            version, _ = self._json_snapshot(self.get_config_path('core_config.json'))
+        except Exception:
+            version = None
+        cached = self._derived_snapshot('core_config', version) if version is not None else None
+        if cached is None:
+            cached = self._build_core_config()
+            if version is not None:
+                self._store_derived('core_config', version, cached)
+        return dict(cached)
+
+    def _build_core_config(self):
         # 从 config 模块导入所有默认配置值
         from config import (
             DEFAULT_CORE_API_KEY,
@@ -690,15 +828,13 @@ class ConfigManager:
         core_cfg = deepcopy(DEFAULT_CONFIG_DATA['core_config.json'])
 
         try:
-            with open(str(self.get_config_path('core_config.json')), 'r', encoding='utf-8') as f:
-                file_data = json.load(f)
-            if isinstance(file_data, dict):
-                core_cfg.update(file_data)
+            _, file_data = self._json_snapshot(self.get_config_path('core_config.json'))
+            if file_data is _MISSING:
+                logger.info("未找到 core_config.json，使用默认配置。")
+            elif isinstance(file_data, dict):
+                core_cfg.update(_copy_json(file_data))
             else:
                 logger.warning("core_config.json 格式异常，使用默认配置。")
-
-        except FileNotFoundError:
-            logger.info("未找到 core_config.json，使用默认配置。")
         except Exception as e:
             logger.error("Error parsing Core API Key: %s", e)
         finally:
@@ -958,8 +1094,10 @@ class ConfigManager:
         config_path = self.get_config_path(filename)
         
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            _, data = self._json_snapshot(config_path)
+            if data is _MISSING:
+                raise FileNotFoundError(str(config_path))
+            return _copy_json(data)
         except FileNotFoundError:
             if default_value is not None:
                 return deepcopy(default_value)
@@ -984,9 +1122,7 @@ class ConfigManager:
         config_path = self.config_dir / filename
         
         try:
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                f.flush()  # 强制刷新缓冲区
+            self._write_json_atomic(config_path, data)
         except Exception as e:
             print(f"Error saving {filename}: {e}", file=sys.stderr)
             raise
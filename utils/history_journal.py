@@ -0,0 +1,230 @@
+"""
+近期聊天记录的追加式日志存储
+
+recent_{name}.json 仍然是完整的快照文件（格式不变，记忆浏览器可直接读写），
+每轮对话新增的消息以"长度前缀 + JSON"记录的形式追加到同目录的
+recent_{name}.json.journal 中，写入量只与新增消息成正比。
+日志累计到一定规模后在后台合并进快照（临时文件 + 原子重命名）。
+
+日志的第一条记录保存其所基于的快照文件指纹（大小、mtime_ns、inode）。
+加载时若快照指纹与日志头不一致（快照已被合并或被外部编辑），
+说明日志已过期，直接丢弃，从而在任意时刻崩溃都不会重复或丢失记录。
+"""
+import json
+import os
+import struct
+import threading
+from typing import Any, Dict, List, Optional
+
+JOURNAL_SUFFIX = '.journal'
+
+# 单条记录的长度前缀（大端无符号32位）
+_LENGTH_PREFIX = struct.Struct('>I')
+
+# 同一进程内同一文件共享一把锁（memory_server重新加载组件时新旧实例可能并存）
+_path_locks: Dict[str, threading.Lock] = {}
+_path_locks_guard = threading.Lock()
+
+
+def _lock_for(path: str) -> threading.Lock:
+    key = os.path.normcase(os.path.abspath(path))
+    with _path_locks_guard:
+        lock = _path_locks.get(key)
+        if lock is None:
+            lock = _path_locks[key] = threading.Lock()
+        return lock
+
+
+def journal_path_for(snapshot_path: str) -> str:
+    """返回快照文件对应的日志文件路径"""
+    return str(snapshot_path) + JOURNAL_SUFFIX
+
+
+def _snapshot_stamp(snapshot_path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(snapshot_path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def _encode_record(record: Dict[str, Any]) -> bytes:
+    payload = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return _LENGTH_PREFIX.pack(len(payload)) + payload
+
+
+def _read_records(journal_path: str) -> List[Dict[str, Any]]:
+    """读取日志中的全部完整记录；末尾被截断的记录（写入时崩溃）会被忽略"""
+    records = []
+    try:
+        with open(journal_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return records
+    offset = 0
+    prefix_size = _LENGTH_PREFIX.size
+    while offset + prefix_size <= len(data):
+        (length,) = _LENGTH_PREFIX.unpack_from(data, offset)
+        end = offset + prefix_size + length
+        if end > len(data):
+            break
+        try:
+            records.append(json.loads(data[offset + prefix_size:end].decode('utf-8')))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            break
+        offset = end
+    return records
+
+
+def _apply_record(history: List[Dict[str, Any]], record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    op = record.get('op')
+    if op == 'append':
+        history.extend(record.get('messages', []))
+    elif op == 'splice':
+        # 用新的消息替换开头的count条（历史压缩）
+        history = list(record.get('messages', [])) + history[record.get('count', 0):]
+    return history
+
+
+def _load_snapshot(snapshot_path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(snapshot_path):
+        return []
+    with open(snapshot_path, encoding='utf-8') as f:
+        content = json.load(f)
+    return content or []
+
+
+def _replay(snapshot_path: str):
+    """读取快照并重放未过期的日志，返回 (消息字典列表, 快照指纹, 有效记录数)"""
+    stamp = _snapshot_stamp(snapshot_path)
+    history = _load_snapshot(snapshot_path)
+    records = _read_records(journal_path_for(snapshot_path))
+    if not records or records[0].get('op') != 'base' or records[0].get('stamp') != stamp:
+        return history, stamp, 0
+    for record in records[1:]:
+        history = _apply_record(history, record)
+    return history, stamp, len(records) - 1
+
+
+def read_history_dicts(snapshot_path: str) -> List[Dict[str, Any]]:
+    """
+    读取某个角色的完整近期记录（快照 + 日志）
+
+    Returns:
+        List[Dict[str, Any]]: messages_to_dict 格式的消息列表
+    """
+    with _lock_for(snapshot_path):
+        history, _, _ = _replay(snapshot_path)
+    return history
+
+
+def write_snapshot(snapshot_path: str, history: List[Dict[str, Any]]) -> Optional[List[int]]:
+    """以临时文件 + 原子重命名的方式写入快照，返回新快照的指纹"""
+    os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, snapshot_path)
+    return _snapshot_stamp(snapshot_path)
+
+
+class HistoryJournal:
+    """单个角色近期记录的快照 + 追加日志"""
+
+    def __init__(self, snapshot_path: str, compact_threshold: int = 32, compact_bytes: int = 256 * 1024):
+        self.snapshot_path = str(snapshot_path)
+        self.journal_path = journal_path_for(self.snapshot_path)
+        self.compact_threshold = compact_threshold
+        self.compact_bytes = compact_bytes
+        self._lock = _lock_for(self.snapshot_path)
+        self._stamp: Optional[List[int]] = None
+        self._journal_size = 0
+        self._record_count = 0
+        # 每次追加/合并都会递增，后台合并据此判断内存副本是否仍与磁盘一致
+        self.seq = 0
+
+    def load(self) -> List[Dict[str, Any]]:
+        """从磁盘加载快照并重放日志，作为内存权威副本的初始值"""
+        with self._lock:
+            history, self._stamp, self._record_count = _replay(self.snapshot_path)
+            self._journal_size = self._current_journal_size() if self._record_count else 0
+            self.seq += 1
+        return history
+
+    def has_snapshot(self) -> bool:
+        return self._stamp is not None and os.path.exists(self.snapshot_path)
+
+    def is_stale(self) -> bool:
+        """快照或日志被其他进程（如记忆浏览器）修改过时返回True"""
+        if _snapshot_stamp(self.snapshot_path) != self._stamp:
+            return True
+        return self._record_count > 0 and self._current_journal_size() != self._journal_size
+
+    def append(self, messages: List[Dict[str, Any]]):
+        """追加新消息"""
+        if messages:
+            self._write_record({'op': 'append', 'messages': messages})
+
+    def splice(self, count: int, messages: List[Dict[str, Any]]):
+        """用 messages 替换开头的 count 条消息（历史压缩后调用）"""
+        self._write_record({'op': 'splice', 'count': count, 'messages': messages})
+
+    def needs_compaction(self) -> bool:
+        return self._record_count >= self.compact_threshold or self._journal_size >= self.compact_bytes
+
+    def compact(self, history: List[Dict[str, Any]], expected_seq: Optional[int] = None) -> bool:
+        """
+        将完整记录写成新快照并清空日志
+
+        Args:
+            history: 完整的消息字典列表
+            expected_seq: 若提供，仅当此期间没有新的写入时才执行（用于后台合并）
+
+        Returns:
+            bool: 是否执行了合并
+        """
+        with self._lock:
+            if expected_seq is not None and expected_seq != self.seq:
+                return False
+            if self._record_count and self._current_journal_size() != self._journal_size:
+                # 日志被其他实例写过，交给下一次加载处理
+                return False
+            self._stamp = write_snapshot(self.snapshot_path, history)
+            self._reset_journal()
+            self.seq += 1
+            return True
+
+    def _write_record(self, record: Dict[str, Any]):
+        with self._lock:
+            if not self.has_snapshot():
+                # 还没有快照（新角色）时日志无所依附，调用方应先 compact
+                raise FileNotFoundError(self.snapshot_path)
+            data = _encode_record(record)
+            if self._record_count == 0:
+                data = _encode_record({'op': 'base', 'stamp': self._stamp}) + data
+                mode = 'wb'
+            else:
+                mode = 'ab'
+            with open(self.journal_path, mode) as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_size = self._journal_size + len(data) if mode == 'ab' else len(data)
+            self._record_count += 1
+            self.seq += 1
+
+    def _reset_journal(self):
+        self._record_count = 0
+        self._journal_size = 0
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+    def _current_journal_size(self) -> int:
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+JSON 编解码层
+
+实时会话里 JSON 的编解码非常频繁：服务端每 ~100ms 推一条携带 base64 音频的
+response.audio.delta，上行/前端/监控同步也都是逐条 json.dumps。这里统一提供：
+
+- loads / dumps：安装了 orjson 时使用 orjson，否则退回标准库 json；
+  dumps 返回 str，可直接作为 websocket 文本帧发送，输出与 Starlette send_json 一样紧凑、不转义非 ASCII
+- extract_audio_delta：音频增量事件的快速路径，直接从原始文本中切出 base64 字段，不构建完整 dict
+
+运行 `python -m utils.json_codec [events.jsonl]` 回放一段服务端事件流（每行一条原始消息），
+比较标准库与 orjson 以及快速路径的耗时；不给文件时使用内置的模拟事件流。
+"""
+import json
+import logging
+from typing import Any, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于安装环境
+    orjson = None
+
+CODEC_NAME = 'orjson' if orjson is not None else 'json'
+
+# 只在消息开头这么多字符内查找 type 字段；找不到时走完整解析
+_TYPE_SCAN_LIMIT = 160
+_AUDIO_DELTA_TYPES = (
+    '"type":"response.audio.delta"',
+    '"type":"response.output_audio.delta"',
+)
+_DELTA_KEY = '"delta":"'
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+if orjson is not None:
+    def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj: Any) -> str:
+        try:
+            return orjson.dumps(obj).decode()
+        except TypeError:
+            # orjson 不支持的类型（非字符串键、自定义对象等）交给标准库处理
+            return _stdlib_dumps(obj)
+else:
+    def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+    dumps = _stdlib_dumps
+
+
+def extract_audio_delta(message: Union[str, bytes]) -> Optional[str]:
+    """
+    若 message 是音频增量事件，返回其中的 base64 音频字段，否则返回 None
+
+    只处理紧凑格式（无空格）且 type 字段靠前的消息；delta 中出现转义字符时同样返回 None，
+    由调用方退回到完整解析，因此结果总是与 loads(message)["delta"] 一致。
+    """
+    if not isinstance(message, str):
+        return None
+    head = message[:_TYPE_SCAN_LIMIT]
+    if _AUDIO_DELTA_TYPES[0] not in head and _AUDIO_DELTA_TYPES[1] not in head:
+        return None
+    start = message.find(_DELTA_KEY)
+    if start < 0:
+        return None
+    start += len(_DELTA_KEY)
+    end = message.find('"', start)
+    if end < 0:
+        return None
+    delta = message[start:end]
+    if '\\' in delta:
+        return None
+    return delta
+
+
+def _synthetic_event_stream(n_responses: int = 40):
+    """模拟一段 qwen 实时会话的服务端事件流（音频增量为主，夹杂转录增量）"""
+    import base64
+    import os
+
+    messages = []
+    for r in range(n_responses):
+        response_id = f"resp_{r:06d}"
+        messages.append(_stdlib_dumps({"type": "response.created", "event_id": f"event_{len(messages)}",
+                                       "response": {"id": response_id, "status": "in_progress", "output": []}}))
+        for i in range(50):
+            messages.append(_stdlib_dumps({
+                "type": "response.audio.delta", "event_id": f"event_{len(messages)}",
+                "response_id": response_id, "item_id": f"item_{r}", "output_index": 0, "content_index": 0,
+                # 24kHz PCM16 约 100ms
+                "delta": base64.b64encode(os.urandom(4800)).decode(),
+            }))
+            if i % 5 == 0:
+                messages.append(_stdlib_dumps({
+                    "type": "response.audio_transcript.delta", "event_id": f"event_{len(messages)}",
+                    "response_id": response_id, "item_id": f"item_{r}", "output_index": 0, "content_index": 0,
+                    "delta": "你好呀，今天过得怎么样？",
+                }))
+        messages.append(_stdlib_dumps({"type": "response.done", "event_id": f"event_{len(messages)}",
+                                       "response": {"id": response_id, "status": "completed"}}))
+    return messages
+
+
+def _run_benchmark(path: Optional[str] = None, rounds: int = 5) -> None:
+    import time
+
+    if path:
+        with open(path, encoding='utf-8') as f:
+            messages = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        messages = _synthetic_event_stream()
+    audio = sum(1 for m in messages if extract_audio_delta(m) is not None)
+    print(f"{len(messages)} events ({audio} audio deltas), {sum(map(len, messages)) / 1e6:.1f} MB, codec={CODEC_NAME}")
+
+    def best_of(fn):
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best / len(messages) * 1e6
+
+    def parse_all(parse):
+        def run():
+            for m in messages:
+                parse(m)
+        return run
+
+    def fast_path(parse):
+        def run():
+            for m in messages:
+                if extract_audio_delta(m) is None:
+                    parse(m)
+        return run
+
+    results = [("json.loads", best_of(parse_all(json.loads)))]
+    if orjson is not None:
+        results.append(("orjson.loads", best_of(parse_all(orjson.loads))))
+    results.append(("fast path + loads", best_of(fast_path(loads))))
+    for name, us in results:
+        print(f"  {name:<20} {us:7.2f} µs/event")
+
+
+if __name__ == "__main__":
+    import sys
+
+    _run_benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -15,7 +15,7 @@ import threading
 import asyncio
 import os
 from typing import Optional, Tuple, List
-from langchain_openai import ChatOpenAI
+from utils.llm_client import get_chat_llm
 from langchain_core.messages import SystemMessage, HumanMessage
 from utils.config_manager import get_config_manager
 
@@ -720,10 +720,10 @@ async def translate_text(text: str, target_lang: str, source_lang: Optional[str]
         source_name = lang_names.get(source_lang, source_lang)
         target_name = lang_names.get(target_lang, target_lang)
         
-        llm = ChatOpenAI(
-            model=correction_config['model'],
-            base_url=correction_config['base_url'],
-            api_key=correction_config['api_key'],
+        llm = get_chat_llm(
+            correction_config['model'],
+            correction_config['base_url'],
+            correction_config['api_key'],
             temperature=0.3,  # 低temperature保证翻译准确性
             timeout=10.0
         )
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+共享的LLM客户端工厂
+
+各模块原先在每次调用时新建 ChatOpenAI（连同新的 httpx 连接池）来支持配置热重载，
+导致每次摘要/审阅/重排都要重新建立TCP与TLS连接。这里统一维护：
+
+- 按 (base_url, api_key, model, 参数) 缓存的 ChatOpenAI 实例；
+  配置快照版本变化（core_config.json 被修改）后整体重建，配置不变时直接复用
+- 按端点 (scheme://host:port) 共享的 keep-alive 连接池（装有 h2 时启用 HTTP/2），
+  配置变化只重建 ChatOpenAI 对象，不会断开已有连接
+- 每个端点的请求数、错误数、当前连接数等统计，见 get_pool_stats()
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from config import get_extra_body
+from utils.config_manager import get_config_manager
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+# 每个端点的连接池参数
+POOL_MAX_CONNECTIONS = 32
+POOL_MAX_KEEPALIVE = 16
+POOL_KEEPALIVE_EXPIRY = 120.0
+
+_lock = threading.Lock()
+# (端点, 事件循环id) -> (事件循环, httpx.AsyncClient)
+_async_pools: Dict[Tuple[str, Optional[int]], Tuple[Any, httpx.AsyncClient]] = {}
+# 端点 -> httpx.Client
+_sync_pools: Dict[str, httpx.Client] = {}
+# 注册表键 -> (事件循环, ChatOpenAI)
+_registry: Dict[tuple, Tuple[Any, ChatOpenAI]] = {}
+_registry_version: Optional[int] = None
+# 端点 -> 统计
+_endpoint_stats: Dict[str, Dict[str, int]] = {}
+# 正在后台关闭的旧连接池（保留引用，避免任务被回收）
+_closing_tasks = set()
+
+
+def _endpoint_of(base_url: Optional[str]) -> str:
+    try:
+        url = httpx.URL(base_url or '')
+    except Exception:
+        return base_url or ''
+    port = url.port or (443 if url.scheme == 'https' else 80)
+    return f"{url.scheme}://{url.host}:{port}"
+
+
+def _stats_for(endpoint: str) -> Dict[str, int]:
+    stats = _endpoint_stats.get(endpoint)
+    if stats is None:
+        stats = _endpoint_stats[endpoint] = {
+            'clients_built': 0,
+            'client_reuses': 0,
+            'pools_built': 0,
+            'requests': 0,
+            'errors': 0,
+        }
+    return stats
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def _make_hooks(endpoint: str, is_async: bool):
+    stats = _stats_for(endpoint)
+
+    def on_request(request):
+        stats['requests'] += 1
+
+    def on_response(response):
+        if response.status_code >= 400:
+            stats['errors'] += 1
+
+    if not is_async:
+        return {'request': [on_request], 'response': [on_response]}
+
+    async def on_request_async(request):
+        on_request(request)
+
+    async def on_response_async(response):
+        on_response(response)
+
+    return {'request': [on_request_async], 'response': [on_response_async]}
+
+
+def _get_async_pool(endpoint: str) -> httpx.AsyncClient:
+    """
+    获取当前事件循环下该端点的共享连接池
+
+    httpx.AsyncClient 的连接绑定在创建它的事件循环上，因此按 (端点, 事件循环) 区分；
+    不在事件循环中调用时（例如同步初始化阶段）使用 None 作为键，首次使用时绑定。
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    key = (endpoint, id(loop) if loop is not None else None)
+    with _lock:
+        entry = _async_pools.get(key)
+        if entry is not None and (entry[0] is None or not entry[0].is_closed()):
+            return entry[1]
+        stale = _pop_stale_pools()
+        client = httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            limits=_pool_limits(),
+            event_hooks=_make_hooks(endpoint, is_async=True),
+        )
+        _async_pools[key] = (loop, client)
+        _stats_for(endpoint)['pools_built'] += 1
+    if stale and loop is not None:
+        task = loop.create_task(_aclose_clients(stale))
+        _closing_tasks.add(task)
+        task.add_done_callback(_closing_tasks.discard)
+    return client
+
+
+def _pop_stale_pools():
+    """
+    移除事件循环已关闭的连接池及绑定在这些循环上的 ChatOpenAI（调用方需持有 _lock）
+
+    事件循环关闭后 id 可能被新的循环复用，不清理的话注册表与打开的连接会随每个循环累积。
+    """
+    stale_keys = [k for k, (loop, _) in _async_pools.items() if loop is not None and loop.is_closed()]
+    clients = [_async_pools.pop(k)[1] for k in stale_keys]
+    for k in [k for k, (loop, _) in _registry.items() if loop is not None and loop.is_closed()]:
+        del _registry[k]
+    return clients
+
+
+async def _aclose_clients(clients):
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            # 原事件循环已关闭时 aclose 会报错，但连接已从池中移除、套接字已关闭
+            logger.debug(f"关闭连接池失败: {e}")
+
+
+def _get_sync_pool(endpoint: str) -> httpx.Client:
+    with _lock:
+        client = _sync_pools.get(endpoint)
+        if client is None:
+            client = _sync_pools[endpoint] = httpx.Client(
+                http2=_HTTP2_AVAILABLE,
+                limits=_pool_limits(),
+                event_hooks=_make_hooks(endpoint, is_async=False),
+            )
+        return client
+
+
+def _check_config_version():
+    """配置快照版本变化后清空 ChatOpenAI 注册表（连接池保留）"""
+    global _registry_version
+    version = get_config_manager().get_config_version()
+    if version != _registry_version:
+        _registry.clear()
+        _registry_version = version
+
+
+def get_chat_llm(model: str, base_url: str, api_key: Optional[str], **params) -> ChatOpenAI:
+    """
+    获取共享连接池的 ChatOpenAI 实例，相同参数的调用返回同一个对象
+
+    Args:
+        model: 模型名
+        base_url: API端点
+        api_key: API密钥，空字符串按None处理
+        **params: 其余 ChatOpenAI 参数（temperature、extra_body、max_tokens、timeout 等），
+            参与缓存键的计算
+    """
+    api_key = api_key or None
+    endpoint = _endpoint_of(base_url)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    key = (base_url, api_key, model, repr(sorted(params.items())), id(loop) if loop is not None else None)
+    with _lock:
+        _check_config_version()
+        entry = _registry.get(key)
+        if entry is not None and (entry[0] is None or not entry[0].is_closed()):
+            _stats_for(endpoint)['client_reuses'] += 1
+            return entry[1]
+    llm = ChatOpenAI(
+        model=model,
+        base_url=base_url,
+        api_key=api_key,
+        http_client=_get_sync_pool(endpoint),
+        http_async_client=_get_async_pool(endpoint),
+        **params,
+    )
+    with _lock:
+        _registry[key] = (loop, llm)
+        _stats_for(endpoint)['clients_built'] += 1
+    return llm
+
+
+def get_model_llm(model_type: str, model: Optional[str] = None, with_extra_body: bool = True, **params) -> ChatOpenAI:
+    """
+    按 ConfigManager.get_model_api_config 的模型类型获取 ChatOpenAI
+
+    Args:
+        model_type: 'summary'、'correction'、'emotion' 等，见 get_model_api_config
+        model: 覆盖配置中的模型名（例如 memory 中固定使用的 ROUTER_MODEL）
+        with_extra_body: 是否自动附加 get_extra_body(model)
+        **params: 其余 ChatOpenAI 参数
+    """
+    api_config = get_config_manager().get_model_api_config(model_type)
+    model = model or api_config['model']
+    if with_extra_body and 'extra_body' not in params:
+        params['extra_body'] = get_extra_body(model) or None
+    return get_chat_llm(model, api_config['base_url'], api_config['api_key'], **params)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """返回每个端点的客户端复用与连接池统计"""
+    with _lock:
+        result = {endpoint: dict(stats) for endpoint, stats in _endpoint_stats.items()}
+        for (endpoint, _), (_, client) in _async_pools.items():
+            pool = getattr(getattr(client, '_transport', None), '_pool', None)
+            connections = getattr(pool, 'connections', None)
+            if connections is not None:
+                stats = result.setdefault(endpoint, {})
+                stats['open_connections'] = stats.get('open_connections', 0) + len(connections)
+        result_registry = len(_registry)
+    for stats in result.values():
+        stats.setdefault('open_connections', 0)
+    return {'endpoints': result, 'cached_clients': result_registry, 'http2': _HTTP2_AVAILABLE}
+
+
+async def aclose_pools():
+    """关闭当前事件循环下的全部连接池（服务关闭时调用）"""
+    try:
+        loop_id = id(asyncio.get_running_loop())
+    except RuntimeError:
+        loop_id = None
+    with _lock:
+        keys = [key for key in _async_pools if key[1] in (loop_id, None)]
+        clients = [_async_pools.pop(key)[1] for key in keys] + _pop_stale_pools()
+        for key in [k for k in _registry if k[-1] in (loop_id, None)]:
+            del _registry[key]
+    await _aclose_clients(clients)
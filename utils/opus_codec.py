@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Opus 编解码（基于 PyAV 自带的 libopus）
+
+TTS 输出统一为 48kHz 单声道 PCM16，按 20ms 对齐（见 main_logic.tts_output_stage），
+正好是 Opus 的标准帧长。这里提供：
+- OpusEncoder.encode：PCM16 -> Opus 包列表，不足一帧的尾部补零（输入通常已是整帧）
+- OpusDecoder.decode：Opus 包 -> PCM16
+- pack_packets / unpack_packets：多个 Opus 包以 2 字节长度前缀拼成一段负载
+
+PyAV 不可用或不含 libopus 时 OPUS_AVAILABLE 为 False，调用方应退回 PCM16。
+"""
+import logging
+import struct
+from typing import Iterable, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import av
+    av.codec.Codec('libopus', 'w')
+    av.codec.Codec('libopus', 'r')
+    OPUS_AVAILABLE = True
+except Exception:  # pragma: no cover - 取决于安装环境
+    av = None
+    OPUS_AVAILABLE = False
+
+OPUS_SAMPLE_RATE = 48000
+OPUS_FRAME_MS = 20
+OPUS_FRAME_SAMPLES = OPUS_SAMPLE_RATE * OPUS_FRAME_MS // 1000
+# 语音场景下 32kbps 已足够清晰（PCM16 为 768kbps）
+OPUS_BITRATE = 32000
+
+_LENGTH = struct.Struct('<H')
+
+
+def pack_packets(packets: Iterable[bytes]) -> bytes:
+    return b''.join(_LENGTH.pack(len(p)) + p for p in packets)
+
+
+def unpack_packets(payload: bytes) -> List[bytes]:
+    packets = []
+    view = memoryview(payload)
+    offset = 0
+    while offset + 2 <= len(view):
+        (n,) = _LENGTH.unpack_from(view, offset)
+        offset += 2
+        packets.append(bytes(view[offset:offset + n]))
+        offset += n
+    return packets
+
+
+class OpusEncoder:
+    """48kHz 单声道 PCM16 -> Opus（每个连接/每路流一个实例）"""
+
+    def __init__(self, bitrate: int = OPUS_BITRATE):
+        if not OPUS_AVAILABLE:
+            raise RuntimeError("PyAV/libopus 不可用")
+        self._ctx = av.CodecContext.create('libopus', 'w')
+        self._ctx.sample_rate = OPUS_SAMPLE_RATE
+        self._ctx.layout = 'mono'
+        self._ctx.format = 's16'
+        self._ctx.bit_rate = bitrate
+        self._ctx.options = {'application': 'voip', 'frame_duration': str(OPUS_FRAME_MS)}
+        self._ctx.open()
+        self._pts = 0
+
+    @property
+    def header(self) -> bytes:
+        """编码器给出的 OpusHead（含 pre-skip），用于封装 OGG 流"""
+        return bytes(self._ctx.extradata or b'')
+
+    def encode(self, pcm: bytes) -> List[bytes]:
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        rest = len(samples) % OPUS_FRAME_SAMPLES
+        if rest:
+            samples = np.concatenate([samples, np.zeros(OPUS_FRAME_SAMPLES - rest, dtype=np.int16)])
+        packets = []
+        for start in range(0, len(samples), OPUS_FRAME_SAMPLES):
+            frame = av.AudioFrame.from_ndarray(samples[None, start:start + OPUS_FRAME_SAMPLES], format='s16', layout='mono')
+            frame.sample_rate = OPUS_SAMPLE_RATE
+            frame.pts = self._pts
+            self._pts += OPUS_FRAME_SAMPLES
+            packets.extend(bytes(p) for p in self._ctx.encode(frame))
+        return packets
+
+
+class OpusDecoder:
+    """Opus -> 48kHz 单声道 PCM16"""
+
+    def __init__(self):
+        if not OPUS_AVAILABLE:
+            raise RuntimeError("PyAV/libopus 不可用")
+        self._ctx = av.CodecContext.create('libopus', 'r')
+        self._ctx.sample_rate = OPUS_SAMPLE_RATE
+        self._ctx.layout = 'mono'
+        self._ctx.open()
+
+    def decode(self, packets: Iterable[bytes]) -> bytes:
+        out = []
+        for packet in packets:
+            for frame in self._ctx.decode(av.Packet(packet)):
+                samples = frame.to_ndarray()
+                if samples.dtype != np.int16:
+                    # 浮点输出（flt/fltp）转换为 PCM16
+                    samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+                out.append(samples.reshape(-1).tobytes())
+        return b''.join(out)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+主服务器 -> 监控服务器的多路复用同步协议
+
+原先每个角色用 /sync（JSON）与 /sync_binary（PCM）两条 websocket：控制事件与音频走不同连接，
+到达顺序无法保证（例如 "turn end" 可能先于最后一段语音到达），两条连接各自重连、各自心跳。
+现在改为每个角色一条 /sync_mux/{lanlan_name} 连接，所有内容以二进制帧按发送顺序传输：
+
+    +------+-------+-----------+-----+----------------+---------+
+    | type | flags | stream_id | seq | speech_id (16) | payload |
+    |  u8  |  u8   |   u16     | u32 |   UUID 字节    |   ...   |
+    +------+-------+-----------+-----+----------------+---------+
+    小端序，头部 24 字节
+
+- type：FRAME_EVENTS（payload 为若干条以换行分隔的紧凑 JSON）/ FRAME_AUDIO / FRAME_HEARTBEAT
+- flags：FLAG_OPUS 表示音频 payload 为 Opus 包（见 utils.opus_codec.pack_packets），否则为 48kHz PCM16
+- stream_id：逻辑流编号（STREAM_EVENTS / STREAM_SPEECH），便于以后在同一连接上增加新的流
+- seq：发送方递增的序号（u32 回绕），接收方据此统计丢失与乱序
+- speech_id：音频所属的 speech_id（core.current_speech_id），没有时全零
+
+运行 `python -m utils.sync_protocol` 在本机回环上比较两条连接与单条多路复用连接的吞吐和乱序率。
+"""
+import struct
+import uuid
+from typing import NamedTuple, Optional
+
+HEADER = struct.Struct('<BBHI16s')
+HEADER_SIZE = HEADER.size
+
+FRAME_EVENTS = 1
+FRAME_AUDIO = 2
+FRAME_HEARTBEAT = 3
+
+FLAG_OPUS = 0x01
+
+STREAM_EVENTS = 0
+STREAM_SPEECH = 1
+
+_NO_SPEECH_ID = bytes(16)
+
+
+class SyncFrame(NamedTuple):
+    frame_type: int
+    flags: int
+    stream_id: int
+    seq: int
+    speech_id: Optional[str]
+    payload: memoryview
+
+
+def _speech_id_bytes(speech_id: Optional[str]) -> bytes:
+    if not speech_id:
+        return _NO_SPEECH_ID
+    try:
+        return uuid.UUID(speech_id).bytes
+    except (ValueError, AttributeError, TypeError):
+        # 非 UUID 格式的 id 不在帧头中携带
+        return _NO_SPEECH_ID
+
+
+def encode_frame(frame_type: int, payload: bytes = b'', seq: int = 0, stream_id: int = STREAM_EVENTS,
+                 speech_id: Optional[str] = None, flags: int = 0) -> bytes:
+    return HEADER.pack(frame_type, flags, stream_id, seq & 0xFFFFFFFF, _speech_id_bytes(speech_id)) + payload
+
+
+def decode_frame(data: bytes) -> SyncFrame:
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"同步帧长度不足: {len(data)} < {HEADER_SIZE}")
+    frame_type, flags, stream_id, seq, sid = HEADER.unpack_from(data)
+    speech_id = str(uuid.UUID(bytes=sid)) if sid != _NO_SPEECH_ID else None
+    return SyncFrame(frame_type, flags, stream_id, seq, speech_id, memoryview(data)[HEADER_SIZE:])
+
+
+class SequenceTracker:
+    """接收方统计：收到的帧数、序号缺口（丢失）与回退（乱序）"""
+
+    def __init__(self):
+        self.expected = None
+        self.received = 0
+        self.missing = 0
+        self.reordered = 0
+
+    def observe(self, seq: int):
+        self.received += 1
+        if self.expected is None:
+            self.expected = (seq + 1) & 0xFFFFFFFF
+            return
+        delta = (seq - self.expected) & 0xFFFFFFFF
+        if delta == 0:
+            self.expected = (seq + 1) & 0xFFFFFFFF
+        elif delta < 0x80000000:
+            self.missing += delta
+            self.expected = (seq + 1) & 0xFFFFFFFF
+        else:
+            # 比期望的序号小：晚到的帧
+            self.reordered += 1
+            self.missing = max(0, self.missing - 1)
+
+    @property
+    def stats(self):
+        return {
+            'received': self.received,
+            'missing': self.missing,
+            'reordered': self.reordered,
+            'reorder_rate': round(self.reordered / self.received, 4) if self.received else 0.0,
+        }
+
+
+def _run_benchmark(n_turns: int = 200, use_opus: bool = True) -> None:
+    """
+    本机回环测试：每轮发送 gemini_response 文本增量与 100ms 语音交替的事件序列，最后是 turn end。
+    legacy：JSON 与音频分走两条 websocket（与旧的 /sync + /sync_binary 相同）；
+    mux：全部走一条连接。接收方按全局序号统计乱序率，并记录总字节数与吞吐。
+    """
+    import asyncio
+    import json
+    import time
+
+    import numpy as np
+    import websockets
+
+    from utils import opus_codec
+
+    chunk = (np.sin(np.arange(4800) / 48000 * 2 * np.pi * 220) * 6000).astype(np.int16).tobytes()
+    events = []
+    for turn in range(n_turns):
+        sid = str(uuid.uuid4())
+        for i in range(8):
+            events.append(('json', {"type": "gemini_response", "text": "你好" * 4, "isNewMessage": i == 0}, sid))
+            events.append(('audio', chunk, sid))
+        events.append(('json', {"type": "turn end"}, sid))
+
+    async def run_legacy():
+        tracker = SequenceTracker()
+        done = asyncio.Event()
+        received = {'bytes': 0}
+
+        async def handler(ws):
+            async for m in ws:
+                received['bytes'] += len(m)
+                seq = json.loads(m)['seq'] if isinstance(m, str) else struct.unpack_from('<I', m)[0]
+                tracker.observe(seq)
+                if tracker.received == len(events):
+                    done.set()
+
+        async with websockets.serve(handler, '127.0.0.1', 0, max_size=None) as server:
+            port = server.sockets[0].getsockname()[1]
+            text_ws = await websockets.connect(f'ws://127.0.0.1:{port}')
+            bin_ws = await websockets.connect(f'ws://127.0.0.1:{port}')
+            start = time.perf_counter()
+            for seq, (kind, data, sid) in enumerate(events):
+                if kind == 'json':
+                    await text_ws.send(json.dumps({**data, 'seq': seq}, ensure_ascii=False, separators=(',', ':')))
+                else:
+                    await bin_ws.send(struct.pack('<I', seq) + data)
+            await asyncio.wait_for(done.wait(), 30)
+            elapsed = time.perf_counter() - start
+            await text_ws.close()
+            await bin_ws.close()
+        return tracker.stats, received['bytes'], elapsed
+
+    async def run_mux(opus: bool):
+        tracker = SequenceTracker()
+        done = asyncio.Event()
+        received = {'bytes': 0}
+        decoder = opus_codec.OpusDecoder() if opus else None
+
+        async def handler(ws):
+            async for m in ws:
+                received['bytes'] += len(m)
+                frame = decode_frame(m)
+                tracker.observe(frame.seq)
+                if frame.frame_type == FRAME_AUDIO and frame.flags & FLAG_OPUS:
+                    decoder.decode(opus_codec.unpack_packets(frame.payload))
+                if tracker.received == len(events):
+                    done.set()
+
+        async with websockets.serve(handler, '127.0.0.1', 0, max_size=None) as server:
+            port = server.sockets[0].getsockname()[1]
+            ws = await websockets.connect(f'ws://127.0.0.1:{port}')
+            encoder = opus_codec.OpusEncoder() if opus else None
+            start = time.perf_counter()
+            for seq, (kind, data, sid) in enumerate(events):
+                if kind == 'json':
+                    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+                    await ws.send(encode_frame(FRAME_EVENTS, payload, seq))
+                elif opus:
+                    payload = opus_codec.pack_packets(encoder.encode(data))
+                    await ws.send(encode_frame(FRAME_AUDIO, payload, seq, STREAM_SPEECH, sid, FLAG_OPUS))
+                else:
+                    await ws.send(encode_frame(FRAME_AUDIO, data, seq, STREAM_SPEECH, sid))
+            await asyncio.wait_for(done.wait(), 60)
+            elapsed = time.perf_counter() - start
+            await ws.close()
+        return tracker.stats, received['bytes'], elapsed
+
+    audio_seconds = n_turns * 8 * 0.1
+    print(f"{len(events)} events, {n_turns} turns, {audio_seconds:.0f} s of 48kHz speech")
+    runs = [('legacy 2 sockets', run_legacy), ('mux pcm16', lambda: run_mux(False))]
+    if use_opus and opus_codec.OPUS_AVAILABLE:
+        runs.append(('mux opus', lambda: run_mux(True)))
+    for name, run in runs:
+        stats, nbytes, elapsed = asyncio.run(run())
+        print(f"  {name:<17} {len(events) / elapsed:8.0f} msg/s  {nbytes / 1e6:7.2f} MB "
+              f"({nbytes * 8 / audio_seconds / 1000:6.0f} kbps of speech)  reorder {stats['reorder_rate'] * 100:5.2f}%")
+
+
+if __name__ == "__main__":
+    _run_benchmark()
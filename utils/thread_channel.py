@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+线程与事件循环之间的双向队列
+
+TTS 工作线程运行在独立线程（多数还在线程内跑自己的事件循环），原先与主循环之间用
+queue.Queue 交换数据：主循环每 10ms 轮询一次响应队列，工作线程则在 run_in_executor
+里阻塞 request_queue.get，长期占住一个默认线程池线程。
+
+ThreadChannel 兼容 queue.Queue 的常用接口（put / get / get_nowait / empty），
+同时提供 aget() 供任意事件循环等待：put 时通过 loop.call_soon_threadsafe
+唤醒正在等待的协程，有数据才唤醒，不再依赖定时器。
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from queue import Empty
+from typing import Any, List, Optional, Tuple
+
+
+class ThreadChannel:
+    """线程安全、可被多个事件循环 await 的 FIFO 队列（无容量上限）"""
+
+    def __init__(self):
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        # 正在 aget() 中等待的 (事件循环, future)
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @staticmethod
+    def _wake(fut: asyncio.Future):
+        if not fut.done():
+            fut.set_result(None)
+
+    def _notify_locked(self):
+        self._not_empty.notify()
+        waiters, self._waiters = self._waiters, []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(self._wake, fut)
+            except RuntimeError:
+                # 等待方的事件循环已关闭
+                pass
+
+    def put(self, item: Any):
+        with self._lock:
+            self._items.append(item)
+            self._notify_locked()
+
+    def put_nowait(self, item: Any):
+        self.put(item)
+
+    def unget(self, item: Any):
+        """把取出的元素放回队首"""
+        with self._lock:
+            self._items.appendleft(item)
+            self._notify_locked()
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        """与 queue.Queue.get 语义一致，供没有事件循环的工作线程使用"""
+        with self._not_empty:
+            if not block:
+                if not self._items:
+                    raise Empty
+            elif timeout is None:
+                while not self._items:
+                    self._not_empty.wait()
+            else:
+                deadline = time.monotonic() + timeout
+                while not self._items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Empty
+                    self._not_empty.wait(remaining)
+            return self._items.popleft()
+
+    def get_nowait(self) -> Any:
+        return self.get(block=False)
+
+    async def aget(self) -> Any:
+        """在当前事件循环中等待下一个元素，不占用线程池线程"""
+        return await self._aget_raw()
+
+    async def _aget_raw(self) -> Any:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._items:
+                    return self._items.popleft()
+                fut = loop.create_future()
+                self._waiters.append((loop, fut))
+            try:
+                await fut
+            finally:
+                # 被取消（例如 wait_for 超时）时注销等待；已被 put 唤醒的不在列表中
+                with self._lock:
+                    try:
+                        self._waiters.remove((loop, fut))
+                    except ValueError:
+                        pass
+
+    async def adrain(self, limit: Optional[int] = None) -> List[Any]:
+        """等待至少一个元素，然后一次取出当前全部（最多 limit 个）元素"""
+        first = await self._aget_raw()
+        with self._lock:
+            items = self._items
+            n = len(items) if limit is None else min(len(items), limit - 1)
+            batch = [first]
+            for _ in range(n):
+                batch.append(items.popleft())
+        return batch
+
+    def empty(self) -> bool:
+        with self._lock:
+            return not self._items
+
+    def qsize(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def clear(self) -> int:
+        """丢弃全部待处理元素，返回丢弃的数量"""
+        with self._lock:
+            count = len(self._items)
+            self._items.clear()
+            return count
+
+
+class StampedThreadChannel(ThreadChannel):
+    """
+    put 时记录入队时间（time.monotonic）的 ThreadChannel
+
+    get / get_nowait / aget / adrain 与父类一样只返回元素；
+    adrain_stamped 返回 (入队时间, 元素)，供转发方统计排队延迟。
+    """
+
+    def put(self, item: Any):
+        super().put((time.monotonic(), item))
+
+    def unget(self, item: Any):
+        super().unget((time.monotonic(), item))
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        return super().get(block, timeout)[1]
+
+    async def aget(self) -> Any:
+        return (await self._aget_raw())[1]
+
+    async def adrain(self, limit: Optional[int] = None) -> List[Any]:
+        return [item for _, item in await self.adrain_stamped(limit)]
+
+    async def adrain_stamped(self, limit: Optional[int] = None) -> List[Tuple[float, Any]]:
+        return await super().adrain(limit)
+
+
+async def channel_get(channel) -> Any:
+    """
+    在事件循环中从队列取一个元素
+
+    ThreadChannel 直接 await；普通 queue.Queue 退回到 run_in_executor 阻塞读取。
+    """
+    aget = getattr(channel, 'aget', None)
+    if aget is not None:
+        return await aget()
+    return await asyncio.get_running_loop().run_in_executor(None, channel.get)
@@ -17,6 +17,7 @@ from langchain_core.messages import SystemMessage, HumanMessage
 
 # 复用 language_utils 的公共函数，避免重复实现
 from utils.language_utils import detect_language as _detect_language_impl, normalize_language_code
+from utils.llm_client import get_chat_llm
 
 logger = logging.getLogger(__name__)
 
@@ -66,15 +67,11 @@ class TranslationService:
                 logger.warning("翻译服务：API配置不完整（缺少 api_key、model 或 base_url），无法进行翻译")
                 return None
             
-            # 懒加载：如果客户端已存在，直接返回（注意：不会检测配置变化）
-            if self._llm_client is not None:
-                return self._llm_client
-            
-            # 使用翻译任务的专用参数
-            self._llm_client = ChatOpenAI(
-                model=config.get('model', 'qwen-turbo'),
-                base_url=config.get('base_url'),
-                api_key=config.get('api_key'),
+            # 使用翻译任务的专用参数；共享连接池，配置变化后自动重建
+            self._llm_client = get_chat_llm(
+                config.get('model', 'qwen-turbo'),
+                config.get('base_url'),
+                config.get('api_key'),
                 temperature=0.3,  # 低温度保证翻译准确性
                 max_tokens=2000,  # 增加令牌数以支持更长文本
                 timeout=30.0,  # 增加超时时间
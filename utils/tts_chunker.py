@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+文本模式的流式TTS分句器
+
+LLM 的流式输出按 token 到达，原先每个 delta 直接送入 tts_request_queue，
+TTS 服务收到的是零碎片段：要么自己攒句（增加延迟），要么按碎片合成导致韵律不自然。
+StreamingTTSChunker 在 LLM 输出和 TTS worker 之间按标点/分句切分：
+
+- 首句只要求很短（first_min），尽早开始合成，降低首音频延迟
+- 之后每句的最短时长按 growth 倍数增长到 max_min，后续句子更完整、请求更少
+- 一直没有标点时，超过 hard_max 强制切出
+切分基于 frontend_utils.split_paragraph，参数按语言见 config.TTS_CHUNK_PROFILES。
+"""
+import re
+from typing import List, Optional
+
+from config import TTS_CHUNK_PROFILES
+from utils.frontend_utils import contains_chinese, estimate_speech_time, split_paragraph
+
+_KANA_PATTERN = re.compile(r'[\u3040-\u30ff]')
+
+
+def detect_chunk_lang(text: str) -> str:
+    """按文本内容选择分句参数：含假名为日文，含汉字为中文，否则按英文处理"""
+    if _KANA_PATTERN.search(text):
+        return 'ja'
+    if contains_chinese(text):
+        return 'zh'
+    return 'en'
+
+
+class StreamingTTSChunker:
+    """单条回复（一个 speech_id）的流式分句状态"""
+
+    def __init__(self, lang: Optional[str] = None):
+        """
+        Args:
+            lang: 'zh' / 'ja' / 'en'，缺省时根据第一段文本自动判断
+        """
+        self._fixed_lang = lang
+        self.reset()
+
+    def reset(self):
+        self.lang = self._fixed_lang
+        self.profile = TTS_CHUNK_PROFILES.get(self.lang) if self.lang else None
+        self._buffer = ""
+        self._min_len = None
+        self.emitted = 0
+
+    @property
+    def pending(self) -> str:
+        return self._buffer
+
+    def _ensure_profile(self):
+        if self.profile is None:
+            self.lang = detect_chunk_lang(self._buffer)
+            self.profile = TTS_CHUNK_PROFILES.get(self.lang) or TTS_CHUNK_PROFILES['zh']
+        if self._min_len is None:
+            self._min_len = self.profile['first_min']
+
+    def _emit(self, text: str) -> str:
+        self.emitted += 1
+        self._min_len = min(self._min_len * self.profile['growth'], self.profile['max_min'])
+        return text
+
+    def feed(self, text: str) -> List[str]:
+        """加入一段 LLM 输出，返回可以送入TTS的完整片段（可能为空）"""
+        if not text:
+            return []
+        self._buffer += text
+        self._ensure_profile()
+        # split_paragraph 的标点表只区分中文/其他，日文句读与中文相同
+        split_lang = 'en' if self.lang == 'en' else 'zh'
+        chunks = []
+        while self._buffer:
+            head, rest = split_paragraph(self._buffer, lang=split_lang,
+                                         token_min_n=0, comma_split=self.profile['comma_split'])
+            if head and estimate_speech_time(head) >= self._min_len:
+                chunks.append(self._emit(head))
+                self._buffer = rest
+                continue
+            if estimate_speech_time(self._buffer) >= self.profile['hard_max']:
+                # 一直凑不出足够长的整句：优先在已有标点处切，否则整段送出
+                chunk = head or self._buffer
+                self._buffer = rest if head else ""
+                chunks.append(self._emit(chunk))
+                continue
+            break
+        return chunks
+
+    def flush(self) -> Optional[str]:
+        """送出剩余文本（回复结束或 LLM 停顿时调用）"""
+        text, self._buffer = self._buffer, ""
+        if not text.strip():
+            return None
+        if self.profile is None:
+            self._ensure_profile()
+        return self._emit(text)
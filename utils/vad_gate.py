@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+基于 RNNoise 语音概率的上行音频门限（VAD gate）
+
+常开麦克风时，静音帧也会一帧不落地作为 input_audio_buffer.append 发送，
+既浪费上行带宽，也让服务端缓存大量无用音频。SpeechGate 使用 AudioProcessor
+已经计算出的 speech_probability 决定哪些音频需要上行：
+
+- 滞回：概率连续 open_frames 帧超过 open_threshold 才打开，低于 close_threshold 才开始计算静音
+- 预录（pre-roll）：门关闭时保留最近 pre_roll_ms 的音频，打开时一并发出，避免吞掉首字
+- 拖尾（hang-over）：语音结束后继续发送 hang_over_ms 的静音，保证服务端 VAD 能判定一句话结束
+统计数据包括丢弃比例与"误切"次数（门关闭后很快又重新打开，说明可能在一句话中间切断）。
+参数见 config.AUDIO_VAD_GATE。
+"""
+from collections import deque
+from typing import Any, Dict, Optional
+
+from config import AUDIO_VAD_GATE
+
+
+class SpeechGate:
+    """单个会话的上行音频门限，输入输出均为 PCM16 字节"""
+
+    def __init__(self, sample_rate: int = 16000, params: Optional[Dict[str, Any]] = None):
+        params = {**AUDIO_VAD_GATE, **(params or {})}
+        self.sample_rate = sample_rate
+        self.open_threshold = params['open_threshold']
+        self.close_threshold = params['close_threshold']
+        self.open_frames = max(1, int(params['open_frames']))
+        self._pre_roll_bytes = sample_rate * params['pre_roll_ms'] // 1000 * 2
+        self._hang_over_bytes = sample_rate * params['hang_over_ms'] // 1000 * 2
+        self._false_cut_bytes = sample_rate * params['false_cut_ms'] // 1000 * 2
+        self._pre_roll = deque()
+        self._stats = {
+            'bytes_in': 0, 'bytes_sent': 0, 'segments': 0, 'false_cuts': 0,
+        }
+        self.reset()
+
+    def reset(self):
+        """回到关闭状态并丢弃预录音频（服务端缓存被清空或会话切换时调用）"""
+        self.is_open = False
+        self._above = 0           # 连续超过 open_threshold 的帧数
+        self._silence_bytes = 0   # 打开状态下连续低于 close_threshold 的音频量
+        self._closed_bytes = None  # 上次关闭后经过的音频量（用于判定误切）
+        self._pre_roll.clear()
+        self._pre_roll_size = 0
+
+    def _remember(self, chunk: bytes):
+        self._pre_roll.append(chunk)
+        self._pre_roll_size += len(chunk)
+        while self._pre_roll and self._pre_roll_size - len(self._pre_roll[0]) >= self._pre_roll_bytes:
+            self._pre_roll_size -= len(self._pre_roll.popleft())
+
+    def process(self, chunk: bytes, speech_prob: float) -> bytes:
+        """
+        输入一块处理后的音频及其语音概率，返回需要上行的音频（门关闭时为空）
+        """
+        self._stats['bytes_in'] += len(chunk)
+        if self.is_open:
+            if speech_prob < self.close_threshold:
+                self._silence_bytes += len(chunk)
+                if self._silence_bytes >= self._hang_over_bytes:
+                    # 拖尾结束：本块仍然发送，之后关闭
+                    self.is_open = False
+                    self._above = 0
+                    self._closed_bytes = 0
+            else:
+                self._silence_bytes = 0
+            self._stats['bytes_sent'] += len(chunk)
+            return chunk
+
+        if self._closed_bytes is not None:
+            self._closed_bytes += len(chunk)
+        self._above = self._above + 1 if speech_prob >= self.open_threshold else 0
+        if self._above < self.open_frames:
+            self._remember(chunk)
+            return b''
+
+        # 打开：预录音频 + 当前块一起发出
+        self.is_open = True
+        self._silence_bytes = 0
+        self._stats['segments'] += 1
+        if self._closed_bytes is not None and self._closed_bytes <= self._false_cut_bytes:
+            self._stats['false_cuts'] += 1
+        self._closed_bytes = None
+        self._pre_roll.append(chunk)
+        out = b''.join(self._pre_roll)
+        self._pre_roll.clear()
+        self._pre_roll_size = 0
+        self._stats['bytes_sent'] += len(out)
+        return out
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """上行/丢弃的音频时长、语音段数、误切次数与误切率"""
+        stats = dict(self._stats)
+        bytes_per_second = self.sample_rate * 2
+        stats['seconds_in'] = round(stats['bytes_in'] / bytes_per_second, 2)
+        stats['seconds_sent'] = round(stats['bytes_sent'] / bytes_per_second, 2)
+        stats['drop_rate'] = round(1 - stats['bytes_sent'] / stats['bytes_in'], 3) if stats['bytes_in'] else 0.0
+        stats['false_cut_rate'] = round(stats['false_cuts'] / stats['segments'], 3) if stats['segments'] else 0.0
+        return stats
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket 扇出广播
+
+监控服务器原先对每个查看端依次 await send_json / send_bytes：一个网络慢的客户端会拖住
+其余所有客户端，也拖住 /sync 读循环（读不动时主服务器的同步队列随之堆积）。
+
+BroadcastHub 改为：
+- 每个客户端一个有界发送队列 + 独立的写任务，publish_* 只入队、从不 await
+- 消息只序列化一次，同一个 str / bytes 对象在所有客户端队列间共享
+- 落后的客户端按策略丢弃或合并：
+  * 音频帧按排队时长丢弃：入队和发送时丢掉排队超过 MAX_QUEUE_AUDIO_AGE 的帧（迟到的音频没有播放价值）
+  * 带 coalesce_key 的消息与队尾同 key 的未发送消息合并（字幕为"最新状态"，文本增量为拼接）
+  * 控制消息不丢；仍然放不下，或单次发送超过 SEND_TIMEOUT 时断开该客户端
+- 客户端可以带一个音频编码标记（audio_codec），publish_bytes 指定编码时只发给该编码的客户端，
+  同一编码的客户端共享同一份已编码的字节
+- 每个客户端记录排队深度、丢弃/合并次数与入队到发送完成的延迟，见 BroadcastHub.stats
+
+运行 `python -m utils.ws_broadcast` 用模拟客户端比较逐个 await 与扇出两种方式下快客户端的延迟。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 单个客户端最多排队的消息数
+MAX_QUEUE_MESSAGES = 512
+# 音频帧最多排队多久（秒），更旧的帧直接丢弃，落后的客户端只会听到最近的音频
+MAX_QUEUE_AUDIO_AGE = 0.5
+# 单次发送的超时时间，超过则认为客户端已经不可用
+SEND_TIMEOUT = 10.0
+# 延迟的指数滑动平均系数
+LAG_EWMA_ALPHA = 0.1
+
+_TEXT = 0
+_BINARY = 1
+_PAUSE = 2
+
+# merge(旧的未发送消息, 新消息) -> 合并后的消息
+MergeFn = Callable[[str, str], str]
+
+
+class _Outgoing:
+    __slots__ = ('kind', 'payload', 'key', 'enqueued_at')
+
+    def __init__(self, kind: int, payload: Any, key: Optional[str], enqueued_at: float):
+        self.kind = kind
+        self.payload = payload
+        self.key = key
+        self.enqueued_at = enqueued_at
+
+
+class ClientChannel:
+    """一个客户端的发送队列与写任务"""
+
+    def __init__(self, hub: 'BroadcastHub', websocket, audio_codec: Optional[str] = None):
+        self.hub = hub
+        self.websocket = websocket
+        self.audio_codec = audio_codec
+        self.queue: Deque[_Outgoing] = deque()
+        self.audio_bytes = 0
+        self.connected_at = time.monotonic()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.avg_lag = 0.0
+        self.max_audio_lag = 0.0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    def enqueue(self, item: _Outgoing, merge: Optional[MergeFn] = None, merged: Optional[Dict] = None) -> bool:
+        """入队，返回 False 表示客户端严重落后需要断开"""
+        queue = self.queue
+        if merge is not None and item.key is not None and queue and queue[-1].key == item.key:
+            tail = queue[-1]
+            # 多个落后客户端的队尾通常是同一个对象，合并结果在本次 publish 内共享
+            memo_key = (id(tail.payload), id(item.payload))
+            payload = merged.get(memo_key) if merged is not None else None
+            if payload is None:
+                payload = merge(tail.payload, item.payload)
+                if merged is not None:
+                    merged[memo_key] = payload
+            tail.payload = payload
+            self.coalesced += 1
+            return True
+
+        if item.kind == _BINARY:
+            if queue and queue[0].enqueued_at < item.enqueued_at - MAX_QUEUE_AUDIO_AGE:
+                self._drop_audio(item.enqueued_at - MAX_QUEUE_AUDIO_AGE)
+            self.audio_bytes += len(item.payload)
+        queue.append(item)
+        if len(queue) > MAX_QUEUE_MESSAGES:
+            self._drop_audio(None)
+            if len(queue) > MAX_QUEUE_MESSAGES:
+                return False
+        self._wakeup.set()
+        return True
+
+    def push_text(self, text: str) -> bool:
+        """只发给这个客户端（例如连接时补发当前状态）"""
+        return self.enqueue(_Outgoing(_TEXT, text, None, time.monotonic()))
+
+    def _drop_audio(self, cutoff: Optional[float]):
+        """丢弃入队时间早于 cutoff 的音频帧；cutoff 为 None 时只丢最旧的一帧"""
+        freed = 0
+        kept = deque()
+        queue = self.queue
+        while queue and (queue[0].enqueued_at < cutoff if cutoff is not None else not freed):
+            item = queue.popleft()
+            if item.kind == _BINARY:
+                freed += len(item.payload)
+                self.dropped += 1
+            else:
+                kept.append(item)
+        # 保留下来的控制消息放回队首，保持原有顺序
+        queue.extendleft(reversed(kept))
+        self.audio_bytes -= freed
+
+    async def _writer(self):
+        websocket = self.websocket
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                item = self.queue.popleft()
+                if item.kind == _PAUSE:
+                    await asyncio.sleep(item.payload)
+                    continue
+                if item.kind == _BINARY:
+                    self.audio_bytes -= len(item.payload)
+                    if time.monotonic() - item.enqueued_at > MAX_QUEUE_AUDIO_AGE:
+                        # 没有新帧入队时不会触发入队侧的清理，这里兜底
+                        self.dropped += 1
+                        continue
+                    await asyncio.wait_for(websocket.send_bytes(item.payload), SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(websocket.send_text(item.payload), SEND_TIMEOUT)
+                lag = time.monotonic() - item.enqueued_at
+                self.sent += 1
+                self.last_lag = lag
+                if lag > self.max_lag:
+                    self.max_lag = lag
+                if item.kind == _BINARY and lag > self.max_audio_lag:
+                    self.max_audio_lag = lag
+                self.avg_lag += LAG_EWMA_ALPHA * (lag - self.avg_lag)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if not self.closed:
+                print(f"❌ [{self.hub.name}] 发送到 {websocket.client} 失败，移除客户端: {type(e).__name__} {e}")
+                self.hub.discard(websocket)
+                await self._close_socket()
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.audio_bytes = 0
+        self._wakeup.set()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        client = self.websocket.client
+        return {
+            'client': f"{client.host}:{client.port}" if client else None,
+            'audio_codec': self.audio_codec,
+            'connected_seconds': round(time.monotonic() - self.connected_at, 1),
+            'queue_depth': len(self.queue),
+            'queued_audio_bytes': self.audio_bytes,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'last_lag_ms': round(self.last_lag * 1000, 1),
+            'avg_lag_ms': round(self.avg_lag * 1000, 1),
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'max_audio_lag_ms': round(self.max_audio_lag * 1000, 1),
+        }
+
+
+class BroadcastHub:
+    """一组客户端（同一角色的查看端、或所有字幕端）的扇出广播"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.channels: Dict[Any, ClientChannel] = {}
+        self.published = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def add(self, websocket, audio_codec: Optional[str] = None) -> ClientChannel:
+        channel = ClientChannel(self, websocket, audio_codec)
+        self.channels[websocket] = channel
+        return channel
+
+    def discard(self, websocket):
+        channel = self.channels.pop(websocket, None)
+        if channel is not None:
+            channel.close()
+
+    def publish_text(self, text: str, coalesce_key: Optional[str] = None, merge: Optional[MergeFn] = None):
+        """
+        广播一条已序列化的文本消息
+
+        Args:
+            coalesce_key: 带 key 的消息可以作为合并目标
+            merge: 给出时，若某客户端队尾是同 key 的未发送消息，则与其合并而不是追加
+        """
+        self._publish(_Outgoing(_TEXT, text, coalesce_key, time.monotonic()), merge)
+
+    def publish_bytes(self, data: bytes, audio_codec: Optional[str] = None):
+        """广播二进制音频；指定 audio_codec 时只发给该编码的客户端"""
+        self._publish(_Outgoing(_BINARY, data, None, time.monotonic()), audio_codec=audio_codec)
+
+    def audio_codecs(self) -> Set[Optional[str]]:
+        """当前客户端用到的音频编码（没有客户端需要的编码可以不生成）"""
+        return {channel.audio_codec for channel in self.channels.values()}
+
+    def publish_pause(self, seconds: float):
+        """让每个客户端的写任务在此处暂停（例如等前端动画完成），不阻塞发布方"""
+        self._publish(_Outgoing(_PAUSE, seconds, None, time.monotonic()))
+
+    def _publish(self, item: _Outgoing, merge: Optional[MergeFn] = None, audio_codec: Optional[str] = None):
+        self.published += 1
+        merged = {} if merge is not None else None
+        laggards = None
+        for websocket, channel in self.channels.items():
+            if audio_codec is not None and channel.audio_codec != audio_codec:
+                continue
+            # 各客户端共享 payload，但合并会改写队尾，因此每个客户端一个条目对象
+            entry = _Outgoing(item.kind, item.payload, item.key, item.enqueued_at)
+            if not channel.enqueue(entry, merge, merged):
+                if laggards is None:
+                    laggards = []
+                laggards.append(websocket)
+        if laggards:
+            for websocket in laggards:
+                print(f"🐢 [{self.name}] 客户端 {websocket.client} 积压超过 {MAX_QUEUE_MESSAGES} 条，断开连接")
+                channel = self.channels.pop(websocket)
+                channel.close()
+                self.evicted += 1
+                asyncio.create_task(channel._close_socket())
+
+    def close(self):
+        for channel in self.channels.values():
+            channel.close()
+        self.channels.clear()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        clients = [channel.stats for channel in self.channels.values()]
+        return {
+            'clients': len(clients),
+            'published': self.published,
+            'evicted': self.evicted,
+            'max_queue_depth': max((c['queue_depth'] for c in clients), default=0),
+            'max_lag_ms': max((c['max_lag_ms'] for c in clients), default=0.0),
+            'per_client': clients,
+        }
+
+
+class _FakeClient:
+    __slots__ = ('host', 'port')
+
+    def __init__(self, port):
+        self.host = '127.0.0.1'
+        self.port = port
+
+
+class _FakeWebSocket:
+    """模拟网络写入耗时的 websocket，记录每条消息的到达时间"""
+
+    def __init__(self, port: int, delay: float):
+        self.client = _FakeClient(port)
+        self.delay = delay
+        self.arrivals: List[float] = []
+
+    async def _send(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0)
+        self.arrivals.append(time.monotonic())
+
+    send_text = _send
+    send_bytes = _send
+
+    async def close(self):
+        pass
+
+
+def _run_benchmark(n_clients: int = 300, n_slow: int = 5, seconds: float = 3.0) -> None:
+    import statistics
+
+    frame = bytes(1920)  # 48kHz 20ms PCM16
+    delta = '{"type":"gemini_response","text":"你好","isNewMessage":false}'
+    interval = 0.02
+
+    def report(name, clients, sent_at):
+        lags = []
+        for ws in clients:
+            if ws.delay:
+                continue
+            lags.extend(a - s for a, s in zip(ws.arrivals, sent_at))
+        lags.sort()
+        p = lambda q: lags[min(len(lags) - 1, int(len(lags) * q))] * 1000
+        print(f"  {name:<12} fast clients: p50 {p(0.5):8.1f} ms  p99 {p(0.99):8.1f} ms  "
+              f"delivered {len(lags) / (n_clients - n_slow) / len(sent_at) * 100:5.1f}%")
+
+    async def sequential():
+        clients = [_FakeWebSocket(i, 0.2 if i < n_slow else 0) for i in range(n_clients)]
+        sent_at = []
+        end = time.monotonic() + seconds
+        i = 0
+        while time.monotonic() < end:
+            sent_at.append(time.monotonic())
+            for ws in clients:
+                if i % 5 == 0:
+                    await ws.send_text(delta)
+                else:
+                    await ws.send_bytes(frame)
+            i += 1
+            await asyncio.sleep(interval)
+        report('sequential', clients, sent_at)
+
+    async def fanout():
+        clients = [_FakeWebSocket(i, 0.2 if i < n_slow else 0) for i in range(n_clients)]
+        hub = BroadcastHub('bench')
+        for ws in clients:
+            hub.add(ws)
+        sent_at = []
+        end = time.monotonic() + seconds
+        i = 0
+        while time.monotonic() < end:
+            sent_at.append(time.monotonic())
+            if i % 5 == 0:
+                hub.publish_text(delta)
+            else:
+                hub.publish_bytes(frame)
+            i += 1
+            await asyncio.sleep(interval)
+        await asyncio.sleep(0.5)
+        report('fan-out', clients, sent_at)
+        slow = [c for c in hub.stats['per_client'] if c['max_lag_ms'] > 100]
+        print(f"  {'':<12} slow clients: max audio lag {max(c['max_audio_lag_ms'] for c in slow):.0f} ms, "
+              f"max text lag {max(c['max_lag_ms'] for c in slow):.0f} ms, "
+              f"dropped {statistics.mean(c['dropped'] for c in slow):.0f} of "
+              f"{int(seconds / interval * 4 / 5)} frames each")
+        hub.close()
+
+    print(f"{n_clients} clients ({n_slow} with 200 ms send latency), 20 ms publish interval, {seconds:.0f} s")
+    asyncio.run(sequential())
+    asyncio.run(fanout())
+
+
+if __name__ == "__main__":
+    _run_benchmark()